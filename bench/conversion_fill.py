@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Time the Conversion Report's per-Pat ID insurance fill at two sizes and check it
+grows roughly linearly (the per-row loop it replaced was quadratic).
+
+Run from the repository root: python bench/conversion_fill.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_comparison import fill_insurance_by_pat_id  # noqa: E402
+
+SMALL_ROWS = 50_000
+LARGE_ROWS = 200_000
+# Linear growth gives a ratio near LARGE_ROWS / SMALL_ROWS; quadratic near its square
+MAX_GROWTH = 2 * LARGE_ROWS / SMALL_ROWS
+REPEATS = 3
+
+
+def conversion_frame(rows, seed=0):
+    """Processed Conversion Report rows: about three rows per Pat ID, some IDs and names missing."""
+    rng = np.random.default_rng(seed)
+    pat_ids = rng.integers(1, rows // 3 + 2, rows).astype(object)
+    pat_ids[rng.random(rows) < 0.05] = None
+    carriers = np.array(
+        ["Delta Dental of AZ", "Cigna", "BCBS of TX", "", None], dtype=object
+    )
+    return pd.DataFrame(
+        {
+            "Pat ID": pat_ids,
+            "Formatted Insurance": carriers[rng.integers(0, len(carriers), rows)],
+            "Dental Primary Ins Carr": "",
+            "Dental Secondary Ins Carr": "",
+        }
+    )
+
+
+def best_time(rows):
+    """Fastest of REPEATS fills of a fresh frame with this many rows, in seconds."""
+    timings = []
+    for seed in range(REPEATS):
+        df = conversion_frame(rows, seed)
+        start = time.perf_counter()
+        fill_insurance_by_pat_id(df, "Pat ID")
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    small = best_time(SMALL_ROWS)
+    large = best_time(LARGE_ROWS)
+    growth = large / small
+    print(f"{SMALL_ROWS} rows: {small:.3f}s")
+    print(f"{LARGE_ROWS} rows: {large:.3f}s")
+    print(
+        f"growth x{growth:.1f} for x{LARGE_ROWS // SMALL_ROWS} rows (limit x{MAX_GROWTH:.0f})"
+    )
+    assert growth < MAX_GROWTH, "insurance fill grows faster than linearly"
+
+
+if __name__ == "__main__":
+    main()
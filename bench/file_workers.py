@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Time a multi-file Dental BV Step 1 upload and an EV Allocation report run as
+background jobs, first with FILE_WORKERS=1 and then with several file workers,
+and check that the job really spread its files over more than one process.
+
+Worker processes are counted from /proc, so this runs on Linux only.
+Run from the repository root: python bench/file_workers.py
+"""
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import excel_comparison  # noqa: E402
+
+FILES = 6
+ROWS = 5_000
+PARALLEL_WORKERS = max(2, os.cpu_count() or 1)
+SAMPLE_SECONDS = 0.05
+
+
+def workbook(sheet_name, df):
+    buf = io.BytesIO()
+    df.to_excel(buf, sheet_name=sheet_name, index=False)
+    return buf.getvalue()
+
+
+def step1_file(seed):
+    """A Stovall Step 1 workbook ('Today' sheet)."""
+    rng = np.random.default_rng(seed)
+    return workbook(
+        "Today",
+        pd.DataFrame(
+            {
+                "Entity Code": rng.choice(["A1", "B2", "C3"], ROWS),
+                "Pats Number": rng.integers(1, 10**6, ROWS),
+                "Patient Name": [f"Last{i}, First{i}" for i in range(ROWS)],
+                "Appointment": pd.Timestamp("2026-01-05")
+                + pd.to_timedelta(rng.integers(0, 60, ROWS), unit="D"),
+                "Carrier Name": rng.choice(["Cigna", "Aetna", "Delta Dental"], ROWS),
+            }
+        ),
+    )
+
+
+def ev_file(seed):
+    """A Kates EV Allocation workbook."""
+    rng = np.random.default_rng(seed)
+    return workbook(
+        "Sheet1",
+        pd.DataFrame(
+            {
+                "Tx Location": rng.choice(["North", "South"], ROWS),
+                "Scheduled Appts": pd.Timestamp("2026-01-05")
+                + pd.to_timedelta(rng.integers(0, 60, ROWS), unit="D"),
+                "Full Name": [f"Last{i}, First{i}" for i in range(ROWS)],
+                "DOB": pd.Timestamp("1980-01-01")
+                + pd.to_timedelta(rng.integers(0, 9000, ROWS), unit="D"),
+                "Patient ID": rng.integers(1, 10**6, ROWS),
+                "Payor": rng.choice(["Cigna", "Aetna", "Medicaid"], ROWS),
+                "Member ID": rng.integers(1, 10**9, ROWS),
+            }
+        ),
+    )
+
+
+def descendants():
+    """Pids of every live process started (directly or not) by this one."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces
+        parents[int(entry)] = int(stat.rsplit(")", 1)[1].split()[1])
+    found, frontier = set(), {os.getpid()}
+    while frontier:
+        frontier = {pid for pid, ppid in parents.items() if ppid in frontier}
+        found |= frontier
+    return found
+
+
+def run_job(client, path, data):
+    """Run one background job; returns (seconds, most file workers seen at once)."""
+    before = descendants()
+    start = time.perf_counter()
+    response = client.post(
+        path,
+        data=data,
+        headers={excel_comparison.BACKGROUND_JOB_HEADER: "1"},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 202, response.get_data(as_text=True)
+    status_url = response.get_json()["status_url"]
+    peak = 0
+    while True:
+        # Processes beyond those running before the job and still running after it
+        # are the job's own file workers (the job pool itself persists)
+        peak = max(peak, len(descendants() - before))
+        status = client.get(status_url).get_json()
+        if status["status"] in ("done", "failed"):
+            break
+        time.sleep(SAMPLE_SECONDS)
+    elapsed = time.perf_counter() - start
+    assert status["status"] == "done", status["error"]
+    return elapsed, max(0, peak - len(descendants() - before))
+
+
+def step1_job(client, files):
+    return run_job(
+        client,
+        "/upload_dental_bv_step1",
+        {"files": [(io.BytesIO(c), f"Stovall {i}.xlsx") for i, c in enumerate(files)]},
+    )
+
+
+def ev_allocation_job(client, files):
+    client.post("/reset_ev_allocation")
+    client.post(
+        "/upload_ev_allocation",
+        data={
+            "files": [(io.BytesIO(c), f"Kates {i}.xlsx") for i, c in enumerate(files)]
+        },
+        content_type="multipart/form-data",
+    )
+    return run_job(client, "/process_ev_allocation", {})
+
+
+def main():
+    step1_files = [step1_file(seed) for seed in range(FILES)]
+    ev_files = [ev_file(seed) for seed in range(FILES)]
+    client = excel_comparison.app.test_client()
+    # Start the job pool so its processes are not counted as file workers
+    step1_job(client, step1_files[:1])
+
+    for name, job, files in (
+        ("Dental BV Step 1", step1_job, step1_files),
+        ("EV Allocation", ev_allocation_job, ev_files),
+    ):
+        timings = {}
+        for workers in (1, PARALLEL_WORKERS):
+            excel_comparison.FILE_WORKERS = workers
+            elapsed, peak = job(client, files)
+            timings[workers] = elapsed
+            print(
+                f"{name}, FILE_WORKERS={workers}: {elapsed:.2f}s, "
+                f"{peak} file worker process(es) seen"
+            )
+            if workers > 1:
+                assert peak > 1, f"{name} job did not use several file workers"
+        print(f"{name}: speedup x{timings[1] / timings[PARALLEL_WORKERS]:.2f}")
+    if (os.cpu_count() or 1) < 2:
+        print("Only one CPU: worker processes run but cannot be faster here.")
+
+
+if __name__ == "__main__":
+    main()
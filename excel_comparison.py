@@ -4,151 +4,170 @@ Excel File Comparison Tool
 Compare Patient IDs between two Excel files and add insurance columns
 """
 
-from flask import Flask, render_template_string, request, jsonify, send_file, redirect
+from flask import (
+    Flask,
+    g,
+    render_template_string,
+    request,
+    jsonify,
+    send_file,
+    redirect,
+)
 import pandas as pd
+import numpy as np
 import os
 import io
-from datetime import datetime, timedelta
+from datetime import date, datetime, time as datetime_time, timedelta, timezone
+from werkzeug.datastructures import MultiDict
 from werkzeug.utils import secure_filename
 import re
+import functools
+import hashlib
+import json
+import multiprocessing
+import codecs
+import copy
+import fcntl
+import pickle
+import queue
+import secrets
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from collections.abc import Mapping, MutableMapping
+from contextlib import ExitStack, closing, contextmanager, nullcontext, suppress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from numbers import Integral, Real
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
 
-# Global variables to store session data
-raw_data = None
-previous_data = None
-raw_filename = None
-previous_filename = None
-comparison_result = None
-
-# Global variables for file merging (Comparison Tool)
-merge_file1_data = None
-merge_file2_data = None
-merge_file1_filename = None
-merge_file2_filename = None
-merge_result = None
-
-# Global variables for conversion report
-conversion_data = None
-conversion_filename = None
-conversion_result = None
-
-# Global variables for insurance name formatting
-insurance_formatting_data = None
-insurance_formatting_filename = None
-insurance_formatting_result = None
-insurance_formatting_output = ""
-
-# Global variables for remarks update
-remarks_appointments_data = None
-remarks_excel_data = None
-remarks_appointments_filename = None
-remarks_remarks_filename = None
-remarks_result = None
-remarks_updated_count = 0
-
-# Global variables for appointment report formatting
-appointment_report_data = None
-appointment_report_filename = None
-appointment_report_result = None
-appointment_report_output = ""
-
-# Global variables for smart assist report formatting
-smart_assist_data = None
-smart_assist_filename = None
-smart_assist_result = None
-smart_assist_output = ""
-
-# Global variables for consolidate report
-consolidate_master_data = None
-consolidate_daily_data = None
-consolidate_master_filename = None
-consolidate_daily_filename = None
-consolidate_result = None
-consolidate_output = ""
-
-# Global variables for reallocation data generation
-reallocation_consolidate_data = None
-reallocation_blank_data = None
-reallocation_consolidate_filename = None
-reallocation_blank_filename = None
-reallocation_result = None
-reallocation_output = ""
-reallocation_merged_data = None
-reallocation_available_remarks = []
-reallocation_available_agents = []
-reallocation_selected_remarks = []
-reallocation_selected_agents = []
-
-# Global variables for general comparison
-general_primary_data = None
-general_main_data = None
-general_primary_filename = None
-general_main_filename = None
-general_comparison_result = None
-general_comparison_output = ""
-general_comparison_updated_data = None
-
-# Global variables for data cleanser
-data_cleanser_data = None
-data_cleanser_filename = None
-data_cleanser_result = None
-data_cleanser_output = ""
-data_cleanser_processed_data = None
-
-# Global variables for agent & remark transfer
-agent_remark_transfer_data = None
-agent_remark_transfer_filename = None
-agent_remark_transfer_result = None
-agent_remark_transfer_output = ""
-agent_remark_transfer_processed_data = None
-
-# Global variables for EV Allocation report (multi-file upload by filename)
-ev_allocation_files = (
-    {}
-)  # filename -> {"data": {sheet_name: df}, "filename": original_filename}
-ev_allocation_result = None
-ev_allocation_output = None  # bytes for download when ready
-ev_allocation_output_filename = ""
-
-# Dental BV Report globals
-dental_bv_step1_data = None  # DataFrame of combined Step 1 rows
-dental_bv_step2_data = None  # DataFrame of combined Step 2 rows
-dental_bv_step3_data = None  # DataFrame of combined Step 3 rows
-dental_bv_step1_output = None  # bytes for step 1 download
-dental_bv_step2_output = None  # bytes for step 2 download
-dental_bv_step3_output = None  # bytes for step 3 download
-dental_bv_result_step1 = None
-dental_bv_result_step2 = None
-dental_bv_result_step3 = None
-dental_bv_final_output = None  # bytes for final combined download
-
-# Agent Productivity Tracker globals
-apt_data = None  # {sheet_name: df}
-apt_filename = None
-apt_selected_sheet = None
-apt_sheet_columns = []  # column names from selected sheet
-apt_agent_col = None  # user-selected agent/auditor column
-apt_date_col = None  # user-selected date column
-apt_remark_values = []  # unique remark values from selected sheet
-apt_selected_remarks = []
-apt_result = None
-apt_output = None  # bytes for download
-
-# NH Allocation Report globals
-nh_data = None  # {sheet_name: df} from first file
-nh_filename = None
-nh_selected_sheet = None
-nh_remark_values = []
-nh_selected_remarks = []
-nh_filtered_df = None  # DataFrame after excluding selected remarks
-nh_step2_files = None  # list of {"filename": str, "sheets": {sheet_name: df}} after Step 2 upload, before sheet selection
-nh_file2_data = None  # DataFrame from second file(s) after merge
-nh_file2_filename = None
-nh_result = None
-nh_output = None  # bytes for download
+# Workflow state of one browser session, by tab. Routes read and write it through
+# session_state(); each new session starts from a copy of these values.
+_SESSION_STATE_DEFAULTS = {
+    # Comparison tool
+    "raw_data": None,
+    "previous_data": None,
+    "raw_filename": None,
+    "previous_filename": None,
+    "comparison_result": None,
+    # File merging (Comparison Tool)
+    "merge_file1_data": None,
+    "merge_file2_data": None,
+    "merge_file1_filename": None,
+    "merge_file2_filename": None,
+    "merge_result": None,
+    # Conversion report
+    "conversion_data": None,
+    "conversion_filename": None,
+    "conversion_result": None,
+    # Insurance name formatting
+    "insurance_formatting_data": None,
+    "insurance_formatting_filename": None,
+    "insurance_formatting_result": None,
+    "insurance_formatting_output": "",
+    # Remarks update
+    "remarks_appointments_data": None,
+    "remarks_excel_data": None,
+    "remarks_appointments_filename": None,
+    "remarks_remarks_filename": None,
+    "remarks_result": None,
+    "remarks_updated_count": 0,
+    # Appointment report formatting
+    "appointment_report_data": None,
+    "appointment_report_filename": None,
+    "appointment_report_result": None,
+    "appointment_report_output": "",
+    # Smart assist report formatting
+    "smart_assist_data": None,
+    "smart_assist_filename": None,
+    "smart_assist_result": None,
+    "smart_assist_output": "",
+    # Consolidate report
+    "consolidate_master_data": None,
+    "consolidate_daily_data": None,
+    "consolidate_master_filename": None,
+    "consolidate_daily_filename": None,
+    "consolidate_result": None,
+    "consolidate_output": "",
+    # Reallocation data generation
+    "reallocation_consolidate_data": None,
+    "reallocation_blank_data": None,
+    "reallocation_consolidate_filename": None,
+    "reallocation_blank_filename": None,
+    "reallocation_result": None,
+    "reallocation_output": "",
+    "reallocation_merged_data": None,
+    "reallocation_available_remarks": [],
+    "reallocation_available_agents": [],
+    "reallocation_selected_remarks": [],
+    "reallocation_selected_agents": [],
+    # General comparison
+    "general_primary_data": None,
+    "general_main_data": None,
+    "general_primary_filename": None,
+    "general_main_filename": None,
+    "general_comparison_result": None,
+    "general_comparison_output": "",
+    "general_comparison_updated_data": None,
+    # Data cleanser
+    "data_cleanser_data": None,
+    "data_cleanser_filename": None,
+    "data_cleanser_result": None,
+    "data_cleanser_output": "",
+    "data_cleanser_processed_data": None,
+    # Agent & remark transfer
+    "agent_remark_transfer_data": None,
+    "agent_remark_transfer_filename": None,
+    "agent_remark_transfer_result": None,
+    "agent_remark_transfer_output": "",
+    "agent_remark_transfer_processed_data": None,
+    # EV Allocation report (multi-file upload by filename)
+    "ev_allocation_files": {},  # filename -> {"data": {sheet_name: df}, "filename": original_filename}
+    "ev_allocation_result": None,
+    "ev_allocation_output": None,  # {sheet_name: df} for download when ready
+    "ev_allocation_output_filename": "",
+    # Dental BV Report
+    "dental_bv_step1_data": None,  # DataFrame of combined Step 1 rows
+    "dental_bv_step2_data": None,  # DataFrame of combined Step 2 rows
+    "dental_bv_step3_data": None,  # DataFrame of combined Step 3 rows
+    "dental_bv_step1_output": None,  # {sheet_name: df} for step 1 download
+    "dental_bv_step2_output": None,  # {sheet_name: df} for step 2 download
+    "dental_bv_step3_output": None,  # {sheet_name: df} for step 3 download
+    "dental_bv_result_step1": None,
+    "dental_bv_result_step2": None,
+    "dental_bv_result_step3": None,
+    "dental_bv_final_output": None,  # {sheet_name: df} for final combined download
+    # Agent Productivity Tracker
+    "apt_data": None,  # {sheet_name: df}
+    "apt_filename": None,
+    "apt_selected_sheet": None,
+    "apt_sheet_columns": [],  # column names from selected sheet
+    "apt_agent_col": None,  # user-selected agent/auditor column
+    "apt_date_col": None,  # user-selected date column
+    "apt_remark_values": [],  # unique remark values from selected sheet
+    "apt_selected_remarks": [],
+    "apt_result": None,
+    "apt_output": None,  # {sheet_name: df} for download
+    # NH Allocation Report
+    "nh_data": None,  # {sheet_name: df} from first file
+    "nh_filename": None,
+    "nh_selected_sheet": None,
+    "nh_remark_values": [],
+    "nh_selected_remarks": [],
+    "nh_filtered_df": None,  # DataFrame after excluding selected remarks
+    "nh_step2_files": None,  # list of {"filename": str, "sheets": {sheet_name: df}} after Step 2 upload, before sheet selection
+    "nh_file2_data": None,  # DataFrame from second file(s) after merge
+    "nh_file2_filename": None,
+    "nh_result": None,
+    "nh_output": None,  # {sheet_name: df} for download
+}
 
 NH_OUTPUT_COLUMNS = [
     "Software",
@@ -825,6 +844,58 @@ EV_ALLOCATION_COMMERCIAL_INSURANCE_LIST = frozenset(
     ]
 )
 
+
+def _build_insurance_list_matcher(names):
+    """Prebuild a matcher answering "some name occurs in text, or text occurs in some name".
+    Names-in-text uses an Aho-Corasick automaton; text-in-names searches the NUL-joined names.
+    """
+    goto, terminal = [{}], [False]
+    for name in names:
+        node = 0
+        for ch in name:
+            nxt = goto[node].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto[node][ch] = nxt
+                goto.append({})
+                terminal.append(False)
+            node = nxt
+        terminal[node] = True
+    fail = [0] * len(goto)
+    queue = list(goto[0].values())
+    for node in queue:
+        for ch, nxt in goto[node].items():
+            queue.append(nxt)
+            f = fail[node]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f].get(ch, 0)
+            terminal[nxt] = terminal[nxt] or terminal[fail[nxt]]
+    return goto, fail, terminal, "\0".join(names)
+
+
+def _insurance_list_matches(matcher, text):
+    """True if any name of the matcher's list is contained in text or contains text."""
+    goto, fail, terminal, joined = matcher
+    if "\0" not in text and text in joined:
+        return True
+    node = 0
+    for ch in text:
+        while node and ch not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(ch, 0)
+        if terminal[node]:
+            return True
+    return False
+
+
+_EV_ALLOCATION_MCD_INSURANCE_MATCHER = _build_insurance_list_matcher(
+    EV_ALLOCATION_MCD_INSURANCE_LIST
+)
+_EV_ALLOCATION_COMMERCIAL_INSURANCE_MATCHER = _build_insurance_list_matcher(
+    EV_ALLOCATION_COMMERCIAL_INSURANCE_LIST
+)
+
 # Department and Practice ID by (Office/Doctor Name, Reference/Status). Keys normalized strip(); match case-insensitive.
 # (office_doctor_name, reference) -> (department, practice_id)
 EV_ALLOCATION_DEPARTMENT_PRACTICE_LOOKUP = {
@@ -852,6 +923,21 @@ EV_ALLOCATION_DEPARTMENT_PRACTICE_LOOKUP = {
     ("Dr. Susan Park", "MCD"): ("Medicaid 160", "9017"),
 }
 
+# Upper-cased (Office/Doctor Name, Reference) -> (Department, Practice ID); the first entry wins on case-only duplicates.
+EV_ALLOCATION_DEPARTMENT_PRACTICE_INDEX = {
+    (od.upper(), ref.upper()): dept_pid
+    for (od, ref), dept_pid in reversed(
+        list(EV_ALLOCATION_DEPARTMENT_PRACTICE_LOOKUP.items())
+    )
+}
+_EV_ALLOCATION_DEPARTMENT_PRACTICE_FRAME = pd.DataFrame(
+    [
+        (od, ref, dept, pid)
+        for (od, ref), (dept, pid) in EV_ALLOCATION_DEPARTMENT_PRACTICE_INDEX.items()
+    ],
+    columns=["_office_upper", "_reference_upper", "Department", "Practice ID"],
+)
+
 # Column mapping per format_key: output column name -> input column name (or list of input cols to join).
 # Office/Doctor Name is filled only for sl_evening (Office Name). All other formats leave it blank.
 EV_ALLOCATION_COLUMN_MAPPING = {
@@ -937,11 +1023,28 @@ EV_ALLOCATION_COLUMN_MAPPING = {
     },
 }
 
+# Input columns _ev_allocation_map_sheet reads per format_key besides the mapped ones above;
+# process_ev_allocation parses only these and the mapped columns of each sheet.
+EV_ALLOCATION_EXTRA_INPUT_COLUMNS = {
+    "erickson": ["Insurance Company Name"],
+    "hoang_viva_smiles": ["Insurance Company Billing Center Name"],
+    "hoang_ismiles": ["Insurance Company Billing Center Name"],
+    "kates": ["Payor"],
+    "montefiore": ["Insurance Company Billing Center Name"],
+    "ortho": ["Entity Code", "Carrier"],
+    "sl_evening": [
+        "Office Name",
+        "Insurance Company Billing Center Name",
+        "Carrier Name",
+    ],
+    "sl_medicaid": ["Pats First Name", "Pats Last Name", "Carrier Name"],
+}
+
 
 @app.route("/load_reallocation_consolidate", methods=["POST"])
 def load_reallocation_consolidate():
     """Load the Current Consolidate File, align remarks, and return available remarks/agents as JSON."""
-    global reallocation_consolidate_data, reallocation_consolidate_filename, reallocation_available_remarks, reallocation_available_agents
+    session = session_state()
 
     try:
         if "consolidate_file" not in request.files:
@@ -956,21 +1059,18 @@ def load_reallocation_consolidate():
         consolidate_file.save(consolidate_filepath)
 
         # Load and align remarks on all sheets
-        consolidate_xls = pd.ExcelFile(consolidate_filepath)
-        reallocation_consolidate_data = {}
-        for sheet in consolidate_xls.sheet_names:
-            df = pd.read_excel(consolidate_filepath, sheet_name=sheet)
+        session.reallocation_consolidate_data = read_excel_sheets(consolidate_filepath)
+        for df in session.reallocation_consolidate_data.values():
             if "Remark" in df.columns:
                 df["Remark"] = df["Remark"].apply(align_remark)
-            reallocation_consolidate_data[sheet] = df
 
-        reallocation_consolidate_filename = consolidate_filename
+        session.reallocation_consolidate_filename = consolidate_filename
 
         # Build available remark list from All Agent Data if present
         remarks = []
         agents = []
-        if "All Agent Data" in reallocation_consolidate_data:
-            df = reallocation_consolidate_data["All Agent Data"]
+        if "All Agent Data" in session.reallocation_consolidate_data:
+            df = session.reallocation_consolidate_data["All Agent Data"]
             if "Remark" in df.columns:
                 remarks = sorted(
                     pd.Series(
@@ -990,15 +1090,15 @@ def load_reallocation_consolidate():
                     ).tolist()
                 )
 
-        reallocation_available_remarks = remarks
-        reallocation_available_agents = agents
+        session.reallocation_available_remarks = remarks
+        session.reallocation_available_agents = agents
 
         return jsonify(
             {
                 "ok": True,
-                "filename": reallocation_consolidate_filename,
-                "remarks": reallocation_available_remarks,
-                "agents": reallocation_available_agents,
+                "filename": session.reallocation_consolidate_filename,
+                "remarks": session.reallocation_available_remarks,
+                "agents": session.reallocation_available_agents,
             }
         )
     except Exception as e:
@@ -1837,6 +1937,14 @@ HTML_TEMPLATE = """
                         <input type="text" id="output_filename" name="filename" 
                                placeholder="comparison_result.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                     </div>
+                    <div class="form-group">
+                        <label for="output_format">Format:</label>
+                        <select id="output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                            <option value="xlsx" selected>Excel (.xlsx)</option>
+                            <option value="csv">CSV (fast export)</option>
+                            <option value="tsv">TSV (fast export)</option>
+                        </select>
+                    </div>
                     <button type="submit" id="comparison-download-btn">💾 Download Result File</button>
                 </form>
             </div>
@@ -1908,6 +2016,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="conversion_output_filename" name="filename" 
                                    placeholder="conversion_report_formatted.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="conversion_output_format">Format:</label>
+                            <select id="conversion_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="conversion-download-btn">💾 Download Processed File</button>
                     </form>
                 </div>
@@ -1989,6 +2105,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="insurance_output_filename" name="filename" 
                                    placeholder="formatted_insurance_names.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="insurance_output_format">Format:</label>
+                            <select id="insurance_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="insurance-download-btn">💾 Download Formatted File</button>
                     </form>
                 </div>
@@ -2093,6 +2217,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="remarks_output_filename" name="filename" 
                                    placeholder="appointments_with_remarks.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="remarks_output_format">Format:</label>
+                            <select id="remarks_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="remarks-download-btn">💾 Download Updated File</button>
                     </form>
                 </div>
@@ -2174,6 +2306,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="appointment_output_filename" name="filename" 
                                    placeholder="formatted_appointment_report.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="appointment_output_format">Format:</label>
+                            <select id="appointment_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="appointment-download-btn">💾 Download Formatted File</button>
                     </form>
                 </div>
@@ -2255,6 +2395,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="smartassist_output_filename" name="filename" 
                                    placeholder="formatted_smart_assist_report.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="smartassist_output_format">Format:</label>
+                            <select id="smartassist_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="smartassist-download-btn">💾 Download Formatted File</button>
                     </form>
                 </div>
@@ -2286,7 +2434,10 @@ HTML_TEMPLATE = """
                                 <h4>Master Consolidate File</h4>
                                 <div class="form-group">
                                     <label for="consolidate_master_file">Select Master Consolidate Excel File:</label>
-                                    <input type="file" id="consolidate_master_file" name="master_file" accept=".xlsx,.xls" required>
+                                    <input type="file" id="consolidate_master_file" name="master_file" accept=".xlsx,.xls" {% if not consolidate_store_ready %}required{% endif %}>
+                                    {% if consolidate_store_ready %}
+                                    <small>Optional: the master is kept in the consolidate store. Upload a master file only to replace it.</small>
+                                    {% endif %}
                                 </div>
                                 {% if consolidate_master_filename %}
                                 <div class="file-status">
@@ -2365,6 +2516,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="consolidate_output_filename" name="filename" 
                                    placeholder="consolidated_report.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="consolidate_output_format">Format:</label>
+                            <select id="consolidate_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit">💾 Download Consolidated File</button>
                     </form>
                 </div>
@@ -2377,6 +2536,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="consolidate_only_output_filename" name="filename" 
                                    placeholder="consolidated_only.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="consolidate_only_output_format">Format:</label>
+                            <select id="consolidate_only_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit">💾 Download Consolidated Sheet</button>
                     </form>
                 </div>
@@ -2613,6 +2780,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="reallocation_output_filename" name="filename" 
                                    value="reallocation_output.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="reallocation_output_format">Format:</label>
+                            <select id="reallocation_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="reallocation-download-btn">💾 Download Reallocation File</button>
                     </form>
                 </div>
@@ -2842,6 +3017,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="gc_output_filename" name="filename"
                                    value="general_comparison_output.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="gc_output_format">Format:</label>
+                            <select id="gc_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="general-download-btn">💾 Download Updated File</button>
                     </form>
                 </div>
@@ -2965,6 +3148,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="datacleanser_output_filename" name="filename" 
                                    placeholder="cleaned_data.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="datacleanser_output_format">Format:</label>
+                            <select id="datacleanser_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="datacleanser-download-btn">💾 Download Cleaned File</button>
                     </form>
                 </div>
@@ -3179,6 +3370,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="agentremarktransfer_output_filename" name="filename" 
                                    placeholder="agent_remark_transferred.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="agentremarktransfer_output_format">Format:</label>
+                            <select id="agentremarktransfer_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="agentremarktransfer-download-btn">💾 Download Processed File</button>
                     </form>
                 </div>
@@ -3275,6 +3474,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="ev_allocation_output_filename" name="filename" 
                                    placeholder="ev_allocation_report.xlsx" value="{{ ev_allocation_output_filename or 'ev_allocation_report.xlsx' }}" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="ev_allocation_output_format">Format:</label>
+                            <select id="ev_allocation_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="evallocation-download-btn">💾 Download output file</button>
                     </form>
                 </div>
@@ -3332,6 +3539,14 @@ HTML_TEMPLATE = """
                             <label for="dental_bv_step1_dl_filename">Output filename (optional):</label>
                             <input type="text" id="dental_bv_step1_dl_filename" name="filename" placeholder="dental_bv_step1_output.xlsx" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="dental_bv_step1_dl_format">Format:</label>
+                            <select id="dental_bv_step1_dl_format" name="export_format" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="dentalbv-download-step1-btn">💾 Download Step 1 output</button>
                     </form>
                     {% endif %}
@@ -3362,6 +3577,14 @@ HTML_TEMPLATE = """
                             <label for="dental_bv_step2_dl_filename">Output filename (optional):</label>
                             <input type="text" id="dental_bv_step2_dl_filename" name="filename" placeholder="dental_bv_step2_output.xlsx" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="dental_bv_step2_dl_format">Format:</label>
+                            <select id="dental_bv_step2_dl_format" name="export_format" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="dentalbv-download-step2-btn">💾 Download Step 2 output</button>
                     </form>
                     {% endif %}
@@ -3392,6 +3615,14 @@ HTML_TEMPLATE = """
                             <label for="dental_bv_step3_dl_filename">Output filename (optional):</label>
                             <input type="text" id="dental_bv_step3_dl_filename" name="filename" placeholder="dental_bv_step3_output.xlsx" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="dental_bv_step3_dl_format">Format:</label>
+                            <select id="dental_bv_step3_dl_format" name="export_format" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="dentalbv-download-step3-btn">💾 Download Step 3 output</button>
                     </form>
                     {% endif %}
@@ -3407,6 +3638,14 @@ HTML_TEMPLATE = """
                             <label for="dental_bv_final_dl_filename">Output filename (optional):</label>
                             <input type="text" id="dental_bv_final_dl_filename" name="filename" placeholder="dental_bv_report.xlsx" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="dental_bv_final_dl_format">Format:</label>
+                            <select id="dental_bv_final_dl_format" name="export_format" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="dentalbv-download-final-btn">💾 Download final report</button>
                     </form>
                 </div>
@@ -3536,6 +3775,14 @@ HTML_TEMPLATE = """
                             <input type="text" id="apt_output_filename" name="filename"
                                    placeholder="agent_productivity_report.xlsx" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="apt_output_format">Format:</label>
+                            <select id="apt_output_format" name="export_format" style="width: 100%; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="apt-download-btn">💾 Download Productivity Report</button>
                     </form>
                 </div>
@@ -3662,6 +3909,14 @@ HTML_TEMPLATE = """
                             <label for="nh_dl_filename">Output filename (optional):</label>
                             <input type="text" id="nh_dl_filename" name="filename" placeholder="nh_allocation_report.xlsx" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
                         </div>
+                        <div class="form-group">
+                            <label for="nh_dl_format">Format:</label>
+                            <select id="nh_dl_format" name="export_format" style="width: 100%; max-width: 420px; padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                                <option value="xlsx" selected>Excel (.xlsx)</option>
+                                <option value="csv">CSV (fast export)</option>
+                                <option value="tsv">TSV (fast export)</option>
+                            </select>
+                        </div>
                         <button type="submit" id="nh-download-btn">📥 Download NH Allocation report</button>
                     </form>
                 </div>
@@ -3792,6 +4047,57 @@ HTML_TEMPLATE = """
             }
         }
         
+        /** POST form as a background job, keep the processing modal up while polling /jobs/<id>, then follow the route's redirect. */
+        async function submitFormAsBackgroundJob(form, opts) {
+            const o = opts || {};
+            const btn = o.buttonId ? document.getElementById(o.buttonId) : null;
+            const fallbackUrl = '/comparison' + (o.redirectTab ? '?tab=' + o.redirectTab : '');
+            const baseMessage = o.message || 'Please wait while we process your request';
+            const setMessage = (text) => {
+                const messageEl = document.getElementById('processing-message');
+                messageEl.textContent = text;
+                const dots = document.createElement('span');
+                dots.className = 'processing-dots';
+                dots.textContent = '...';
+                messageEl.appendChild(dots);
+            };
+            showProcessingModal(o.title || 'Processing', baseMessage);
+            if (btn) btn.disabled = true;
+            try {
+                const resp = await fetch(form.action, {
+                    method: 'POST',
+                    body: new FormData(form),
+                    headers: { 'X-Background-Job': '1' },
+                });
+                if (resp.status !== 202) {
+                    // Handled inline: show the page the route redirected to
+                    window.location.assign(resp.redirected ? resp.url : fallbackUrl);
+                    return;
+                }
+                const job = await resp.json();
+                while (true) {
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                    const statusResp = await fetch(job.status_url, { cache: 'no-store' });
+                    const status = await statusResp.json();
+                    if (!statusResp.ok) throw new Error(status.error || ('Job status ' + statusResp.status));
+                    if (status.status === 'done') {
+                        window.location.assign(status.redirect || fallbackUrl);
+                        return;
+                    }
+                    if (status.status === 'failed') throw new Error(status.error || 'Job failed');
+                    if (status.status === 'queued' && status.position) {
+                        setMessage('Waiting for ' + status.position + ' earlier job(s)');
+                    } else {
+                        setMessage(status.progress || baseMessage);
+                    }
+                }
+            } catch (err) {
+                hideProcessingModal();
+                if (btn) btn.disabled = false;
+                alert('Processing failed: ' + (err && err.message ? err.message : String(err)));
+            }
+        }
+        
         // Toggle sidebar on mobile
         function toggleSidebar() {
             const sidebar = document.getElementById('sidebar');
@@ -3950,9 +4256,14 @@ HTML_TEMPLATE = """
         // Conversion form submission
         const conversionForm = document.getElementById('conversion-form');
         if (conversionForm) {
-            conversionForm.addEventListener('submit', function() {
-                showProcessingModal('Processing Conversion Report', 'Validating and formatting conversion report');
-                document.getElementById('conversion-btn').disabled = true;
+            conversionForm.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(conversionForm, {
+                    buttonId: 'conversion-btn',
+                    title: 'Processing Conversion Report',
+                    message: 'Validating and formatting conversion report',
+                    redirectTab: 'conversion',
+                });
             });
         }
 
@@ -3977,9 +4288,14 @@ HTML_TEMPLATE = """
         // Appointment report form submission
         const appointmentForm = document.getElementById('appointment-form');
         if (appointmentForm) {
-            appointmentForm.addEventListener('submit', function() {
-                showProcessingModal('Formatting Insurance Columns', 'Processing file and formatting insurance names');
-                document.getElementById('appointment-btn').disabled = true;
+            appointmentForm.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(appointmentForm, {
+                    buttonId: 'appointment-btn',
+                    title: 'Formatting Insurance Columns',
+                    message: 'Processing file and formatting insurance names',
+                    redirectTab: 'appointment',
+                });
             });
         }
 
@@ -4127,9 +4443,14 @@ HTML_TEMPLATE = """
         // Smart assist form submission
         const smartAssistForm = document.getElementById('smartassist-form');
         if (smartAssistForm) {
-            smartAssistForm.addEventListener('submit', function() {
-                showProcessingModal('Formatting Insurance Columns', 'Processing file and formatting insurance names');
-                document.getElementById('smartassist-btn').disabled = true;
+            smartAssistForm.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(smartAssistForm, {
+                    buttonId: 'smartassist-btn',
+                    title: 'Formatting Insurance Columns',
+                    message: 'Processing file and formatting insurance names',
+                    redirectTab: 'smartassist',
+                });
             });
         }
 
@@ -4154,10 +4475,14 @@ HTML_TEMPLATE = """
         // General comparison form submission
         const generalComparisonForm = document.getElementById('general-comparison-form');
         if (generalComparisonForm) {
-            generalComparisonForm.addEventListener('submit', function() {
-                showProcessingModal('Running General Comparison', 'Matching keys and updating primary rows');
-                const btn = document.getElementById('gc-run-btn');
-                if (btn) btn.disabled = true;
+            generalComparisonForm.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(generalComparisonForm, {
+                    buttonId: 'gc-run-btn',
+                    title: 'Running General Comparison',
+                    message: 'Matching keys and updating primary rows',
+                    redirectTab: 'general',
+                });
             });
         }
 
@@ -4210,10 +4535,14 @@ HTML_TEMPLATE = """
         }
         const evAllocationProcessForm = document.getElementById('evallocation-process-form');
         if (evAllocationProcessForm) {
-            evAllocationProcessForm.addEventListener('submit', function() {
-                showProcessingModal('Generating output', 'Building EV Allocation report...');
-                const btn = document.getElementById('evallocation-process-btn');
-                if (btn) btn.disabled = true;
+            evAllocationProcessForm.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(evAllocationProcessForm, {
+                    buttonId: 'evallocation-process-btn',
+                    title: 'Generating output',
+                    message: 'Building EV Allocation report...',
+                    redirectTab: 'evallocation',
+                });
             });
         }
 
@@ -4233,28 +4562,40 @@ HTML_TEMPLATE = """
 
         const dentalBvStep1Form = document.getElementById('dentalbv-step1-upload-form');
         if (dentalBvStep1Form) {
-            dentalBvStep1Form.addEventListener('submit', function() {
-                showProcessingModal('Processing Step 1', 'Uploading and processing Dental BV Step 1 files...');
-                const btn = document.getElementById('dentalbv-step1-upload-btn');
-                if (btn) btn.disabled = true;
+            dentalBvStep1Form.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(dentalBvStep1Form, {
+                    buttonId: 'dentalbv-step1-upload-btn',
+                    title: 'Processing Step 1',
+                    message: 'Uploading and processing Dental BV Step 1 files...',
+                    redirectTab: 'dentalbv',
+                });
             });
         }
 
         const dentalBvStep2Form = document.getElementById('dentalbv-step2-upload-form');
         if (dentalBvStep2Form) {
-            dentalBvStep2Form.addEventListener('submit', function() {
-                showProcessingModal('Processing Step 2', 'Comparing Today vs Previous Day files...');
-                const btn = document.getElementById('dentalbv-step2-upload-btn');
-                if (btn) btn.disabled = true;
+            dentalBvStep2Form.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(dentalBvStep2Form, {
+                    buttonId: 'dentalbv-step2-upload-btn',
+                    title: 'Processing Step 2',
+                    message: 'Comparing Today vs Previous Day files...',
+                    redirectTab: 'dentalbv',
+                });
             });
         }
 
         const dentalBvStep3Form = document.getElementById('dentalbv-step3-upload-form');
         if (dentalBvStep3Form) {
-            dentalBvStep3Form.addEventListener('submit', function() {
-                showProcessingModal('Processing Step 3', 'Comparing Raw Smilelink vs Consolidated...');
-                const btn = document.getElementById('dentalbv-step3-upload-btn');
-                if (btn) btn.disabled = true;
+            dentalBvStep3Form.addEventListener('submit', function(ev) {
+                ev.preventDefault();
+                void submitFormAsBackgroundJob(dentalBvStep3Form, {
+                    buttonId: 'dentalbv-step3-upload-btn',
+                    title: 'Processing Step 3',
+                    message: 'Comparing Raw Smilelink vs Consolidated...',
+                    redirectTab: 'dentalbv',
+                });
             });
         }
 
@@ -4587,13 +4928,167 @@ def expand_state_abbreviations(text):
     return text_str
 
 
+# Distinct carrier strings kept by the format_insurance_name memo; real carrier
+# columns have a few hundred distinct values across tens of thousands of rows.
+INSURANCE_FORMAT_CACHE_SIZE = 8192
+
+_INSURANCE_NO_PATIENT_CHART_RE = re.compile(r"no\s+patient\s+chart", re.IGNORECASE)
+_INSURANCE_COVERAGE_ROLE_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r"\s*\(Primary\)",
+        r"\s*\(Secondary\)",
+        r"\s*Primary",
+        r"\s*Secondary",
+    )
+)
+_INSURANCE_DD_PREFIX_RE = re.compile(r"^dd\s+", re.IGNORECASE)
+_INSURANCE_STATE_TAIL_RE = re.compile(r"\s*[,\|;]\s*|\s+Ph#", re.IGNORECASE)
+_INSURANCE_DELTA_DENTAL_RE = re.compile(r"delta\s+dental", re.IGNORECASE)
+_INSURANCE_DELTA_DENTAL_STATE_RE = re.compile(
+    r"delta\s+dental\s+(?:of\s+)?(.+)", re.IGNORECASE
+)
+_INSURANCE_ANTHEM_RE = re.compile(
+    r"anthem|blue\s+cross.*anthem|anthem.*blue\s+cross", re.IGNORECASE
+)
+_INSURANCE_BCBS_RE = re.compile(
+    r"bcbs|bc/bs|bc\s+of|blue\s+cross|blue\s+shield|bcbbs", re.IGNORECASE
+)
+# BCBS spellings in priority order: (detect pattern, state pattern or None for plain "BCBS")
+_INSURANCE_BCBS_VARIANTS = (
+    (
+        re.compile(r"blue\s+cross\s+blue\s+shield", re.IGNORECASE),
+        re.compile(r"blue\s+cross\s+blue\s+shield\s+(?:of\s+)?(.+)", re.IGNORECASE),
+    ),
+    (
+        re.compile(r"bc/bs", re.IGNORECASE),
+        re.compile(r"bc/bs\s+(?:of\s+)?(.+)", re.IGNORECASE),
+    ),
+    (
+        re.compile(r"bc\s+of", re.IGNORECASE),
+        re.compile(r"bc\s+of\s+(.+)", re.IGNORECASE),
+    ),
+    (re.compile(r"bcbbs", re.IGNORECASE), None),
+)
+_INSURANCE_BCBS_STATE_RE = re.compile(
+    r"(?:bcbs|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)", re.IGNORECASE
+)
+_INSURANCE_HEALTH_PARTNERS_STATE_RE = re.compile(
+    r"health\s*partners\s+of\s+(.+)", re.IGNORECASE
+)
+_INSURANCE_WISCONSIN_RE = re.compile(r"wisconsin", re.IGNORECASE)
+
+
+def _format_network_health(company_name):
+    # Check if it has "Wisconsin" in the name
+    if _INSURANCE_WISCONSIN_RE.search(company_name):
+        return "Network Health Wisconsin"
+    return "Network Health Go"
+
+
+def _format_health_partners(company_name):
+    # Check if it has "of [State]" pattern
+    state_match = _INSURANCE_HEALTH_PARTNERS_STATE_RE.search(company_name)
+    if state_match:
+        return f"Health Partners {state_match.group(1).strip()}"
+    return "Health Partners"
+
+
+# Carriers after Anthem/BCBS, checked in order (first match wins). The value is the
+# formatted name, or a function of the company name for carriers with variants.
+_INSURANCE_CARRIER_RULES = tuple(
+    (re.compile(pattern, re.IGNORECASE), formatted)
+    for pattern, formatted in (
+        (r"metlife|met\s+life", "Metlife"),
+        (r"cigna", "Cigna"),
+        (r"aarp", "AARP"),
+        (r"adn\s+administrators", "ADN Administrators"),
+        (r"beam", "Beam"),
+        (r"uhc|united.*health|united.*heal|unitedhelathcare", "UHC"),
+        (r"teamcare", "Teamcare"),
+        (r"humana", "Humana"),
+        (r"aetna", "Aetna"),
+        (r"guardian", "Guardian"),
+        (r"g\s*e\s*h\s*a", "GEHA"),
+        (r"principal", "Principal"),
+        (r"ameritas", "Ameritas"),
+        (r"physicians\s+mutual", "Physicians Mutual"),
+        (r"mutual\s+of\s+omaha", "Mutual Omaha"),
+        (r"sunlife|sun\s+life", "Sunlife"),
+        (r"liberty(?:\s+dental)?", "Liberty Dental Plan"),
+        (r"careington", "Careington Benefit Solutions"),
+        (r"automated\s+benefit", "Automated Benefit Services Inc"),
+        (r"network\s+health", _format_network_health),
+        (r"regence", "REGENCE BCBS"),
+        (r"united\s+concordia", "United Concordia"),
+        (r"medical\s+mutual", "Medical Mutual"),
+        (r"blue\s+care\s+dental", "Blue Care Dental"),
+        (r"dominion\s+dental", "Dominion Dental"),
+        (r"carefirst", "CareFirst BCBS"),
+        (r"health\s*partners", _format_health_partners),
+        (r"keenan", "Keenan"),
+        (r"wilson\s+mcshane", "Wilson McShane- Delta Dental"),
+        (r"standard\s+(?:life\s+)?insurance", "Standard Life Insurance"),
+        (r"plan\s+for\s+health", "Plan for Health"),
+        (r"kansas\s+city", "Kansas City"),
+        (r"the\s+guardian", "The Guardian"),
+        (r"community\s+dental", "Community Dental Associates"),
+        (r"northeast\s+delta\s+dental", "Northeast Delta Dental"),
+        (r"say\s+cheese\s+dental", "Say Cheese Dental Network"),
+        (r"dentaquest", "Dentaquest"),
+        (r"umr", "UMR"),
+        (r"mhbp", "MHBP"),
+        (r"united\s+states\s+army", "United States Army"),
+        (
+            r"conversion\s+default",
+            "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!",
+        ),
+        (r"equitable", "Equitable"),
+        (r"manhattan\s+life", "Manhattan Life"),
+        (r"ucci", "UCCI"),
+        (r"ccpoa|cc\s*poa|c\s+c\s+p\s+o\s+a", "CCPOA"),
+    )
+)
+
+_INSURANCE_DD_FAMILY_RE = re.compile(
+    r"dd\s+of|dd\s+[a-z]{2}|delta\s+dental|dental\s+dental|denta\s+dental|dleta\s+dental|dektal?\s+dental",
+    re.IGNORECASE,
+)
+# "DD OF [State]" and "DD [State]" - only 2-letter abbreviations, expanded
+_INSURANCE_DD_ABBREVIATION_RES = (
+    re.compile(r"dd\s+of\s+([a-z]{2})", re.IGNORECASE),
+    re.compile(r"dd\s+([a-z]{2})\b", re.IGNORECASE),
+)
+# "DD [Full State Name]" - for cases like "DD Pennsylvania"
+_INSURANCE_DD_FULL_STATE_RE = re.compile(r"^dd\s+([a-z]{3,})", re.IGNORECASE)
+# "<Delta Dental spelling> of [State]", including common typos
+_INSURANCE_DD_OF_STATE_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r"delta\s+dental\s+of\s+(.+)",
+        r"dental\s+dental\s+of\s+(.+)",
+        r"denta\s+dental\s+of\s+(.+)",
+        r"dleta\s+dental\s+of\s+(.+)",
+        r"dektal?\s+dental\s+of\s+(.+)",
+        r"dental\s+of\s+(.+)",
+    )
+)
+_INSURANCE_DD_NETWORK_OF_AMERICA_RE = re.compile(
+    r"dental\s+network\s+of\s+america", re.IGNORECASE
+)
+
+
 def format_insurance_name(insurance_text):
     """Format insurance name to match expected format"""
     if pd.isna(insurance_text):
         return insurance_text
 
-    insurance_str = str(insurance_text).strip()
+    return _format_insurance_text(str(insurance_text).strip())
 
+
+@functools.lru_cache(maxsize=INSURANCE_FORMAT_CACHE_SIZE)
+def _format_insurance_text(insurance_str):
+    """format_insurance_name for a stripped string (memoized per distinct value)"""
     # Handle special cases first
     if insurance_str.upper() == "NO INSURANCE":
         return "No Insurance"
@@ -4601,7 +5096,7 @@ def format_insurance_name(insurance_text):
         return "PATIENT NOT FOUND"
     elif insurance_str.upper() == "DUPLICATE":
         return "DUPLICATE"
-    elif re.search(r"no\s+patient\s+chart", insurance_str, re.IGNORECASE):
+    elif _INSURANCE_NO_PATIENT_CHART_RE.search(insurance_str):
         return "No Patient chart"
 
     # Extract company name before "Ph#"
@@ -4611,37 +5106,29 @@ def format_insurance_name(insurance_text):
         company_name = insurance_str
 
     # Remove "Primary" and "Secondary" text
-    company_name = re.sub(r"\s*\(Primary\)", "", company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r"\s*\(Secondary\)", "", company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r"\s*Primary", "", company_name, flags=re.IGNORECASE)
-    company_name = re.sub(r"\s*Secondary", "", company_name, flags=re.IGNORECASE)
+    for role_re in _INSURANCE_COVERAGE_ROLE_RES:
+        company_name = role_re.sub("", company_name)
 
     # If already formatted as "DD [State]", preserve it (don't reformat)
-    if re.match(r"^dd\s+", company_name, re.IGNORECASE):
+    if _INSURANCE_DD_PREFIX_RE.match(company_name):
         # Extract the state part
-        state_part = re.sub(r"^dd\s+", "", company_name, flags=re.IGNORECASE).strip()
+        state_part = _INSURANCE_DD_PREFIX_RE.sub("", company_name).strip()
         # Remove any trailing text (like "Ph#")
-        state_part = re.split(r"\s*[,\|;]\s*|\s+Ph#", state_part, flags=re.IGNORECASE)[
-            0
-        ].strip()
+        state_part = _INSURANCE_STATE_TAIL_RE.split(state_part)[0].strip()
         # Capitalize properly (Title Case) if not already uppercase
         if state_part and not state_part.isupper():
             state_part = state_part.title()
         return f"DD {state_part}"
 
     # Handle Delta Dental variations
-    if re.search(r"delta\s+dental", company_name, re.IGNORECASE):
+    if _INSURANCE_DELTA_DENTAL_RE.search(company_name):
         # Extract state from Delta Dental - handles "Delta Dental Arizona", "Delta Dental of Arizona", etc.
-        delta_match = re.search(
-            r"delta\s+dental\s+(?:of\s+)?(.+)", company_name, re.IGNORECASE
-        )
+        delta_match = _INSURANCE_DELTA_DENTAL_STATE_RE.search(company_name)
         if delta_match:
             state = delta_match.group(1).strip()
             # Remove any trailing text after state (like "Ph#" or other info)
             # Split on common separators and take first part
-            state = re.split(r"\s*[,\|;]\s*|\s+Ph#", state, flags=re.IGNORECASE)[
-                0
-            ].strip()
+            state = _INSURANCE_STATE_TAIL_RE.split(state)[0].strip()
             # Expand state abbreviations (e.g., "AZ" -> "Arizona")
             state = expand_state_abbreviations(state)
             # Capitalize properly (Title Case)
@@ -4652,267 +5139,79 @@ def format_insurance_name(insurance_text):
             return "DD"
 
     # Handle Anthem variations FIRST (before BCBS to avoid conflicts)
-    if re.search(
-        r"anthem|blue\s+cross.*anthem|anthem.*blue\s+cross", company_name, re.IGNORECASE
-    ):
+    if _INSURANCE_ANTHEM_RE.search(company_name):
         return "Anthem"
 
     # Handle BCBS variations
-    elif re.search(
-        r"bcbs|bc/bs|bc\s+of|blue\s+cross|blue\s+shield|bcbbs",
-        company_name,
-        re.IGNORECASE,
-    ):
-        # Check for full "Blue Cross Blue Shield" pattern first
-        if re.search(r"blue\s+cross\s+blue\s+shield", company_name, re.IGNORECASE):
-            # Extract state from "Blue Cross Blue Shield of [State]"
-            bcbs_match = re.search(
-                r"blue\s+cross\s+blue\s+shield\s+(?:of\s+)?(.+)",
-                company_name,
-                re.IGNORECASE,
-            )
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BC/BS patterns
-        elif re.search(r"bc/bs", company_name, re.IGNORECASE):
-            bcbs_match = re.search(
-                r"bc/bs\s+(?:of\s+)?(.+)", company_name, re.IGNORECASE
-            )
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BC Of patterns
-        elif re.search(r"bc\s+of", company_name, re.IGNORECASE):
-            bcbs_match = re.search(r"bc\s+of\s+(.+)", company_name, re.IGNORECASE)
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
-        # Handle BCBBS typo
-        elif re.search(r"bcbbs", company_name, re.IGNORECASE):
-            return "BCBS"
-        # Handle other BCBS patterns
+    if _INSURANCE_BCBS_RE.search(company_name):
+        for variant_re, state_re in _INSURANCE_BCBS_VARIANTS:
+            if variant_re.search(company_name):
+                break
         else:
-            bcbs_match = re.search(
-                r"(?:bcbs|blue\s+cross|blue\s+shield)\s+(?:of\s+)?(.+)",
-                company_name,
-                re.IGNORECASE,
-            )
-            if bcbs_match:
-                state = bcbs_match.group(1).strip()
-                # Expand state abbreviations
-                state = expand_state_abbreviations(state)
-                return f"BCBS {state}"
-            else:
-                return "BCBS"
+            # Handle other BCBS patterns
+            state_re = _INSURANCE_BCBS_STATE_RE
+        bcbs_match = state_re.search(company_name) if state_re else None
+        if bcbs_match:
+            # Expand state abbreviations
+            state = expand_state_abbreviations(bcbs_match.group(1).strip())
+            return f"BCBS {state}"
+        return "BCBS"
 
     # Handle other specific companies
-    elif re.search(r"metlife|met\s+life", company_name, re.IGNORECASE):
-        return "Metlife"
-    elif re.search(r"cigna", company_name, re.IGNORECASE):
-        return "Cigna"
-    elif re.search(r"aarp", company_name, re.IGNORECASE):
-        return "AARP"
-    elif re.search(r"adn\s+administrators", company_name, re.IGNORECASE):
-        return "ADN Administrators"
-    elif re.search(r"beam", company_name, re.IGNORECASE):
-        return "Beam"
-    elif re.search(
-        r"uhc|united.*health|united.*heal|unitedhelathcare", company_name, re.IGNORECASE
-    ):
-        return "UHC"
-    elif re.search(r"teamcare", company_name, re.IGNORECASE):
-        return "Teamcare"
-    elif re.search(r"humana", company_name, re.IGNORECASE):
-        return "Humana"
-    elif re.search(r"aetna", company_name, re.IGNORECASE):
-        return "Aetna"
-    elif re.search(r"guardian", company_name, re.IGNORECASE):
-        return "Guardian"
-    elif re.search(r"g\s*e\s*h\s*a", company_name, re.IGNORECASE):
-        return "GEHA"
-    elif re.search(r"principal", company_name, re.IGNORECASE):
-        return "Principal"
-    elif re.search(r"ameritas", company_name, re.IGNORECASE):
-        return "Ameritas"
-    elif re.search(r"physicians\s+mutual", company_name, re.IGNORECASE):
-        return "Physicians Mutual"
-    elif re.search(r"mutual\s+of\s+omaha", company_name, re.IGNORECASE):
-        return "Mutual Omaha"
-    elif re.search(r"sunlife|sun\s+life", company_name, re.IGNORECASE):
-        return "Sunlife"
-    elif re.search(r"liberty(?:\s+dental)?", company_name, re.IGNORECASE):
-        return "Liberty Dental Plan"
-    elif re.search(r"careington", company_name, re.IGNORECASE):
-        return "Careington Benefit Solutions"
-    elif re.search(r"automated\s+benefit", company_name, re.IGNORECASE):
-        return "Automated Benefit Services Inc"
-    elif re.search(r"network\s+health", company_name, re.IGNORECASE):
-        # Check if it has "Wisconsin" in the name
-        if re.search(r"wisconsin", company_name, re.IGNORECASE):
-            return "Network Health Wisconsin"
-        else:
-            return "Network Health Go"
-    elif re.search(r"regence", company_name, re.IGNORECASE):
-        return "REGENCE BCBS"
-    elif re.search(r"united\s+concordia", company_name, re.IGNORECASE):
-        return "United Concordia"
-    elif re.search(r"medical\s+mutual", company_name, re.IGNORECASE):
-        return "Medical Mutual"
-    elif re.search(r"blue\s+care\s+dental", company_name, re.IGNORECASE):
-        return "Blue Care Dental"
-    elif re.search(r"dominion\s+dental", company_name, re.IGNORECASE):
-        return "Dominion Dental"
-    elif re.search(r"carefirst", company_name, re.IGNORECASE):
-        return "CareFirst BCBS"
-    elif re.search(r"health\s*partners", company_name, re.IGNORECASE):
-        # Check if it has "of [State]" pattern
-        if re.search(r"health\s*partners\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"health\s*partners\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            return f"Health Partners {state}"
-        else:
-            return "Health Partners"
-    elif re.search(r"keenan", company_name, re.IGNORECASE):
-        return "Keenan"
-    elif re.search(r"wilson\s+mcshane", company_name, re.IGNORECASE):
-        return "Wilson McShane- Delta Dental"
-    elif re.search(r"standard\s+(?:life\s+)?insurance", company_name, re.IGNORECASE):
-        return "Standard Life Insurance"
-    elif re.search(r"plan\s+for\s+health", company_name, re.IGNORECASE):
-        return "Plan for Health"
-    elif re.search(r"kansas\s+city", company_name, re.IGNORECASE):
-        return "Kansas City"
-    elif re.search(r"the\s+guardian", company_name, re.IGNORECASE):
-        return "The Guardian"
-    elif re.search(r"community\s+dental", company_name, re.IGNORECASE):
-        return "Community Dental Associates"
-    elif re.search(r"northeast\s+delta\s+dental", company_name, re.IGNORECASE):
-        return "Northeast Delta Dental"
-    elif re.search(r"say\s+cheese\s+dental", company_name, re.IGNORECASE):
-        return "Say Cheese Dental Network"
-    elif re.search(r"dentaquest", company_name, re.IGNORECASE):
-        return "Dentaquest"
-    elif re.search(r"umr", company_name, re.IGNORECASE):
-        return "UMR"
-    elif re.search(r"mhbp", company_name, re.IGNORECASE):
-        return "MHBP"
-    elif re.search(r"united\s+states\s+army", company_name, re.IGNORECASE):
-        return "United States Army"
-    elif re.search(r"conversion\s+default", company_name, re.IGNORECASE):
-        return "CONVERSION DEFAULT - Do NOT Delete! Change Pt Ins!"
-    elif re.search(r"equitable", company_name, re.IGNORECASE):
-        return "Equitable"
-    elif re.search(r"manhattan\s+life", company_name, re.IGNORECASE):
-        return "Manhattan Life"
-    elif re.search(r"ucci", company_name, re.IGNORECASE):
-        return "UCCI"
-    elif re.search(r"ccpoa|cc\s*poa|c\s+c\s+p\s+o\s+a", company_name, re.IGNORECASE):
-        return "CCPOA"
-    elif re.search(
-        r"dd\s+of|dd\s+[a-z]{2}|delta\s+dental|dental\s+dental|denta\s+dental|dleta\s+dental|dektal?\s+dental",
-        company_name,
-        re.IGNORECASE,
-    ):
+    for carrier_re, formatted in _INSURANCE_CARRIER_RULES:
+        if carrier_re.search(company_name):
+            return formatted(company_name) if callable(formatted) else formatted
+
+    if _INSURANCE_DD_FAMILY_RE.search(company_name):
         # Extract state from various Delta Dental patterns
-        # Handle DD OF [State] pattern
-        if re.search(r"dd\s+of\s+([a-z]{2})", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"dd\s+of\s+([a-z]{2})", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).upper()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle DD [State] pattern - only match if it's exactly 2 letters (abbreviation) followed by word boundary
-        elif re.search(r"dd\s+([a-z]{2})\b", company_name, re.IGNORECASE):
-            state_match = re.search(r"dd\s+([a-z]{2})\b", company_name, re.IGNORECASE)
-            state = state_match.group(1).upper()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle DD [Full State Name] pattern - for cases like "DD Pennsylvania"
-        elif re.search(r"^dd\s+([a-z]{3,})", company_name, re.IGNORECASE):
-            state_match = re.search(r"^dd\s+([a-z]{3,})", company_name, re.IGNORECASE)
+        for abbreviation_re in _INSURANCE_DD_ABBREVIATION_RES:
+            state_match = abbreviation_re.search(company_name)
+            if state_match:
+                state = state_match.group(1).upper()
+                state = expand_state_abbreviations(state)
+                return f"DD {state}"
+        state_match = _INSURANCE_DD_FULL_STATE_RE.search(company_name)
+        if state_match:
             state = state_match.group(1).strip()
             # Remove any trailing text after state (like "Ph#" or other info)
-            state = re.split(r"\s*[,\|;]\s*|\s+Ph#", state, flags=re.IGNORECASE)[
-                0
-            ].strip()
+            state = _INSURANCE_STATE_TAIL_RE.split(state)[0].strip()
             # Don't expand abbreviations - preserve full state name
             # Capitalize properly (Title Case)
             if state and not state.isupper():
                 state = state.title()
             return f"DD {state}"
-        # Handle Delta Dental of [State] pattern
-        elif re.search(r"delta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"delta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle Dental Dental Of [State] pattern
-        elif re.search(r"dental\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"dental\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle Denta Dental Of [State] pattern
-        elif re.search(r"denta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"denta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle Dleta Dental of [State] pattern
-        elif re.search(r"dleta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"dleta\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle Dekta Dental of [State] pattern
-        elif re.search(r"dektal?\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(
-                r"dektal?\s+dental\s+of\s+(.+)", company_name, re.IGNORECASE
-            )
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
-        # Handle Dental of [State] pattern
-        elif re.search(r"dental\s+of\s+(.+)", company_name, re.IGNORECASE):
-            state_match = re.search(r"dental\s+of\s+(.+)", company_name, re.IGNORECASE)
-            state = state_match.group(1).strip()
-            state = expand_state_abbreviations(state)
-            return f"DD {state}"
+        for of_state_re in _INSURANCE_DD_OF_STATE_RES:
+            state_match = of_state_re.search(company_name)
+            if state_match:
+                state = state_match.group(1).strip()
+                state = expand_state_abbreviations(state)
+                return f"DD {state}"
         # Handle Dental Network of America
-        elif re.search(r"dental\s+network\s+of\s+america", company_name, re.IGNORECASE):
+        if _INSURANCE_DD_NETWORK_OF_AMERICA_RE.search(company_name):
             return "DD Network of America"
         # Default DD
-        else:
-            return "DD"
+        return "DD"
 
     # If no specific pattern matches, return the cleaned company name
     return company_name.strip()
 
 
+def format_insurance_series(values):
+    """Format a whole insurance column, running format_insurance_name once per distinct value"""
+    series = (
+        values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    )
+    present = series.notna()
+    if not present.any():
+        return series.copy()
+    # format_insurance_name only depends on the text of a cell
+    text = series[present].astype(object).astype(str)
+    formatted = {value: format_insurance_name(value) for value in text.unique()}
+    result = series.astype(object)
+    result[present.to_numpy()] = text.map(formatted).to_numpy()
+    return result
+
+
 def normalize_patient_id(patient_id_val):
     """Normalize patient ID for consistent matching - handles numeric, string, whitespace, leading zeros"""
     if pd.isna(patient_id_val):
@@ -4942,38 +5241,280 @@ def normalize_patient_id(patient_id_val):
         return patient_id_str.strip()
 
 
+# Strings int()/float() may read in ways the patterns below don't cover
+# (decimals, underscores, non-ASCII digits) go through normalize_patient_id.
+_PATIENT_ID_SCALAR_RE = r"[._]|[^\x00-\x7f]"
+
+
+def _normalize_patient_id_text(text):
+    """normalize_patient_id for a Series of str(value) strings (no missing values)"""
+    text = text.reset_index(drop=True).str.strip()
+    out = text.where(text != "", None)
+
+    # "0042", "-7" and "42.000" (up to 15 digits, exact as a float) become canonical integers
+    integer = text.str.fullmatch(r"[+-]?[0-9]+")
+    whole = text.str.fullmatch(r"[+-]?(?:[0-9]{1,15}\.0*|\.0+)")
+    numeric = integer | whole
+    if numeric.any():
+        number = text[numeric]
+        digits = number.str.lstrip("+-").str.partition(".")[0].str.lstrip("0")
+        negative = number.str.startswith("-") & (digits != "")
+        digits = digits.where(digits != "", "0")
+        digits[negative] = "-" + digits[negative]
+        out[numeric] = digits
+
+    unusual = ~numeric & out.notna() & text.str.contains(_PATIENT_ID_SCALAR_RE)
+    if unusual.any():
+        rest = text[unusual]
+        normalized = {v: normalize_patient_id(v) for v in rest.unique()}
+        out[unusual] = rest.map(normalized)
+    return out
+
+
+def normalize_patient_id_series(values):
+    """Normalize a whole column of patient IDs; same results as normalize_patient_id per cell (None for blanks)"""
+    series = (
+        values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    )
+    out = np.full(len(series), None, dtype=object)
+    present = series.notna().to_numpy()
+    positions = present.nonzero()[0]
+    values_present = series.iloc[positions]
+
+    if pd.api.types.is_integer_dtype(values_present) and not pd.api.types.is_bool_dtype(
+        values_present
+    ):
+        out[positions] = values_present.to_numpy().astype(str)
+    elif pd.api.types.is_float_dtype(values_present):
+        floats = values_present.to_numpy(dtype=float)
+        # Whole numbers below 1e16 print as "123.0" and become str(int(value))
+        whole = (np.floor(floats) == floats) & (np.abs(floats) < 1e16)
+        out[positions[whole]] = floats[whole].astype(np.int64).astype(str)
+        out[positions[~whole]] = _normalize_patient_id_text(
+            values_present[~whole].astype(object).astype(str)
+        ).to_numpy()
+    elif len(positions):
+        out[positions] = _normalize_patient_id_text(
+            values_present.astype(object).astype(str)
+        ).to_numpy()
+    return pd.Series(out, index=series.index)
+
+
+_NUMERIC_TEXT_RE = re.compile(r"-?\d+\.?\d*")
+
+
+def _excel_serial_to_mmddyyyy(number):
+    """MM/DD/YYYY for an Excel serial day number (200-100000, years 1900-2100); None otherwise."""
+    if not 200 <= number <= 100000:
+        return None
+    try:
+        d = datetime(1899, 12, 30) + timedelta(days=number)
+    except (ValueError, OverflowError):
+        return None
+    return d.strftime("%m/%d/%Y") if 1900 <= d.year <= 2100 else None
+
+
+def format_date_mmddyyyy(value):
+    """Format one cell as MM/DD/YYYY text for Excel downloads.
+
+    Blanks become "", Excel serial numbers are converted, and anything that
+    does not parse as a date is kept as text.
+    """
+    try:
+        if pd.isna(value) or value == "":
+            return ""
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, str):
+        if _NUMERIC_TEXT_RE.fullmatch(value.strip()):
+            serial = _excel_serial_to_mmddyyyy(float(value))
+            if serial:
+                return serial
+    elif isinstance(value, Real) and not isinstance(value, bool):
+        serial = _excel_serial_to_mmddyyyy(float(value))
+        if serial:
+            return serial
+    try:
+        date_obj = pd.to_datetime(value, errors="coerce")
+        if pd.isna(date_obj):
+            return str(value)
+        return date_obj.strftime("%m/%d/%Y")
+    except (ValueError, TypeError, AttributeError, OverflowError):
+        return str(value)
+
+
+def _format_date_strings_mmddyyyy(texts):
+    """format_date_mmddyyyy for an object array of distinct strings, parsed in one pass"""
+    try:
+        # format="mixed" parses each string on its own, like a scalar to_datetime call
+        parsed = pd.to_datetime(
+            pd.Series(texts, dtype=object), errors="coerce", format="mixed"
+        )
+    except (ValueError, TypeError, OverflowError):
+        parsed = None
+    if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed):
+        # Mixed UTC offsets do not fit one datetime column
+        return np.array([format_date_mmddyyyy(t) for t in texts], dtype=object)
+    formatted = parsed.dt.strftime("%m/%d/%Y").to_numpy(dtype=object)
+    out = np.empty(len(texts), dtype=object)
+    for i, (text, date_text) in enumerate(zip(texts, formatted)):
+        if text == "":
+            out[i] = ""
+            continue
+        if _NUMERIC_TEXT_RE.fullmatch(text.strip()):
+            serial = _excel_serial_to_mmddyyyy(float(text))
+            if serial:
+                out[i] = serial
+                continue
+        out[i] = text if not isinstance(date_text, str) else date_text
+    return out
+
+
+class DistinctValueCache:
+    """Memo of a per-value function (date formatting, name cleanup), meant to live for one request.
+
+    func runs once per distinct value however many cells share it, e.g. a
+    repeated appointment date or DOB string. The value's type is part of the
+    key, so 1, 1.0 and True stay apart. Missing values (None, NaN, NaT, pd.NA)
+    share one key per type: NaN never equals itself, so keying on the value
+    would add an entry for every blank cell.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, func):
+        self.func = func
+        self._results = {}
+
+    def __call__(self, value):
+        if (
+            value is None
+            or value is pd.NaT
+            or value is pd.NA
+            or (isinstance(value, (float, np.floating)) and value != value)
+        ):
+            key = (type(value), self._MISSING)
+        else:
+            key = (type(value), value)
+        try:
+            return self._results[key]
+        except KeyError:
+            result = self._results[key] = self.func(value)
+            return result
+        except TypeError:
+            return self.func(value)
+
+    def series(self, values):
+        """Apply func to a whole column through the cache"""
+        series = (
+            values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+        )
+        cells = series.to_numpy(dtype=object)
+        if pd.api.types.infer_dtype(cells, skipna=False) == "string":
+            # Only strings: one lookup per distinct string
+            codes, uniques = pd.factorize(cells)
+            results = np.empty(len(uniques), dtype=object)
+            results[:] = [self(value) for value in uniques]
+            out = results[codes]
+        else:
+            out = [self(value) for value in cells]
+        return pd.Series(out, index=series.index, dtype=object)
+
+
+def format_date_series_mmddyyyy(values):
+    """Format a whole column as MM/DD/YYYY text; same results as format_date_mmddyyyy per cell"""
+    series = (
+        values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    )
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime("%m/%d/%Y").fillna("").astype(object)
+    cells = series.to_numpy(dtype=object)
+    out = np.empty(len(cells), dtype=object)
+    is_text = np.fromiter(
+        (isinstance(v, str) for v in cells), dtype=bool, count=len(cells)
+    )
+    if is_text.any():
+        codes, texts = pd.factorize(cells[is_text])
+        out[is_text] = _format_date_strings_mmddyyyy(texts)[codes]
+    if not is_text.all():
+        # Numbers, timestamps and other objects: once per distinct value
+        others = DistinctValueCache(format_date_mmddyyyy).series(cells[~is_text])
+        out[~is_text] = others.to_numpy()
+    return pd.Series(out, index=series.index, dtype=object)
+
+
+def _series_to_stripped_text(series):
+    """Column-wise str(value).strip(); missing values become empty strings."""
+    text = series.astype(object).astype(str).str.strip()
+    return text.where(series.notna(), "")
+
+
+def fill_insurance_by_pat_id(df, pat_id_col):
+    """Set the Conversion Report's Primary/Secondary insurance on every row, in place.
+
+    Unique "Formatted Insurance" values per Pat ID (order of first occurrence):
+    the first goes to "Dental Primary Ins Carr" and the second to "Dental
+    Secondary Ins Carr" of each row with that Pat ID; other rows get blanks.
+    """
+    pat_ids = df[pat_id_col]
+    insurance_names = pd.DataFrame(
+        {
+            "pat_id": pat_ids,
+            "insurance": _series_to_stripped_text(df["Formatted Insurance"]),
+        }
+    )
+    insurance_names = insurance_names[
+        pat_ids.notna() & (insurance_names["insurance"] != "")
+    ].drop_duplicates()
+    insurance_rank = insurance_names.groupby("pat_id", sort=False).cumcount()
+    for rank, col_name in enumerate(
+        ["Dental Primary Ins Carr", "Dental Secondary Ins Carr"]
+    ):
+        by_pat_id = insurance_names[insurance_rank == rank].set_index("pat_id")[
+            "insurance"
+        ]
+        df[col_name] = pat_ids.map(by_pat_id).fillna("")
+
+
+def _appointment_report_columns(raw_columns):
+    """(Patient ID, primary insurance, secondary insurance) columns of an Appointment report; None when missing."""
+    raw_index = get_column_index(raw_columns)
+    patient_col = raw_index.find(
+        ["Patient ID", "PatientID", "patient id"]
+    ) or raw_index.find_containing(("patient", "id"))
+    primary_col = raw_index.find(
+        [
+            "Dental Primary Ins Carr",
+            "DentalPrimaryInsCarr",
+            "Dental Primary Insurance Carrier",
+        ],
+    ) or raw_index.find_containing(("primary", "ins"))
+    secondary_col = raw_index.find(
+        [
+            "Dental Secondary Ins Carr",
+            "DentalSecondaryInsCarr",
+            "Dental Secondary Insurance Carrier",
+        ],
+    ) or raw_index.find_containing(("secondary", "ins"))
+    return patient_col, primary_col, secondary_col
+
+
 def compare_patient_names(raw_df, previous_df):
     """Compare Patient ID from Appointment report with PATID from Smart Assist and add insurance columns"""
-    global merge_file2_data  # Access Conversion Report data for replacing CONVERSION values
+    session = session_state()
     try:
         # Debug: Show available columns
         raw_columns = list(raw_df.columns)
         previous_columns = list(previous_df.columns)
+        previous_index = get_column_index(previous_columns)
 
-        # Function to find specific column names
-        def find_column(columns, target_names):
-            """Find column matching any of the target names (case-insensitive)"""
-            for col in columns:
-                col_lower = col.lower().strip()
-                for target in target_names:
-                    if col_lower == target.lower().strip():
-                        return col
-            return None
-
-        # Find Patient ID in raw file (Appointment report)
-        raw_patient_col = find_column(
-            raw_columns, ["Patient ID", "PatientID", "patient id"]
+        # Find Patient ID and insurance columns in raw file (Appointment report)
+        raw_patient_col, appointment_primary_col, appointment_secondary_col = (
+            _appointment_report_columns(raw_columns)
         )
-        if not raw_patient_col:
-            # Try flexible search as fallback
-            for col in raw_columns:
-                if "patient" in col.lower() and "id" in col.lower():
-                    raw_patient_col = col
-                    break
 
         # Find PATID in previous file (Smart Assist) - now also checking for "Patient ID"
-        previous_patient_col = find_column(
-            previous_columns,
+        previous_patient_col = previous_index.find(
             [
                 "PATID",
                 "PatID",
@@ -5003,16 +5544,14 @@ def compare_patient_names(raw_df, previous_df):
             )
 
         # Find insurance columns in Smart Assist file, or create them if missing
-        primary_ins_col = find_column(
-            previous_columns,
+        primary_ins_col = previous_index.find(
             [
                 "Dental Primary Ins Carr",
                 "DentalPrimaryInsCarr",
                 "Dental Primary Insurance Carrier",
             ],
         )
-        secondary_ins_col = find_column(
-            previous_columns,
+        secondary_ins_col = previous_index.find(
             [
                 "Dental Secondary Ins Carr",
                 "DentalSecondaryInsCarr",
@@ -5044,79 +5583,38 @@ def compare_patient_names(raw_df, previous_df):
                 None,
             )
 
-        # Find insurance columns in Appointment Report file (more flexible search)
-        appointment_primary_col = None
-        appointment_secondary_col = None
-
-        # Try exact matches first
-        appointment_primary_col = find_column(
-            raw_columns,
-            [
-                "Dental Primary Ins Carr",
-                "DentalPrimaryInsCarr",
-                "Dental Primary Insurance Carrier",
-            ],
+        # Build a Patient ID -> insurance lookup from the Appointment Report
+        # (one row per normalized Patient ID, last occurrence wins)
+        appointment_lookup = pd.DataFrame(
+            {
+                "patient_id": normalize_patient_id_series(raw_df[raw_patient_col]),
+                "primary": (
+                    _series_to_stripped_text(raw_df[appointment_primary_col])
+                    if appointment_primary_col
+                    else ""
+                ),
+                "secondary": (
+                    _series_to_stripped_text(raw_df[appointment_secondary_col])
+                    if appointment_secondary_col
+                    else ""
+                ),
+            },
+            index=raw_df.index,
         )
-        appointment_secondary_col = find_column(
-            raw_columns,
-            [
-                "Dental Secondary Ins Carr",
-                "DentalSecondaryInsCarr",
-                "Dental Secondary Insurance Carrier",
-            ],
+        appointment_lookup = (
+            appointment_lookup[appointment_lookup["patient_id"].notna()]
+            .drop_duplicates(subset="patient_id", keep="last")
+            .set_index("patient_id")
         )
 
-        # If not found, try partial matches
-        if not appointment_primary_col:
-            for col in raw_columns:
-                col_lower = col.lower()
-                if ("primary" in col_lower and "ins" in col_lower) or (
-                    "primary" in col_lower and "insurance" in col_lower
-                ):
-                    appointment_primary_col = col
-                    break
-
-        if not appointment_secondary_col:
-            for col in raw_columns:
-                col_lower = col.lower()
-                if ("secondary" in col_lower and "ins" in col_lower) or (
-                    "secondary" in col_lower and "insurance" in col_lower
-                ):
-                    appointment_secondary_col = col
-                    break
-
-        # Create a mapping from Patient ID to insurance data in Appointment Report
-        appointment_insurance_map = {}
-        for idx, row in raw_df.iterrows():
-            patient_id_val = row[raw_patient_col]
-            # Normalize patient ID for consistent matching
-            patient_id = normalize_patient_id(patient_id_val)
-            if patient_id:
-                primary_value = ""
-                secondary_value = ""
-
-                if appointment_primary_col:
-                    primary_val = row[appointment_primary_col]
-                    if pd.notna(primary_val):
-                        primary_value = str(primary_val).strip()
-
-                if appointment_secondary_col:
-                    secondary_val = row[appointment_secondary_col]
-                    if pd.notna(secondary_val):
-                        secondary_value = str(secondary_val).strip()
-
-                appointment_insurance_map[patient_id] = {
-                    "primary": primary_value,
-                    "secondary": secondary_value,
-                }
-
         # Build mapping from Patient ID to "Dental Primary Ins Carr" and "Dental Secondary Ins Carr" from Conversion Report (File 2)
         # This is used to replace "CONVERSION <text>" values with actual insurance names
-        conversion_insurance_map = {}  # Primary insurance mapping
-        conversion_secondary_insurance_map = {}  # Secondary insurance mapping
-        if merge_file2_data:
+        # Primary/secondary insurance candidates, in sheet order
+        conversion_primary_frames = []
+        conversion_secondary_frames = []
+        if session.merge_file2_data:
             # Search through all sheets in Conversion Report (except "Zero ID")
-            for sheet_name, conversion_df in merge_file2_data.items():
+            for sheet_name, conversion_df in session.merge_file2_data.items():
                 if sheet_name.lower().strip() == "zero id":
                     continue
 
@@ -5168,35 +5666,70 @@ def compare_patient_names(raw_df, previous_df):
                         conversion_secondary_ins_col = col
                         break
 
-                # Build mapping if Patient ID and at least one insurance column found
+                # Collect candidates if Patient ID and at least one insurance column found
                 if conversion_pat_id_col:
-                    for idx, row in conversion_df.iterrows():
-                        pat_id_val = row[conversion_pat_id_col]
-                        pat_id = normalize_patient_id(pat_id_val)
-                        if pat_id:
-                            # Map primary insurance (only add if not already in map - first occurrence wins)
-                            if (
-                                conversion_primary_ins_col
-                                and pat_id not in conversion_insurance_map
-                            ):
-                                ins_val = row[conversion_primary_ins_col]
-                                if pd.notna(ins_val):
-                                    ins_str = str(ins_val).strip()
-                                    if ins_str:  # Only add non-empty values
-                                        conversion_insurance_map[pat_id] = ins_str
+                    conversion_ids = normalize_patient_id_series(
+                        conversion_df[conversion_pat_id_col]
+                    )
+                    for ins_col, frames in (
+                        (conversion_primary_ins_col, conversion_primary_frames),
+                        (conversion_secondary_ins_col, conversion_secondary_frames),
+                    ):
+                        if ins_col:
+                            frames.append(
+                                pd.DataFrame(
+                                    {
+                                        "patient_id": conversion_ids,
+                                        "insurance": _series_to_stripped_text(
+                                            conversion_df[ins_col]
+                                        ),
+                                    }
+                                )
+                            )
 
-                            # Map secondary insurance (only add if not already in map - first occurrence wins)
-                            if (
-                                conversion_secondary_ins_col
-                                and pat_id not in conversion_secondary_insurance_map
-                            ):
-                                ins_val = row[conversion_secondary_ins_col]
-                                if pd.notna(ins_val):
-                                    ins_str = str(ins_val).strip()
-                                    if ins_str:  # Only add non-empty values
-                                        conversion_secondary_insurance_map[pat_id] = (
-                                            ins_str
-                                        )
+        def first_nonempty_by_patient_id(frames):
+            """Patient ID -> first non-empty insurance value across frames (first occurrence wins)."""
+            if not frames:
+                return pd.Series(dtype=object)
+            candidates = pd.concat(frames, ignore_index=True)
+            candidates = candidates[
+                candidates["patient_id"].notna() & (candidates["insurance"] != "")
+            ]
+            candidates = candidates.drop_duplicates(subset="patient_id", keep="first")
+            return candidates.set_index("patient_id")["insurance"]
+
+        conversion_insurance_map = first_nonempty_by_patient_id(
+            conversion_primary_frames
+        )
+        conversion_secondary_insurance_map = first_nonempty_by_patient_id(
+            conversion_secondary_frames
+        )
+
+        # Format insurance names once per Patient ID and substitute "CONVERSION" values
+        # (case-insensitive) with the Conversion Report insurance, or blank when not found
+        def format_with_conversion(values, conversion_map):
+            formatted = format_insurance_series(values)
+            is_conversion = formatted.str.lower().str.contains(
+                "conversion", regex=False
+            )
+            replacement = formatted.index.to_series().map(conversion_map)
+            replaced = is_conversion & replacement.notna()
+            formatted = formatted.mask(is_conversion, "")
+            formatted = formatted.mask(replaced, format_insurance_series(replacement))
+            return formatted, replaced
+
+        (
+            appointment_lookup["primary"],
+            appointment_lookup["primary_replaced"],
+        ) = format_with_conversion(
+            appointment_lookup["primary"], conversion_insurance_map
+        )
+        (
+            appointment_lookup["secondary"],
+            appointment_lookup["secondary_replaced"],
+        ) = format_with_conversion(
+            appointment_lookup["secondary"], conversion_secondary_insurance_map
+        )
 
         # Use Smart Assist file as the result file (base)
         result_df = smart_assist_df.copy()
@@ -5227,69 +5760,41 @@ def compare_patient_names(raw_df, previous_df):
             # Column already exists, initialize empty values if needed
             result_df[secondary_col_name] = result_df[secondary_col_name].fillna("")
 
-        # Compare and populate insurance columns in Smart Assist file from Appointment Report
-        matched_count = 0
-        unmatched_patids = []  # Track unmatched PATIDs for debugging
-        conversion_replaced_count = (
-            0  # Track how many primary CONVERSION values were replaced
-        )
-        conversion_secondary_replaced_count = (
-            0  # Track how many secondary CONVERSION values were replaced
-        )
-        for idx, row in result_df.iterrows():
-            patid_val = row[previous_patient_col]
-            # Normalize patient ID for consistent matching
-            patid = normalize_patient_id(patid_val)
-            if patid and patid in appointment_insurance_map:
-                # Match found - Patient ID from Appointment Report matches PATID in Smart Assist
-                # Copy insurance data FROM Appointment Report TO Smart Assist file
-                # Format the insurance names before adding
-                insurance_data = appointment_insurance_map[patid]
-                primary_insurance_value = format_insurance_name(
-                    insurance_data["primary"]
-                )
-
-                # Check if primary insurance contains "CONVERSION" (case-insensitive)
-                if (
-                    primary_insurance_value
-                    and "conversion" in primary_insurance_value.lower()
-                ):
-                    # Try to replace with insurance from Conversion Report (File 2)
-                    if patid in conversion_insurance_map:
-                        primary_insurance_value = format_insurance_name(
-                            conversion_insurance_map[patid]
-                        )
-                        conversion_replaced_count += 1
-                    else:
-                        # If no match found in Conversion Report, set to blank
-                        primary_insurance_value = ""
-
-                secondary_insurance_value = format_insurance_name(
-                    insurance_data["secondary"]
-                )
+        # Join Smart Assist PATIDs against the Appointment Report lookup (left join keeps row order)
+        patid_values = result_df[previous_patient_col]
+        patids = normalize_patient_id_series(patid_values)
+        joined = pd.DataFrame({"patient_id": patids.to_numpy()}).merge(
+            appointment_lookup,
+            how="left",
+            left_on="patient_id",
+            right_index=True,
+            indicator=True,
+        )
+        matched = (joined["_merge"] == "both").to_numpy()
+        matched_count = int(matched.sum())
+
+        # Copy insurance data FROM Appointment Report TO Smart Assist file for matched records
+        if matched_count:
+            for col_name, source_col in (
+                (primary_col_name, "primary"),
+                (secondary_col_name, "secondary"),
+            ):
+                col_values = result_df[col_name].to_numpy(dtype=object, copy=True)
+                col_values[matched] = joined[source_col].to_numpy(dtype=object)[matched]
+                result_df[col_name] = col_values
 
-                # Check if secondary insurance contains "CONVERSION" (case-insensitive)
-                if (
-                    secondary_insurance_value
-                    and "conversion" in secondary_insurance_value.lower()
-                ):
-                    # Try to replace with insurance from Conversion Report (File 2)
-                    if patid in conversion_secondary_insurance_map:
-                        secondary_insurance_value = format_insurance_name(
-                            conversion_secondary_insurance_map[patid]
-                        )
-                        conversion_secondary_replaced_count += 1
-                    else:
-                        # If no match found in Conversion Report, set to blank
-                        secondary_insurance_value = ""
+        # Track how many primary/secondary CONVERSION values were replaced
+        conversion_replaced_count = int(
+            joined["primary_replaced"].to_numpy()[matched].sum()
+        )
+        conversion_secondary_replaced_count = int(
+            joined["secondary_replaced"].to_numpy()[matched].sum()
+        )
 
-                result_df.at[idx, primary_col_name] = primary_insurance_value
-                result_df.at[idx, secondary_col_name] = secondary_insurance_value
-                matched_count += 1
-            elif patid:
-                # Track unmatched PATIDs (limit to first 10 for display)
-                if len(unmatched_patids) < 10:
-                    unmatched_patids.append(str(patid_val))
+        # Track unmatched PATIDs (limit to first 10 for display)
+        unmatched_patids = [
+            str(v) for v in patid_values[patids.notna().to_numpy() & ~matched].iloc[:10]
+        ]
 
         # Count statistics
         total_patients = len(result_df)
@@ -5334,7 +5839,7 @@ def compare_patient_names(raw_df, previous_df):
   - Insurance columns: "{primary_ins_col}", "{secondary_ins_col}"{columns_info}
   
 📊 Matching details:
-- Total Patient IDs in Appointment Report: {len(appointment_insurance_map)}
+- Total Patient IDs in Appointment Report: {len(appointment_lookup)}
 - Records in Smart Assist: {total_patients}
 - Successful matches: {matched_count}{unmatched_info}
 
@@ -5353,6 +5858,1051 @@ def compare_patient_names(raw_df, previous_df):
         return f"❌ Error during comparison: {str(e)}", None
 
 
+# =============================
+# Per-session workflow state
+# =============================
+
+SESSION_COOKIE_NAME = "excel_comparison_session"
+SESSION_STATE_TTL_SECONDS = 8 * 60 * 60  # drop sessions idle this long
+SESSION_STATE_MEMORY_BUDGET_BYTES = 1024 * 1024 * 1024  # in-memory store size budget
+SESSION_STATE_DISK_CACHE_SESSIONS = 8  # unpickled sessions kept per worker process
+SESSION_STATE_TOUCH_SECONDS = (
+    10 * 60
+)  # how often reads push back a stored session's expiry
+# Local directory shared by all worker processes (e.g. several gunicorn workers); empty = in-memory store.
+SESSION_STATE_DIR = os.environ.get("SESSION_STATE_DIR", "")
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class _DigestSink:
+    """File-like target that feeds pickled bytes straight into a hash."""
+
+    def __init__(self, digest):
+        self.write = digest.update
+
+
+def _estimate_state_bytes(value):
+    """Approximate memory used by a session-state value (DataFrames, bytes, nested containers)."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, LazySheets):
+        return value.memory_usage()
+    if isinstance(value, dict):
+        return sum(
+            _estimate_state_bytes(k) + _estimate_state_bytes(v)
+            for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sum(_estimate_state_bytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SessionState:
+    """Workflow state of one browser session: uploads, results and download bytes by tab.
+
+    Routes read and write its attributes through session_state(). Assigning an
+    attribute records the name as written; a route that changes a stored value in
+    place (a sheet of an uploaded workbook, a list) calls touch() with its name.
+    The session is only saved again when something was written. Each write also
+    bumps the name's version, which background jobs compare before merging.
+    """
+
+    def __init__(self, values=None):
+        if values is None:
+            values = copy.deepcopy(_SESSION_STATE_DEFAULTS)
+        self.__dict__.update(values)
+        self.__dict__["_written"] = set()
+        self.__dict__["_versions"] = {}  # name -> number of writes
+
+    def __getattr__(self, name):
+        # Only reached for names the state does not hold, i.e. in a background job
+        raise AttributeError(
+            f"session state {name!r} was not sent to this background job; "
+            "list it in the route's @background_job(...)"
+        )
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        self.touch(name)
+
+    def touch(self, *names):
+        """Record values changed in place as written."""
+        self._written.update(names)
+        for name in names:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def versions(self):
+        """{name: version} of every name written so far; unwritten names are version 0."""
+        return dict(self._versions)
+
+    @property
+    def written(self):
+        """Names assigned or touched since the state was loaded or last saved."""
+        return frozenset(self._written)
+
+    def mark_saved(self):
+        self._written.clear()
+
+    def values(self):
+        """{name: value} of the state (only the names it holds, for a job's partial state)."""
+        return {
+            name: value
+            for name, value in self.__dict__.items()
+            if not name.startswith("_")
+        }
+
+    def __getstate__(self):
+        return dict(self.values(), _versions=self._versions)
+
+    def __setstate__(self, values):
+        # Names added since the session was saved start from their defaults
+        values = dict(values)
+        self.__dict__.update(copy.deepcopy(_SESSION_STATE_DEFAULTS))
+        self.__dict__["_versions"] = values.pop("_versions", {})
+        self.__dict__.update(values)
+        self.__dict__["_written"] = set()
+
+
+class _SessionLocks:
+    """Thread locks by session id, kept only while a thread holds or waits for one."""
+
+    def __init__(self):
+        self._locks = {}  # session id -> [lock, threads holding or waiting]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, session_id):
+        with self._guard:
+            entry = self._locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[session_id]
+
+
+class MemorySessionStore:
+    """In-process LRU of session states with idle-TTL eviction and a byte budget."""
+
+    def __init__(self, ttl_seconds, budget_bytes):
+        self.ttl_seconds = ttl_seconds
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # session id -> [state, size, last used, spool touched]
+        self._total_bytes = 0
+        self._locks = _SessionLocks()
+        self._guard = threading.Lock()
+
+    def load(self, session_id):
+        with self._guard:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl_seconds:
+                self._drop(session_id)
+                return None
+            return entry[0]
+
+    def lock(self, session_id):
+        """Hold one session exclusively; requests of other sessions run freely."""
+        return self._locks.hold(session_id)
+
+    def save(self, session_id, state):
+        # The stored state is the live object, so writes only mean re-measuring it
+        with self._guard:
+            entry = self._entries.get(session_id)
+            if entry is None or state.written:
+                size = sum(_estimate_state_bytes(v) for v in state.values().values())
+                spool_touched = 0.0
+                if entry is not None:
+                    self._total_bytes -= entry[1]
+                    spool_touched = entry[3]
+                entry = self._entries[session_id] = [state, size, 0.0, spool_touched]
+                self._total_bytes += size
+            state.mark_saved()
+            entry[0] = state
+            entry[2] = time.time()
+            self._entries.move_to_end(session_id)
+            self._evict()
+            touch_spool = entry[2] - entry[3] > SESSION_STATE_TOUCH_SECONDS
+            if touch_spool:
+                entry[3] = entry[2]
+        if touch_spool:
+            _touch_upload_spool(state.values())
+
+    def _drop(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [
+            sid for sid, e in self._entries.items() if now - e[2] > self.ttl_seconds
+        ]:
+            self._drop(session_id)
+        # Least recently used first; the session just saved is always kept
+        while self._total_bytes > self.budget_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+
+class DirectorySessionStore:
+    """Session states pickled into a local directory so every worker process sees the same state."""
+
+    def __init__(self, directory, ttl_seconds):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._cache = OrderedDict()  # session id -> (mtime_ns, state)
+        self._locks = _SessionLocks()
+        self._guard = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, session_id + ".pkl")
+
+    @contextmanager
+    def lock(self, session_id):
+        """Hold one session exclusively across threads and worker processes; others run freely."""
+        # The thread lock comes first: flock would not keep this process's threads apart
+        with self._locks.hold(session_id):
+            path = os.path.join(self.directory, session_id + ".lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                os.utime(fd)  # keeps the lock file of an active session out of _prune
+                yield
+            finally:
+                os.close(fd)
+
+    def _remember(self, session_id, mtime_ns, state):
+        with self._guard:
+            self._cache[session_id] = (mtime_ns, state)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > SESSION_STATE_DISK_CACHE_SESSIONS:
+                self._cache.popitem(last=False)
+
+    def load(self, session_id):
+        path = self._path(session_id)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if time.time() - st.st_mtime > self.ttl_seconds:
+            return None
+        cached = self._cache.get(session_id)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1]
+        # Another worker wrote this session since we last read it
+        with open(path, "rb") as fh:
+            state = pickle.load(fh)
+        self._remember(session_id, st.st_mtime_ns, state)
+        return state
+
+    def save(self, session_id, state):
+        path = self._path(session_id)
+        if not state.written:
+            # Nothing was written: only keep the file from expiring. The mtime is
+            # what other workers check their cached copy against, so it is moved
+            # at most every SESSION_STATE_TOUCH_SECONDS.
+            with suppress(OSError):
+                if time.time() - os.stat(path).st_mtime > SESSION_STATE_TOUCH_SECONDS:
+                    os.utime(path)
+                    self._remember(session_id, os.stat(path).st_mtime_ns, state)
+                    _touch_upload_spool(state.values())
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        state.mark_saved()
+        self._prune()
+        self._remember(session_id, os.stat(path).st_mtime_ns, state)
+        _touch_upload_spool(state.values())
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+if SESSION_STATE_DIR:
+    session_state_store = DirectorySessionStore(
+        SESSION_STATE_DIR, SESSION_STATE_TTL_SECONDS
+    )
+else:
+    session_state_store = MemorySessionStore(
+        SESSION_STATE_TTL_SECONDS, SESSION_STATE_MEMORY_BUDGET_BYTES
+    )
+
+
+def session_state():
+    """The SessionState of the browser session making the current request."""
+    return g.session_state
+
+
+# Paths that never touch workflow state: job polling only reads the job table, so
+# it never waits behind a request of its session, and static files need no session.
+_SESSIONLESS_ENDPOINTS = frozenset({"job_status", "static"})
+
+
+@app.before_request
+def _load_session_state():
+    """Load the requesting browser session's workflow state, holding that session's lock."""
+    if request.endpoint in _SESSIONLESS_ENDPOINTS:
+        return
+    session_id = request.cookies.get(SESSION_COOKIE_NAME, "")
+    if not _SESSION_ID_RE.match(session_id):
+        session_id = secrets.token_hex(16)
+        g.new_session_id = session_id
+    # Requests of one session run one at a time, also across worker processes
+    # sharing SESSION_STATE_DIR; other sessions are not held up
+    hold = g.session_state_hold = ExitStack()
+    hold.enter_context(session_state_store.lock(session_id))
+    g.session_id = session_id
+    g.session_state = session_state_store.load(session_id) or SessionState()
+
+
+@app.after_request
+def _set_session_cookie(response):
+    """Issue the session cookie to browsers that did not send a valid one."""
+    new_session_id = g.get("new_session_id")
+    if new_session_id:
+        response.set_cookie(
+            SESSION_COOKIE_NAME,
+            new_session_id,
+            max_age=SESSION_STATE_TTL_SECONDS,
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+@app.teardown_request
+def _save_session_state(exc):
+    """Store the session's workflow state (rewritten only if the request wrote to it) and release it."""
+    hold = g.pop("session_state_hold", None)
+    if hold is None:
+        return
+    with hold:
+        state = g.get("session_state")
+        if state is not None:
+            session_state_store.save(g.session_id, state)
+
+
+# =============================
+# Download artifacts
+# =============================
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOWNLOAD_CACHE_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024  # rendered downloads per process
+# Download format picked on each tab's download form -> field separator (None = styled xlsx)
+EXPORT_FORMATS = {"xlsx": None, "csv": ",", "tsv": "\t"}
+EXPORT_MIMETYPES = {"csv": "text/csv", "tsv": "text/tab-separated-values"}
+EXPORT_CHUNK_ROWS = 20000  # rows converted to CSV/TSV text at a time
+DOWNLOAD_STREAM_CHUNK_BYTES = 64 * 1024  # bytes handed to the socket at a time
+DOWNLOAD_STREAM_QUEUE_CHUNKS = 16  # chunks a render may run ahead of the client
+
+
+def download_fingerprint(kind, frames, *options):
+    """Content hash of the sheets a download renders plus the options that change its bytes."""
+    digest = hashlib.blake2b(digest_size=20)
+    pickler = pickle.Pickler(_DigestSink(digest), protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dump((kind, options))
+    for sheet_name, df in frames.items():
+        pickler.dump(sheet_name)
+        pickler.dump(df)
+    return digest.hexdigest()
+
+
+class DownloadArtifactCache:
+    """In-process LRU of rendered download files keyed by content fingerprint, with a byte budget."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()  # fingerprint -> bytes
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        if len(content) > self.budget_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+            self._entries[key] = content
+            self._total_bytes += len(content)
+            while self._total_bytes > self.budget_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self._total_bytes -= len(dropped)
+
+
+download_artifact_cache = DownloadArtifactCache(DOWNLOAD_CACHE_MEMORY_BUDGET_BYTES)
+
+
+def cached_download(kind, frames, export_format):
+    """Fingerprint and cached bytes for an xlsx download; (None, None) for CSV/TSV, which are not cached."""
+    if export_format != "xlsx":
+        return None, None
+    cache_key = download_fingerprint(kind, frames)
+    return cache_key, download_artifact_cache.get(cache_key)
+
+
+def requested_export_format():
+    """Download format chosen on the submitted form (xlsx unless csv/tsv was picked)."""
+    export_format = request.form.get("export_format", "xlsx").strip().lower()
+    return export_format if export_format in EXPORT_FORMATS else "xlsx"
+
+
+def send_xlsx_bytes(content, filename):
+    """Send an in-memory workbook as a download."""
+    return send_file(
+        io.BytesIO(content),
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=filename,
+    )
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file that hands out what was written in chunks."""
+
+    def __init__(self, emit=None):
+        self._emit = emit
+        self._buffer = bytearray()
+        self._chunks = []
+        self._discarded = False
+
+    def discard(self):
+        """Drop what is buffered and anything written from now on (the output failed)."""
+        self._discarded = True
+        self._buffer.clear()
+
+    def write(self, data):
+        if self._discarded:
+            return len(data)
+        self._buffer += data
+        if len(self._buffer) >= DOWNLOAD_STREAM_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            if self._emit is not None:
+                self._emit(chunk)
+            else:
+                self._chunks.append(chunk)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+class _StreamReader(io.RawIOBase):
+    """Binary file over a chunk generator, so send_file streams it to the client as it is produced."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def prime(self):
+        """Produce the first chunk now, so an error starting the render reaches the route.
+
+        A route turns such errors into its usual error response; once send_file
+        has returned, the 200 status is committed and they can only cut the
+        download short. For an xlsx this waits until all rows have been written.
+        """
+        self._pending = memoryview(next(self._chunks, b""))
+        return self
+
+    def close(self):
+        # Client went away or the response finished: stop the producer
+        self._chunks.close()
+        super().close()
+
+
+def _stream_imagen_workbook(sheets, cache_key=None):
+    """Yield an Imagen-styled workbook from a render thread.
+
+    ImagenExcelWriter keeps the rows in openpyxl's temporary files and zips them
+    into the sink only on close, so the first bytes come once every row has been
+    written. From then on the client receives the workbook as it is compressed, and
+    the finished file is never held in memory (unless it fits the download cache).
+    """
+    chunks = queue.Queue(maxsize=DOWNLOAD_STREAM_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def emit(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise OSError("download cancelled")
+
+    def render():
+        sink = _ChunkSink(emit)
+        writer = None
+        try:
+            writer = ImagenExcelWriter(sink)
+            for sheet_name, df in sheets:
+                writer.write_sheet(sheet_name, df)
+            writer.close()
+            sink.flush()
+            emit(None)
+        except Exception as exc:
+            # The unfinished zip must not reach the client ahead of the error
+            sink.discard()
+            if writer is not None:
+                writer.abort()
+            if not cancelled.is_set():
+                emit(exc)
+
+    threading.Thread(target=render, name="download", daemon=True).start()
+    cached, cached_bytes = [], 0
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if cache_key is not None and cached is not None:
+                cached.append(chunk)
+                cached_bytes += len(chunk)
+                if cached_bytes > download_artifact_cache.budget_bytes:
+                    cached = None
+            yield chunk
+        if cache_key is not None and cached is not None:
+            download_artifact_cache.put(cache_key, b"".join(cached))
+    finally:
+        cancelled.set()
+
+
+def _delimited_chunks(df, sep):
+    """CSV/TSV text of df (header row first), EXPORT_CHUNK_ROWS rows at a time."""
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        part = df.iloc[start : start + EXPORT_CHUNK_ROWS]
+        yield part.to_csv(sep=sep, index=False, header=start == 0).encode("utf-8")
+
+
+def _stream_delimited(sheets, export_format):
+    """Yield one sheet as CSV/TSV text, or several as a zip with one file per sheet."""
+    sep = EXPORT_FORMATS[export_format]
+    if len(sheets) == 1:
+        # BOM so Excel opens the file as UTF-8
+        yield codecs.BOM_UTF8
+        yield from _delimited_chunks(sheets[0][1], sep)
+        return
+    sink = _ChunkSink()
+    used_names = set()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for sheet_name, df in sheets:
+            member = re.sub(r'[\\/:*?"<>|]', "_", str(sheet_name)).strip() or "sheet"
+            while member.lower() in used_names:
+                member += "_"
+            used_names.add(member.lower())
+            with archive.open(f"{member}.{export_format}", "w") as fh:
+                fh.write(codecs.BOM_UTF8)
+                for chunk in _delimited_chunks(df, sep):
+                    fh.write(chunk)
+                    yield from sink.drain()
+    sink.flush()
+    yield from sink.drain()
+
+
+def _check_excel_cells(df):
+    """Raise now the error openpyxl would raise part-way through streaming df as a sheet."""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.utils.exceptions import IllegalCharacterError
+
+    columns = [list(df.columns)]
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        if isinstance(values.dtype, pd.DatetimeTZDtype) and values.notna().any():
+            _excel_cell_value(values.dropna().iloc[0])  # timezones are not supported
+        columns.append(values.tolist())
+    for values in columns:
+        strings = [value for value in values if isinstance(value, str)]
+        # One search over the column's text; the offending cell is found only on a hit
+        if strings and ILLEGAL_CHARACTERS_RE.search("".join(strings)):
+            bad = next(s for s in strings if ILLEGAL_CHARACTERS_RE.search(s))
+            raise IllegalCharacterError(f"{bad} cannot be used in worksheets.")
+
+
+class SheetExport:
+    """Sheets a download route has prepared, sent as one streamed response.
+
+    Routes write sheets into it the way they would into ImagenExcelWriter, then
+    return response(): an Imagen-styled xlsx, or CSV/TSV text (a zip with one file
+    per sheet when there are several) for the fast-export formats.
+    """
+
+    def __init__(self, export_format="xlsx"):
+        self.export_format = export_format
+        self.sheets = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+    def write_sheet(self, sheet_name, df):
+        if self.export_format == "xlsx":
+            _check_excel_cells(df)
+        self.sheets.append((sheet_name, df))
+
+    def response(self, filename, cache_key=None):
+        if self.export_format == "xlsx":
+            chunks = _stream_imagen_workbook(self.sheets, cache_key)
+            return send_file(
+                _StreamReader(chunks).prime(),
+                mimetype=XLSX_MIMETYPE,
+                as_attachment=True,
+                download_name=filename,
+            )
+        stem = os.path.splitext(filename)[0] or "download"
+        if len(self.sheets) == 1:
+            filename = f"{stem}.{self.export_format}"
+            mimetype = EXPORT_MIMETYPES[self.export_format]
+        else:
+            filename = f"{stem}.zip"
+            mimetype = "application/zip"
+        return send_file(
+            _StreamReader(_stream_delimited(self.sheets, self.export_format)).prime(),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=filename,
+        )
+
+
+def clear_session_state_when_sent(response, *names):
+    """Reset session-state values to their defaults once the body of response has been sent in full.
+
+    For download routes that consume their tab's data: if the render fails or the
+    client disconnects part-way, the data stays in place for another try.
+    """
+    session_id = g.session_id
+    body = response.response
+
+    def chunks():
+        try:
+            yield from body
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+        # The request (and its hold on the session) ended when the body started
+        with session_state_store.lock(session_id):
+            state = session_state_store.load(session_id)
+            if state is not None:
+                for name in names:
+                    setattr(state, name, copy.deepcopy(_SESSION_STATE_DEFAULTS[name]))
+                session_state_store.save(session_id, state)
+
+    response.response = chunks()
+    return response
+
+
+def send_output_sheets(kind, sheets, filename):
+    """Send a tab's stored output sheets ({sheet_name: df}) in the download format picked on the form."""
+    try:
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(kind, sheets, export_format)
+        if cached is not None:
+            return send_xlsx_bytes(cached, filename)
+        with SheetExport(export_format) as export:
+            for sheet_name, df in sheets.items():
+                export.write_sheet(sheet_name, df)
+        return export.response(filename, cache_key)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# =============================
+# Background jobs
+# =============================
+
+# Long-running POST routes run as jobs when the page asks for it; the request
+# returns a job id at once and the page polls /jobs/<id>. Each job runs in its
+# own process on the session-state values its route reads, so jobs of different
+# sessions run side by side and the web workers stay free while they do.
+JOB_WORKERS = max(2, os.cpu_count() or 1)
+JOB_RETENTION_SECONDS = 60 * 60  # finished jobs stay queryable this long
+JOB_PROGRESS_POLL_SECONDS = 0.5
+BACKGROUND_JOB_HEADER = "X-Background-Job"
+
+# Worker processes come from a fork server that has imported this module, rather
+# than being forked from the multithreaded web server.
+_process_context = multiprocessing.get_context("forkserver")
+_process_context.set_forkserver_preload([__name__])
+
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_job_pool = None
+_job_manager = None
+_job_pool_lock = threading.Lock()
+_jobs = {}  # job id -> job record
+_jobs_lock = threading.Lock()
+_job_context = threading.local()
+_JOB_PUBLIC_FIELDS = (
+    "job_id",
+    "name",
+    "status",
+    "progress",
+    "redirect",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+def _job_file(job_id):
+    return os.path.join(SESSION_STATE_DIR, "jobs", job_id + ".json")
+
+
+def _update_job(job, **fields):
+    """Update a job record; with SESSION_STATE_DIR set, also publish it for other worker processes."""
+    with _jobs_lock:
+        job.update(fields)
+        snapshot = dict(job)
+    if SESSION_STATE_DIR:
+        path = _job_file(snapshot["job_id"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(snapshot, fh)
+        os.replace(tmp_path, path)
+
+
+def _get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+    if SESSION_STATE_DIR and re.fullmatch(r"[0-9a-f]{32}", job_id):
+        try:
+            with open(_job_file(job_id)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for job_id in [
+            jid
+            for jid, job in _jobs.items()
+            if job["finished_at"] and job["finished_at"] < cutoff
+        ]:
+            del _jobs[job_id]
+    if SESSION_STATE_DIR and os.path.isdir(os.path.join(SESSION_STATE_DIR, "jobs")):
+        for name in os.listdir(os.path.join(SESSION_STATE_DIR, "jobs")):
+            path = os.path.join(SESSION_STATE_DIR, "jobs", name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def report_job_progress(message):
+    """Record a progress message for the background job running in this process (no-op in a normal request)."""
+    report = getattr(_job_context, "report", None)
+    if report is not None:
+        report(message)
+
+
+def _job_processes():
+    """The job process pool and a manager for the progress queues its jobs report to."""
+    global _job_pool, _job_manager
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ProcessPoolExecutor(
+                max_workers=JOB_WORKERS,
+                mp_context=_process_context,
+            )
+            _job_manager = _process_context.Manager()
+        return _job_pool, _job_manager
+
+
+def _execute_job(endpoint, view_kwargs, path, data, values, progress, file_workers):
+    """Job process side of _run_job: replay the captured POST request on the session-state values sent.
+
+    file_workers is how many worker processes map_files may use for this job.
+    Returns (status, redirect, error, {name: value} of the session state the request wrote).
+    """
+    state = SessionState(values)
+    _job_context.report = progress.put
+    _job_context.file_workers = file_workers
+    try:
+        with app.test_request_context(path, method="POST", data=data):
+            g.session_state = state
+            response = app.make_response(app.view_functions[endpoint](**view_kwargs))
+    finally:
+        _job_context.report = None
+        _job_context.file_workers = None
+    changes = {name: getattr(state, name) for name in state.written}
+    if response.status_code >= 400:
+        error = response.get_data(as_text=True)
+        if response.is_json:
+            error = (response.get_json(silent=True) or {}).get("error") or error
+        return "failed", None, error[:1000], changes
+    return "done", response.location, None, changes
+
+
+def _run_job(job, endpoint, view_kwargs, path, data, state_names):
+    """Run a captured POST request in a job process, then merge the state it wrote into its session."""
+    global _job_pool
+    session_id = job["session_id"]
+    _update_job(job, status="running", started_at=time.time())
+    # Jobs running side by side split FILE_WORKERS between them
+    with _jobs_lock:
+        running = sum(1 for other in _jobs.values() if other["status"] == "running")
+    file_workers = max(1, FILE_WORKERS // max(1, running))
+    try:
+        with session_state_store.lock(session_id):
+            state = session_state_store.load(session_id) or SessionState()
+            values = {name: getattr(state, name) for name in state_names}
+            versions = state.versions()
+        pool, manager = _job_processes()
+        progress = manager.Queue()
+        future = pool.submit(
+            _execute_job,
+            endpoint,
+            view_kwargs,
+            path,
+            data,
+            values,
+            progress,
+            file_workers,
+        )
+        while True:
+            try:
+                _update_job(
+                    job, progress=progress.get(timeout=JOB_PROGRESS_POLL_SECONDS)
+                )
+            except queue.Empty:
+                if future.done():
+                    break
+        try:
+            status, location, error, changes = future.result()
+        except BrokenProcessPool:
+            with _job_pool_lock:
+                if _job_pool is pool:
+                    _job_pool = None
+            raise RuntimeError("The job's worker process stopped unexpectedly.")
+        if changes:
+            # Only the values this job wrote are set, over the session's current
+            # state, so requests made while it ran are kept. If one of them was
+            # written meanwhile (a Reset, a new upload), the job's results are stale.
+            with session_state_store.lock(session_id):
+                state = session_state_store.load(session_id) or SessionState()
+                current = state.versions()
+                if any(
+                    current.get(name, 0) != versions.get(name, 0) for name in changes
+                ):
+                    status, location = "failed", None
+                    error = (
+                        "This tab was reset or given new files while the job ran, "
+                        "so its results were discarded. Please run it again."
+                    )
+                else:
+                    for name, value in changes.items():
+                        setattr(state, name, value)
+                    session_state_store.save(session_id, state)
+        _update_job(job, status=status, redirect=location, error=error)
+    except Exception as e:
+        _update_job(job, status="failed", error=str(e))
+    finally:
+        _update_job(job, finished_at=time.time())
+
+
+def background_job(*state_names):
+    """Run the decorated POST route as a background job when the page sends the X-Background-Job header.
+    Responds 202 with the job id; the page polls /jobs/<id>, then follows the redirect.
+
+    state_names are the session-state values the route reads; only those are sent
+    to the job process, and only the values the route writes come back.
+    """
+    return functools.partial(_background_job_view, state_names=state_names)
+
+
+def _background_job_view(view, state_names):
+    @functools.wraps(view)
+    def wrapper(**view_kwargs):
+        if request.headers.get(BACKGROUND_JOB_HEADER) != "1":
+            return view(**view_kwargs)
+        # Capture the request now: uploaded file streams are closed once it returns
+        data = MultiDict(request.form.items(multi=True))
+        for field, storage in request.files.items(multi=True):
+            data.add(
+                field,
+                (io.BytesIO(storage.read()), storage.filename, storage.content_type),
+            )
+        job_id = secrets.token_hex(16)
+        job = {
+            "job_id": job_id,
+            "name": request.endpoint,
+            "status": "queued",
+            "progress": "",
+            "redirect": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "session_id": g.session_id,
+        }
+        _prune_jobs()
+        with _jobs_lock:
+            _jobs[job_id] = job
+        _update_job(job)
+        _job_executor.submit(
+            _run_job,
+            job,
+            request.endpoint,
+            view_kwargs,
+            request.path,
+            data,
+            state_names,
+        )
+        return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+    return wrapper
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Status/progress of a background job started by this browser session."""
+    job = _get_job(job_id)
+    if job is None or job["session_id"] != request.cookies.get(SESSION_COOKIE_NAME):
+        return jsonify({"error": "Unknown job."}), 404
+    status = {field: job.get(field) for field in _JOB_PUBLIC_FIELDS}
+    if job["status"] == "queued":
+        with _jobs_lock:
+            status["position"] = sum(
+                1
+                for other in _jobs.values()
+                if other["status"] == "queued"
+                and other["created_at"] < job["created_at"]
+            )
+    return jsonify(status)
+
+
+# =============================
+# Worker processes
+# =============================
+
+# The files of one multi-file upload or report are handled in up to this many
+# processes. FILE_WORKERS=1 handles them one after another in the request thread
+# (useful when debugging). A background job gets FILE_WORKERS divided by the
+# number of jobs running when it starts, in processes of its own that exit when
+# its files are done.
+FILE_WORKERS = int(os.environ.get("FILE_WORKERS", "0")) or os.cpu_count() or 1
+
+_file_pool = None
+_file_pool_lock = threading.Lock()
+
+
+def _file_worker_pool():
+    global _file_pool
+    with _file_pool_lock:
+        if _file_pool is None:
+            _file_pool = ProcessPoolExecutor(
+                max_workers=FILE_WORKERS, mp_context=_process_context
+            )
+        return _file_pool
+
+
+def map_files(fn, items, progress=()):
+    """Iterator of fn(*item) for each item, spread over worker processes when there are several.
+
+    fn must be a module-level function whose arguments and result can be pickled;
+    it should catch its own per-file errors. All items start at once and results
+    come back in the order of items. progress optionally holds one job progress
+    message per item, reported when that item's result is next. If the pool
+    breaks (a worker died), the remaining files are processed here instead.
+    """
+    items = list(items)
+    job_workers = getattr(_job_context, "file_workers", None)
+    workers = min(FILE_WORKERS if job_workers is None else job_workers, len(items))
+    if workers <= 1:
+        return _file_results(fn, items, None, list(progress))
+    if job_workers is not None:
+        return _job_file_results(fn, items, workers, list(progress))
+    results = _file_worker_pool().map(fn, *zip(*items))
+    return _file_results(fn, items, results, list(progress))
+
+
+def _job_file_results(fn, items, workers, progress):
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_process_context)
+    try:
+        yield from _file_results(fn, items, pool.map(fn, *zip(*items)), progress)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _file_results(fn, items, results, progress):
+    global _file_pool
+    for i, item in enumerate(items):
+        if i < len(progress):
+            report_job_progress(progress[i])
+        if results is not None:
+            try:
+                yield next(results)
+                continue
+            except BrokenProcessPool:
+                with _file_pool_lock:
+                    _file_pool = None
+                results = None
+        yield fn(*item)
+
+
 @app.route("/")
 def root():
     return redirect("/comparison")
@@ -5360,122 +6910,114 @@ def root():
 
 @app.route("/comparison")
 def comparison_index():
-    global raw_data, previous_data, raw_filename, previous_filename, comparison_result
-    global merge_file1_data, merge_file2_data, merge_file1_filename, merge_file2_filename, merge_result
-    global conversion_data, conversion_filename, conversion_result
-    global insurance_formatting_data, insurance_formatting_filename, insurance_formatting_result, insurance_formatting_output
-    global remarks_appointments_data, remarks_excel_data, remarks_appointments_filename, remarks_remarks_filename, remarks_result, remarks_updated_count
-    global appointment_report_data, appointment_report_filename, appointment_report_result, appointment_report_output
-    global smart_assist_data, smart_assist_filename, smart_assist_result, smart_assist_output
-    global consolidate_master_data, consolidate_daily_data, consolidate_master_filename, consolidate_daily_filename, consolidate_result, consolidate_output
-    global reallocation_consolidate_data, reallocation_blank_data, reallocation_consolidate_filename, reallocation_blank_filename, reallocation_result, reallocation_output, reallocation_merged_data, reallocation_available_remarks, reallocation_selected_remarks, reallocation_available_agents, reallocation_selected_agents
-    global general_primary_data, general_main_data, general_primary_filename, general_main_filename, general_comparison_result, general_comparison_output, general_comparison_updated_data
-    global data_cleanser_data, data_cleanser_filename, data_cleanser_result, data_cleanser_output, data_cleanser_processed_data
-    global agent_remark_transfer_data, agent_remark_transfer_filename, agent_remark_transfer_result, agent_remark_transfer_output, agent_remark_transfer_processed_data
-    global ev_allocation_files, ev_allocation_result, ev_allocation_output, ev_allocation_output_filename
+    session = session_state()
 
     # Get the active tab from URL parameter
     active_tab = request.args.get("tab", "comparison")
+    store = consolidate_store()
 
     return render_template_string(
         HTML_TEMPLATE,
-        raw_data=raw_data,
-        previous_data=previous_data,
-        raw_filename=raw_filename,
-        previous_filename=previous_filename,
-        comparison_result=comparison_result,
-        merge_file1_data=merge_file1_data,
-        merge_file2_data=merge_file2_data,
-        merge_file1_filename=merge_file1_filename,
-        merge_file2_filename=merge_file2_filename,
-        merge_result=merge_result,
-        conversion_data=conversion_data,
-        conversion_filename=conversion_filename,
-        conversion_result=conversion_result,
-        insurance_formatting_data=insurance_formatting_data,
-        insurance_formatting_filename=insurance_formatting_filename,
-        insurance_formatting_result=insurance_formatting_result,
-        insurance_formatting_output=insurance_formatting_output,
-        remarks_appointments_data=remarks_appointments_data,
-        remarks_excel_data=remarks_excel_data,
-        remarks_appointments_filename=remarks_appointments_filename,
-        remarks_remarks_filename=remarks_remarks_filename,
-        remarks_result=remarks_result,
-        remarks_updated_count=remarks_updated_count,
-        appointment_report_data=appointment_report_data,
-        appointment_report_filename=appointment_report_filename,
-        appointment_report_result=appointment_report_result,
-        appointment_report_output=appointment_report_output,
-        smart_assist_data=smart_assist_data,
-        smart_assist_filename=smart_assist_filename,
-        smart_assist_result=smart_assist_result,
-        smart_assist_output=smart_assist_output,
-        consolidate_master_data=consolidate_master_data,
-        consolidate_daily_data=consolidate_daily_data,
-        consolidate_master_filename=consolidate_master_filename,
-        consolidate_daily_filename=consolidate_daily_filename,
-        consolidate_result=consolidate_result,
-        consolidate_output=consolidate_output,
-        reallocation_consolidate_data=reallocation_consolidate_data,
-        reallocation_blank_data=reallocation_blank_data,
-        reallocation_consolidate_filename=reallocation_consolidate_filename,
-        reallocation_blank_filename=reallocation_blank_filename,
-        reallocation_result=reallocation_result,
-        reallocation_output=reallocation_output,
-        reallocation_merged_data=reallocation_merged_data,
-        reallocation_available_remarks=reallocation_available_remarks,
-        reallocation_selected_remarks=reallocation_selected_remarks,
-        reallocation_available_agents=reallocation_available_agents,
-        reallocation_selected_agents=reallocation_selected_agents,
-        general_primary_data=general_primary_data,
-        general_main_data=general_main_data,
-        general_primary_filename=general_primary_filename,
-        general_main_filename=general_main_filename,
-        general_comparison_result=general_comparison_result,
-        general_comparison_output=general_comparison_output,
-        general_comparison_updated_data=general_comparison_updated_data,
-        data_cleanser_data=data_cleanser_data,
-        data_cleanser_filename=data_cleanser_filename,
-        data_cleanser_result=data_cleanser_result,
-        data_cleanser_output=data_cleanser_output,
-        data_cleanser_processed_data=data_cleanser_processed_data,
-        agent_remark_transfer_data=agent_remark_transfer_data,
-        agent_remark_transfer_filename=agent_remark_transfer_filename,
-        agent_remark_transfer_result=agent_remark_transfer_result,
-        agent_remark_transfer_output=agent_remark_transfer_output,
-        agent_remark_transfer_processed_data=agent_remark_transfer_processed_data,
-        ev_allocation_files=ev_allocation_files,
-        ev_allocation_result=ev_allocation_result,
-        ev_allocation_output_filename=ev_allocation_output_filename
+        raw_data=session.raw_data,
+        previous_data=session.previous_data,
+        raw_filename=session.raw_filename,
+        previous_filename=session.previous_filename,
+        comparison_result=session.comparison_result,
+        merge_file1_data=session.merge_file1_data,
+        merge_file2_data=session.merge_file2_data,
+        merge_file1_filename=session.merge_file1_filename,
+        merge_file2_filename=session.merge_file2_filename,
+        merge_result=session.merge_result,
+        conversion_data=session.conversion_data,
+        conversion_filename=session.conversion_filename,
+        conversion_result=session.conversion_result,
+        insurance_formatting_data=session.insurance_formatting_data,
+        insurance_formatting_filename=session.insurance_formatting_filename,
+        insurance_formatting_result=session.insurance_formatting_result,
+        insurance_formatting_output=session.insurance_formatting_output,
+        remarks_appointments_data=session.remarks_appointments_data,
+        remarks_excel_data=session.remarks_excel_data,
+        remarks_appointments_filename=session.remarks_appointments_filename,
+        remarks_remarks_filename=session.remarks_remarks_filename,
+        remarks_result=session.remarks_result,
+        remarks_updated_count=session.remarks_updated_count,
+        appointment_report_data=session.appointment_report_data,
+        appointment_report_filename=session.appointment_report_filename,
+        appointment_report_result=session.appointment_report_result,
+        appointment_report_output=session.appointment_report_output,
+        smart_assist_data=session.smart_assist_data,
+        smart_assist_filename=session.smart_assist_filename,
+        smart_assist_result=session.smart_assist_result,
+        smart_assist_output=session.smart_assist_output,
+        consolidate_master_data=session.consolidate_master_data,
+        consolidate_daily_data=session.consolidate_daily_data,
+        consolidate_master_filename=session.consolidate_master_filename,
+        consolidate_daily_filename=session.consolidate_daily_filename,
+        consolidate_result=session.consolidate_result,
+        consolidate_output=session.consolidate_output,
+        consolidate_store_ready=store is not None
+        and store.available_to(g.session_id)
+        and "consolidated" in store,
+        reallocation_consolidate_data=session.reallocation_consolidate_data,
+        reallocation_blank_data=session.reallocation_blank_data,
+        reallocation_consolidate_filename=session.reallocation_consolidate_filename,
+        reallocation_blank_filename=session.reallocation_blank_filename,
+        reallocation_result=session.reallocation_result,
+        reallocation_output=session.reallocation_output,
+        reallocation_merged_data=session.reallocation_merged_data,
+        reallocation_available_remarks=session.reallocation_available_remarks,
+        reallocation_selected_remarks=session.reallocation_selected_remarks,
+        reallocation_available_agents=session.reallocation_available_agents,
+        reallocation_selected_agents=session.reallocation_selected_agents,
+        general_primary_data=session.general_primary_data,
+        general_main_data=session.general_main_data,
+        general_primary_filename=session.general_primary_filename,
+        general_main_filename=session.general_main_filename,
+        general_comparison_result=session.general_comparison_result,
+        general_comparison_output=session.general_comparison_output,
+        general_comparison_updated_data=session.general_comparison_updated_data,
+        data_cleanser_data=session.data_cleanser_data,
+        data_cleanser_filename=session.data_cleanser_filename,
+        data_cleanser_result=session.data_cleanser_result,
+        data_cleanser_output=session.data_cleanser_output,
+        data_cleanser_processed_data=session.data_cleanser_processed_data,
+        agent_remark_transfer_data=session.agent_remark_transfer_data,
+        agent_remark_transfer_filename=session.agent_remark_transfer_filename,
+        agent_remark_transfer_result=session.agent_remark_transfer_result,
+        agent_remark_transfer_output=session.agent_remark_transfer_output,
+        agent_remark_transfer_processed_data=session.agent_remark_transfer_processed_data,
+        ev_allocation_files=session.ev_allocation_files,
+        ev_allocation_result=session.ev_allocation_result,
+        ev_allocation_output_filename=session.ev_allocation_output_filename
         or "ev_allocation_report.xlsx",
-        ev_allocation_has_output=(ev_allocation_output is not None),
+        ev_allocation_has_output=(session.ev_allocation_output is not None),
         ev_allocation_output_columns=EV_ALLOCATION_OUTPUT_COLUMNS,
         dental_bv_output_columns=DENTAL_BV_OUTPUT_COLUMNS,
-        dental_bv_result_step1=dental_bv_result_step1,
-        dental_bv_result_step2=dental_bv_result_step2,
-        dental_bv_result_step3=dental_bv_result_step3,
-        dental_bv_has_step1_output=(dental_bv_step1_output is not None),
-        dental_bv_has_step2_output=(dental_bv_step2_output is not None),
-        dental_bv_has_step3_output=(dental_bv_step3_output is not None),
-        dental_bv_has_final_output=(dental_bv_final_output is not None),
-        apt_data=apt_data,
-        apt_filename=apt_filename,
-        apt_selected_sheet=apt_selected_sheet,
-        apt_sheet_columns=apt_sheet_columns,
-        apt_agent_col=apt_agent_col,
-        apt_date_col=apt_date_col,
-        apt_remark_values=apt_remark_values,
-        apt_result=apt_result,
-        apt_has_output=(apt_output is not None),
-        nh_data=nh_data,
-        nh_filename=nh_filename,
-        nh_selected_sheet=nh_selected_sheet,
-        nh_remark_values=nh_remark_values,
-        nh_filtered_df=nh_filtered_df,
-        nh_step2_files=nh_step2_files,
-        nh_file2_filename=nh_file2_filename,
-        nh_result=nh_result,
-        nh_output=nh_output,
+        dental_bv_result_step1=session.dental_bv_result_step1,
+        dental_bv_result_step2=session.dental_bv_result_step2,
+        dental_bv_result_step3=session.dental_bv_result_step3,
+        dental_bv_has_step1_output=(session.dental_bv_step1_output is not None),
+        dental_bv_has_step2_output=(session.dental_bv_step2_output is not None),
+        dental_bv_has_step3_output=(session.dental_bv_step3_output is not None),
+        dental_bv_has_final_output=(session.dental_bv_final_output is not None),
+        apt_data=session.apt_data,
+        apt_filename=session.apt_filename,
+        apt_selected_sheet=session.apt_selected_sheet,
+        apt_sheet_columns=session.apt_sheet_columns,
+        apt_agent_col=session.apt_agent_col,
+        apt_date_col=session.apt_date_col,
+        apt_remark_values=session.apt_remark_values,
+        apt_result=session.apt_result,
+        apt_has_output=(session.apt_output is not None),
+        nh_data=session.nh_data,
+        nh_filename=session.nh_filename,
+        nh_selected_sheet=session.nh_selected_sheet,
+        nh_remark_values=session.nh_remark_values,
+        nh_filtered_df=session.nh_filtered_df,
+        nh_step2_files=session.nh_step2_files,
+        nh_file2_filename=session.nh_file2_filename,
+        nh_result=session.nh_result,
+        nh_output=session.nh_output,
         active_tab=active_tab,
     )
 
@@ -5496,14 +7038,355 @@ def normalize_column_name(col_name):
 
 def find_matching_column(col_name, target_columns):
     """Find a matching column in target_columns using flexible matching"""
-    normalized_col = normalize_column_name(col_name)
-    for target_col in target_columns:
-        normalized_target = normalize_column_name(target_col)
-        if normalized_col == normalized_target:
-            return target_col
+    return get_column_index(target_columns).find(col_name, form="alias")
+
+
+# Distinct header tuples kept by get_column_index; one entry per uploaded sheet layout.
+COLUMN_INDEX_CACHE_SIZE = 256
+
+_COLUMN_NAME_FORMS = ("lower", "collapsed", "compact", "key", "alias")
+
+
+def _column_name_form(name, form):
+    """Normalize a column header for ColumnIndex lookups.
+    lower: stripped + lowercase; collapsed: whitespace/underscore runs become one space;
+    compact: no whitespace/underscores; key: compact without hyphens; alias: normalize_column_name.
+    """
+    if form == "alias":
+        return normalize_column_name(name)
+    s = str(name).strip().lower()
+    if form == "collapsed":
+        return re.sub(r"[\s_]+", " ", s)
+    if form == "compact":
+        return re.sub(r"[\s_]+", "", s)
+    if form == "key":
+        return re.sub(r"[\s_\-]+", "", s)
+    return s
+
+
+class ColumnIndex:
+    """Normalized header forms of one DataFrame, computed once, for exact/alias/keyword column lookups."""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self._labels = set(self.columns)
+        self._forms = {form: [] for form in _COLUMN_NAME_FORMS}
+        self._positions = {form: {} for form in _COLUMN_NAME_FORMS}
+        for pos, col in enumerate(self.columns):
+            for form in _COLUMN_NAME_FORMS:
+                value = _column_name_form(col, form)
+                self._forms[form].append(value)
+                self._positions[form].setdefault(value, []).append(pos)
+
+    def get(self, name):
+        """Return name if it is one of the column labels, else None."""
+        return name if name in self._labels else None
+
+    def find(self, names, form="lower", last=False):
+        """Return the first column (last column when last=True) whose normalized form equals that of any of names, or None."""
+        if isinstance(names, str):
+            names = (names,)
+        positions = self._positions[form]
+        best = None
+        for name in names:
+            matches = positions.get(_column_name_form(name, form))
+            if not matches:
+                continue
+            pos = matches[-1] if last else matches[0]
+            if best is None or (pos > best if last else pos < best):
+                best = pos
+        return None if best is None else self.columns[best]
+
+    def find_containing(self, keywords, form="lower"):
+        """Return the first column whose normalized form contains every keyword, or None."""
+        for pos, value in enumerate(self._forms[form]):
+            if all(keyword in value for keyword in keywords):
+                return self.columns[pos]
+        return None
+
+
+@functools.lru_cache(maxsize=COLUMN_INDEX_CACHE_SIZE)
+def _column_index_for(typed_columns):
+    return ColumnIndex(tuple(col for _, col in typed_columns))
+
+
+def get_column_index(columns):
+    """Return the cached ColumnIndex for a DataFrame (or a sequence of column labels)."""
+    if isinstance(columns, pd.DataFrame):
+        columns = columns.columns
+    # Labels are keyed with their type: 1, 1.0 and True are equal as tuple items
+    # but are different headers, and the index hands back the labels themselves
+    return _column_index_for(tuple((type(col), col) for col in columns))
+
+
+def read_excel_sheets(source, sheet_names=None, engine=None, **kwargs):
+    """Read sheets of an Excel file into a {sheet name: DataFrame} dict.
+
+    One pd.ExcelFile is opened for the whole workbook and only the requested sheets
+    are parsed; each parsed sheet is a full DataFrame, as with pd.read_excel.
+    ``sheet_names`` is a list of names, a function picking names from the workbook's
+    sheet list, or None for every sheet. Other keyword arguments (header, usecols,
+    ...) are passed to ExcelFile.parse.
+    """
+    with pd.ExcelFile(source, engine=engine) as xls:
+        if sheet_names is None:
+            sheet_names = xls.sheet_names
+        elif callable(sheet_names):
+            sheet_names = sheet_names(xls.sheet_names)
+        return {name: xls.parse(name, **kwargs) for name in sheet_names}
+
+
+def find_sheet_name(sheet_names, wanted):
+    """Return the sheet name equal to ``wanted`` ignoring case and outer spaces, or None."""
+    wanted = wanted.strip().lower()
+    for name in sheet_names:
+        if name.strip().lower() == wanted:
+            return name
     return None
 
 
+def read_sheet_rows(ws, max_row=None):
+    """Cell values of a read-only openpyxl worksheet as row tuples.
+
+    Rows start at A1 and are padded to the same width, matching
+    ``iter_rows(values_only=True)`` on a fully loaded worksheet.
+    """
+    ws.reset_dimensions()
+    rows = [tuple(row) for row in ws.iter_rows(max_row=max_row, values_only=True)]
+    while rows and not rows[-1]:  # trailing <row> elements without any cells
+        rows.pop()
+    width = max(map(len, rows), default=0)
+    return [row + (None,) * (width - len(row)) for row in rows]
+
+
+def drop_unnamed_columns(df):
+    """Give a sheet string column names and drop pandas' "Unnamed: N" placeholder columns."""
+    df.columns = df.columns.astype(str)
+    return df.loc[:, ~df.columns.str.startswith("Unnamed:")]
+
+
+# Uploaded workbooks with sheets not parsed yet are kept here, named by content
+# digest, rather than in session state. SESSION_STATE_DIR is shared by all worker
+# processes, so their uploads go there. The session stores refresh the files of
+# live sessions at least every SESSION_STATE_TOUCH_SECONDS; files unused for
+# longer than a session can live are removed.
+UPLOAD_SPOOL_DIR = (
+    os.path.join(SESSION_STATE_DIR, "uploads")
+    if SESSION_STATE_DIR
+    else os.path.join(tempfile.gettempdir(), "excel-comparison-uploads")
+)
+
+
+def _upload_spool_dir():
+    """UPLOAD_SPOOL_DIR, created private to this user; None when it is missing or not ours."""
+    try:
+        os.makedirs(UPLOAD_SPOOL_DIR, mode=0o700, exist_ok=True)
+        info = os.lstat(UPLOAD_SPOOL_DIR)
+    except OSError:
+        return None
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        return None
+    return UPLOAD_SPOOL_DIR
+
+
+def _spool_upload(content):
+    """Path of a spool file holding content; None when the spool directory is unusable."""
+    directory = _upload_spool_dir()
+    if directory is None:
+        return None
+    path = os.path.join(
+        directory, hashlib.blake2b(content, digest_size=20).hexdigest() + ".upload"
+    )
+    try:
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as fh:
+                    fh.write(content)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    except OSError:
+        return None
+    cutoff = time.time() - SESSION_STATE_TTL_SECONDS - SESSION_STATE_TOUCH_SECONDS
+    for name in os.listdir(directory):
+        with suppress(OSError):
+            if os.path.getmtime(os.path.join(directory, name)) < cutoff:
+                os.remove(os.path.join(directory, name))
+    return path
+
+
+def _touch_upload_spool(value):
+    """Keep the spool files of pending LazySheets in value (nested dicts and lists) from pruning."""
+    if isinstance(value, LazySheets):
+        value.keep_spool_file()
+    elif isinstance(value, dict):
+        for item in value.values():
+            _touch_upload_spool(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _touch_upload_spool(item)
+
+
+class LazySheets(MutableMapping):
+    """{sheet name: DataFrame} for an uploaded workbook, parsing each sheet on first access.
+
+    Creating it reads only the workbook index (the sheet names). A sheet is parsed
+    and passed through ``transform`` the first time it is looked up, then cached;
+    header rows for column pickers come from ``sheet_columns`` without parsing the
+    rows below. Assigning or deleting sheets works as on a dict.
+
+    While sheets are pending, the upload lives in a spool file under
+    UPLOAD_SPOOL_DIR, so pickling the sheets (session state, worker processes)
+    carries only its path and the parsed frames. Once no sheet is pending the
+    path is dropped too.
+    """
+
+    def __init__(self, source, engine=None, transform=None, **parse_kwargs):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as fh:
+                content = fh.read()
+        else:
+            content = source.read()
+        self._path = _spool_upload(content)
+        # Kept in memory only when the spool directory cannot be used
+        self._content = content if self._path is None else None
+        self._engine = engine
+        self._transform = transform
+        self._parse_kwargs = parse_kwargs
+        self._xls = None
+        self._frames = dict.fromkeys(self._excel_file().sheet_names)
+        self._pending = set(self._frames)  # sheets not parsed yet
+        self._columns = {}  # header rows read for sheets not parsed yet
+        self._close_spool_file()
+        self._release_workbook()
+
+    def keep_spool_file(self):
+        """Push back the pruning of the spool file while sheets are pending."""
+        if self._path is not None:
+            with suppress(OSError):
+                os.utime(self._path)
+
+    def _excel_file(self):
+        if self._xls is None:
+            if self._path is not None:
+                os.utime(self._path)  # keeps a spool file in use out of the pruning
+                self._xls = pd.ExcelFile(self._path, engine=self._engine)
+            else:
+                self._xls = pd.ExcelFile(io.BytesIO(self._content), engine=self._engine)
+        return self._xls
+
+    def _close_spool_file(self):
+        # A spooled upload is reopened for each parse rather than held open between requests
+        if self._path is not None and self._xls is not None:
+            self._xls.close()
+            self._xls = None
+
+    def _parse(self, name, **kwargs):
+        try:
+            df = self._excel_file().parse(name, **self._parse_kwargs, **kwargs)
+        finally:
+            self._close_spool_file()
+        return df if self._transform is None else self._transform(df)
+
+    def _release_workbook(self):
+        # Every sheet is parsed (or replaced): the upload itself is no longer needed.
+        # The spool file is left to the pruning, since copies of these sheets
+        # (other processes, LazySheets.copy()) may still have sheets pending.
+        if not self._pending:
+            if self._xls is not None:
+                self._xls.close()
+            self._xls = None
+            self._content = None
+            self._path = None
+
+    def __getitem__(self, name):
+        if name in self._pending:
+            self._frames[name] = self._parse(name)
+            self._pending.discard(name)
+            self._columns.pop(name, None)
+            self._release_workbook()
+        return self._frames[name]
+
+    def __setitem__(self, name, df):
+        self._frames[name] = df
+        self._pending.discard(name)
+        self._columns.pop(name, None)
+        self._release_workbook()
+
+    def __delitem__(self, name):
+        del self._frames[name]
+        self._pending.discard(name)
+        self._columns.pop(name, None)
+        self._release_workbook()
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_xls"] = None
+        return state
+
+    def copy(self):
+        """Shallow copy, like dict.copy(); sheets not parsed yet stay lazy in both."""
+        other = copy.copy(self)
+        other._frames = dict(self._frames)
+        other._pending = set(self._pending)
+        other._columns = dict(self._columns)
+        return other
+
+    def sheet_columns(self, name):
+        """Column names of a sheet, reading only its header row if it is not parsed yet."""
+        if name not in self._pending:
+            return list(self._frames[name].columns)
+        if name not in self._columns:
+            self._columns[name] = list(self._parse(name, nrows=0).columns)
+        return self._columns[name]
+
+    def select_columns(self, name, columns):
+        """The given columns of a sheet; a sheet not parsed yet is read with usecols, uncached."""
+        columns = list(columns)
+        if name not in self._pending:
+            return self._frames[name][columns]
+        wanted = set(columns)
+        df = self._parse(name, usecols=lambda col: col in wanted or str(col) in wanted)
+        if not wanted.issubset(df.columns):  # duplicate headers pandas renamed
+            return self[name][columns]
+        return df[columns]
+
+    def memory_usage(self):
+        """Approximate bytes held: parsed sheets, plus the upload if it could not be spooled."""
+        return len(self._content or b"") + sum(
+            _estimate_state_bytes(df) for df in self._frames.values()
+        )
+
+
+def sheet_column_names(sheets, name):
+    """Column names of a sheet in a LazySheets or a plain {sheet name: DataFrame} dict."""
+    if isinstance(sheets, LazySheets):
+        return sheets.sheet_columns(name)
+    return list(sheets[name].columns)
+
+
+def select_sheet_columns(sheets, name, columns):
+    """Only the given columns of a sheet; unparsed LazySheets sheets read just those columns."""
+    if isinstance(sheets, LazySheets):
+        return sheets.select_columns(name, columns)
+    return sheets[name][list(columns)]
+
+
 def merge_dataframes_by_columns(df1, df2):
     """Merge two dataframes by matching columns flexibly"""
     if df1.empty and df2.empty:
@@ -5558,84 +7441,72 @@ def merge_dataframes_by_columns(df1, df2):
 
 @app.route("/upload_merge_file1", methods=["POST"])
 def upload_merge_file1():
-    global merge_file1_data, merge_file1_filename, merge_result
+    session = session_state()
 
     if "file" not in request.files:
-        merge_result = "❌ Error: No file provided"
+        session.merge_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=comparison")
 
     file = request.files["file"]
     if file.filename == "":
-        merge_result = "❌ Error: No file selected"
+        session.merge_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=comparison")
 
     try:
         filename = secure_filename(file.filename)
         file.seek(0)
-        merge_file1_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets
-        cleaned_data = {}
-        for sheet_name, df in merge_file1_data.items():
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-        merge_file1_data = cleaned_data
+        # Only the sheet names are read here; each sheet is parsed when the merge
+        # first uses it, with "Unnamed:" columns removed as it loads
+        session.merge_file1_data = LazySheets(
+            file, engine="openpyxl", transform=drop_unnamed_columns
+        )
 
-        merge_file1_filename = filename
-        merge_result = f"✅ File 1 uploaded successfully! Loaded {len(merge_file1_data)} sheets: {', '.join(list(merge_file1_data.keys()))}"
+        session.merge_file1_filename = filename
+        session.merge_result = f"✅ File 1 uploaded successfully! Loaded {len(session.merge_file1_data)} sheets: {', '.join(list(session.merge_file1_data.keys()))}"
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        merge_result = f"❌ Error uploading File 1: {str(e)}"
+        session.merge_result = f"❌ Error uploading File 1: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/upload_merge_file2", methods=["POST"])
 def upload_merge_file2():
-    global merge_file2_data, merge_file2_filename, merge_result
+    session = session_state()
 
     if "file" not in request.files:
-        merge_result = "❌ Error: No file provided"
+        session.merge_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=comparison")
 
     file = request.files["file"]
     if file.filename == "":
-        merge_result = "❌ Error: No file selected"
+        session.merge_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=comparison")
 
     try:
-        filename = secure_filename(file.filename)
-        file.seek(0)
-        merge_file2_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets
-        cleaned_data = {}
-        for sheet_name, df in merge_file2_data.items():
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-        merge_file2_data = cleaned_data
+        filename = secure_filename(file.filename)
+        file.seek(0)
+        # Only the sheet names are read here; each sheet is parsed when the merge
+        # first uses it, with "Unnamed:" columns removed as it loads
+        session.merge_file2_data = LazySheets(
+            file, engine="openpyxl", transform=drop_unnamed_columns
+        )
 
-        merge_file2_filename = filename
-        merge_result = f"✅ File 2 uploaded successfully! Loaded {len(merge_file2_data)} sheets: {', '.join(list(merge_file2_data.keys()))}"
+        session.merge_file2_filename = filename
+        session.merge_result = f"✅ File 2 uploaded successfully! Loaded {len(session.merge_file2_data)} sheets: {', '.join(list(session.merge_file2_data.keys()))}"
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        merge_result = f"❌ Error uploading File 2: {str(e)}"
+        session.merge_result = f"❌ Error uploading File 2: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/merge_files", methods=["POST"])
 def merge_files():
-    global merge_file1_data, merge_file2_data, raw_data, raw_filename, merge_result
+    session = session_state()
 
-    if not merge_file1_data or not merge_file2_data:
-        merge_result = "❌ Error: Please upload both files first"
+    if not session.merge_file1_data or not session.merge_file2_data:
+        session.merge_result = "❌ Error: Please upload both files first"
         return redirect("/comparison?tab=comparison")
 
     try:
@@ -5648,7 +7519,8 @@ def merge_files():
 
         # Get all unique sheet names from both files
         all_sheet_names = set(
-            list(merge_file1_data.keys()) + list(merge_file2_data.keys())
+            list(session.merge_file1_data.keys())
+            + list(session.merge_file2_data.keys())
         )
 
         for sheet_name in all_sheet_names:
@@ -5662,8 +7534,8 @@ def merge_files():
         total_rows_before = 0
 
         for sheet_name in other_sheets:
-            df1 = merge_file1_data.get(sheet_name, pd.DataFrame())
-            df2 = merge_file2_data.get(sheet_name, pd.DataFrame())
+            df1 = session.merge_file1_data.get(sheet_name, pd.DataFrame())
+            df2 = session.merge_file2_data.get(sheet_name, pd.DataFrame())
 
             # Merge the dataframes by matching columns
             merged_df = merge_dataframes_by_columns(df1, df2)
@@ -5689,8 +7561,8 @@ def merge_files():
 
         # Handle Zero ID sheets separately (keep them as separate sheets)
         for sheet_name in zero_id_sheets:
-            df1 = merge_file1_data.get(sheet_name, pd.DataFrame())
-            df2 = merge_file2_data.get(sheet_name, pd.DataFrame())
+            df1 = session.merge_file1_data.get(sheet_name, pd.DataFrame())
+            df2 = session.merge_file2_data.get(sheet_name, pd.DataFrame())
 
             # Merge Zero ID sheets together
             merged_zero_id = merge_dataframes_by_columns(df1, df2)
@@ -5703,30 +7575,30 @@ def merge_files():
             )
 
         # Store merged result as raw_data (Appointment Report)
-        raw_data = merged_sheets
-        raw_filename = f"Merged Appointment Report ({merge_file1_filename} + {merge_file2_filename})"
+        session.raw_data = merged_sheets
+        session.raw_filename = f"Merged Appointment Report ({session.merge_file1_filename} + {session.merge_file2_filename})"
 
         summary_text = "\n".join(merge_summary)
-        merge_result = f"✅ Files merged successfully! Merged Appointment Report created with {len(merged_sheets)} sheet(s).\n\n{summary_text}"
+        session.merge_result = f"✅ Files merged successfully! Merged Appointment Report created with {len(merged_sheets)} sheet(s).\n\n{summary_text}"
 
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        merge_result = f"❌ Error merging files: {str(e)}"
+        session.merge_result = f"❌ Error merging files: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/upload_raw", methods=["POST"])
 def upload_raw_file():
-    global raw_data, raw_filename, comparison_result
+    session = session_state()
 
     if "file" not in request.files:
-        comparison_result = "❌ Error: No file provided"
+        session.comparison_result = "❌ Error: No file provided"
         return redirect("/comparison")
 
     file = request.files["file"]
     if file.filename == "":
-        comparison_result = "❌ Error: No file selected"
+        session.comparison_result = "❌ Error: No file selected"
         return redirect("/comparison")
 
     try:
@@ -5735,40 +7607,33 @@ def upload_raw_file():
 
         # Read Excel file directly from memory (no disk storage)
         file.seek(0)  # Reset file pointer to beginning
-        raw_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets
-        cleaned_data = {}
-        for sheet_name, df in raw_data.items():
-            # Convert column names to strings first, then remove columns that start with "Unnamed:"
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-        raw_data = cleaned_data
+        # Sheets are parsed when the comparison picks them; "Unnamed:" columns are
+        # removed as each sheet loads
+        session.raw_data = LazySheets(
+            file, engine="openpyxl", transform=drop_unnamed_columns
+        )
 
-        raw_filename = filename
+        session.raw_filename = filename
 
-        comparison_result = f"✅ Appointment Report uploaded successfully! Loaded {len(raw_data)} sheets: {', '.join(list(raw_data.keys()))}"
+        session.comparison_result = f"✅ Appointment Report uploaded successfully! Loaded {len(session.raw_data)} sheets: {', '.join(list(session.raw_data.keys()))}"
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        comparison_result = f"❌ Error uploading Appointment Report: {str(e)}"
+        session.comparison_result = f"❌ Error uploading Appointment Report: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/upload_previous", methods=["POST"])
 def upload_previous_file():
-    global previous_data, previous_filename, comparison_result
+    session = session_state()
 
     if "file" not in request.files:
-        comparison_result = "❌ Error: No file provided"
+        session.comparison_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=comparison")
 
     file = request.files["file"]
     if file.filename == "":
-        comparison_result = "❌ Error: No file selected"
+        session.comparison_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=comparison")
 
     try:
@@ -5777,72 +7642,77 @@ def upload_previous_file():
 
         # Read Excel file directly from memory (no disk storage)
         file.seek(0)  # Reset file pointer to beginning
-        previous_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets
-        cleaned_data = {}
-        for sheet_name, df in previous_data.items():
-            # Convert column names to strings first, then remove columns that start with "Unnamed:"
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-        previous_data = cleaned_data
+        # Sheets are parsed when the comparison picks them; "Unnamed:" columns are
+        # removed as each sheet loads
+        session.previous_data = LazySheets(
+            file, engine="openpyxl", transform=drop_unnamed_columns
+        )
 
-        previous_filename = filename
+        session.previous_filename = filename
 
-        comparison_result = f"✅ Smart Assist file uploaded successfully! Loaded {len(previous_data)} sheets: {', '.join(list(previous_data.keys()))}"
+        session.comparison_result = f"✅ Smart Assist file uploaded successfully! Loaded {len(session.previous_data)} sheets: {', '.join(list(session.previous_data.keys()))}"
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        comparison_result = f"❌ Error uploading Smart Assist file: {str(e)}"
+        session.comparison_result = f"❌ Error uploading Smart Assist file: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/compare", methods=["POST"])
 def compare_files():
-    global raw_data, previous_data, comparison_result
+    session = session_state()
 
-    if not raw_data or not previous_data:
-        comparison_result = "❌ Error: Please upload both files first"
+    if not session.raw_data or not session.previous_data:
+        session.comparison_result = "❌ Error: Please upload both files first"
         return redirect("/comparison?tab=comparison")
 
     raw_sheet = request.form.get("raw_sheet")
     previous_sheet = request.form.get("previous_sheet")
 
     if not raw_sheet or not previous_sheet:
-        comparison_result = "❌ Error: Please select sheets for both files"
+        session.comparison_result = "❌ Error: Please select sheets for both files"
         return redirect("/comparison?tab=comparison")
 
     try:
-        # Get the selected sheets
-        raw_df = raw_data[raw_sheet]
-        previous_df = previous_data[previous_sheet]
+        # Get the selected sheets; the comparison reads only the Patient ID and
+        # insurance columns of the Appointment report
+        report_columns = _appointment_report_columns(
+            sheet_column_names(session.raw_data, raw_sheet)
+        )
+        if report_columns[0]:
+            raw_df = select_sheet_columns(
+                session.raw_data,
+                raw_sheet,
+                dict.fromkeys(c for c in report_columns if c),
+            )
+        else:
+            raw_df = session.raw_data[raw_sheet]
+        previous_df = session.previous_data[previous_sheet]
 
         # Perform comparison
         result_message, result_df = compare_patient_names(raw_df, previous_df)
 
         if result_df is not None:
             # Store the result for download
-            comparison_result = result_message
+            session.comparison_result = result_message
             # Update the previous_data with the result (result is based on Smart Assist file)
-            previous_data[previous_sheet] = result_df
+            session.previous_data[previous_sheet] = result_df
+            session.touch("previous_data")
         else:
-            comparison_result = result_message
+            session.comparison_result = result_message
 
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        comparison_result = f"❌ Error comparing files: {str(e)}"
+        session.comparison_result = f"❌ Error comparing files: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/download_result", methods=["POST"])
 def download_result():
-    global previous_data, previous_filename
+    session = session_state()
 
-    if not previous_data:
+    if not session.previous_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -5851,235 +7721,183 @@ def download_result():
         filename = f"smart_assist_result_{timestamp}.xlsx"
 
     try:
-        # Create a temporary file
-        import tempfile
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(
+            "download_result", session.previous_data, export_format
+        )
+        if cached is not None:
+            return send_xlsx_bytes(cached, filename)
 
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
+        # Process data: Extract "No insurance" rows and remove from main sheets
+        processed_data = {}
+        no_ins_rows_list = []
 
-        try:
-            # Process data: Extract "No insurance" rows and remove from main sheets
-            processed_data = {}
-            no_ins_rows_list = []
+        for sheet_name, df in session.previous_data.items():
+            # Skip "NO INS" sheet if it already exists (to avoid processing it)
+            if sheet_name == "NO INS":
+                continue
 
-            for sheet_name, df in previous_data.items():
-                # Skip "NO INS" sheet if it already exists (to avoid processing it)
-                if sheet_name == "NO INS":
-                    continue
+            df_clean = df.copy()
 
-                df_clean = df.copy()
+            # Find "Dental Primary Ins Carr" column (case-insensitive, flexible matching)
+            primary_ins_col = None
+            for col in df_clean.columns:
+                col_lower = str(col).lower().strip()
+                # Match variations: "Dental Primary Ins Carr", "Dental Primary Insurance Carrier", etc.
+                if (
+                    "dental" in col_lower
+                    and "primary" in col_lower
+                    and ("ins" in col_lower or "insurance" in col_lower)
+                    and ("carr" in col_lower or "carrier" in col_lower)
+                ):
+                    primary_ins_col = col
+                    break
 
-                # Find "Dental Primary Ins Carr" column (case-insensitive, flexible matching)
-                primary_ins_col = None
+            # Fallback: if exact match not found, try simpler pattern
+            if not primary_ins_col:
                 for col in df_clean.columns:
                     col_lower = str(col).lower().strip()
-                    # Match variations: "Dental Primary Ins Carr", "Dental Primary Insurance Carrier", etc.
                     if (
                         "dental" in col_lower
                         and "primary" in col_lower
                         and ("ins" in col_lower or "insurance" in col_lower)
-                        and ("carr" in col_lower or "carrier" in col_lower)
                     ):
                         primary_ins_col = col
                         break
 
-                # Fallback: if exact match not found, try simpler pattern
-                if not primary_ins_col:
-                    for col in df_clean.columns:
-                        col_lower = str(col).lower().strip()
-                        if (
-                            "dental" in col_lower
-                            and "primary" in col_lower
-                            and ("ins" in col_lower or "insurance" in col_lower)
-                        ):
-                            primary_ins_col = col
-                            break
-
-                # Last resort: look for any column with "primary" and "insurance"
-                if not primary_ins_col:
-                    for col in df_clean.columns:
-                        col_lower = str(col).lower().strip()
-                        if "primary" in col_lower and (
-                            "ins" in col_lower or "insurance" in col_lower
-                        ):
-                            primary_ins_col = col
-                            break
-
-                # Extract rows with "No insurance" in "Dental Primary Ins Carr"
-                if primary_ins_col:
-
-                    def is_no_insurance(val):
-                        if pd.isna(val):
-                            return False
-                        val_str = str(val).strip()
-                        # Case-insensitive matching for variations: "No insurance", "No Insurance", "NO INSURANCE", etc.
-                        val_lower = val_str.lower()
-                        # Check for exact matches or common variations
-                        return (
-                            val_lower == "no insurance"
-                            or val_lower == "no ins"
-                            or val_lower == "noinsurance"
-                            or val_lower == "noins"
-                            or val_lower.startswith("no insurance")
-                            or val_lower.startswith("no ins")
-                        )
-
-                    no_ins_mask = df_clean[primary_ins_col].apply(is_no_insurance)
-                    no_ins_df = df_clean[no_ins_mask].copy()
+            # Last resort: look for any column with "primary" and "insurance"
+            if not primary_ins_col:
+                for col in df_clean.columns:
+                    col_lower = str(col).lower().strip()
+                    if "primary" in col_lower and (
+                        "ins" in col_lower or "insurance" in col_lower
+                    ):
+                        primary_ins_col = col
+                        break
 
-                    if len(no_ins_df) > 0:
-                        no_ins_rows_list.append(no_ins_df)
+            # Extract rows with "No insurance" in "Dental Primary Ins Carr"
+            if primary_ins_col:
 
-                    # Remove "No insurance" rows from main sheet
-                    df_clean = df_clean[~no_ins_mask].copy()
+                def is_no_insurance(val):
+                    if pd.isna(val):
+                        return False
+                    val_str = str(val).strip()
+                    # Case-insensitive matching for variations: "No insurance", "No Insurance", "NO INSURANCE", etc.
+                    val_lower = val_str.lower()
+                    # Check for exact matches or common variations
+                    return (
+                        val_lower == "no insurance"
+                        or val_lower == "no ins"
+                        or val_lower == "noinsurance"
+                        or val_lower == "noins"
+                        or val_lower.startswith("no insurance")
+                        or val_lower.startswith("no ins")
+                    )
 
-                processed_data[sheet_name] = df_clean
+                no_ins_mask = df_clean[primary_ins_col].apply(is_no_insurance)
+                no_ins_df = df_clean[no_ins_mask].copy()
 
-            # Create "NO INS" sheet from collected rows
-            if no_ins_rows_list:
-                no_ins_combined = pd.concat(no_ins_rows_list, ignore_index=True)
-                if len(no_ins_combined) > 0:
-                    processed_data["NO INS"] = no_ins_combined
+                if len(no_ins_df) > 0:
+                    no_ins_rows_list.append(no_ins_df)
 
-            # Write processed data to Excel
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                # Collect main sheets (not special sheets) to combine into "Today"
-                main_sheets_data = []
-                special_sheets = ["NO INS", "Zero ID", "zero id"]
+                # Remove "No insurance" rows from main sheet
+                df_clean = df_clean[~no_ins_mask].copy()
 
-                for sheet_name, df_clean in processed_data.items():
-                    # Skip special sheets - they will be written separately
-                    if sheet_name in special_sheets or sheet_name.lower() in [
-                        s.lower() for s in special_sheets
-                    ]:
-                        continue
+            processed_data[sheet_name] = df_clean
 
-                    # Collect main sheet data
-                    main_sheets_data.append((sheet_name, df_clean))
+        # Create "NO INS" sheet from collected rows
+        if no_ins_rows_list:
+            no_ins_combined = pd.concat(no_ins_rows_list, ignore_index=True)
+            if len(no_ins_combined) > 0:
+                processed_data["NO INS"] = no_ins_combined
 
-                # Write "Today" sheet (combine all main sheets)
-                if main_sheets_data:
-                    # Combine all main sheets into one
-                    today_dataframes = []
-                    for sheet_name, df_clean in main_sheets_data:
-                        if not df_clean.empty:
-                            today_dataframes.append(df_clean)
+        # Write processed data to Excel
+        with SheetExport(export_format) as writer:
+            # Collect main sheets (not special sheets) to combine into "Today"
+            main_sheets_data = []
+            special_sheets = ["NO INS", "Zero ID", "zero id"]
 
-                    if today_dataframes:
-                        today_df = pd.concat(today_dataframes, ignore_index=True)
-                    else:
-                        # If all main sheets are empty, create empty dataframe with columns from first sheet
-                        today_df = (
-                            main_sheets_data[0][1]
-                            if main_sheets_data
-                            else pd.DataFrame()
-                        )
+            for sheet_name, df_clean in processed_data.items():
+                # Skip special sheets - they will be written separately
+                if sheet_name in special_sheets or sheet_name.lower() in [
+                    s.lower() for s in special_sheets
+                ]:
+                    continue
 
-                    # Format "Appt Date" column to MM/DD/YYYY format
-                    appt_date_col = None
-                    for col in today_df.columns:
-                        col_lower = (
-                            col.lower().strip().replace(" ", "").replace("_", "")
-                        )
-                        if "appt" in col_lower and "date" in col_lower:
-                            appt_date_col = col
-                            break
+                # Collect main sheet data
+                main_sheets_data.append((sheet_name, df_clean))
 
-                    if appt_date_col:
+            # Write "Today" sheet (combine all main sheets)
+            if main_sheets_data:
+                # Combine all main sheets into one
+                today_dataframes = []
+                for sheet_name, df_clean in main_sheets_data:
+                    if not df_clean.empty:
+                        today_dataframes.append(df_clean)
 
-                        def format_date(date_val):
-                            if pd.isna(date_val) or date_val == "":
-                                return ""
-                            try:
-                                if isinstance(date_val, pd.Timestamp):
-                                    date_obj = date_val
-                                elif isinstance(date_val, str):
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(date_val)
-                                else:
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(date_val)
-                                return date_obj.strftime("%m/%d/%Y")
-                            except (ValueError, TypeError, AttributeError):
-                                return str(date_val)
-
-                        today_df[appt_date_col] = today_df[appt_date_col].apply(
-                            format_date
-                        )
-                        today_df[appt_date_col] = today_df[appt_date_col].astype(str)
+                if today_dataframes:
+                    today_df = pd.concat(today_dataframes, ignore_index=True)
+                else:
+                    # If all main sheets are empty, create empty dataframe with columns from first sheet
+                    today_df = (
+                        main_sheets_data[0][1] if main_sheets_data else pd.DataFrame()
+                    )
 
-                    today_df.to_excel(writer, sheet_name="Today", index=False)
-                    _apply_imagen_excel_sheet_styling(writer, "Today", today_df)
+                # Format "Appt Date" column to MM/DD/YYYY format
+                appt_date_col = None
+                for col in today_df.columns:
+                    col_lower = col.lower().strip().replace(" ", "").replace("_", "")
+                    if "appt" in col_lower and "date" in col_lower:
+                        appt_date_col = col
+                        break
 
-                # Write special sheets (NO INS, Zero ID, etc.)
-                for sheet_name, df_clean in processed_data.items():
-                    if sheet_name not in special_sheets and sheet_name.lower() not in [
-                        s.lower() for s in special_sheets
-                    ]:
-                        continue  # Already written as "Today"
+                if appt_date_col:
+                    today_df[appt_date_col] = format_date_series_mmddyyyy(
+                        today_df[appt_date_col]
+                    )
 
-                    # Format "Appt Date" column to MM/DD/YYYY format
-                    appt_date_col = None
-                    for col in df_clean.columns:
-                        col_lower = (
-                            col.lower().strip().replace(" ", "").replace("_", "")
-                        )
-                        if "appt" in col_lower and "date" in col_lower:
-                            appt_date_col = col
-                            break
+                writer.write_sheet("Today", today_df)
 
-                    if appt_date_col:
+            # Write special sheets (NO INS, Zero ID, etc.)
+            for sheet_name, df_clean in processed_data.items():
+                if sheet_name not in special_sheets and sheet_name.lower() not in [
+                    s.lower() for s in special_sheets
+                ]:
+                    continue  # Already written as "Today"
 
-                        def format_date(date_val):
-                            if pd.isna(date_val) or date_val == "":
-                                return ""
-                            try:
-                                if isinstance(date_val, pd.Timestamp):
-                                    date_obj = date_val
-                                elif isinstance(date_val, str):
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(date_val)
-                                else:
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(date_val)
-                                return date_obj.strftime("%m/%d/%Y")
-                            except (ValueError, TypeError, AttributeError):
-                                return str(date_val)
-
-                        df_clean[appt_date_col] = df_clean[appt_date_col].apply(
-                            format_date
-                        )
-                        df_clean[appt_date_col] = df_clean[appt_date_col].astype(str)
+                # Format "Appt Date" column to MM/DD/YYYY format
+                appt_date_col = None
+                for col in df_clean.columns:
+                    col_lower = col.lower().strip().replace(" ", "").replace("_", "")
+                    if "appt" in col_lower and "date" in col_lower:
+                        appt_date_col = col
+                        break
 
-                    df_clean.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df_clean)
+                if appt_date_col:
+                    df_clean[appt_date_col] = format_date_series_mmddyyyy(
+                        df_clean[appt_date_col]
+                    )
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+                writer.write_sheet(sheet_name, df_clean)
 
-        finally:
-            # Clean up temporary file
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return writer.response(filename, cache_key)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/upload_conversion", methods=["POST"])
+@background_job()
 def upload_conversion_file():
-    global conversion_data, conversion_filename, conversion_result
+    session = session_state()
 
     if "file" not in request.files:
-        conversion_result = "❌ Error: No file provided"
+        session.conversion_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=conversion")
 
     file = request.files["file"]
     if file.filename == "":
-        conversion_result = "❌ Error: No file selected"
+        session.conversion_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=conversion")
 
     try:
@@ -6088,14 +7906,14 @@ def upload_conversion_file():
 
         # Read Excel file directly from memory WITHOUT headers (we'll find header row)
         file.seek(0)  # Reset file pointer to beginning
-        conversion_data = pd.read_excel(
-            file, sheet_name=None, engine="openpyxl", header=None
+        session.conversion_data = read_excel_sheets(
+            file, engine="openpyxl", header=None
         )
-        conversion_filename = filename
+        session.conversion_filename = filename
 
         # Step 1: Find header row, set it as column names, then remove blank rows
         cleaned_data = {}
-        for sheet_name, df in conversion_data.items():
+        for sheet_name, df in session.conversion_data.items():
             # Convert all column names to strings (they'll be 0, 1, 2, etc. since header=None)
             df.columns = [str(i) for i in range(len(df.columns))]
 
@@ -6169,11 +7987,11 @@ def upload_conversion_file():
 
             cleaned_data[sheet_name] = df
 
-        conversion_data = cleaned_data
+        session.conversion_data = cleaned_data
 
         # Step 2: Remove "Unnamed_<random_number>" columns from all sheets
         cleaned_data = {}
-        for sheet_name, df in conversion_data.items():
+        for sheet_name, df in session.conversion_data.items():
             # Convert column names to strings first, then remove columns that match "Unnamed_<number>" pattern
             df.columns = df.columns.astype(str)
             # Remove columns that match "Unnamed_" followed by digits
@@ -6181,19 +7999,19 @@ def upload_conversion_file():
                 :, ~df.columns.str.contains("^Unnamed_\\d+$", na=False, regex=True)
             ]
             cleaned_data[sheet_name] = df_cleaned
-        conversion_data = cleaned_data
+        session.conversion_data = cleaned_data
 
         # Step 3: Validate "Insurance Note" column exists in all sheets
         missing_sheets = []
-        for sheet_name, df in conversion_data.items():
+        for sheet_name, df in session.conversion_data.items():
             columns = [col.lower().strip() for col in df.columns]
             if "insurance note" not in columns:
                 missing_sheets.append(sheet_name)
 
         if missing_sheets:
-            conversion_result = f"❌ Validation Error: 'Insurance Note' column not found in the following sheets: {', '.join(missing_sheets)}\n\nAvailable columns in first sheet: {list(conversion_data[list(conversion_data.keys())[0]].columns) if conversion_data else 'N/A'}"
-            conversion_data = None
-            conversion_filename = None
+            session.conversion_result = f"❌ Validation Error: 'Insurance Note' column not found in the following sheets: {', '.join(missing_sheets)}\n\nAvailable columns in first sheet: {list(session.conversion_data[list(session.conversion_data.keys())[0]].columns) if session.conversion_data else 'N/A'}"
+            session.conversion_data = None
+            session.conversion_filename = None
         else:
             # Step 4: Process the Insurance Note column
             processed_sheets = {}
@@ -6201,7 +8019,7 @@ def upload_conversion_file():
             patient_name_created = False
             total_duplicates_removed = 0
 
-            for sheet_name, df in conversion_data.items():
+            for sheet_name, df in session.conversion_data.items():
                 # Find Insurance Note column (case-insensitive)
                 insurance_note_col = None
                 for col in df.columns:
@@ -6276,10 +8094,16 @@ def upload_conversion_file():
                         # If no status found, return 'Conversion' instead of empty string
                         return "Conversion"
 
-                    # Apply extraction and formatting
-                    processed_df["Formatted Insurance"] = processed_df[
-                        insurance_note_col
-                    ].apply(extract_and_format_insurance)
+                    # Apply extraction and formatting (once per distinct note text)
+                    notes = processed_df[insurance_note_col]
+                    note_text = notes.astype(object).astype(str)
+                    formatted_notes = {
+                        text: extract_and_format_insurance(text)
+                        for text in note_text[notes.notna()].unique()
+                    }
+                    processed_df["Formatted Insurance"] = note_text.map(
+                        formatted_notes
+                    ).where(notes.notna(), "")
                     processed_df["Status"] = processed_df[insurance_note_col].apply(
                         extract_status
                     )
@@ -6322,19 +8146,11 @@ def upload_conversion_file():
                     # Create "Patient Name" column from "Patient Last Name" and "Patient First Name"
                     def find_column(columns, target_names):
                         """Find column matching any of the target names (case-insensitive, flexible matching)"""
-                        for col in columns:
-                            col_lower = (
-                                col.lower().strip().replace(" ", "").replace("_", "")
-                            )
-                            for target in target_names:
-                                target_lower = (
-                                    target.lower()
-                                    .strip()
-                                    .replace(" ", "")
-                                    .replace("_", "")
-                                )
-                                if col_lower == target_lower:
-                                    return col
+                        col = get_column_index(columns).find(
+                            target_names, form="compact"
+                        )
+                        if col is not None:
+                            return col
                         # Try partial matching as fallback
                         for col in columns:
                             col_lower = col.lower().strip()
@@ -6505,41 +8321,7 @@ def upload_conversion_file():
                             # Instead, just update each row's insurance columns from the Formatted Insurance
                             rows_before = len(processed_df)
 
-                            # Apply insurance values to each row without consolidating
-                            for idx, row in processed_df.iterrows():
-                                pat_id = row[pat_id_col]
-                                # Find all rows with this Pat ID to get unique insurance values
-                                same_id_rows = processed_df[
-                                    processed_df[pat_id_col] == pat_id
-                                ]
-
-                                # Get unique insurance names for this Pat ID (preserve order of first occurrence)
-                                insurance_names = []
-                                seen = set()
-                                for ins in same_id_rows["Formatted Insurance"]:
-                                    if pd.notna(ins):
-                                        ins_str = str(ins).strip()
-                                        if ins_str and ins_str not in seen:
-                                            insurance_names.append(ins_str)
-                                            seen.add(ins_str)
-
-                                # Set Primary Insurance (first unique insurance)
-                                if len(insurance_names) > 0:
-                                    processed_df.at[idx, "Dental Primary Ins Carr"] = (
-                                        insurance_names[0]
-                                    )
-                                else:
-                                    processed_df.at[idx, "Dental Primary Ins Carr"] = ""
-
-                                # Set Secondary Insurance (second unique insurance if exists)
-                                if len(insurance_names) > 1:
-                                    processed_df.at[
-                                        idx, "Dental Secondary Ins Carr"
-                                    ] = insurance_names[1]
-                                else:
-                                    processed_df.at[
-                                        idx, "Dental Secondary Ins Carr"
-                                    ] = ""
+                            fill_insurance_by_pat_id(processed_df, pat_id_col)
 
                             # Track stats (no rows consolidated since we keep duplicates)
                             rows_after = len(processed_df)
@@ -6632,12 +8414,12 @@ def upload_conversion_file():
                     processed_sheets[sheet_name] = df
 
             # Update conversion_data with processed data
-            conversion_data = processed_sheets
+            session.conversion_data = processed_sheets
 
             # Remove "Time" and "MI" columns from all sheets
             cleaned_data = {}
             columns_removed_count = {}
-            for sheet_name, df in conversion_data.items():
+            for sheet_name, df in session.conversion_data.items():
                 df_cleaned = df.copy()
                 removed_cols = []
 
@@ -6659,7 +8441,7 @@ def upload_conversion_file():
                 if removed_cols:
                     columns_removed_count[sheet_name] = removed_cols
 
-            conversion_data = cleaned_data
+            session.conversion_data = cleaned_data
 
             # Arrange columns in specified order
             column_order = [
@@ -6675,7 +8457,7 @@ def upload_conversion_file():
             ]
 
             ordered_data = {}
-            for sheet_name, df in conversion_data.items():
+            for sheet_name, df in session.conversion_data.items():
                 df_ordered = df.copy()
 
                 # Find actual column names (case-insensitive matching)
@@ -6708,7 +8490,7 @@ def upload_conversion_file():
                 df_ordered = df_ordered[ordered_cols]
                 ordered_data[sheet_name] = df_ordered
 
-            conversion_data = ordered_data
+            session.conversion_data = ordered_data
 
             # Build columns added message
             columns_added_msg = "- 'Dental Primary Ins Carr' - Extracted and formatted insurance names (first insurance for each Pat ID)\n- 'Dental Secondary Ins Carr' - Second insurance for Pat IDs with multiple insurances\n- 'Status' - Extracted status values (shows 'Conversion' when no status is found)"
@@ -6720,22 +8502,22 @@ def upload_conversion_file():
             if total_duplicates_removed > 0:
                 dedup_msg = f"\n\n🔄 Row Consolidation:\n- Consolidated {total_duplicates_removed} row(s) with same Pat ID\n- Multiple insurances for same Pat ID: first in 'Dental Primary Ins Carr', second in 'Dental Secondary Ins Carr'"
 
-            conversion_result = f"✅ Validation and processing completed successfully!\n\n📊 File loaded: {filename}\n📋 Sheets processed: {len(conversion_data)}\n📋 Sheet names: {', '.join(list(conversion_data.keys()))}\n📊 Total rows processed: {total_rows_processed}{dedup_msg}\n\n✅ New columns added:\n{columns_added_msg}\n💾 Ready to download the processed file!"
+            session.conversion_result = f"✅ Validation and processing completed successfully!\n\n📊 File loaded: {filename}\n📋 Sheets processed: {len(session.conversion_data)}\n📋 Sheet names: {', '.join(list(session.conversion_data.keys()))}\n📊 Total rows processed: {total_rows_processed}{dedup_msg}\n\n✅ New columns added:\n{columns_added_msg}\n💾 Ready to download the processed file!"
 
         return redirect("/comparison?tab=conversion")
 
     except Exception as e:
-        conversion_result = f"❌ Error uploading Conversion Report: {str(e)}"
-        conversion_data = None
-        conversion_filename = None
+        session.conversion_result = f"❌ Error uploading Conversion Report: {str(e)}"
+        session.conversion_data = None
+        session.conversion_filename = None
         return redirect("/comparison?tab=conversion")
 
 
 @app.route("/download_conversion", methods=["POST"])
 def download_conversion_result():
-    global conversion_data, conversion_filename
+    session = session_state()
 
-    if not conversion_data:
+    if not session.conversion_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -6744,75 +8526,46 @@ def download_conversion_result():
         filename = f"conversion_report_{timestamp}.xlsx"
 
     try:
-        # Create a temporary file
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in conversion_data.items():
-                    # Remove "Conversion" column if it exists (safety check)
-                    df_clean = df.copy()
-                    if "Conversion" in df_clean.columns:
-                        df_clean = df_clean.drop(columns=["Conversion"])
-
-                    # Format "Appt Date" column to MM/DD/YYYY format
-                    appt_date_col = None
-                    for col in df_clean.columns:
-                        if col.lower().strip() == "appt date":
-                            appt_date_col = col
-                            break
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(
+            "download_conversion", session.conversion_data, export_format
+        )
+        if cached is not None:
+            return clear_session_state_when_sent(
+                send_xlsx_bytes(cached, filename),
+                "conversion_data",
+                "conversion_filename",
+                "conversion_result",
+            )
 
-                    if appt_date_col:
-                        # Convert dates to MM/DD/YYYY format
-                        def format_date(date_val):
-                            if pd.isna(date_val) or date_val == "":
-                                return ""
-                            try:
-                                # Convert to datetime if not already
-                                if isinstance(date_val, pd.Timestamp):
-                                    date_obj = date_val
-                                elif isinstance(date_val, str):
-                                    # Try to parse string date
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(
-                                            date_val
-                                        )  # Return original if can't parse
-                                else:
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(
-                                            date_val
-                                        )  # Return original if can't parse
-
-                                # Format as MM/DD/YYYY
-                                return date_obj.strftime("%m/%d/%Y")
-                            except (ValueError, TypeError, AttributeError):
-                                # If parsing fails, return as-is
-                                return str(date_val)
-
-                        df_clean[appt_date_col] = df_clean[appt_date_col].apply(
-                            format_date
-                        )
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.conversion_data.items():
+                # Remove "Conversion" column if it exists (safety check)
+                df_clean = df.copy()
+                if "Conversion" in df_clean.columns:
+                    df_clean = df_clean.drop(columns=["Conversion"])
 
-                    df_clean.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df_clean)
+                # Format "Appt Date" column to MM/DD/YYYY format
+                appt_date_col = None
+                for col in df_clean.columns:
+                    if col.lower().strip() == "appt date":
+                        appt_date_col = col
+                        break
 
-            # Clear data after successful download
-            global conversion_result
-            conversion_data = None
-            conversion_filename = None
-            conversion_result = None
+                if appt_date_col:
+                    df_clean[appt_date_col] = format_date_series_mmddyyyy(
+                        df_clean[appt_date_col]
+                    )
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+                writer.write_sheet(sheet_name, df_clean)
 
-        finally:
-            # Clean up temporary file
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Clear data once the download has been sent
+        return clear_session_state_when_sent(
+            writer.response(filename, cache_key),
+            "conversion_data",
+            "conversion_filename",
+            "conversion_result",
+        )
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -6820,45 +8573,44 @@ def download_conversion_result():
 
 @app.route("/reset_comparison", methods=["POST"])
 def reset_comparison():
-    global raw_data, previous_data, raw_filename, previous_filename, comparison_result
-    global merge_file1_data, merge_file2_data, merge_file1_filename, merge_file2_filename, merge_result
+    session = session_state()
     # Explicitly do NOT touch conversion_data, conversion_filename, or conversion_result
 
     try:
         # Reset ONLY comparison tool variables - do not affect conversion tool
-        raw_data = None
-        previous_data = None
-        raw_filename = None
-        previous_filename = None
-        comparison_result = None
-        merge_file1_data = None
-        merge_file2_data = None
-        merge_file1_filename = None
-        merge_file2_filename = None
-        merge_result = "🔄 Comparison tool reset successfully! All files and data have been cleared."
+        session.raw_data = None
+        session.previous_data = None
+        session.raw_filename = None
+        session.previous_filename = None
+        session.comparison_result = None
+        session.merge_file1_data = None
+        session.merge_file2_data = None
+        session.merge_file1_filename = None
+        session.merge_file2_filename = None
+        session.merge_result = "🔄 Comparison tool reset successfully! All files and data have been cleared."
 
         return redirect("/comparison?tab=comparison")
 
     except Exception as e:
-        comparison_result = f"❌ Error resetting comparison tool: {str(e)}"
+        session.comparison_result = f"❌ Error resetting comparison tool: {str(e)}"
         return redirect("/comparison?tab=comparison")
 
 
 @app.route("/reset_conversion", methods=["POST"])
 def reset_conversion():
-    global conversion_data, conversion_filename, conversion_result
+    session = session_state()
     # Explicitly do NOT touch raw_data, previous_data, raw_filename, previous_filename, or comparison_result
 
     try:
         # Reset ONLY conversion tool variables - do not affect comparison tool
-        conversion_data = {}
-        conversion_filename = None
-        conversion_result = "🔄 Conversion tool reset successfully! All files and data have been cleared."
+        session.conversion_data = {}
+        session.conversion_filename = None
+        session.conversion_result = "🔄 Conversion tool reset successfully! All files and data have been cleared."
 
         return redirect("/comparison?tab=conversion")
 
     except Exception as e:
-        conversion_result = f"❌ Error resetting conversion tool: {str(e)}"
+        session.conversion_result = f"❌ Error resetting conversion tool: {str(e)}"
         return redirect("/comparison?tab=conversion")
 
 
@@ -6868,7 +8620,7 @@ def reformat_insurance_column(df, source_column, new_column_name):
         return None, f"Column '{source_column}' not found in sheet."
 
     # Apply the reformatting
-    df[new_column_name] = df[source_column].apply(format_insurance_name)
+    df[new_column_name] = format_insurance_series(df[source_column])
 
     # Get the position of the source column
     source_col_idx = df.columns.get_loc(source_column)
@@ -6949,15 +8701,15 @@ def process_insurance_formatting(
 
 @app.route("/upload_insurance_formatting", methods=["POST"])
 def upload_insurance_formatting():
-    global insurance_formatting_data, insurance_formatting_filename, insurance_formatting_result, insurance_formatting_output
+    session = session_state()
 
     if "file" not in request.files:
-        insurance_formatting_result = "❌ Error: No file provided"
+        session.insurance_formatting_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=insurance")
 
     file = request.files["file"]
     if file.filename == "":
-        insurance_formatting_result = "❌ Error: No file selected"
+        session.insurance_formatting_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=insurance")
 
     try:
@@ -6966,7 +8718,7 @@ def upload_insurance_formatting():
 
         # Read Excel file directly from memory (no disk storage)
         file.seek(0)  # Reset file pointer to beginning
-        excel_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
+        excel_data = read_excel_sheets(file, engine="openpyxl")
 
         # Remove "Unnamed:" columns from all sheets
         cleaned_data = {}
@@ -6979,28 +8731,28 @@ def upload_insurance_formatting():
             cleaned_data[sheet_name] = df_cleaned
 
         # Process all sheets automatically
-        insurance_formatting_data, insurance_formatting_output = (
+        session.insurance_formatting_data, session.insurance_formatting_output = (
             process_insurance_formatting(cleaned_data)
         )
-        insurance_formatting_filename = filename
+        session.insurance_formatting_filename = filename
 
         # Count sheets processed
-        sheets_count = len(insurance_formatting_data)
-        insurance_formatting_result = f"✅ Processing complete! Processed {sheets_count} sheet(s). Formatted insurance names column added to all sheets."
+        sheets_count = len(session.insurance_formatting_data)
+        session.insurance_formatting_result = f"✅ Processing complete! Processed {sheets_count} sheet(s). Formatted insurance names column added to all sheets."
 
         return redirect("/comparison?tab=insurance")
 
     except Exception as e:
-        insurance_formatting_result = f"❌ Error processing file: {str(e)}"
-        insurance_formatting_output = f"Error: {str(e)}"
+        session.insurance_formatting_result = f"❌ Error processing file: {str(e)}"
+        session.insurance_formatting_output = f"Error: {str(e)}"
         return redirect("/comparison?tab=insurance")
 
 
 @app.route("/download_insurance_formatting", methods=["POST"])
 def download_insurance_formatting():
-    global insurance_formatting_data, insurance_formatting_filename, insurance_formatting_result, insurance_formatting_output
+    session = session_state()
 
-    if not insurance_formatting_data:
+    if not session.insurance_formatting_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -7011,80 +8763,38 @@ def download_insurance_formatting():
         filename += ".xlsx"
 
     try:
-        # Create a temporary file
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in insurance_formatting_data.items():
-                    df_clean = df.copy()
-
-                    # Format "Appointment Date" column to MM/DD/YYYY format (flexible column name search)
-                    appt_date_col = None
-                    for col in df_clean.columns:
-                        col_lower = (
-                            col.lower().strip().replace(" ", "").replace("_", "")
-                        )
-                        # Check for variations: "appointment date", "appt date", "apptdate", etc.
-                        if (
-                            "appointment" in col_lower or "appt" in col_lower
-                        ) and "date" in col_lower:
-                            appt_date_col = col
-                            break
+        export_format = requested_export_format()
 
-                    if appt_date_col:
-                        # Convert dates to MM/DD/YYYY format
-                        def format_date(date_val):
-                            if pd.isna(date_val) or date_val == "":
-                                return ""
-                            try:
-                                # Convert to datetime if not already
-                                if isinstance(date_val, pd.Timestamp):
-                                    date_obj = date_val
-                                elif isinstance(date_val, str):
-                                    # Try to parse string date
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(
-                                            date_val
-                                        )  # Return original if can't parse
-                                else:
-                                    date_obj = pd.to_datetime(date_val, errors="coerce")
-                                    if pd.isna(date_obj):
-                                        return str(
-                                            date_val
-                                        )  # Return original if can't parse
-
-                                # Format as MM/DD/YYYY
-                                return date_obj.strftime("%m/%d/%Y")
-                            except (ValueError, TypeError, AttributeError):
-                                # If parsing fails, return as-is
-                                return str(date_val)
-
-                        # Format dates and convert column to string type to prevent Excel auto-formatting
-                        df_clean[appt_date_col] = df_clean[appt_date_col].apply(
-                            format_date
-                        )
-                        df_clean[appt_date_col] = df_clean[appt_date_col].astype(str)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.insurance_formatting_data.items():
+                df_clean = df.copy()
 
-                    df_clean.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df_clean)
+                # Format "Appointment Date" column to MM/DD/YYYY format (flexible column name search)
+                appt_date_col = None
+                for col in df_clean.columns:
+                    col_lower = col.lower().strip().replace(" ", "").replace("_", "")
+                    # Check for variations: "appointment date", "appt date", "apptdate", etc.
+                    if (
+                        "appointment" in col_lower or "appt" in col_lower
+                    ) and "date" in col_lower:
+                        appt_date_col = col
+                        break
 
-            # Clear data after successful download
-            insurance_formatting_data = None
-            insurance_formatting_filename = None
-            insurance_formatting_result = None
-            insurance_formatting_output = ""
+                if appt_date_col:
+                    df_clean[appt_date_col] = format_date_series_mmddyyyy(
+                        df_clean[appt_date_col]
+                    )
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+                writer.write_sheet(sheet_name, df_clean)
 
-        finally:
-            # Clean up temporary file
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Clear data once the download has been sent
+        return clear_session_state_when_sent(
+            writer.response(filename),
+            "insurance_formatting_data",
+            "insurance_formatting_filename",
+            "insurance_formatting_result",
+            "insurance_formatting_output",
+        )
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -7092,20 +8802,20 @@ def download_insurance_formatting():
 
 @app.route("/reset_insurance_formatting", methods=["POST"])
 def reset_insurance_formatting():
-    global insurance_formatting_data, insurance_formatting_filename, insurance_formatting_result, insurance_formatting_output
+    session = session_state()
     # Explicitly do NOT touch other tool variables
 
     try:
         # Reset ONLY insurance formatting tool variables
-        insurance_formatting_data = {}
-        insurance_formatting_filename = None
-        insurance_formatting_result = "🔄 Insurance formatting tool reset successfully! All files and data have been cleared."
-        insurance_formatting_output = ""
+        session.insurance_formatting_data = {}
+        session.insurance_formatting_filename = None
+        session.insurance_formatting_result = "🔄 Insurance formatting tool reset successfully! All files and data have been cleared."
+        session.insurance_formatting_output = ""
 
         return redirect("/comparison?tab=insurance")
 
     except Exception as e:
-        insurance_formatting_result = (
+        session.insurance_formatting_result = (
             f"❌ Error resetting insurance formatting tool: {str(e)}"
         )
         return redirect("/comparison?tab=insurance")
@@ -7118,7 +8828,7 @@ def process_remarks_excel_file(file_stream):
     try:
         from openpyxl import load_workbook
 
-        wb = load_workbook(file_stream)
+        wb = load_workbook(file_stream, read_only=True)
         ws = None
         patient_id_col = None
         remark_col = None
@@ -7136,17 +8846,19 @@ def process_remarks_excel_file(file_stream):
         # Use only the "Today" sheet
         ws = wb["Today"]
         selected_sheet_name = "Today"
+        sheet_rows = read_sheet_rows(ws)
+        wb.close()
+        max_row = len(sheet_rows)
+        max_column = len(sheet_rows[0]) if sheet_rows else 0
 
         # Look for headers in the first few rows
-        for row_num in range(1, min(6, ws.max_row + 1)):
+        for row_num in range(1, min(6, max_row + 1)):
             temp_patient_id_col = None
             temp_remark_col = None
             temp_agent_name_col = None
 
-            for col in range(1, ws.max_column + 1):
-                cell_value = (
-                    str(ws.cell(row=row_num, column=col).value or "").strip().lower()
-                )
+            for col in range(1, max_column + 1):
+                cell_value = str(sheet_rows[row_num - 1][col - 1] or "").strip().lower()
                 cell_value_clean = (
                     cell_value.replace(" ", "")
                     .replace("_", "")
@@ -7176,8 +8888,8 @@ def process_remarks_excel_file(file_stream):
                 agent_name_col = temp_agent_name_col
                 header_row = row_num
                 break
-            for col in range(1, ws.max_column + 1):
-                cell_value = str(ws.cell(row=1, column=col).value or "").strip().lower()
+            for col in range(1, max_column + 1):
+                cell_value = str(sheet_rows[0][col - 1] or "").strip().lower()
                 cell_value_clean = (
                     cell_value.replace(" ", "")
                     .replace("_", "")
@@ -7207,17 +8919,20 @@ def process_remarks_excel_file(file_stream):
         # Extract data - now returns list of records for each patient ID
         excel_data = {}
         data_start_row = header_row + 1
-        for row in range(data_start_row, ws.max_row + 1):  # Skip header row
-            patient_id_raw = ws.cell(row=row, column=patient_id_col).value
-            remark_raw = ws.cell(row=row, column=remark_col).value
-            agent_name_raw = (
-                ws.cell(row=row, column=agent_name_col).value
-                if agent_name_col
-                else None
-            )
-
-            # Normalize Patient ID for consistent matching
-            patient_id = normalize_patient_id(patient_id_raw) if patient_id_raw else ""
+        rows = []
+        for row in sheet_rows[data_start_row - 1 :]:  # Skip header row
+            patient_id_raw = row[patient_id_col - 1]
+            remark_raw = row[remark_col - 1]
+            agent_name_raw = row[agent_name_col - 1] if agent_name_col else None
+            rows.append((patient_id_raw, remark_raw, agent_name_raw))
+
+        # Normalize Patient IDs for consistent matching (whole column at once)
+        normalized_ids = normalize_patient_id_series([r[0] for r in rows])
+
+        for (patient_id_raw, remark_raw, agent_name_raw), normalized_id in zip(
+            rows, normalized_ids
+        ):
+            patient_id = normalized_id if patient_id_raw else ""
 
             # Ensure remark and agent_name are strings, handling None, empty strings, and whitespace
             # Convert None to empty string, then strip whitespace
@@ -7258,7 +8973,7 @@ def process_remarks_appointments_excel(file_stream):
     """
     from openpyxl import load_workbook
 
-    wb = load_workbook(file_stream)
+    wb = load_workbook(file_stream, read_only=True)
     ws = None
     headers = []
     pat_id_col = None
@@ -7269,10 +8984,9 @@ def process_remarks_appointments_excel(file_stream):
         current_ws = wb[sheet_name]
 
         # Try to find header row (check first 5 rows)
-        for row_num in range(1, min(6, current_ws.max_row + 1)):
+        for row_num, row in enumerate(read_sheet_rows(current_ws, max_row=5), 1):
             temp_headers = []
-            for col in range(1, current_ws.max_column + 1):
-                raw = current_ws.cell(row=row_num, column=col).value
+            for raw in row:
                 name = (str(raw or "")).strip()
                 temp_headers.append(name)
 
@@ -7305,10 +9019,10 @@ def process_remarks_appointments_excel(file_stream):
     if pat_id_col is None:
         ws = wb.active
         headers = []
-        for col in range(1, ws.max_column + 1):
-            raw = ws.cell(row=1, column=col).value
-            name = (str(raw or "")).strip()
-            headers.append(name)
+        for row in read_sheet_rows(ws, max_row=1):
+            for raw in row:
+                name = (str(raw or "")).strip()
+                headers.append(name)
 
         for i, header in enumerate(headers):
             header_lower = (
@@ -7333,21 +9047,31 @@ def process_remarks_appointments_excel(file_stream):
             f"Pat ID column not found in appointments Excel. Checked sheets: {sheet_names}. Found columns: {found_columns}. Please ensure there's a column containing 'Pat ID', 'Patient ID', or similar."
         )
 
-    # Read all rows starting after the header row
-    appointments = []
+    # Read all rows starting after the header row; the header scan only looked at the
+    # first rows, so take the headers again at the sheet's full width
+    sheet_rows = read_sheet_rows(ws)
+    wb.close()
+    headers = [(str(raw or "")).strip() for raw in sheet_rows[header_row - 1]]
+    records = []
     data_start_row = header_row + 1
-    for row in range(data_start_row, ws.max_row + 1):
+    for row in sheet_rows[data_start_row - 1 :]:
         record = {}
 
         # Read all columns
-        for col, header in enumerate(headers, 1):
-            value = ws.cell(row=row, column=col).value
+        for header, value in zip(headers, row):
             record[header] = "" if value is None else str(value)
+        records.append(record)
 
-        # Normalize Patient ID using the same normalization function as remarks
-        pat_id_value = record.get(headers[pat_id_col - 1], "")
-        # Use normalize_patient_id for consistent matching with remarks file
-        pid_normalized = normalize_patient_id(pat_id_value) if pat_id_value else ""
+    # Normalize Patient IDs using the same normalization as remarks (whole column at once)
+    pat_id_values = [record.get(headers[pat_id_col - 1], "") for record in records]
+    normalized_ids = normalize_patient_id_series(pat_id_values)
+
+    appointments = []
+    for record, pat_id_value, normalized_id in zip(
+        records, pat_id_values, normalized_ids
+    ):
+        # Use normalized Patient ID for consistent matching with remarks file
+        pid_normalized = normalized_id if pat_id_value else ""
         # Store both normalized and original for maximum compatibility
         record["Pat ID"] = (
             pid_normalized if pid_normalized else str(pat_id_value).strip()
@@ -7382,6 +9106,13 @@ def update_appointments_with_remarks(appointments, excel_data):
     # But we'll create variations to handle any edge cases
     lookup_dict = {}
 
+    # Re-normalize all keys at once (in case there are any edge cases)
+    pids = [pid for pid in excel_data if pid]
+    renormalized_ids = dict(zip(pids, normalize_patient_id_series(pids)))
+    renormalized_str_ids = dict(
+        zip(pids, normalize_patient_id_series([str(pid).strip() for pid in pids]))
+    )
+
     # First, build lookup dictionary with all possible variations
     # Convert all keys to strings for consistent matching
     for pid, data_list in excel_data.items():
@@ -7419,7 +9150,7 @@ def update_appointments_with_remarks(appointments, excel_data):
 
         # Re-normalize (in case there are any edge cases)
         # But only if it's different from what we already have
-        renormalized = normalize_patient_id(pid) if pid else None
+        renormalized = renormalized_ids[pid]
         if (
             renormalized
             and renormalized != pid_str_base
@@ -7429,7 +9160,7 @@ def update_appointments_with_remarks(appointments, excel_data):
             lookup_dict[renormalized].extend(data_list)
 
         # Also try normalizing the string version
-        renormalized_str = normalize_patient_id(pid_str_base) if pid_str_base else None
+        renormalized_str = renormalized_str_ids[pid]
         if (
             renormalized_str
             and renormalized_str != pid_str_base
@@ -7438,14 +9169,18 @@ def update_appointments_with_remarks(appointments, excel_data):
             lookup_dict[renormalized_str] = []
             lookup_dict[renormalized_str].extend(data_list)
 
-    for appointment in appointments:
+    # Normalize every appointment's original Patient ID at once
+    raw_patient_ids = [
+        appointment.get("Pat ID Original", "") or appointment.get("Pat ID", "")
+        for appointment in appointments
+    ]
+    normalized_raw_ids = normalize_patient_id_series(raw_patient_ids)
+
+    for appointment, patient_id_raw, normalized_from_original in zip(
+        appointments, raw_patient_ids, normalized_raw_ids
+    ):
         # Get both normalized and original Patient ID
         patient_id_normalized = appointment.get("Pat ID", "")
-        patient_id_original = appointment.get("Pat ID Original", "")
-        # Fallback to normalized if original not available
-        patient_id_raw = (
-            patient_id_original if patient_id_original else patient_id_normalized
-        )
 
         matches_found = False
 
@@ -7458,7 +9193,6 @@ def update_appointments_with_remarks(appointments, excel_data):
 
         if patient_id_raw:
             # Strategy 2: Normalize the original (in case it wasn't normalized during reading)
-            normalized_from_original = normalize_patient_id(patient_id_raw)
             if (
                 normalized_from_original
                 and normalized_from_original not in match_keys_to_try
@@ -7555,23 +9289,15 @@ def update_appointments_with_remarks(appointments, excel_data):
     return updated_appointments, updated_count
 
 
-def create_excel_from_appointments(appointments, filename):
-    """Create Excel file from processed appointment data with all columns."""
-    from openpyxl import Workbook
-    import io
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Appointment Data"
+def appointments_frame(appointments):
+    """Appointment rows as the 'Appointment Data' sheet: every value as text, Time as MM/DD/YYYY.
 
+    Columns keep their first-seen order, with Pat ID, Insurance Name, Remark and
+    Agent Name moved to the end.
+    """
     if not appointments:
-        excel_buffer = io.BytesIO()
-        wb.save(excel_buffer)
-        excel_buffer.seek(0)
-        return excel_buffer
+        return pd.DataFrame()
 
-    # Union of all keys in stable order (first-seen across rows = matches source sheet order;
-    # set-based union shuffles columns).
     headers = []
     seen_keys = set()
     for appointment in appointments:
@@ -7579,137 +9305,84 @@ def create_excel_from_appointments(appointments, filename):
             if key not in seen_keys:
                 seen_keys.add(key)
                 headers.append(key)
-
-    # Put Pat ID, Insurance Name, Remark, and Agent Name at the end for visibility (same as other exports)
     for name in ("Pat ID", "Insurance Name", "Remark", "Agent Name"):
         if name in headers:
             headers.remove(name)
-    headers.extend(
-        ["Pat ID", "Insurance Name", "Remark", "Agent Name"]
-    )
-
-    # Header labels (Imagen fill/font applied after data rows are written)
-    for col, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col, value=header)
+    headers.extend(["Pat ID", "Insurance Name", "Remark", "Agent Name"])
+
+    columns = {}
+    for header in headers:
+        values = [appointment.get(header, "") for appointment in appointments]
+        columns[header] = [
+            "" if value is None else value if isinstance(value, str) else str(value)
+            for value in values
+        ]
+    df = pd.DataFrame(columns, columns=headers, dtype=object)
 
-    # Find "Time" column index for formatting
-    time_col_idx = None
-    for col, header in enumerate(headers, 1):
+    for header in headers:
         if header.lower().strip() == "time":
-            time_col_idx = col
+            df[header] = format_date_series_mmddyyyy(df[header]).to_numpy()
             break
+    return df
 
-    # Format date function for Time column
-    def format_time_value(time_val):
-        """Format Time column value to MM/DD/YYYY format"""
-        if not time_val or time_val == "":
-            return ""
-        try:
-            # Convert to datetime if not already
-            if isinstance(time_val, pd.Timestamp):
-                date_obj = time_val
-            elif isinstance(time_val, str):
-                # Try to parse string date
-                date_obj = pd.to_datetime(time_val, errors="coerce")
-                if pd.isna(date_obj):
-                    return str(time_val)  # Return original if can't parse
-            else:
-                date_obj = pd.to_datetime(time_val, errors="coerce")
-                if pd.isna(date_obj):
-                    return str(time_val)  # Return original if can't parse
-
-            # Format as MM/DD/YYYY
-            return date_obj.strftime("%m/%d/%Y")
-        except (ValueError, TypeError, AttributeError):
-            # If parsing fails, return as-is
-            return str(time_val)
-
-    # Add appointment data
-    for row, appointment in enumerate(appointments, 2):
-        for col, header in enumerate(headers, 1):
-            value = appointment.get(header, "")
-
-            # Ensure value is not None - convert to string if needed
-            if value is None:
-                value = ""
-            elif not isinstance(value, str):
-                value = str(value)
-
-            # Format Time column if this is the Time column
-            if time_col_idx and col == time_col_idx:
-                value = format_time_value(value)
-
-            # Write the value to the cell
-            cell = ws.cell(row=row, column=col, value=value)
-
-            # Set Time column format to text to preserve MM/DD/YYYY format
-            if time_col_idx and col == time_col_idx and value:
-                cell.number_format = "@"  # Text format
-
-            # Ensure Remark and Agent Name columns are written as text
-            if header in ["Remark", "Agent Name"] and value:
-                cell.number_format = "@"  # Text format to preserve content
-
-    _apply_imagen_openpyxl_worksheet(ws, headers)
-
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
 
-        adjusted_width = min(max_length + 2, 50)  # Cap at 50 characters
-        ws.column_dimensions[column_letter].width = adjusted_width
+def create_excel_from_appointments(appointments, filename):
+    """Create Excel file from processed appointment data with all columns."""
+    df = appointments_frame(appointments)
+    # Auto-adjust column widths to the longest text, capped at 50 characters
+    column_widths = [
+        min(max(len(str(header)), df[header].str.len().max()) + 2, 50)
+        for header in df.columns
+    ]
 
-    # Save to memory
     excel_buffer = io.BytesIO()
-    wb.save(excel_buffer)
+    with ImagenExcelWriter(excel_buffer) as writer:
+        # Remark and Agent Name are written as text to preserve their content
+        writer.write_sheet(
+            "Appointment Data",
+            df,
+            text_columns=("Remark", "Agent Name"),
+            column_widths=column_widths,
+        )
     excel_buffer.seek(0)
-
     return excel_buffer
 
 
 @app.route("/upload_remarks", methods=["POST"])
 def upload_remarks():
-    global remarks_appointments_data, remarks_excel_data, remarks_appointments_filename, remarks_remarks_filename, remarks_result, remarks_updated_count
+    session = session_state()
 
     appointments_file = request.files.get("appointments_file")
     remarks_file = request.files.get("remarks_file")
 
     # Require both Excel files
     if not appointments_file or appointments_file.filename == "":
-        remarks_result = "❌ Error: Please upload the Appointments Excel file."
+        session.remarks_result = "❌ Error: Please upload the Appointments Excel file."
         return redirect("/comparison?tab=remarks")
 
     if not remarks_file or remarks_file.filename == "":
-        remarks_result = "❌ Error: Please upload the Remarks Excel file."
+        session.remarks_result = "❌ Error: Please upload the Remarks Excel file."
         return redirect("/comparison?tab=remarks")
 
     try:
         # Process appointments Excel directly from memory
         appointments_filename_raw = secure_filename(appointments_file.filename)
         appointments_file.seek(0)  # Reset file pointer
-        remarks_appointments_data = process_remarks_appointments_excel(
+        session.remarks_appointments_data = process_remarks_appointments_excel(
             appointments_file
         )
-        remarks_appointments_filename = appointments_filename_raw
+        session.remarks_appointments_filename = appointments_filename_raw
 
         # Process remarks Excel
         remarks_file.seek(0)  # Reset file pointer
-        remarks_excel_data = process_remarks_excel_file(remarks_file)
-        remarks_remarks_filename = secure_filename(remarks_file.filename)
+        session.remarks_excel_data = process_remarks_excel_file(remarks_file)
+        session.remarks_remarks_filename = secure_filename(remarks_file.filename)
 
         # Debug: Check what remarks data we have
         sample_remarks_count = 0
         sample_remarks_with_data = 0
         sample_patient_ids = []
-        for pid, data_list in list(remarks_excel_data.items())[
+        for pid, data_list in list(session.remarks_excel_data.items())[
             :10
         ]:  # Check first 10 patient IDs
             sample_patient_ids.append(str(pid))
@@ -7721,7 +9394,9 @@ def upload_remarks():
         # Debug: Check appointment Patient IDs (both normalized and original)
         sample_appointment_pids = []
         sample_appointment_pids_orig = []
-        for appt in remarks_appointments_data[:10]:  # Check first 10 appointments
+        for appt in session.remarks_appointments_data[
+            :10
+        ]:  # Check first 10 appointments
             pid_norm = appt.get("Pat ID", "")
             pid_orig = appt.get("Pat ID Original", "")
             if pid_norm:
@@ -7731,7 +9406,7 @@ def upload_remarks():
 
         # Update appointments with remarks
         updated_appointments, updated_count = update_appointments_with_remarks(
-            remarks_appointments_data, remarks_excel_data
+            session.remarks_appointments_data, session.remarks_excel_data
         )
 
         # Debug: Verify remarks were set
@@ -7840,69 +9515,79 @@ def upload_remarks():
                 appointment["Insurance Name"] = ""
 
         # Update the global processed_appointments with the new data
-        remarks_appointments_data = updated_appointments
-        remarks_updated_count = updated_count
+        session.remarks_appointments_data = updated_appointments
+        session.remarks_updated_count = updated_count
 
         # Build result message with debug info
-        result_msg = f"✅ Successfully processed {len(remarks_appointments_data)} appointment(s) and updated {updated_count} appointment(s) with remarks and agent names. Insurance Name column added based on Insurance Note formatting."
+        result_msg = f"✅ Successfully processed {len(session.remarks_appointments_data)} appointment(s) and updated {updated_count} appointment(s) with remarks and agent names. Insurance Name column added based on Insurance Note formatting."
 
         # Add debug information if matching rate is low
         if (
-            updated_count < len(remarks_appointments_data) * 0.5
+            updated_count < len(session.remarks_appointments_data) * 0.5
         ):  # Less than 50% matched
-            unmatched_count = len(remarks_appointments_data) - updated_count
-            result_msg += f"\n\n⚠️ Warning: Only {updated_count} out of {len(remarks_appointments_data)} appointments were matched with remarks."
+            unmatched_count = len(session.remarks_appointments_data) - updated_count
+            result_msg += f"\n\n⚠️ Warning: Only {updated_count} out of {len(session.remarks_appointments_data)} appointments were matched with remarks."
             result_msg += f"\n🔍 Sample Patient IDs from Remarks file (normalized): {', '.join(sample_patient_ids[:5]) if sample_patient_ids else 'None'}"
             result_msg += f"\n🔍 Sample Patient IDs from Appointments file (normalized): {', '.join(sample_appointment_pids[:5]) if sample_appointment_pids else 'None'}"
             if sample_appointment_pids_orig:
                 result_msg += f"\n🔍 Sample Patient IDs from Appointments file (original): {', '.join(sample_appointment_pids_orig[:5])}"
-            result_msg += f"\n📊 Total unique Patient IDs in Remarks file: {len(remarks_excel_data)}"
+            result_msg += f"\n📊 Total unique Patient IDs in Remarks file: {len(session.remarks_excel_data)}"
             result_msg += f"\n💡 Tip: Check if Patient IDs in both files match exactly. Check the console/terminal for detailed debug output."
 
-        remarks_result = result_msg
+        session.remarks_result = result_msg
 
         return redirect("/comparison?tab=remarks")
 
     except Exception as e:
-        remarks_result = f"❌ Error processing files: {str(e)}"
+        session.remarks_result = f"❌ Error processing files: {str(e)}"
         return redirect("/comparison?tab=remarks")
 
 
 @app.route("/download_remarks", methods=["POST"])
 def download_remarks():
-    global remarks_appointments_data, remarks_appointments_filename, remarks_remarks_filename, remarks_result, remarks_updated_count
+    session = session_state()
 
-    if not remarks_appointments_data:
+    if not session.remarks_appointments_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
     if not filename:
-        if remarks_appointments_filename:
-            base_name = os.path.splitext(remarks_appointments_filename)[0]
+        if session.remarks_appointments_filename:
+            base_name = os.path.splitext(session.remarks_appointments_filename)[0]
             filename = f"{base_name}_appointments.xlsx"
         else:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"appointments_with_remarks_{timestamp}.xlsx"
 
     try:
-        # Create Excel file
-        excel_buffer = create_excel_from_appointments(
-            remarks_appointments_data, filename
-        )
-
-        # Clear data after successful download
-        remarks_appointments_data = None
-        remarks_excel_data = None
-        remarks_appointments_filename = None
-        remarks_remarks_filename = None
-        remarks_result = None
-        remarks_updated_count = 0
-
-        return send_file(
-            excel_buffer,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        export_format = requested_export_format()
+        if export_format == "xlsx":
+            # Create Excel file
+            excel_buffer = create_excel_from_appointments(
+                session.remarks_appointments_data, filename
+            )
+            response = send_file(
+                excel_buffer,
+                as_attachment=True,
+                download_name=filename,
+                mimetype=XLSX_MIMETYPE,
+            )
+        else:
+            with SheetExport(export_format) as export:
+                export.write_sheet(
+                    "Appointment Data",
+                    appointments_frame(session.remarks_appointments_data),
+                )
+            response = export.response(filename)
+
+        # Clear data once the download has been sent
+        return clear_session_state_when_sent(
+            response,
+            "remarks_appointments_data",
+            "remarks_appointments_filename",
+            "remarks_remarks_filename",
+            "remarks_result",
+            "remarks_updated_count",
         )
 
     except Exception as e:
@@ -7911,38 +9596,39 @@ def download_remarks():
 
 @app.route("/reset_remarks", methods=["POST"])
 def reset_remarks():
-    global remarks_appointments_data, remarks_excel_data, remarks_appointments_filename, remarks_remarks_filename, remarks_result, remarks_updated_count
+    session = session_state()
     # Explicitly do NOT touch other tool variables
 
     try:
         # Reset ONLY remarks tool variables
-        remarks_appointments_data = None
-        remarks_excel_data = None
-        remarks_appointments_filename = None
-        remarks_remarks_filename = None
-        remarks_result = (
+        session.remarks_appointments_data = None
+        session.remarks_excel_data = None
+        session.remarks_appointments_filename = None
+        session.remarks_remarks_filename = None
+        session.remarks_result = (
             "🔄 Remarks tool reset successfully! All files and data have been cleared."
         )
-        remarks_updated_count = 0
+        session.remarks_updated_count = 0
 
         return redirect("/comparison?tab=remarks")
 
     except Exception as e:
-        remarks_result = f"❌ Error resetting remarks tool: {str(e)}"
+        session.remarks_result = f"❌ Error resetting remarks tool: {str(e)}"
         return redirect("/comparison?tab=remarks")
 
 
 @app.route("/upload_appointment_report", methods=["POST"])
+@background_job()
 def upload_appointment_report():
-    global appointment_report_data, appointment_report_filename, appointment_report_result, appointment_report_output
+    session = session_state()
 
     if "file" not in request.files:
-        appointment_report_result = "❌ Error: No file provided"
+        session.appointment_report_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=appointment")
 
     file = request.files["file"]
     if file.filename == "":
-        appointment_report_result = "❌ Error: No file selected"
+        session.appointment_report_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=appointment")
 
     try:
@@ -7952,9 +9638,7 @@ def upload_appointment_report():
         # Read Excel file directly from memory (no disk storage) WITHOUT headers
         # We'll find and set the header row in Step 1
         file.seek(0)  # Reset file pointer to beginning
-        excel_data = pd.read_excel(
-            file, sheet_name=None, engine="openpyxl", header=None
-        )
+        excel_data = read_excel_sheets(file, engine="openpyxl", header=None)
 
         # Store raw data - we'll process headers in Step 1
         cleaned_data = {}
@@ -8237,8 +9921,8 @@ def upload_appointment_report():
 
             if primary_col:
                 # Format primary insurance column
-                df_processed[primary_col] = df_processed[primary_col].apply(
-                    format_insurance_name
+                df_processed[primary_col] = format_insurance_series(
+                    df_processed[primary_col]
                 )
                 formatted_primary = df_processed[primary_col].notna().sum()
                 output_lines.append(
@@ -8249,8 +9933,8 @@ def upload_appointment_report():
 
             if secondary_col:
                 # Format secondary insurance column
-                df_processed[secondary_col] = df_processed[secondary_col].apply(
-                    format_insurance_name
+                df_processed[secondary_col] = format_insurance_series(
+                    df_processed[secondary_col]
                 )
                 formatted_secondary = df_processed[secondary_col].notna().sum()
                 output_lines.append(
@@ -8299,9 +9983,9 @@ def upload_appointment_report():
                 )
 
                 # Normalize Patient IDs for comparison
-                df_processed["_normalized_patient_id"] = df_processed[
-                    patient_id_col
-                ].apply(normalize_patient_id)
+                df_processed["_normalized_patient_id"] = normalize_patient_id_series(
+                    df_processed[patient_id_col]
+                )
 
                 # Find duplicates
                 rows_before = len(df_processed)
@@ -8448,27 +10132,27 @@ def upload_appointment_report():
         output_lines.append("=" * 70)
 
         # Update global variables
-        appointment_report_data = processed_sheets
-        appointment_report_filename = filename
-        appointment_report_output = "\n".join(output_lines)
+        session.appointment_report_data = processed_sheets
+        session.appointment_report_filename = filename
+        session.appointment_report_output = "\n".join(output_lines)
 
         # Count sheets processed
         sheets_count = len(processed_sheets)
-        appointment_report_result = f"✅ Processing complete! Formatted insurance columns in {sheets_count} sheet(s). Total rows processed: {total_rows_processed}"
+        session.appointment_report_result = f"✅ Processing complete! Formatted insurance columns in {sheets_count} sheet(s). Total rows processed: {total_rows_processed}"
 
         return redirect("/comparison?tab=appointment")
 
     except Exception as e:
-        appointment_report_result = f"❌ Error processing file: {str(e)}"
-        appointment_report_output = f"Error: {str(e)}"
+        session.appointment_report_result = f"❌ Error processing file: {str(e)}"
+        session.appointment_report_output = f"Error: {str(e)}"
         return redirect("/comparison?tab=appointment")
 
 
 @app.route("/download_appointment_report", methods=["POST"])
 def download_appointment_report():
-    global appointment_report_data, appointment_report_filename, appointment_report_result, appointment_report_output
+    session = session_state()
 
-    if not appointment_report_data:
+    if not session.appointment_report_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -8477,75 +10161,42 @@ def download_appointment_report():
         filename = f"formatted_appointment_report_{timestamp}.xlsx"
 
     try:
-        # Create a temporary file
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in appointment_report_data.items():
-                    df_clean = df.copy()
-
-                    # Format date columns to MM/DD/YYYY format (flexible column name search)
-                    for col in df_clean.columns:
-                        col_lower = (
-                            col.lower().strip().replace(" ", "").replace("_", "")
-                        )
-                        # Check for date columns
-                        if "date" in col_lower or "time" in col_lower:
-                            # Convert dates to MM/DD/YYYY format
-                            def format_date(date_val):
-                                if pd.isna(date_val) or date_val == "":
-                                    return ""
-                                try:
-                                    # Convert to datetime if not already
-                                    if isinstance(date_val, pd.Timestamp):
-                                        date_obj = date_val
-                                    elif isinstance(date_val, str):
-                                        # Try to parse string date
-                                        date_obj = pd.to_datetime(
-                                            date_val, errors="coerce"
-                                        )
-                                        if pd.isna(date_obj):
-                                            return str(
-                                                date_val
-                                            )  # Return original if can't parse
-                                    else:
-                                        date_obj = pd.to_datetime(
-                                            date_val, errors="coerce"
-                                        )
-                                        if pd.isna(date_obj):
-                                            return str(
-                                                date_val
-                                            )  # Return original if can't parse
-
-                                    # Format as MM/DD/YYYY
-                                    return date_obj.strftime("%m/%d/%Y")
-                                except (ValueError, TypeError, AttributeError):
-                                    # If parsing fails, return as-is
-                                    return str(date_val)
-
-                            # Format dates and convert column to string type to prevent Excel auto-formatting
-                            df_clean[col] = df_clean[col].apply(format_date)
-                            df_clean[col] = df_clean[col].astype(str)
-
-                    df_clean.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df_clean)
-
-            # Clear data after successful download
-            appointment_report_data = None
-            appointment_report_filename = None
-            appointment_report_result = None
-            appointment_report_output = ""
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(
+            "download_appointment_report",
+            session.appointment_report_data,
+            export_format,
+        )
+        if cached is not None:
+            return clear_session_state_when_sent(
+                send_xlsx_bytes(cached, filename),
+                "appointment_report_data",
+                "appointment_report_filename",
+                "appointment_report_result",
+                "appointment_report_output",
+            )
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.appointment_report_data.items():
+                df_clean = df.copy()
 
-        finally:
-            # Clean up temporary file
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+                # Format date columns to MM/DD/YYYY format (flexible column name search)
+                for col in df_clean.columns:
+                    col_lower = col.lower().strip().replace(" ", "").replace("_", "")
+                    # Check for date columns
+                    if "date" in col_lower or "time" in col_lower:
+                        df_clean[col] = format_date_series_mmddyyyy(df_clean[col])
+
+                writer.write_sheet(sheet_name, df_clean)
+
+        # Clear data once the download has been sent
+        return clear_session_state_when_sent(
+            writer.response(filename, cache_key),
+            "appointment_report_data",
+            "appointment_report_filename",
+            "appointment_report_result",
+            "appointment_report_output",
+        )
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -8553,36 +10204,37 @@ def download_appointment_report():
 
 @app.route("/reset_appointment_report", methods=["POST"])
 def reset_appointment_report():
-    global appointment_report_data, appointment_report_filename, appointment_report_result, appointment_report_output
+    session = session_state()
     # Explicitly do NOT touch other tool variables
 
     try:
         # Reset ONLY appointment report tool variables
-        appointment_report_data = None
-        appointment_report_filename = None
-        appointment_report_result = "🔄 Appointment report formatting tool reset successfully! All files and data have been cleared."
-        appointment_report_output = ""
+        session.appointment_report_data = None
+        session.appointment_report_filename = None
+        session.appointment_report_result = "🔄 Appointment report formatting tool reset successfully! All files and data have been cleared."
+        session.appointment_report_output = ""
 
         return redirect("/comparison?tab=appointment")
 
     except Exception as e:
-        appointment_report_result = (
+        session.appointment_report_result = (
             f"❌ Error resetting appointment report formatting tool: {str(e)}"
         )
         return redirect("/comparison?tab=appointment")
 
 
 @app.route("/upload_smart_assist", methods=["POST"])
+@background_job()
 def upload_smart_assist():
-    global smart_assist_data, smart_assist_filename, smart_assist_result, smart_assist_output
+    session = session_state()
 
     if "file" not in request.files:
-        smart_assist_result = "❌ Error: No file provided"
+        session.smart_assist_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=smartassist")
 
     file = request.files["file"]
     if file.filename == "":
-        smart_assist_result = "❌ Error: No file selected"
+        session.smart_assist_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=smartassist")
 
     try:
@@ -8592,7 +10244,9 @@ def upload_smart_assist():
         # Read raw Excel data without headers first to analyze structure
         from openpyxl import load_workbook
 
-        wb = load_workbook(file)
+        wb = load_workbook(file, read_only=True)
+        workbook_rows = {name: read_sheet_rows(wb[name]) for name in wb.sheetnames}
+        wb.close()
 
         processed_sheets = {}
         output_lines = []
@@ -8601,14 +10255,10 @@ def upload_smart_assist():
         output_lines.append("=" * 70)
         output_lines.append("")
 
-        for sheet_name in wb.sheetnames:
+        for sheet_name, all_rows in workbook_rows.items():
             output_lines.append(f"📋 Processing sheet: {sheet_name}")
-            ws = wb[sheet_name]
 
             # Step 1: Read all data as raw values
-            all_rows = []
-            for row in ws.iter_rows(values_only=True):
-                all_rows.append(row)
 
             output_lines.append(f"   Original rows: {len(all_rows)}")
 
@@ -9110,13 +10760,13 @@ def upload_smart_assist():
         output_lines.append("PROCESSING COMPLETE! FILE READY FOR DOWNLOAD")
         output_lines.append("=" * 70)
 
-        smart_assist_data = processed_sheets
-        smart_assist_filename = filename
-        smart_assist_output = "\n".join(output_lines)
+        session.smart_assist_data = processed_sheets
+        session.smart_assist_filename = filename
+        session.smart_assist_output = "\n".join(output_lines)
 
         total_rows = sum(len(df) for df in processed_sheets.values())
         sheets_count = len(processed_sheets)
-        smart_assist_result = f"✅ Processing complete! Formatted {sheets_count} sheet(s) with {total_rows} total rows. All sections combined, blank rows removed, and headers consolidated."
+        session.smart_assist_result = f"✅ Processing complete! Formatted {sheets_count} sheet(s) with {total_rows} total rows. All sections combined, blank rows removed, and headers consolidated."
 
         return redirect("/comparison?tab=smartassist")
 
@@ -9124,65 +10774,170 @@ def upload_smart_assist():
         import traceback
 
         error_details = traceback.format_exc()
-        smart_assist_result = f"❌ Error processing file: {str(e)}"
-        smart_assist_output = f"Error: {str(e)}\n\nDetails:\n{error_details}"
+        session.smart_assist_result = f"❌ Error processing file: {str(e)}"
+        session.smart_assist_output = f"Error: {str(e)}\n\nDetails:\n{error_details}"
         return redirect("/comparison?tab=smartassist")
 
 
-def _apply_imagen_openpyxl_worksheet(ws, column_headers):
-    """Imagen-style sheet: green header #92d050 (bold, centered), thin borders on all cells, text format for date/time columns (rows 2+). Row 1 must already contain header values in column order."""
-    if not column_headers:
-        return
-    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+def _is_imagen_text_column(column_header):
+    """Imagen exports keep date/time columns as text so MM/DD/YYYY values are not reinterpreted."""
+    col_lower = str(column_header).lower().strip().replace(" ", "").replace("_", "")
+    return "date" in col_lower or "time" in col_lower
+
+
+def _excel_cell_value(value):
+    """(cell value, number format or None) the way DataFrame.to_excel writes a value."""
+    if type(value) is str:
+        return value, None
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return "", None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value), None
+    if isinstance(value, (int, np.integer)):
+        return int(value), None
+    if isinstance(value, (float, np.floating)):
+        if np.isinf(value):
+            return ("inf" if value > 0 else "-inf"), None
+        return float(value), None
+    if getattr(value, "tzinfo", None) is not None:
+        raise ValueError(
+            "Excel does not support datetimes with timezones. Please ensure "
+            "that datetimes are timezone unaware before writing to Excel."
+        )
+    if isinstance(value, datetime):
+        return value, "YYYY-MM-DD HH:MM:SS"
+    if isinstance(value, date):
+        return value, "YYYY-MM-DD"
+    if isinstance(value, timedelta):
+        return value.total_seconds() / 86400, "0"
+    return str(value), None
+
+
+class ImagenExcelWriter:
+    """.xlsx writer for Imagen-style sheets in openpyxl's write-only mode.
+
+    write_sheet() emits the same cells as DataFrame.to_excel(index=False) in the
+    Imagen look: green header #92d050 (bold, centered), thin borders on all
+    cells, text format for date/time columns. Cells
+    get one of a few named styles as they are appended, so no second styling pass
+    is needed, and write-only worksheets keep their rows in openpyxl's temporary
+    files rather than in memory.
+
+    close() saves the workbook to path, which can be a file name, a BytesIO or a
+    non-seekable stream that forwards the workbook to a client as it is zipped.
+    """
 
-    ncols = len(column_headers)
-    header_fill = PatternFill(
-        start_color="92d050", end_color="92d050", fill_type="solid"
-    )
-    header_font = Font(bold=True)
-    header_alignment = Alignment(
-        horizontal="center", vertical="center", wrap_text=True
-    )
-    for col_idx in range(1, ncols + 1):
-        cell = ws.cell(row=1, column=col_idx)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-
-    thin_border = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin"),
-    )
-    max_row = ws.max_row or 1
-    for row in range(1, max_row + 1):
-        for col_idx in range(1, ncols + 1):
-            ws.cell(row=row, column=col_idx).border = thin_border
-
-    for idx, col in enumerate(column_headers, 1):
-        col_lower = str(col).lower().strip().replace(" ", "").replace("_", "")
-        if "date" not in col_lower and "time" not in col_lower:
-            continue
-        for row in range(2, max_row + 1):
-            cell = ws.cell(row=row, column=idx)
-            if cell.value:
-                cell.number_format = "@"
+    def __init__(self, path):
+        from openpyxl import Workbook
 
+        self.path = path
+        self.book = Workbook(write_only=True)
+        self._style_names = set()  # named styles added to the book
 
-def _apply_imagen_excel_sheet_styling(writer, sheet_name, df):
-    """Imagen-style Excel export (pandas ExcelWriter): delegates to openpyxl worksheet styling."""
-    if df is None or len(df.columns) == 0:
-        return
-    ws = writer.sheets[sheet_name]
-    _apply_imagen_openpyxl_worksheet(ws, list(df.columns))
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """Drop a failed workbook without saving it, keeping the original error."""
+        self.book = None
+
+    def close(self):
+        self.book.save(self.path)
+
+    def _style(self, header, number_format):
+        """Name of the named style for a header or data cell with number_format (None = General)."""
+        name = "Imagen Header" if header else "Imagen Cell"
+        if number_format:
+            name = f"{name} {number_format}"
+        if name not in self._style_names:
+            from openpyxl.styles import (
+                Alignment,
+                Border,
+                Font,
+                NamedStyle,
+                PatternFill,
+                Side,
+            )
+
+            style = NamedStyle(name=name)
+            thin = Side(style="thin")
+            style.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+            if header:
+                style.fill = PatternFill(
+                    start_color="92d050", end_color="92d050", fill_type="solid"
+                )
+                style.font = Font(bold=True)
+                style.alignment = Alignment(
+                    horizontal="center", vertical="center", wrap_text=True
+                )
+            if number_format:
+                style.number_format = number_format
+            self.book.add_named_style(style)
+            self._style_names.add(name)
+        return name
+
+    def write_sheet(self, sheet_name, df, text_columns=(), column_widths=None):
+        """Append df (header row plus data rows) as a new Imagen-styled sheet.
+
+        text_columns names columns kept as text besides the date/time ones;
+        column_widths optionally gives each column's width in characters.
+        """
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+
+        ws = self.book.create_sheet(sheet_name)
+        if df is None or len(df.columns) == 0:
+            return
+        # Write-only sheets take column widths only before the first row
+        for i, width in enumerate(column_widths or (), 1):
+            ws.column_dimensions[get_column_letter(i)].width = width
+
+        header = []
+        for col in df.columns:
+            value, number_format = _excel_cell_value(col)
+            cell = WriteOnlyCell(ws, value)
+            cell.style = self._style(True, number_format)
+            header.append(cell)
+        ws.append(header)
+
+        # One styled cell per (column, number format), refilled for every row:
+        # append() writes the row out before the next one is built
+        templates = {}
+        text_flags = [
+            col in text_columns or _is_imagen_text_column(col) for col in df.columns
+        ]
+        for row in df.itertuples(index=False, name=None):
+            cells = []
+            for i, (value, text_column) in enumerate(zip(row, text_flags)):
+                value, number_format = _excel_cell_value(value)
+                if text_column and value:
+                    if isinstance(value, date):
+                        # Binding a date replaces a text format: style a cell of its own
+                        cell = WriteOnlyCell(ws, value)
+                        cell.style = self._style(False, "@")
+                        cells.append(cell)
+                        continue
+                    number_format = "@"
+                cell = templates.get((i, number_format))
+                if cell is None:
+                    cell = templates[i, number_format] = WriteOnlyCell(ws)
+                    cell.style = self._style(False, number_format)
+                cell.value = value
+                cells.append(cell)
+            ws.append(cells)
 
 
 @app.route("/download_smart_assist", methods=["POST"])
 def download_smart_assist():
-    global smart_assist_data, smart_assist_filename, smart_assist_result, smart_assist_output
+    session = session_state()
 
-    if not smart_assist_data:
+    if not session.smart_assist_data:
         return jsonify({"error": "No data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -9192,61 +10947,39 @@ def download_smart_assist():
         filename = f"Imagen Dental IV Allocation File - {date_str}.xlsx"
 
     try:
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in smart_assist_data.items():
-                    df_clean = df.copy()
-
-                    # Format date columns
-                    for col in df_clean.columns:
-                        col_lower = (
-                            col.lower().strip().replace(" ", "").replace("_", "")
-                        )
-                        if "date" in col_lower or "time" in col_lower:
-
-                            def format_date(date_val):
-                                if pd.isna(date_val) or date_val == "":
-                                    return ""
-                                try:
-                                    if isinstance(date_val, pd.Timestamp):
-                                        date_obj = date_val
-                                    elif isinstance(date_val, str):
-                                        date_obj = pd.to_datetime(
-                                            date_val, errors="coerce"
-                                        )
-                                        if pd.isna(date_obj):
-                                            return str(date_val)
-                                    else:
-                                        date_obj = pd.to_datetime(
-                                            date_val, errors="coerce"
-                                        )
-                                        if pd.isna(date_obj):
-                                            return str(date_val)
-                                    return date_obj.strftime("%m/%d/%Y")
-                                except (ValueError, TypeError, AttributeError):
-                                    return str(date_val)
-
-                            df_clean[col] = df_clean[col].apply(format_date)
-                            df_clean[col] = df_clean[col].astype(str)
-
-                    df_clean.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df_clean)
-
-            smart_assist_data = None
-            smart_assist_filename = None
-            smart_assist_result = None
-            smart_assist_output = ""
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(
+            "download_smart_assist", session.smart_assist_data, export_format
+        )
+        if cached is not None:
+            return clear_session_state_when_sent(
+                send_xlsx_bytes(cached, filename),
+                "smart_assist_data",
+                "smart_assist_filename",
+                "smart_assist_result",
+                "smart_assist_output",
+            )
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.smart_assist_data.items():
+                df_clean = df.copy()
 
-        finally:
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+                # Format date columns
+                for col in df_clean.columns:
+                    col_lower = col.lower().strip().replace(" ", "").replace("_", "")
+                    if "date" in col_lower or "time" in col_lower:
+                        df_clean[col] = format_date_series_mmddyyyy(df_clean[col])
+
+                writer.write_sheet(sheet_name, df_clean)
+
+        # Clear data once the download has been sent
+        return clear_session_state_when_sent(
+            writer.response(filename, cache_key),
+            "smart_assist_data",
+            "smart_assist_filename",
+            "smart_assist_result",
+            "smart_assist_output",
+        )
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -9254,18 +10987,18 @@ def download_smart_assist():
 
 @app.route("/reset_smart_assist", methods=["POST"])
 def reset_smart_assist():
-    global smart_assist_data, smart_assist_filename, smart_assist_result, smart_assist_output
+    session = session_state()
 
     try:
-        smart_assist_data = None
-        smart_assist_filename = None
-        smart_assist_result = "🔄 Smart assist report formatting tool reset successfully! All files and data have been cleared."
-        smart_assist_output = ""
+        session.smart_assist_data = None
+        session.smart_assist_filename = None
+        session.smart_assist_result = "🔄 Smart assist report formatting tool reset successfully! All files and data have been cleared."
+        session.smart_assist_output = ""
 
         return redirect("/comparison?tab=smartassist")
 
     except Exception as e:
-        smart_assist_result = (
+        session.smart_assist_result = (
             f"❌ Error resetting smart assist report formatting tool: {str(e)}"
         )
         return redirect("/comparison?tab=smartassist")
@@ -9273,15 +11006,15 @@ def reset_smart_assist():
 
 @app.route("/upload_data_cleanser", methods=["POST"])
 def upload_data_cleanser():
-    global data_cleanser_data, data_cleanser_filename, data_cleanser_result, data_cleanser_output, data_cleanser_processed_data
+    session = session_state()
 
     if "file" not in request.files:
-        data_cleanser_result = "❌ Error: No file provided"
+        session.data_cleanser_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=datacleanser")
 
     file = request.files["file"]
     if file.filename == "":
-        data_cleanser_result = "❌ Error: No file selected"
+        session.data_cleanser_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=datacleanser")
 
     try:
@@ -9289,32 +11022,32 @@ def upload_data_cleanser():
         file.seek(0)
 
         # Read Excel file with all sheets
-        data_cleanser_data = pd.read_excel(file, sheet_name=None, engine="openpyxl")
-        data_cleanser_filename = filename
-        data_cleanser_result = f"✅ File uploaded successfully: {filename}"
-        data_cleanser_output = f"Loaded {len(data_cleanser_data)} sheet(s): {', '.join(data_cleanser_data.keys())}"
-        data_cleanser_processed_data = None
+        session.data_cleanser_data = LazySheets(file, engine="openpyxl")
+        session.data_cleanser_filename = filename
+        session.data_cleanser_result = f"✅ File uploaded successfully: {filename}"
+        session.data_cleanser_output = f"Loaded {len(session.data_cleanser_data)} sheet(s): {', '.join(session.data_cleanser_data.keys())}"
+        session.data_cleanser_processed_data = None
 
         return redirect("/comparison?tab=datacleanser")
 
     except Exception as e:
-        data_cleanser_result = f"❌ Error uploading file: {str(e)}"
-        data_cleanser_output = ""
+        session.data_cleanser_result = f"❌ Error uploading file: {str(e)}"
+        session.data_cleanser_output = ""
         return redirect("/comparison?tab=datacleanser")
 
 
 @app.route("/load_data_cleanser_columns", methods=["POST"])
 def load_data_cleanser_columns():
-    global data_cleanser_data
+    session = session_state()
 
-    if not data_cleanser_data:
+    if not session.data_cleanser_data:
         return jsonify({"ok": False, "error": "No file uploaded"}), 400
 
     sheet_name = request.form.get("sheet", "")
-    if not sheet_name or sheet_name not in data_cleanser_data:
+    if not sheet_name or sheet_name not in session.data_cleanser_data:
         return jsonify({"ok": False, "error": "Invalid sheet name"}), 400
 
-    df = data_cleanser_data[sheet_name]
+    df = session.data_cleanser_data[sheet_name]
     columns = list(df.columns)
 
     return jsonify({"ok": True, "columns": columns})
@@ -9322,18 +11055,18 @@ def load_data_cleanser_columns():
 
 @app.route("/load_data_cleanser_values", methods=["POST"])
 def load_data_cleanser_values():
-    global data_cleanser_data
+    session = session_state()
 
-    if not data_cleanser_data:
+    if not session.data_cleanser_data:
         return jsonify({"ok": False, "error": "No file uploaded"}), 400
 
     sheet_name = request.form.get("sheet", "")
     column_name = request.form.get("column", "")
 
-    if not sheet_name or sheet_name not in data_cleanser_data:
+    if not sheet_name or sheet_name not in session.data_cleanser_data:
         return jsonify({"ok": False, "error": "Invalid sheet name"}), 400
 
-    df = data_cleanser_data[sheet_name]
+    df = session.data_cleanser_data[sheet_name]
 
     if column_name not in df.columns:
         return jsonify({"ok": False, "error": f"Column '{column_name}' not found"}), 400
@@ -9348,10 +11081,10 @@ def load_data_cleanser_values():
 
 @app.route("/process_data_cleanser", methods=["POST"])
 def process_data_cleanser():
-    global data_cleanser_data, data_cleanser_result, data_cleanser_output, data_cleanser_processed_data
+    session = session_state()
 
-    if not data_cleanser_data:
-        data_cleanser_result = "❌ Error: No file uploaded"
+    if not session.data_cleanser_data:
+        session.data_cleanser_result = "❌ Error: No file uploaded"
         return redirect("/comparison?tab=datacleanser")
 
     try:
@@ -9362,22 +11095,22 @@ def process_data_cleanser():
             "removed_sheet_name", "Removed Data"
         ).strip()
 
-        if not sheet_name or sheet_name not in data_cleanser_data:
-            data_cleanser_result = "❌ Error: Invalid sheet name"
+        if not sheet_name or sheet_name not in session.data_cleanser_data:
+            session.data_cleanser_result = "❌ Error: Invalid sheet name"
             return redirect("/comparison?tab=datacleanser")
 
         if not column_name:
-            data_cleanser_result = "❌ Error: No column selected"
+            session.data_cleanser_result = "❌ Error: No column selected"
             return redirect("/comparison?tab=datacleanser")
 
         if not values_to_remove:
-            data_cleanser_result = "❌ Error: No values selected for removal"
+            session.data_cleanser_result = "❌ Error: No values selected for removal"
             return redirect("/comparison?tab=datacleanser")
 
-        df = data_cleanser_data[sheet_name].copy()
+        df = session.data_cleanser_data[sheet_name].copy()
 
         if column_name not in df.columns:
-            data_cleanser_result = (
+            session.data_cleanser_result = (
                 f"❌ Error: Column '{column_name}' not found in sheet"
             )
             return redirect("/comparison?tab=datacleanser")
@@ -9393,7 +11126,7 @@ def process_data_cleanser():
         clean_df = df[~mask].copy()
 
         # Create output with both sheets
-        data_cleanser_processed_data = {
+        session.data_cleanser_processed_data = {
             sheet_name: clean_df,  # Clean main sheet (same name as original)
             removed_sheet_name: removed_df,  # Removed data sheet (user-defined name)
         }
@@ -9415,22 +11148,22 @@ def process_data_cleanser():
         output_lines.append(f"✅ Clean data saved to sheet: {sheet_name}")
         output_lines.append(f"✅ Removed data saved to sheet: {removed_sheet_name}")
 
-        data_cleanser_output = "\n".join(output_lines)
-        data_cleanser_result = f"✅ Data cleaning completed successfully! Removed {len(removed_df)} row(s) from '{column_name}' column."
+        session.data_cleanser_output = "\n".join(output_lines)
+        session.data_cleanser_result = f"✅ Data cleaning completed successfully! Removed {len(removed_df)} row(s) from '{column_name}' column."
 
         return redirect("/comparison?tab=datacleanser")
 
     except Exception as e:
-        data_cleanser_result = f"❌ Error processing data: {str(e)}"
-        data_cleanser_output = ""
+        session.data_cleanser_result = f"❌ Error processing data: {str(e)}"
+        session.data_cleanser_output = ""
         return redirect("/comparison?tab=datacleanser")
 
 
 @app.route("/download_data_cleanser", methods=["POST"])
 def download_data_cleanser():
-    global data_cleanser_processed_data
+    session = session_state()
 
-    if not data_cleanser_processed_data:
+    if not session.data_cleanser_processed_data:
         return jsonify({"error": "No processed data to download"}), 400
 
     filename = request.form.get("filename", "").strip()
@@ -9441,22 +11174,13 @@ def download_data_cleanser():
         filename += ".xlsx"
 
     try:
-        import tempfile
+        export_format = requested_export_format()
 
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.data_cleanser_processed_data.items():
+                writer.write_sheet(sheet_name, df)
 
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in data_cleanser_processed_data.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df)
-
-            return send_file(temp_path, as_attachment=True, download_name=filename)
-
-        finally:
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return writer.response(filename)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -9464,33 +11188,35 @@ def download_data_cleanser():
 
 @app.route("/reset_data_cleanser", methods=["POST"])
 def reset_data_cleanser():
-    global data_cleanser_data, data_cleanser_filename, data_cleanser_result, data_cleanser_output, data_cleanser_processed_data
+    session = session_state()
 
     try:
-        data_cleanser_data = None
-        data_cleanser_filename = None
-        data_cleanser_result = "🔄 Data cleanser tool reset successfully! All files and data have been cleared."
-        data_cleanser_output = ""
-        data_cleanser_processed_data = None
+        session.data_cleanser_data = None
+        session.data_cleanser_filename = None
+        session.data_cleanser_result = "🔄 Data cleanser tool reset successfully! All files and data have been cleared."
+        session.data_cleanser_output = ""
+        session.data_cleanser_processed_data = None
 
         return redirect("/comparison?tab=datacleanser")
 
     except Exception as e:
-        data_cleanser_result = f"❌ Error resetting data cleanser tool: {str(e)}"
+        session.data_cleanser_result = (
+            f"❌ Error resetting data cleanser tool: {str(e)}"
+        )
         return redirect("/comparison?tab=datacleanser")
 
 
 @app.route("/upload_agent_remark_transfer", methods=["POST"])
 def upload_agent_remark_transfer():
-    global agent_remark_transfer_data, agent_remark_transfer_filename, agent_remark_transfer_result, agent_remark_transfer_output, agent_remark_transfer_processed_data
+    session = session_state()
 
     if "file" not in request.files:
-        agent_remark_transfer_result = "❌ Error: No file provided"
+        session.agent_remark_transfer_result = "❌ Error: No file provided"
         return redirect("/comparison?tab=agentremarktransfer")
 
     file = request.files["file"]
     if file.filename == "":
-        agent_remark_transfer_result = "❌ Error: No file selected"
+        session.agent_remark_transfer_result = "❌ Error: No file selected"
         return redirect("/comparison?tab=agentremarktransfer")
 
     try:
@@ -9498,38 +11224,38 @@ def upload_agent_remark_transfer():
         file.seek(0)
 
         # Read Excel file with all sheets
-        agent_remark_transfer_data = pd.read_excel(
-            file, sheet_name=None, engine="openpyxl"
+        session.agent_remark_transfer_data = LazySheets(file, engine="openpyxl")
+        session.agent_remark_transfer_filename = filename
+        session.agent_remark_transfer_result = (
+            f"✅ File uploaded successfully: {filename}"
         )
-        agent_remark_transfer_filename = filename
-        agent_remark_transfer_result = f"✅ File uploaded successfully: {filename}"
-        agent_remark_transfer_output = f"Loaded {len(agent_remark_transfer_data)} sheet(s): {', '.join(agent_remark_transfer_data.keys())}"
-        agent_remark_transfer_processed_data = None
+        session.agent_remark_transfer_output = f"Loaded {len(session.agent_remark_transfer_data)} sheet(s): {', '.join(session.agent_remark_transfer_data.keys())}"
+        session.agent_remark_transfer_processed_data = None
 
         return redirect("/comparison?tab=agentremarktransfer")
 
     except Exception as e:
-        agent_remark_transfer_result = f"❌ Error uploading file: {str(e)}"
-        agent_remark_transfer_output = ""
+        session.agent_remark_transfer_result = f"❌ Error uploading file: {str(e)}"
+        session.agent_remark_transfer_output = ""
         return redirect("/comparison?tab=agentremarktransfer")
 
 
 @app.route("/process_agent_remark_transfer", methods=["POST"])
 def process_agent_remark_transfer():
-    global agent_remark_transfer_data, agent_remark_transfer_result, agent_remark_transfer_output, agent_remark_transfer_processed_data
+    session = session_state()
 
-    if not agent_remark_transfer_data:
-        agent_remark_transfer_result = "❌ Error: No file uploaded"
+    if not session.agent_remark_transfer_data:
+        session.agent_remark_transfer_result = "❌ Error: No file uploaded"
         return redirect("/comparison?tab=agentremarktransfer")
 
     try:
         sheet_name = request.form.get("sheet", "")
 
-        if not sheet_name or sheet_name not in agent_remark_transfer_data:
-            agent_remark_transfer_result = "❌ Error: Invalid sheet name"
+        if not sheet_name or sheet_name not in session.agent_remark_transfer_data:
+            session.agent_remark_transfer_result = "❌ Error: Invalid sheet name"
             return redirect("/comparison?tab=agentremarktransfer")
 
-        df = agent_remark_transfer_data[sheet_name].copy()
+        df = session.agent_remark_transfer_data[sheet_name].copy()
 
         # Check if required columns exist
         agent_name_col = None
@@ -9550,7 +11276,7 @@ def process_agent_remark_transfer():
                 break
 
         if not agent_name_col:
-            agent_remark_transfer_result = f"❌ Error: 'Agent Name' column not found in sheet '{sheet_name}'. Available columns: {', '.join(df.columns.tolist())}"
+            session.agent_remark_transfer_result = f"❌ Error: 'Agent Name' column not found in sheet '{sheet_name}'. Available columns: {', '.join(df.columns.tolist())}"
             return redirect("/comparison?tab=agentremarktransfer")
 
         # Create "Remark" column if it doesn't exist
@@ -9657,8 +11383,10 @@ def process_agent_remark_transfer():
                     rows_marked_not_to_work += 1
 
         # Store processed data (all sheets, but only selected sheet is modified)
-        agent_remark_transfer_processed_data = agent_remark_transfer_data.copy()
-        agent_remark_transfer_processed_data[sheet_name] = df
+        session.agent_remark_transfer_processed_data = (
+            session.agent_remark_transfer_data.copy()
+        )
+        session.agent_remark_transfer_processed_data[sheet_name] = df
 
         # Generate output message
         output_lines = []
@@ -9692,20 +11420,21 @@ def process_agent_remark_transfer():
                 f"✅ Remark set to 'Not to work' for {rows_marked_not_to_work} row(s) with matching insurance companies"
             )
 
-        agent_remark_transfer_output = "\n".join(output_lines)
-        agent_remark_transfer_result = f"✅ Transfer completed successfully! Processed {rows_processed} row(s) in sheet '{sheet_name}'."
+        session.agent_remark_transfer_output = "\n".join(output_lines)
+        session.agent_remark_transfer_result = f"✅ Transfer completed successfully! Processed {rows_processed} row(s) in sheet '{sheet_name}'."
 
         return redirect("/comparison?tab=agentremarktransfer")
 
     except Exception as e:
-        agent_remark_transfer_result = f"❌ Error processing data: {str(e)}"
-        agent_remark_transfer_output = ""
+        session.agent_remark_transfer_result = f"❌ Error processing data: {str(e)}"
+        session.agent_remark_transfer_output = ""
         return redirect("/comparison?tab=agentremarktransfer")
 
 
 @app.route("/download_agent_remark_transfer", methods=["POST"])
 def download_agent_remark_transfer():
-    if not agent_remark_transfer_processed_data:
+    session = session_state()
+    if not session.agent_remark_transfer_processed_data:
         return jsonify({"error": "No processed data to download"}), 400
 
     filename = request.form.get("filename", "").strip() or "agent_remark_transferred.xlsx"
@@ -9714,22 +11443,13 @@ def download_agent_remark_transfer():
         filename += ".xlsx"
 
     try:
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in agent_remark_transfer_processed_data.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df)
+        export_format = requested_export_format()
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in session.agent_remark_transfer_processed_data.items():
+                writer.write_sheet(sheet_name, df)
 
-        finally:
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return writer.response(filename)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -9737,48 +11457,449 @@ def download_agent_remark_transfer():
 
 @app.route("/reset_agent_remark_transfer", methods=["POST"])
 def reset_agent_remark_transfer():
-    global agent_remark_transfer_data, agent_remark_transfer_filename, agent_remark_transfer_result, agent_remark_transfer_output, agent_remark_transfer_processed_data
+    session = session_state()
 
     try:
-        agent_remark_transfer_data = None
-        agent_remark_transfer_filename = None
-        agent_remark_transfer_result = "🔄 Agent & Remark Transfer tool reset successfully! All files and data have been cleared."
-        agent_remark_transfer_output = ""
-        agent_remark_transfer_processed_data = None
+        session.agent_remark_transfer_data = None
+        session.agent_remark_transfer_filename = None
+        session.agent_remark_transfer_result = "🔄 Agent & Remark Transfer tool reset successfully! All files and data have been cleared."
+        session.agent_remark_transfer_output = ""
+        session.agent_remark_transfer_processed_data = None
 
         return redirect("/comparison?tab=agentremarktransfer")
 
     except Exception as e:
-        agent_remark_transfer_result = (
+        session.agent_remark_transfer_result = (
             f"❌ Error resetting agent & remark transfer tool: {str(e)}"
         )
         return redirect("/comparison?tab=agentremarktransfer")
 
 
+def _consolidate_key_text(key):
+    """Text form of a Patient ID; values equal in Python (1, 1.0, True) get equal text."""
+    if key is None:
+        return "-"
+    if isinstance(key, str):
+        return "s:" + key
+    if isinstance(key, Integral):
+        return "n:%d" % key
+    if isinstance(key, Real):
+        key = float(key)
+        return "n:%d" % key if key.is_integer() else "n:" + repr(key)
+    if isinstance(key, datetime):
+        return "t:" + pd.Timestamp(key).isoformat()
+    return "o:" + repr(key)
+
+
+def _consolidate_pid_keys(values):
+    """Patient ID keys (text) that compare like duplicated(): 1, 1.0 and True are one key, every blank is one key."""
+    series = (
+        values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    )
+    keys = series.to_numpy(dtype=object, copy=True)
+    keys[series.isna().to_numpy()] = None
+    return [_consolidate_key_text(key) for key in keys]
+
+
+# Local directory holding the Consolidate master between runs; empty = upload the master workbook every run.
+CONSOLIDATE_STORE_DIR = os.environ.get("CONSOLIDATE_STORE_DIR", "")
+
+
+def _consolidate_pid_column(columns):
+    """The Patient ID column duplicates are found on, or None."""
+    if "Patient ID" in columns:
+        return "Patient ID"
+    # Fallbacks commonly used in this project
+    for alt in ["PATID", "Pat ID", "PatientID", "patient id", "patid"]:
+        if alt in columns:
+            return alt
+    return None
+
+
+def _store_cell(value):
+    """A sheet cell as written to SQLite; types SQLite lacks become tagged BLOBs."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (bool, np.bool_)):
+        return b"bool:1" if value else b"bool:0"
+    if isinstance(value, Integral):
+        value = int(value)
+        return value if -(2**63) <= value < 2**63 else b"int:%d" % value
+    if isinstance(value, Real):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, datetime):
+        return b"datetime:" + pd.Timestamp(value).isoformat().encode()
+    if isinstance(value, date):
+        return b"date:" + value.isoformat().encode()
+    if isinstance(value, datetime_time):
+        return b"time:" + value.isoformat().encode()
+    if isinstance(value, timedelta):
+        return b"timedelta:" + pd.Timedelta(value).isoformat().encode()
+    return str(value)
+
+
+def _load_cell(value):
+    """Inverse of _store_cell()."""
+    if not isinstance(value, bytes):
+        return value
+    tag, _, text = value.decode().partition(":")
+    if tag == "bool":
+        return text == "1"
+    if tag == "int":
+        return int(text)
+    if tag == "datetime":
+        return pd.Timestamp(text)
+    if tag == "date":
+        return date.fromisoformat(text)
+    if tag == "time":
+        return datetime_time.fromisoformat(text)
+    return pd.Timedelta(text)
+
+
+class ConsolidateStore(Mapping):
+    """{sheet name: DataFrame} of the Consolidate master, kept in SQLite under a local directory.
+
+    A master workbook is written once; later daily runs append their new rows to
+    the 'consolidated' sheet and replace 'Duplicate' without reading or rewriting
+    the rest. Each row of a sheet carries the text key of its Patient ID, so daily
+    rows are matched through an index rather than against the whole sheet. Sheets
+    are read from the database on lookup, which is how downloads build the
+    workbook on demand.
+
+    The store is single-user: one browser session owns it at a time (see claim),
+    and other sessions are refused until the owner resets the tab or stays idle
+    for SESSION_STATE_TTL_SECONDS, by which time its own session state is gone.
+    """
+
+    FILENAME = "consolidate.sqlite3"
+    _LOOKUP_CHUNK = 500  # keys per "IN (...)" query, below SQLite's variable limit
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILENAME)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Transactions are opened explicitly (see _transaction): sqlite3's implicit ones
+        # start only at INSERT/UPDATE/DELETE, which would leave DROP/ALTER autocommitted
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheets"
+            " (id INTEGER PRIMARY KEY, name TEXT UNIQUE, position INTEGER, pid_col)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_columns (sheet_id INTEGER, position"
+            " INTEGER, name, tagged INTEGER, PRIMARY KEY (sheet_id, position))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS owner"
+            " (id INTEGER PRIMARY KEY CHECK (id = 0), session_id TEXT, used_at REAL)"
+        )
+        return conn
+
+    @contextmanager
+    def _transaction(self, begin="BEGIN IMMEDIATE"):
+        """Connection inside one transaction: committed on success, rolled back entirely on error.
+
+        Writers take the write lock before their first read, so two of them never
+        work from the same snapshot; readers pass begin="BEGIN" for a consistent view.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(begin)
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _sheet(conn, name):
+        """(id, pid_col) of a stored sheet, or None."""
+        return conn.execute(
+            "SELECT id, pid_col FROM sheets WHERE name = ?", (name,)
+        ).fetchone()
+
+    @staticmethod
+    def _columns(conn, sheet_id):
+        """[(name, tagged)] of a stored sheet, in column order."""
+        return [
+            (_load_cell(name), bool(tagged))
+            for name, tagged in conn.execute(
+                "SELECT name, tagged FROM sheet_columns WHERE sheet_id = ?"
+                " ORDER BY position",
+                (sheet_id,),
+            )
+        ]
+
+    @staticmethod
+    def _frame(rows, columns):
+        df = pd.DataFrame.from_records(rows, columns=list(range(len(columns))))
+        for i, (_, tagged) in enumerate(columns):
+            if tagged:
+                df[i] = df[i].map(_load_cell)
+        df.columns = [name for name, _ in columns]
+        return df
+
+    @staticmethod
+    def _rows(df, keys):
+        """SQLite rows (key, cells...) for df, and which of its columns hold tagged cells."""
+        cells_by_column = []
+        tagged = []
+        for i in range(df.shape[1]):
+            values = df.iloc[:, i]
+            cells = values.astype(object).where(values.notna(), None).tolist()
+            if values.dtype.kind not in "if":
+                cells = [_store_cell(cell) for cell in cells]
+            cells_by_column.append(cells)
+            tagged.append(any(isinstance(cell, bytes) for cell in cells))
+        return list(zip(keys, *cells_by_column)), tagged
+
+    @staticmethod
+    def _keys(df, pid_col):
+        if pid_col is None:
+            return [None] * len(df)
+        return _consolidate_pid_keys(df[pid_col])
+
+    def _insert(self, conn, sheet_id, df, pid_col):
+        rows, tagged = self._rows(df, self._keys(df, pid_col))
+        placeholders = ", ".join(["?"] * (len(tagged) + 1))
+        conn.executemany(f"INSERT INTO sheet_{sheet_id} VALUES ({placeholders})", rows)
+        conn.executemany(
+            "UPDATE sheet_columns SET tagged = 1 WHERE sheet_id = ? AND position = ?",
+            [(sheet_id, i) for i, flag in enumerate(tagged) if flag],
+        )
+
+    def _write_sheet(self, conn, name, df, pid_col=None):
+        """Create or replace one sheet, keeping the position of a replaced one."""
+        existing = self._sheet(conn, name)
+        if existing is not None:
+            sheet_id = existing[0]
+            conn.execute(f"DROP TABLE IF EXISTS sheet_{sheet_id}")
+            conn.execute("DELETE FROM sheet_columns WHERE sheet_id = ?", (sheet_id,))
+            conn.execute(
+                "UPDATE sheets SET pid_col = ? WHERE id = ?", (pid_col, sheet_id)
+            )
+        else:
+            sheet_id = conn.execute(
+                "INSERT INTO sheets (name, position, pid_col) VALUES"
+                " (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM sheets), ?)",
+                (name, pid_col),
+            ).lastrowid
+        column_defs = "".join(f", c{i}" for i in range(df.shape[1]))
+        conn.execute(f"CREATE TABLE sheet_{sheet_id} (pid_key{column_defs})")
+        conn.execute(
+            f"CREATE INDEX sheet_{sheet_id}_pid_key ON sheet_{sheet_id} (pid_key)"
+        )
+        conn.executemany(
+            "INSERT INTO sheet_columns VALUES (?, ?, ?, 0)",
+            [(sheet_id, i, _store_cell(col)) for i, col in enumerate(df.columns)],
+        )
+        self._insert(conn, sheet_id, df, pid_col)
+
+    def replace(self, sheets, pid_col):
+        """Replace the whole store with a workbook's sheets; 'consolidated' is keyed on pid_col."""
+        with self._transaction() as conn:
+            for (sheet_id,) in conn.execute("SELECT id FROM sheets").fetchall():
+                conn.execute(f"DROP TABLE IF EXISTS sheet_{sheet_id}")
+            conn.execute("DELETE FROM sheet_columns")
+            conn.execute("DELETE FROM sheets")
+            for name, df in sheets.items():
+                self._write_sheet(
+                    conn, name, df, pid_col if name == "consolidated" else None
+                )
+
+    def append_daily(self, daily_df, pid_col):
+        """Add a daily sheet to 'consolidated' the way upload_consolidate does for a workbook.
+
+        Daily rows whose Patient ID is new are appended; rows sharing a Patient ID
+        with the sheet or with another daily row go to 'Duplicate' together with
+        the matching stored rows. Returns (rows before, rows after, duplicates
+        DataFrame), or None when 'consolidated' is not stored keyed on pid_col.
+        """
+        with self._transaction() as conn:
+            sheet = self._sheet(conn, "consolidated")
+            if sheet is None or sheet[1] != pid_col:
+                return None
+            sheet_id = sheet[0]
+            columns = self._columns(conn, sheet_id)
+            names = [name for name, _ in columns]
+            added = [
+                name
+                for name in dict.fromkeys(map(str, daily_df.columns))
+                if name not in names
+            ]
+            daily_df = daily_df.reindex(columns=names + added)
+            (rows_before,) = conn.execute(
+                f"SELECT COUNT(*) FROM sheet_{sheet_id}"
+            ).fetchone()
+
+            keep_mask = np.ones(len(daily_df), dtype=bool)
+            duplicates_df = pd.DataFrame()
+            if pid_col is not None:
+                daily_keys = self._keys(daily_df, pid_col)
+                wanted = list(set(daily_keys))
+                stored = []  # (rowid, cells...) of stored rows sharing a daily key
+                for start in range(0, len(wanted), self._LOOKUP_CHUNK):
+                    chunk = wanted[start : start + self._LOOKUP_CHUNK]
+                    stored += conn.execute(
+                        f"SELECT rowid, pid_key, * FROM sheet_{sheet_id} WHERE pid_key"
+                        f" IN ({', '.join(['?'] * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                stored.sort()
+                stored_keys = {row[1] for row in stored}
+                daily_counts = Counter(daily_keys)
+                dup_mask = np.zeros(len(daily_df), dtype=bool)
+                seen = set()
+                for i, key in enumerate(daily_keys):
+                    if key in stored_keys or daily_counts[key] > 1:
+                        dup_mask[i] = True
+                    if key in stored_keys or key in seen:
+                        keep_mask[i] = False
+                    else:
+                        seen.add(key)
+                if stored or dup_mask.any():
+                    stored_df = self._frame([row[3:] for row in stored], columns)
+                    duplicates_df = pd.concat(
+                        [stored_df.reindex(columns=names + added), daily_df[dup_mask]],
+                        ignore_index=True,
+                    )
+
+            for offset, name in enumerate(added, len(columns)):
+                conn.execute(f"ALTER TABLE sheet_{sheet_id} ADD COLUMN c{offset}")
+                conn.execute(
+                    "INSERT INTO sheet_columns VALUES (?, ?, ?, 0)",
+                    (sheet_id, offset, name),
+                )
+            self._insert(conn, sheet_id, daily_df[keep_mask], pid_col)
+            if not duplicates_df.empty:
+                self._write_sheet(conn, "Duplicate", duplicates_df)
+        return rows_before, rows_before + int(keep_mask.sum()), duplicates_df
+
+    @staticmethod
+    def _owner(conn):
+        """Session id of the current owner, or None when the store is free."""
+        row = conn.execute("SELECT session_id, used_at FROM owner").fetchone()
+        if row is None or time.time() - row[1] > SESSION_STATE_TTL_SECONDS:
+            return None
+        return row[0]
+
+    def available_to(self, session_id):
+        """Whether session_id may use the store, without claiming it."""
+        if not os.path.exists(self.path):
+            return True
+        with self._transaction("BEGIN") as conn:
+            return self._owner(conn) in (None, session_id)
+
+    def claim(self, session_id):
+        """Make session_id the owner and return True, or False while another session owns the store."""
+        with self._transaction() as conn:
+            if self._owner(conn) not in (None, session_id):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO owner VALUES (0, ?, ?)",
+                (session_id, time.time()),
+            )
+        return True
+
+    def release(self, session_id):
+        """Give up ownership if session_id holds it."""
+        if not os.path.exists(self.path):
+            return
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM owner WHERE session_id = ?", (session_id,))
+
+    def sheet_columns(self, name):
+        """Column names of a stored sheet, without reading its rows."""
+        with self._transaction("BEGIN") as conn:
+            return [col for col, _ in self._columns(conn, self._sheet(conn, name)[0])]
+
+    def _names(self):
+        if not os.path.exists(self.path):
+            return []
+        with closing(self._connect()) as conn:
+            return [
+                name
+                for (name,) in conn.execute("SELECT name FROM sheets ORDER BY position")
+            ]
+
+    def __getitem__(self, name):
+        if not os.path.exists(self.path):
+            raise KeyError(name)
+        with self._transaction("BEGIN") as conn:
+            sheet = self._sheet(conn, name)
+            if sheet is None:
+                raise KeyError(name)
+            columns = self._columns(conn, sheet[0])
+            rows = conn.execute(
+                f"SELECT * FROM sheet_{sheet[0]} ORDER BY rowid"
+            ).fetchall()
+        return self._frame([row[1:] for row in rows], columns)
+
+    def __contains__(self, name):
+        return name in self._names()
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def __len__(self):
+        return len(self._names())
+
+
+def consolidate_store():
+    """The ConsolidateStore under CONSOLIDATE_STORE_DIR, or None when it is not configured."""
+    return ConsolidateStore(CONSOLIDATE_STORE_DIR) if CONSOLIDATE_STORE_DIR else None
+
+
+CONSOLIDATE_STORE_BUSY = (
+    "The consolidate store is in use by another session; it serves one user at a"
+    " time. Try again once that session resets the Consolidate tab."
+)
+
+
+def consolidate_store_refused(session):
+    """True when the session's master is the store and another session now owns it."""
+    master = session.consolidate_master_data
+    return isinstance(master, ConsolidateStore) and not master.claim(g.session_id)
+
+
 @app.route("/upload_consolidate", methods=["POST"])
 def upload_consolidate():
-    global consolidate_master_data, consolidate_daily_data, consolidate_master_filename, consolidate_daily_filename, consolidate_result, consolidate_output
+    session = session_state()
 
     try:
-        consolidate_output = ""
+        session.consolidate_output = ""
         output_lines = []
 
-        # Check for both files
-        if "master_file" not in request.files or "daily_file" not in request.files:
-            consolidate_result = "❌ Error: Both Master Consolidate file and Daily Consolidated file are required."
+        master_file = request.files.get("master_file")
+        daily_file = request.files.get("daily_file")
+        # With a consolidate store holding the master, a master workbook only replaces it
+        store = consolidate_store()
+        if store is not None and not store.claim(g.session_id):
+            session.consolidate_result = f"❌ Error: {CONSOLIDATE_STORE_BUSY}"
             return redirect("/comparison?tab=consolidate")
+        use_store = (
+            store is not None
+            and (master_file is None or master_file.filename == "")
+            and "consolidated" in store
+        )
 
-        master_file = request.files["master_file"]
-        daily_file = request.files["daily_file"]
+        # Check for both files
+        if daily_file is None or (master_file is None and not use_store):
+            session.consolidate_result = "❌ Error: Both Master Consolidate file and Daily Consolidated file are required."
+            return redirect("/comparison?tab=consolidate")
 
-        if master_file.filename == "" or daily_file.filename == "":
-            consolidate_result = "❌ Error: Both files must be selected."
+        if daily_file.filename == "" or (not use_store and master_file.filename == ""):
+            session.consolidate_result = "❌ Error: Both files must be selected."
             return redirect("/comparison?tab=consolidate")
 
         # Save and read master file
-        master_filename = secure_filename(master_file.filename)
-        master_filepath = os.path.join("/tmp", master_filename)
-        master_file.save(master_filepath)
+        if use_store:
+            master_filename = None
+        else:
+            master_filename = secure_filename(master_file.filename)
+            master_filepath = os.path.join("/tmp", master_filename)
+            master_file.save(master_filepath)
 
         # Save and read daily file
         daily_filename = secure_filename(daily_file.filename)
@@ -9789,24 +11910,27 @@ def upload_consolidate():
         output_lines.append("=" * 80)
         output_lines.append("CONSOLIDATE REPORT - FILE PROCESSING")
         output_lines.append("=" * 80)
-        output_lines.append(f"\nMaster File: {master_filename}")
+        output_lines.append(
+            f"\nMaster File: {master_filename or 'consolidate store (' + store.path + ')'}"
+        )
         output_lines.append(f"Daily File: {daily_filename}")
         output_lines.append(
             f"Processing Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         )
 
-        # Load master workbook (all sheets)
-        master_xls = pd.ExcelFile(master_filepath)
-        consolidate_master_data = {}
-        for sheet in master_xls.sheet_names:
-            consolidate_master_data[sheet] = pd.read_excel(
-                master_filepath, sheet_name=sheet
-            )
+        # Load master workbook (all sheets); stored sheets are read only when needed
+        if use_store:
+            session.consolidate_master_data = store
+        else:
+            with open(master_filepath, "rb") as fh:
+                master_content = fh.read()
+            session.consolidate_master_data = LazySheets(io.BytesIO(master_content))
 
         # Ensure we have a 'consolidated' sheet in master (create empty if missing)
-        master_has_consolidated = "consolidated" in consolidate_master_data
+        master_has_consolidated = "consolidated" in session.consolidate_master_data
         if not master_has_consolidated:
-            consolidate_master_data["consolidated"] = pd.DataFrame()
+            session.consolidate_master_data["consolidated"] = pd.DataFrame()
+            session.touch("consolidate_master_data")
 
         # Load only the required sheet from daily
         try:
@@ -9814,14 +11938,16 @@ def upload_consolidate():
                 daily_filepath, sheet_name="All Agent Data"
             )
         except Exception as e:
-            consolidate_result = f"❌ Error: Could not find/read sheet 'All Agent Data' in Daily Consolidated File. Details: {str(e)}"
+            session.consolidate_result = f"❌ Error: Could not find/read sheet 'All Agent Data' in Daily Consolidated File. Details: {str(e)}"
             return redirect("/comparison?tab=consolidate")
 
-        consolidate_master_filename = master_filename
-        consolidate_daily_filename = daily_filename
+        session.consolidate_master_filename = master_filename
+        session.consolidate_daily_filename = daily_filename
 
         output_lines.append(f"\n✅ Master file loaded successfully")
-        output_lines.append(f"   Sheets: {', '.join(consolidate_master_data.keys())}")
+        output_lines.append(
+            f"   Sheets: {', '.join(session.consolidate_master_data.keys())}"
+        )
         output_lines.append(
             f"   Consolidated sheet present: {'Yes' if master_has_consolidated else 'No (created)'}"
         )
@@ -9853,57 +11979,90 @@ def upload_consolidate():
 
         daily_all_agent_df = normalize_appointment_date(daily_all_agent_df)
 
-        # Append daily data to master's 'consolidated' sheet
-        master_consolidated_df = consolidate_master_data.get(
-            "consolidated", pd.DataFrame()
-        )
-
-        # Align columns to union of both DataFrames
-        combined_columns = list(
-            {
-                *map(str, master_consolidated_df.columns),
-                *map(str, daily_all_agent_df.columns),
-            }
-        )
-        master_consolidated_aligned = master_consolidated_df.reindex(
-            columns=combined_columns
-        )
-        daily_all_agent_aligned = daily_all_agent_df.reindex(columns=combined_columns)
+        if use_store:
+            pid_col = _consolidate_pid_column(
+                [
+                    *store.sheet_columns("consolidated"),
+                    *map(str, daily_all_agent_df.columns),
+                ]
+            )
+        appended = None
+        if use_store:
+            # Append to the stored sheet: only the daily rows are read and written
+            appended = store.append_daily(daily_all_agent_df, pid_col)
+        if appended is not None:
+            rows_before, rows_after, duplicates_df = appended
+            if pid_col is None:
+                output_lines.append(
+                    "\n⚠️  'Patient ID' column not found. Skipping duplicate detection."
+                )
+            output_lines.append(
+                f"\n💾 Consolidate store updated: {rows_after - rows_before} rows appended to 'consolidated'"
+            )
+        else:
+            if use_store:
+                # Stored rows are keyed on another Patient ID column: rebuild from all rows
+                session.consolidate_master_data = dict(store.items())
 
-        appended_df = pd.concat(
-            [master_consolidated_aligned, daily_all_agent_aligned], ignore_index=True
-        )
+            # Append daily data to master's 'consolidated' sheet
+            master_consolidated_df = session.consolidate_master_data.get(
+                "consolidated", pd.DataFrame()
+            )
 
-        # Identify duplicates by 'Patient ID' across the combined data
-        pid_col = None
-        if "Patient ID" in appended_df.columns:
-            pid_col = "Patient ID"
-        else:
-            # Fallbacks commonly used in this project
-            for alt in ["PATID", "Pat ID", "PatientID", "patient id", "patid"]:
-                if alt in appended_df.columns:
-                    pid_col = alt
-                    break
+            # Align columns to union of both DataFrames
+            combined_columns = list(
+                {
+                    *map(str, master_consolidated_df.columns),
+                    *map(str, daily_all_agent_df.columns),
+                }
+            )
+            master_consolidated_aligned = master_consolidated_df.reindex(
+                columns=combined_columns
+            )
+            daily_all_agent_aligned = daily_all_agent_df.reindex(
+                columns=combined_columns
+            )
 
-        duplicates_df = pd.DataFrame()
-        if pid_col is not None:
-            dup_mask = appended_df.duplicated(subset=[pid_col], keep=False)
-            duplicates_df = appended_df[dup_mask].copy()
-            # Keep only first occurrence in consolidated sheet
-            consolidated_unique_df = appended_df.drop_duplicates(
-                subset=[pid_col], keep="first"
-            ).copy()
-        else:
-            # If no patient id column found, proceed without duplicate handling
-            consolidated_unique_df = appended_df.copy()
-            output_lines.append(
-                "\n⚠️  'Patient ID' column not found. Skipping duplicate detection."
+            appended_df = pd.concat(
+                [master_consolidated_aligned, daily_all_agent_aligned],
+                ignore_index=True,
             )
 
-        # Update in-memory workbook
-        consolidate_master_data["consolidated"] = consolidated_unique_df
+            # Identify duplicates by 'Patient ID' across the combined data
+            pid_col = _consolidate_pid_column(appended_df.columns)
+
+            duplicates_df = pd.DataFrame()
+            if pid_col is not None:
+                dup_mask = appended_df.duplicated(subset=[pid_col], keep=False)
+                duplicates_df = appended_df[dup_mask].copy()
+                # Keep only first occurrence in consolidated sheet
+                consolidated_unique_df = appended_df.drop_duplicates(
+                    subset=[pid_col], keep="first"
+                ).copy()
+            else:
+                # If no patient id column found, proceed without duplicate handling
+                consolidated_unique_df = appended_df.copy()
+                output_lines.append(
+                    "\n⚠️  'Patient ID' column not found. Skipping duplicate detection."
+                )
+
+            # Update in-memory workbook
+            session.consolidate_master_data["consolidated"] = consolidated_unique_df
+            if not duplicates_df.empty:
+                session.consolidate_master_data["Duplicate"] = duplicates_df
+            session.touch("consolidate_master_data")
+            rows_before = len(master_consolidated_df)
+            rows_after = len(consolidated_unique_df)
+
+            if store is not None:
+                # Later daily runs append to the store instead of a master workbook
+                store.replace(session.consolidate_master_data, pid_col)
+                session.consolidate_master_data = store
+                output_lines.append(
+                    f"\n💾 Master saved to consolidate store: {store.path}"
+                )
+
         if not duplicates_df.empty:
-            consolidate_master_data["Duplicate"] = duplicates_df
             output_lines.append(
                 f"\n🧬 Duplicates found on '{pid_col}': {len(duplicates_df)} rows (written to 'Duplicate' sheet)"
             )
@@ -9913,47 +12072,51 @@ def upload_consolidate():
         output_lines.append("\n" + "=" * 80)
         output_lines.append("✅ CONSOLIDATION COMPLETE")
         output_lines.append("=" * 80)
-        output_lines.append(
-            f"Rows in master 'consolidated' before: {len(master_consolidated_df)}"
-        )
+        output_lines.append(f"Rows in master 'consolidated' before: {rows_before}")
         output_lines.append(f"Rows appended from daily: {len(daily_all_agent_df)}")
-        output_lines.append(
-            f"Rows in 'consolidated' after: {len(consolidate_master_data['consolidated'])}"
-        )
+        output_lines.append(f"Rows in 'consolidated' after: {rows_after}")
         output_lines.append("\nReady to download consolidated file.")
 
-        consolidate_output = "\n".join(output_lines)
-        consolidate_result = (
-            f"✅ Consolidation complete successfully!\n\n{consolidate_output}"
+        session.consolidate_output = "\n".join(output_lines)
+        session.consolidate_result = (
+            f"✅ Consolidation complete successfully!\n\n{session.consolidate_output}"
         )
 
         return redirect("/comparison?tab=consolidate")
 
     except Exception as e:
-        consolidate_result = f"❌ Error processing consolidation: {str(e)}"
-        consolidate_output = f"Error: {str(e)}"
+        session.consolidate_result = f"❌ Error processing consolidation: {str(e)}"
+        session.consolidate_output = f"Error: {str(e)}"
         return redirect("/comparison?tab=consolidate")
 
 
 @app.route("/download_consolidate", methods=["POST"])
 def download_consolidate():
-    global consolidate_master_data, consolidate_master_filename
+    session = session_state()
 
     try:
-        if not consolidate_master_data:
+        if not session.consolidate_master_data:
             return "No consolidate data available", 400
+        if consolidate_store_refused(session):
+            return CONSOLIDATE_STORE_BUSY, 409
 
         filename = request.form.get("filename", "consolidated_report.xlsx")
         if not filename.endswith(".xlsx"):
             filename += ".xlsx"
 
+        export_format = requested_export_format()
+        if export_format != "xlsx":
+            with SheetExport(export_format) as export:
+                for sheet_name, df in session.consolidate_master_data.items():
+                    export.write_sheet(sheet_name, df)
+            return export.response(filename)
+
         # Create Excel file with all sheets
-        output_path = os.path.join("/tmp", filename)
-        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-            for sheet_name, df in consolidate_master_data.items():
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            for sheet_name, df in session.consolidate_master_data.items():
                 df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        return send_file(output_path, as_attachment=True, download_name=filename)
+        return send_xlsx_bytes(buf.getvalue(), filename)
 
     except Exception as e:
         return f"Error downloading file: {str(e)}", 500
@@ -9962,23 +12125,35 @@ def download_consolidate():
 @app.route("/download_consolidate_consolidated_only", methods=["POST"])
 def download_consolidate_consolidated_only():
     """Download only the merged 'consolidated' sheet."""
-    global consolidate_master_data
+    session = session_state()
 
     try:
-        if not consolidate_master_data or "consolidated" not in consolidate_master_data:
+        if (
+            not session.consolidate_master_data
+            or "consolidated" not in session.consolidate_master_data
+        ):
             return "No consolidated data available", 400
+        if consolidate_store_refused(session):
+            return CONSOLIDATE_STORE_BUSY, 409
 
         filename = request.form.get("filename", "consolidated_only.xlsx")
         if not filename.endswith(".xlsx"):
             filename += ".xlsx"
 
-        output_path = os.path.join("/tmp", filename)
-        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-            consolidate_master_data["consolidated"].to_excel(
+        export_format = requested_export_format()
+        if export_format != "xlsx":
+            with SheetExport(export_format) as export:
+                export.write_sheet(
+                    "consolidated", session.consolidate_master_data["consolidated"]
+                )
+            return export.response(filename)
+
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            session.consolidate_master_data["consolidated"].to_excel(
                 writer, sheet_name="consolidated", index=False
             )
-
-        return send_file(output_path, as_attachment=True, download_name=filename)
+        return send_xlsx_bytes(buf.getvalue(), filename)
 
     except Exception as e:
         return f"Error downloading consolidated sheet: {str(e)}", 500
@@ -9986,37 +12161,42 @@ def download_consolidate_consolidated_only():
 
 @app.route("/reset_consolidate", methods=["POST"])
 def reset_consolidate():
-    global consolidate_master_data, consolidate_daily_data, consolidate_master_filename, consolidate_daily_filename, consolidate_result, consolidate_output
+    session = session_state()
 
     try:
-        consolidate_master_data = None
-        consolidate_daily_data = None
-        consolidate_master_filename = None
-        consolidate_daily_filename = None
-        consolidate_result = "🔄 Consolidate report tool reset successfully! All files and data have been cleared."
-        consolidate_output = ""
+        store = consolidate_store()
+        if store is not None:
+            store.release(g.session_id)
+        session.consolidate_master_data = None
+        session.consolidate_daily_data = None
+        session.consolidate_master_filename = None
+        session.consolidate_daily_filename = None
+        session.consolidate_result = "🔄 Consolidate report tool reset successfully! All files and data have been cleared."
+        session.consolidate_output = ""
 
         return redirect("/comparison?tab=consolidate")
 
     except Exception as e:
-        consolidate_result = f"❌ Error resetting consolidate report tool: {str(e)}"
+        session.consolidate_result = (
+            f"❌ Error resetting consolidate report tool: {str(e)}"
+        )
         return redirect("/comparison?tab=consolidate")
 
 
 @app.route("/upload_reallocation", methods=["POST"])
 def upload_reallocation():
-    global reallocation_consolidate_data, reallocation_blank_data, reallocation_consolidate_filename, reallocation_blank_filename, reallocation_result, reallocation_output, reallocation_merged_data, reallocation_available_remarks, reallocation_selected_remarks, reallocation_available_agents, reallocation_selected_agents
+    session = session_state()
 
     try:
-        reallocation_output = ""
-        reallocation_merged_data = None
+        session.reallocation_output = ""
+        session.reallocation_merged_data = None
         output_lines = []
 
         # Read selections (if any)
         selected_remarks = request.form.getlist("remarks_filter")
         selected_agents = request.form.getlist("agent_filter")
-        reallocation_selected_remarks = selected_remarks
-        reallocation_selected_agents = selected_agents
+        session.reallocation_selected_remarks = selected_remarks
+        session.reallocation_selected_agents = selected_agents
 
         # Files may be provided in steps; load any provided, keep previous if not
         consolidate_file = request.files.get("consolidate_file")
@@ -10028,55 +12208,47 @@ def upload_reallocation():
             consolidate_filepath = os.path.join("/tmp", consolidate_filename)
             consolidate_file.save(consolidate_filepath)
             # Load consolidate file
-            consolidate_xls = pd.ExcelFile(consolidate_filepath)
-            reallocation_consolidate_data = {}
-            for sheet in consolidate_xls.sheet_names:
-                reallocation_consolidate_data[sheet] = pd.read_excel(
-                    consolidate_filepath, sheet_name=sheet
-                )
-            reallocation_consolidate_filename = consolidate_filename
+            session.reallocation_consolidate_data = read_excel_sheets(
+                consolidate_filepath
+            )
+            session.reallocation_consolidate_filename = consolidate_filename
 
         # Save and read blank allocation file if provided
         if blank_file and blank_file.filename:
             blank_filename = secure_filename(blank_file.filename)
             blank_filepath = os.path.join("/tmp", blank_filename)
             blank_file.save(blank_filepath)
-            blank_xls = pd.ExcelFile(blank_filepath)
-            reallocation_blank_data = {}
-            for sheet in blank_xls.sheet_names:
-                reallocation_blank_data[sheet] = pd.read_excel(
-                    blank_filepath, sheet_name=sheet
-                )
-            reallocation_blank_filename = blank_filename
+            session.reallocation_blank_data = read_excel_sheets(blank_filepath)
+            session.reallocation_blank_filename = blank_filename
         # Log processing info
         output_lines.append("=" * 80)
         output_lines.append("REALLOCATION DATA GENERATION - FILE PROCESSING")
         output_lines.append("=" * 80)
         output_lines.append(
-            f"\nConsolidate File: {reallocation_consolidate_filename or 'Not provided'}"
+            f"\nConsolidate File: {session.reallocation_consolidate_filename or 'Not provided'}"
         )
         output_lines.append(
-            f"Blank Allocation File: {reallocation_blank_filename or 'Not provided'}"
+            f"Blank Allocation File: {session.reallocation_blank_filename or 'Not provided'}"
         )
         output_lines.append(
             f"Processing Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         )
 
-        if reallocation_consolidate_data:
+        if session.reallocation_consolidate_data:
             output_lines.append(f"\n✅ Consolidate file loaded successfully")
             output_lines.append(
-                f"   Sheets: {', '.join(reallocation_consolidate_data.keys())}"
+                f"   Sheets: {', '.join(session.reallocation_consolidate_data.keys())}"
             )
             output_lines.append(
-                f"   Total rows: {sum(len(df) for df in reallocation_consolidate_data.values())}"
+                f"   Total rows: {sum(len(df) for df in session.reallocation_consolidate_data.values())}"
             )
-        if reallocation_blank_data:
+        if session.reallocation_blank_data:
             output_lines.append(f"\n✅ Blank allocation file loaded successfully")
             output_lines.append(
-                f"   Sheets: {', '.join(reallocation_blank_data.keys())}"
+                f"   Sheets: {', '.join(session.reallocation_blank_data.keys())}"
             )
             output_lines.append(
-                f"   Total rows: {sum(len(df) for df in reallocation_blank_data.values())}"
+                f"   Total rows: {sum(len(df) for df in session.reallocation_blank_data.values())}"
             )
 
         # STEP 1: Align remarks in consolidate file
@@ -10085,7 +12257,7 @@ def upload_reallocation():
         output_lines.append("=" * 80)
 
         total_remarks_aligned = 0
-        for sheet_name, df in (reallocation_consolidate_data or {}).items():
+        for sheet_name, df in (session.reallocation_consolidate_data or {}).items():
             if "Remark" in df.columns:
                 # Apply remark alignment
                 original_remarks = df["Remark"].copy()
@@ -10095,7 +12267,8 @@ def upload_reallocation():
                 changed_count = (original_remarks != df["Remark"]).sum()
                 total_remarks_aligned += changed_count
 
-                reallocation_consolidate_data[sheet_name] = df
+                session.reallocation_consolidate_data[sheet_name] = df
+                session.touch("reallocation_consolidate_data")
 
                 if changed_count > 0:
                     output_lines.append(f"\n📄 Sheet '{sheet_name}':")
@@ -10110,39 +12283,39 @@ def upload_reallocation():
         )
 
         # Build available remark/agent lists from All Agent Data (if present)
-        reallocation_available_remarks = []
-        reallocation_available_agents = []
+        session.reallocation_available_remarks = []
+        session.reallocation_available_agents = []
         if (
-            reallocation_consolidate_data
-            and "All Agent Data" in reallocation_consolidate_data
+            session.reallocation_consolidate_data
+            and "All Agent Data" in session.reallocation_consolidate_data
         ):
-            df_all = reallocation_consolidate_data["All Agent Data"]
+            df_all = session.reallocation_consolidate_data["All Agent Data"]
             if "Remark" in df_all.columns:
                 remarks_series = df_all["Remark"].dropna()
-                reallocation_available_remarks = sorted(
+                session.reallocation_available_remarks = sorted(
                     pd.Series(remarks_series.astype(str).str.strip().unique()).tolist()
                 )
                 output_lines.append(
-                    f"\n📚 Available remarks detected: {len(reallocation_available_remarks)}"
+                    f"\n📚 Available remarks detected: {len(session.reallocation_available_remarks)}"
                 )
             if "Agent Name" in df_all.columns:
                 agents_series = df_all["Agent Name"].dropna()
-                reallocation_available_agents = sorted(
+                session.reallocation_available_agents = sorted(
                     pd.Series(agents_series.astype(str).str.strip().unique()).tolist()
                 )
                 output_lines.append(
-                    f"📚 Available agents detected: {len(reallocation_available_agents)}"
+                    f"📚 Available agents detected: {len(session.reallocation_available_agents)}"
                 )
 
         # If no selections and blank file not yet loaded, prompt user and stop early
         if (not selected_remarks and not selected_agents) or (
-            not reallocation_blank_data
+            not session.reallocation_blank_data
         ):
-            reallocation_output = "\n".join(output_lines)
+            session.reallocation_output = "\n".join(output_lines)
             if not selected_remarks and not selected_agents:
-                reallocation_result = "ℹ️ Data loaded. Please select remarks and/or agents, then click Generate."
-            elif not reallocation_blank_data:
-                reallocation_result = (
+                session.reallocation_result = "ℹ️ Data loaded. Please select remarks and/or agents, then click Generate."
+            elif not session.reallocation_blank_data:
+                session.reallocation_result = (
                     "ℹ️ Consolidate loaded. Please upload the Blank Allocation file."
                 )
             return redirect("/comparison?tab=reallocation")
@@ -10155,12 +12328,12 @@ def upload_reallocation():
         merged_data = {}
 
         # Get the "All Agent Data" sheet from consolidate file
-        if "All Agent Data" not in reallocation_consolidate_data:
+        if "All Agent Data" not in session.reallocation_consolidate_data:
             raise Exception(
                 "'All Agent Data' sheet not found in Current Consolidate File"
             )
 
-        cons_df = reallocation_consolidate_data["All Agent Data"]
+        cons_df = session.reallocation_consolidate_data["All Agent Data"]
         remark_filtered = pd.DataFrame(columns=cons_df.columns)
         agent_workable_filtered = pd.DataFrame(columns=cons_df.columns)
 
@@ -10193,12 +12366,12 @@ def upload_reallocation():
         )
 
         # Get the first sheet from blank allocation file (either "Today" or "Sheet1")
-        blank_sheet_names = list(reallocation_blank_data.keys())
+        blank_sheet_names = list(session.reallocation_blank_data.keys())
         if not blank_sheet_names:
             raise Exception("Blank Allocation File has no sheets")
 
         target_sheet_name = blank_sheet_names[0]
-        blank_df = reallocation_blank_data[target_sheet_name]
+        blank_df = session.reallocation_blank_data[target_sheet_name]
         output_lines.append(
             f"📄 Target: '{target_sheet_name}' from blank allocation ({len(blank_df)} rows)"
         )
@@ -10292,14 +12465,14 @@ def upload_reallocation():
         merged_data[target_sheet_name] = deduplicated_df
 
         # Add any other sheets from blank allocation file (keep as-is)
-        for sheet_name, df in reallocation_blank_data.items():
+        for sheet_name, df in session.reallocation_blank_data.items():
             if sheet_name not in merged_data:
                 merged_data[sheet_name] = df.copy()
                 output_lines.append(
                     f"\n➕ Kept '{sheet_name}' from blank allocation ({len(df)} rows)"
                 )
 
-        reallocation_merged_data = merged_data
+        session.reallocation_merged_data = merged_data
 
         output_lines.append("\n" + "=" * 80)
         output_lines.append("✅ GENERATION COMPLETE")
@@ -10310,21 +12483,24 @@ def upload_reallocation():
         )
         output_lines.append("\nReady to download reallocation file.")
 
-        reallocation_output = "\n".join(output_lines)
-        reallocation_result = f"✅ Reallocation data generation complete successfully!\n\n{reallocation_output}"
+        session.reallocation_output = "\n".join(output_lines)
+        session.reallocation_result = f"✅ Reallocation data generation complete successfully!\n\n{session.reallocation_output}"
 
         return redirect("/comparison?tab=reallocation")
 
     except Exception as e:
-        reallocation_result = f"❌ Error processing reallocation: {str(e)}"
-        reallocation_output = f"Error: {str(e)}"
+        session.reallocation_result = f"❌ Error processing reallocation: {str(e)}"
+        session.reallocation_output = f"Error: {str(e)}"
         return redirect("/comparison?tab=reallocation")
 
 
 @app.route("/download_reallocation", methods=["POST"])
 def download_reallocation():
     # Prefer merged data; fallback to consolidate data
-    data_to_write = reallocation_merged_data or reallocation_consolidate_data
+    session = session_state()
+    data_to_write = (
+        session.reallocation_merged_data or session.reallocation_consolidate_data
+    )
     if not data_to_write:
         return jsonify({"error": "No reallocation data available"}), 400
 
@@ -10333,22 +12509,13 @@ def download_reallocation():
         filename += ".xlsx"
 
     try:
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in data_to_write.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    _apply_imagen_excel_sheet_styling(writer, sheet_name, df)
+        export_format = requested_export_format()
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in data_to_write.items():
+                writer.write_sheet(sheet_name, df)
 
-        finally:
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return writer.response(filename)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -10356,25 +12523,25 @@ def download_reallocation():
 
 @app.route("/reset_reallocation", methods=["POST"])
 def reset_reallocation():
-    global reallocation_consolidate_data, reallocation_blank_data, reallocation_consolidate_filename, reallocation_blank_filename, reallocation_result, reallocation_output, reallocation_merged_data, reallocation_available_remarks, reallocation_selected_remarks, reallocation_available_agents, reallocation_selected_agents
+    session = session_state()
 
     try:
-        reallocation_consolidate_data = None
-        reallocation_blank_data = None
-        reallocation_consolidate_filename = None
-        reallocation_blank_filename = None
-        reallocation_result = "🔄 Reallocation tool reset successfully! All files and data have been cleared."
-        reallocation_output = ""
-        reallocation_merged_data = None
-        reallocation_available_remarks = []
-        reallocation_selected_remarks = []
-        reallocation_available_agents = []
-        reallocation_selected_agents = []
+        session.reallocation_consolidate_data = None
+        session.reallocation_blank_data = None
+        session.reallocation_consolidate_filename = None
+        session.reallocation_blank_filename = None
+        session.reallocation_result = "🔄 Reallocation tool reset successfully! All files and data have been cleared."
+        session.reallocation_output = ""
+        session.reallocation_merged_data = None
+        session.reallocation_available_remarks = []
+        session.reallocation_selected_remarks = []
+        session.reallocation_available_agents = []
+        session.reallocation_selected_agents = []
 
         return redirect("/comparison?tab=reallocation")
 
     except Exception as e:
-        reallocation_result = f"❌ Error resetting reallocation tool: {str(e)}"
+        session.reallocation_result = f"❌ Error resetting reallocation tool: {str(e)}"
         return redirect("/comparison?tab=reallocation")
 
 
@@ -10385,6 +12552,8 @@ def reset_reallocation():
 
 # Regex for characters Excel/openpyxl rejects in cell values (control chars). Must match openpyxl's ILLEGAL_CHARACTERS_RE.
 _EV_ALLOCATION_ILLEGAL_CHARS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+_EV_ALLOCATION_WHOLE_FLOAT_TEXT_RE = re.compile(r"^(-?\d+)\.0+$")
+_EV_ALLOCATION_OFFICE_NAME_RE = re.compile(r"Office Name:\s*(.+)", re.IGNORECASE)
 
 
 def _ev_allocation_sanitize_cell(value):
@@ -10423,6 +12592,7 @@ def _ev_allocation_format_date_mmddyyyy(value):
         return _ev_allocation_sanitize_cell(value)
 
 
+@functools.lru_cache(maxsize=INSURANCE_FORMAT_CACHE_SIZE)
 def _ev_allocation_classify_insurance(ins_lower):
     """Classify an insurance name as 'MCD', 'Commercial', or None (unknown).
     First tries exact match, then checks if the input contains any MCD/Commercial entry
@@ -10435,12 +12605,10 @@ def _ev_allocation_classify_insurance(ins_lower):
     if ins_lower in EV_ALLOCATION_COMMERCIAL_INSURANCE_LIST:
         return "Commercial"
     # Partial match: check if any MCD entry is contained in the input or vice versa
-    for mcd_name in EV_ALLOCATION_MCD_INSURANCE_LIST:
-        if mcd_name in ins_lower or ins_lower in mcd_name:
-            return "MCD"
-    for comm_name in EV_ALLOCATION_COMMERCIAL_INSURANCE_LIST:
-        if comm_name in ins_lower or ins_lower in comm_name:
-            return "Commercial"
+    if _insurance_list_matches(_EV_ALLOCATION_MCD_INSURANCE_MATCHER, ins_lower):
+        return "MCD"
+    if _insurance_list_matches(_EV_ALLOCATION_COMMERCIAL_INSURANCE_MATCHER, ins_lower):
+        return "Commercial"
     return None
 
 
@@ -10470,38 +12638,52 @@ def _ev_allocation_normalize_col_name(name):
     return s_collapse, s_no_space
 
 
-def _ev_allocation_get_cell(row_series, input_col_name):
-    """Get cell value from row, matching column by name (case-insensitive, flexible spaces). Tries alternates for known columns like Office Name."""
+def _ev_allocation_resolve_column(columns, input_col_name):
+    """Return the column in columns matching input_col_name (case-insensitive, flexible spaces), or None. Tries alternates for known columns like Office Name."""
+    column_index = get_column_index(columns)
     # Direct and normalized match
-    if input_col_name in row_series.index:
-        return row_series[input_col_name]
-    want_collapse, want_no_space = _ev_allocation_normalize_col_name(input_col_name)
-    for c in row_series.index:
-        col_collapse, col_no_space = _ev_allocation_normalize_col_name(c)
-        if col_collapse == want_collapse or col_no_space == want_no_space:
-            return row_series[c]
+    if column_index.get(input_col_name) is not None:
+        return input_col_name
+    col = column_index.find(input_col_name, form="compact")
+    if col is not None:
+        return col
     # Fallback: try alternate names for common columns (e.g. "Office Name" in SL Evening files)
     alternates = {
         "office name": ["OfficeName", "Office  Name", "Office Name ", " Office Name"],
     }
+    want_collapse, want_no_space = _ev_allocation_normalize_col_name(input_col_name)
     key = want_collapse or want_no_space
     for alt in alternates.get(key, []):
-        if alt in row_series.index:
-            return row_series[alt]
-        alt_c, alt_ns = _ev_allocation_normalize_col_name(alt)
-        for c in row_series.index:
-            col_collapse, col_no_space = _ev_allocation_normalize_col_name(c)
-            if col_collapse == alt_c or col_no_space == alt_ns:
-                return row_series[c]
+        col = column_index.get(alt) or column_index.find(alt, form="compact")
+        if col is not None:
+            return col
     # Last resort for "office name": column that contains both "office" and "name"
     if key == "office name" or key == "officename":
-        for c in row_series.index:
-            col_collapse, _ = _ev_allocation_normalize_col_name(c)
-            if "office" in col_collapse and "name" in col_collapse:
-                return row_series[c]
+        return column_index.find_containing(("office", "name"), form="collapsed")
     return None
 
 
+def _ev_allocation_sanitize_text(text):
+    """Column-wise _ev_allocation_sanitize_cell for a Series of strings."""
+    text = text.str.strip().str.replace(
+        _EV_ALLOCATION_WHOLE_FLOAT_TEXT_RE, r"\1", regex=True
+    )
+    return text.str.replace(_EV_ALLOCATION_ILLEGAL_CHARS_RE, "", regex=True)
+
+
+def _ev_allocation_column_text(df, input_col_name):
+    """Stripped text of the column matching input_col_name; empty strings when it is missing."""
+    col = _ev_allocation_resolve_column(df.columns, input_col_name)
+    if col is None:
+        return pd.Series("", index=df.index, dtype=object)
+    return _series_to_stripped_text(df[col])
+
+
+def _ev_allocation_classify_series(ins_lower):
+    """Column-wise _ev_allocation_classify_insurance; unknown names become None."""
+    return DistinctValueCache(_ev_allocation_classify_insurance).series(ins_lower)
+
+
 def _ev_allocation_patients_name_ensure_comma(value):
     """EV output 'Patients Name': use 'Last, First' when there is no comma; single token unchanged."""
     if value is None or (isinstance(value, float) and pd.isna(value)):
@@ -10518,65 +12700,266 @@ def _ev_allocation_patients_name_ensure_comma(value):
     return _ev_allocation_sanitize_cell(last_first)
 
 
-def _ev_allocation_map_row(row_series, mapping, output_columns):
-    """Map one row (Series) to output columns using mapping.
+def _ev_allocation_compile_mapping(columns, mapping, output_columns):
+    """Resolve each output column's mapping spec to concrete source columns once per sheet.
     spec may be: str (one column), tuple[str,...] (coalesce: first non-empty column),
     or list[str,...] (combine columns: comma-join Patients Name and Subscriber Name, else space-join).
+    Returns a list of (output column, kind, source columns); kind is None for unmapped columns.
     """
-    out = {}
+    compiled = []
     for out_col in output_columns:
         spec = mapping.get(out_col)
-        if spec is None:
-            out[out_col] = ""
-            continue
         if isinstance(spec, str):
-            val = _ev_allocation_get_cell(row_series, spec)
-            raw = "" if (val is None or pd.isna(val)) else str(val).strip()
-            out[out_col] = _ev_allocation_sanitize_cell(raw)
-            continue
+            kind, names = "value", [spec]
         # Tuple of column names = either/or: use first column with a non-empty value
-        if isinstance(spec, tuple) and spec and all(isinstance(x, str) for x in spec):
-            chosen = ""
-            for c in spec:
-                v = _ev_allocation_get_cell(row_series, c)
-                if v is not None and not pd.isna(v) and str(v).strip():
-                    chosen = str(v).strip()
-                    break
-            out[out_col] = _ev_allocation_sanitize_cell(chosen)
+        elif isinstance(spec, tuple) and spec and all(isinstance(x, str) for x in spec):
+            kind, names = "coalesce", list(spec)
+        elif isinstance(spec, list):
+            kind, names = "join", spec
+        else:
+            compiled.append((out_col, None, []))
             continue
-        if isinstance(spec, list):
-            parts = []
-            for c in spec:
-                v = _ev_allocation_get_cell(row_series, c)
-                if v is not None and not pd.isna(v) and str(v).strip():
-                    parts.append(_ev_allocation_sanitize_cell(str(v).strip()))
-            # Last, First from separate columns (comma between parts)
-            if out_col in ("Patients Name", "Subscriber Name"):
-                out[out_col] = ", ".join(parts)
-            else:
-                out[out_col] = " ".join(parts)
+        sources = [_ev_allocation_resolve_column(columns, c) for c in names]
+        compiled.append((out_col, kind, [c for c in sources if c is not None]))
+    return compiled
+
+
+def _ev_allocation_apply_mapping(df, compiled):
+    """Build the mapped output columns of a whole sheet from a compiled mapping."""
+    out = {}
+    for out_col, kind, sources in compiled:
+        if not kind or not sources:
+            out[out_col] = pd.Series("", index=df.index, dtype=object)
             continue
-        out[out_col] = ""
+        texts = [_series_to_stripped_text(df[c]) for c in sources]
+        if kind == "value":
+            out[out_col] = _ev_allocation_sanitize_text(texts[0])
+        elif kind == "coalesce":
+            chosen = texts[0]
+            for text in texts[1:]:
+                chosen = chosen.where(chosen != "", text)
+            out[out_col] = _ev_allocation_sanitize_text(chosen)
+        else:
+            # Last, First from separate columns (comma between parts)
+            sep = ", " if out_col in ("Patients Name", "Subscriber Name") else " "
+            joined = None
+            for text in texts:
+                part = _ev_allocation_sanitize_text(text).where(text != "")
+                if joined is None:
+                    joined = part
+                else:
+                    joined = (joined + sep + part).fillna(joined).fillna(part)
+            out[out_col] = joined.fillna("")
     return out
 
 
+def _ev_allocation_assign_department_practice(frame):
+    """Fill Department and Practice ID from the (Office/Doctor Name, Reference) lookup with one merge."""
+    keys = pd.DataFrame(
+        {
+            "_office_upper": frame["Office/Doctor Name"].str.strip().str.upper(),
+            "_reference_upper": (
+                frame["Reference"].str.strip().str.upper()
+                if "Reference" in frame.columns
+                else ""
+            ),
+        }
+    )
+    matched = keys.merge(
+        _EV_ALLOCATION_DEPARTMENT_PRACTICE_FRAME,
+        how="left",
+        on=["_office_upper", "_reference_upper"],
+    )
+    has_match = matched["Department"].notna().to_numpy()
+    if has_match.any():
+        for col in ("Department", "Practice ID"):
+            frame.loc[has_match, col] = matched.loc[has_match, col].to_numpy()
+    return frame
+
+
+def _ev_allocation_input_columns(columns, format_key, mapping):
+    """Columns of a sheet that _ev_allocation_map_sheet reads for format_key, in sheet order."""
+    names = list(EV_ALLOCATION_EXTRA_INPUT_COLUMNS.get(format_key, ()))
+    for source in mapping.values():
+        names.extend([source] if isinstance(source, str) else source)
+    resolved = {_ev_allocation_resolve_column(columns, name) for name in names}
+    return [col for col in columns if col in resolved]
+
+
+def _ev_allocation_map_sheet(
+    df, format_key, mapping, current_location_entity="", format_date=None
+):
+    """Map one sheet to EV Allocation output rows using whole-column operations.
+    Returns (frame, current_location_entity); the SL Medicaid office name carries over to the next sheet.
+    format_date is a DistinctValueCache shared with the other sheets and files mapped in this process.
+    """
+    if format_date is None:
+        format_date = DistinctValueCache(_ev_allocation_format_date_mmddyyyy)
+    compiled = _ev_allocation_compile_mapping(
+        df.columns, mapping, EV_ALLOCATION_OUTPUT_COLUMNS
+    )
+    mapped = _ev_allocation_apply_mapping(df, compiled)
+    received_date = datetime.now().strftime("%m/%d/%Y")
+
+    # SL Medicaid only: find "Office Name: <office_name>" in Pats First Name, extract office_name and put in Location/EntityCode; carry until next "Office Name: ..." row
+    if format_key == "sl_medicaid":
+        office_name = (
+            _ev_allocation_column_text(df, "Pats First Name")
+            .str.extract(_EV_ALLOCATION_OFFICE_NAME_RE, expand=False)
+            .str.strip()
+        )
+        location = office_name.ffill().fillna(current_location_entity)
+        current_location_entity = location.iloc[-1]
+        mapped["Location/EntityCode"] = _ev_allocation_sanitize_text(location)
+        mapped["Patients Name"] = mapped["Patients Name"].where(
+            office_name.isna(),
+            _ev_allocation_sanitize_text(
+                _ev_allocation_column_text(df, "Pats Last Name")
+            ),
+        )
+        mapped["Office/Doctor Name"] = mapped["Location/EntityCode"]
+    if format_key == "erickson":
+        mapped["Office/Doctor Name"] = "Dr. Erickson"
+        mapped["Software"] = "Edge"
+        mapped["Source"] = "Evening"
+        mapped["Received Date"] = received_date
+        ins_lower = _ev_allocation_column_text(df, "Insurance Company Name").str.lower()
+        mapped["Reference"] = _ev_allocation_classify_series(ins_lower).fillna(
+            "Commercial"
+        )
+    if format_key in ("hoang_viva_smiles", "hoang_ismiles"):
+        mapped["Office/Doctor Name"] = (
+            "Dr. Hoang Viva Smiles"
+            if format_key == "hoang_viva_smiles"
+            else "Dr. Hoang Ismiles"
+        )
+        mapped["Software"] = "Dolphin"
+        mapped["Source"] = "Evening"
+        mapped["Received Date"] = received_date
+        ins_lower = _ev_allocation_column_text(
+            df, "Insurance Company Billing Center Name"
+        ).str.lower()
+        mapped["Reference"] = np.where(ins_lower == "denti-cal", "MCD", "Commercial")
+    if format_key == "kates":
+        mapped["Office/Doctor Name"] = "Dr. Kates"
+        mapped["Software"] = "Greyfinch"
+        mapped["Source"] = "Evening"
+        mapped["Received Date"] = received_date
+        ins_lower = _ev_allocation_column_text(df, "Payor").str.lower()
+        mapped["Reference"] = _ev_allocation_classify_series(ins_lower).fillna(
+            "Commercial"
+        )
+    if format_key == "montefiore":
+        mapped["Office/Doctor Name"] = "Montefiore"
+        mapped["Software"] = "Dolphin"
+        mapped["Source"] = "Evening"
+        mapped["Received Date"] = received_date
+        bc = _ev_allocation_column_text(
+            df, "Insurance Company Billing Center Name"
+        ).str.lower()
+        mapped["Reference"] = _ev_allocation_classify_series(bc).fillna("Commercial")
+    if format_key == "sl_medicaid":
+        mapped["Software"] = "Smilelink"
+        mapped["Source"] = "Morning"
+        mapped["Received Date"] = received_date
+        ins_lower = _ev_allocation_column_text(df, "Carrier Name").str.lower()
+        mapped["Reference"] = _ev_allocation_classify_series(ins_lower).fillna(
+            "Commercial"
+        )
+    if format_key == "ortho":
+        ec = _ev_allocation_column_text(df, "Entity Code").str.upper()
+        mapped["Office/Doctor Name"] = np.select(
+            [ec == "FREDORMD", ec.isin(["SYRACUSE", "NTHSYRNY"])],
+            ["Dr. Mansman", "Dr. Susan Park"],
+            "",
+        )
+        mapped["Software"] = "OrthoTrack"
+        mapped["Source"] = "Morning"
+        mapped["Received Date"] = received_date
+        ins_lower = _ev_allocation_column_text(df, "Carrier").str.lower()
+        mapped["Reference"] = _ev_allocation_classify_series(ins_lower).fillna(
+            "Commercial"
+        )
+    if format_key == "sl_evening":
+        mapped["Software"] = "Smilelink"
+        mapped["Source"] = "Evening"
+        office_name_col = _ev_allocation_resolve_column(df.columns, "Office Name")
+        mapped["Office/Doctor Name"] = (
+            ""
+            if office_name_col is None
+            else DistinctValueCache(_ev_allocation_sanitize_cell).series(
+                df[office_name_col]
+            )
+        )
+        bc_class = _ev_allocation_classify_series(
+            _ev_allocation_column_text(
+                df, "Insurance Company Billing Center Name"
+            ).str.lower()
+        )
+        carrier_class = _ev_allocation_classify_series(
+            _ev_allocation_column_text(df, "Carrier Name").str.lower()
+        )
+        mapped["Reference"] = np.select(
+            [
+                bc_class == "MCD",
+                carrier_class == "Commercial",
+                bc_class == "Commercial",
+                carrier_class == "MCD",
+            ],
+            ["MCD", "Commercial", "Commercial", "MCD"],
+            "Commercial",
+        )
+        mapped["Received Date"] = received_date
+    frame = pd.DataFrame(mapped, index=df.index).astype(object)
+
+    frame["Patients Name"] = DistinctValueCache(
+        _ev_allocation_patients_name_ensure_comma
+    ).series(frame["Patients Name"])
+    for date_col in ("Appointment", "DOB", "Subscriber DOB"):
+        frame[date_col] = format_date.series(frame[date_col])
+    # Skip rows with empty Patients Name for sl_medicaid
+    if format_key == "sl_medicaid":
+        frame = frame[frame["Patients Name"].str.strip() != ""]
+    return frame, current_location_entity
+
+
+def _ev_allocation_read_csv(content):
+    """Parse one EV Allocation CSV upload (in a worker process); returns (DataFrame, None) or (None, error)."""
+    try:
+        try:
+            df = pd.read_csv(io.BytesIO(content), encoding="utf-8", on_bad_lines="skip")
+        except UnicodeDecodeError:
+            df = pd.read_csv(
+                io.BytesIO(content), encoding="latin-1", on_bad_lines="skip"
+            )
+        df = df.copy()
+        df.columns = df.columns.astype(str)
+        df_cleaned = df.loc[
+            :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
+        ]
+        return df_cleaned, None
+    except Exception as e:
+        return None, str(e)
+
+
 @app.route("/upload_ev_allocation", methods=["POST"])
 def upload_ev_allocation():
     """Accept multiple Excel files and store them by filename for EV Allocation report."""
-    global ev_allocation_files, ev_allocation_result, ev_allocation_output, ev_allocation_output_filename
+    session = session_state()
 
     try:
         files = request.files.getlist("files")
         if not files or all(not f or f.filename == "" for f in files):
-            ev_allocation_result = (
+            session.ev_allocation_result = (
                 "❌ No files selected. Please select at least one CSV or Excel file."
             )
             return redirect("/comparison?tab=evallocation")
 
-        ev_allocation_result = None
-        ev_allocation_output = None
-        ev_allocation_output_filename = ""
+        session.ev_allocation_result = None
+        session.ev_allocation_output = None
+        session.ev_allocation_output_filename = ""
 
+        uploads = []  # (name, original filename, content)
         for f in files:
             if not f or f.filename == "":
                 continue
@@ -10589,93 +12972,130 @@ def upload_ev_allocation():
             ):
                 continue
             f.seek(0)
+            uploads.append((name, f.filename, f.read()))
 
-            if lower.endswith(".csv"):
-                try:
-                    f.seek(0)
-                    df = pd.read_csv(f, encoding="utf-8", on_bad_lines="skip")
-                except UnicodeDecodeError:
-                    f.seek(0)
-                    df = pd.read_csv(f, encoding="latin-1", on_bad_lines="skip")
-                except Exception as csv_err:
-                    ev_allocation_result = f"❌ Error reading CSV {name}: {csv_err}"
-                    return redirect("/comparison?tab=evallocation")
-                df = df.copy()
-                df.columns = df.columns.astype(str)
-                df_cleaned = df.loc[
-                    :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-                ]
-                ev_allocation_files[name] = {
-                    "data": {"Sheet1": df_cleaned},
-                    "filename": f.filename,
+        # CSVs are parsed side by side in worker processes; workbooks only need
+        # their sheet index read here. Files are added in upload order.
+        csv_results = map_files(
+            _ev_allocation_read_csv,
+            [
+                (content,)
+                for name, _, content in uploads
+                if name.lower().endswith(".csv")
+            ],
+        )
+        failed = []
+        for name, filename, content in uploads:
+            if name.lower().endswith(".csv"):
+                df, error = next(csv_results)
+                if error is not None:
+                    failed.append(f"{name} ({error})")
+                    continue
+                session.ev_allocation_files[name] = {
+                    "data": {"Sheet1": df},
+                    "filename": filename,
                 }
+                session.touch("ev_allocation_files")
                 continue
-
-            tmp_path = os.path.join("/tmp", name)
-            f.save(tmp_path)
             try:
-                xls = pd.ExcelFile(tmp_path)
-                cleaned = {}
-                for sheet_name in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-                    df = df.copy()
-                    df.columns = df.columns.astype(str)
-                    df_cleaned = df.loc[
-                        :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-                    ]
-                    cleaned[sheet_name] = df_cleaned
-                ev_allocation_files[name] = {"data": cleaned, "filename": f.filename}
-            finally:
-                if os.path.exists(tmp_path):
-                    try:
-                        os.remove(tmp_path)
-                    except OSError:
-                        pass
+                # Sheets are parsed by process_ev_allocation, which reads only the
+                # columns the file's format maps
+                cleaned = LazySheets(
+                    io.BytesIO(content), transform=drop_unnamed_columns
+                )
+            except Exception as e:
+                failed.append(f"{name} ({e})")
+                continue
+            session.ev_allocation_files[name] = {"data": cleaned, "filename": filename}
+            session.touch("ev_allocation_files")
 
-        if not ev_allocation_files:
-            ev_allocation_result = "❌ No valid CSV or Excel files were uploaded."
+        if not session.ev_allocation_files:
+            session.ev_allocation_result = (
+                "❌ No valid CSV or Excel files were uploaded."
+            )
+            if failed:
+                session.ev_allocation_result += "<br>Could not read: " + ", ".join(
+                    failed
+                )
             return redirect("/comparison?tab=evallocation")
 
-        ev_allocation_result = (
-            f"✅ Uploaded {len(ev_allocation_files)} file(s): "
-            + ", ".join(ev_allocation_files.keys())
+        session.ev_allocation_result = (
+            f"✅ Uploaded {len(session.ev_allocation_files)} file(s): "
+            + ", ".join(session.ev_allocation_files.keys())
         )
+        if failed:
+            session.ev_allocation_result += "<br>⚠️ Could not read: " + ", ".join(
+                failed
+            )
         return redirect("/comparison?tab=evallocation")
     except Exception as e:
-        ev_allocation_result = f"❌ Error uploading files: {str(e)}"
+        session.ev_allocation_result = f"❌ Error uploading files: {str(e)}"
         return redirect("/comparison?tab=evallocation")
 
 
+def _ev_allocation_map_file(sheets, format_key, mapping, format_date):
+    """Map every sheet of one EV Allocation file (run in a worker process); returns the non-empty frames.
+
+    format_date is the request's date cache; files mapped in this process share
+    it, while a worker process gets its own copy.
+    """
+    frames = []
+    # SL Medicaid office name from "Office Name: ..." rows carries across sheets of one file
+    current_location_entity = ""
+    for sheet_name in sheets:
+        # Parse only the columns this format maps (the whole sheet if none match)
+        input_columns = _ev_allocation_input_columns(
+            sheet_column_names(sheets, sheet_name), format_key, mapping
+        )
+        if input_columns:
+            df = select_sheet_columns(sheets, sheet_name, input_columns)
+        else:
+            df = sheets[sheet_name]
+        if df.empty:
+            continue
+        frame, current_location_entity = _ev_allocation_map_sheet(
+            df, format_key, mapping, current_location_entity, format_date
+        )
+        if not frame.empty:
+            frames.append(frame)
+    return frames
+
+
 @app.route("/process_ev_allocation", methods=["POST"])
+@background_job("ev_allocation_files")
 def process_ev_allocation():
     """Generate EV Allocation output: identify each file by filename rules, map columns, produce one Excel."""
-    global ev_allocation_files, ev_allocation_result, ev_allocation_output, ev_allocation_output_filename
+    session = session_state()
 
     try:
-        if not ev_allocation_files:
-            ev_allocation_result = "❌ Please upload at least one file in Step 1 first."
+        if not session.ev_allocation_files:
+            session.ev_allocation_result = (
+                "❌ Please upload at least one file in Step 1 first."
+            )
             return redirect("/comparison?tab=evallocation")
 
         if not EV_ALLOCATION_FILENAME_RULES or not EV_ALLOCATION_COLUMN_MAPPING:
-            ev_allocation_result = (
+            session.ev_allocation_result = (
                 "📋 <strong>EV Allocation report</strong><br><br>"
                 "File identification and column mapping are not configured yet. "
                 "In the code, add:<br>"
                 '• <strong>EV_ALLOCATION_FILENAME_RULES</strong>: list of {contains: "substring", format_key: "key"} so files are identified by filename.<br>'
                 "• <strong>EV_ALLOCATION_COLUMN_MAPPING</strong>: dict of format_key → {output column: input column, [cols] to combine, or (cols) for first non-empty} to map each file to the output columns.<br><br>"
                 "Output columns are fixed (Software, Office/Doctor Name, Practice ID, …). "
-                f"You have <strong>{len(ev_allocation_files)}</strong> file(s) uploaded: "
-                + ", ".join(ev_allocation_files.keys())
+                f"You have <strong>{len(session.ev_allocation_files)}</strong> file(s) uploaded: "
+                + ", ".join(session.ev_allocation_files.keys())
             )
-            ev_allocation_output = None
-            ev_allocation_output_filename = "ev_allocation_report.xlsx"
+            session.ev_allocation_output = None
+            session.ev_allocation_output_filename = "ev_allocation_report.xlsx"
             return redirect("/comparison?tab=evallocation")
 
-        all_rows = []
         files_processed = []
         files_skipped = []
+        format_date = DistinctValueCache(_ev_allocation_format_date_mmddyyyy)
+        tasks = []  # (sheets, format key, mapping, date cache) of each file to map
+        progress = []
 
-        for fname, finfo in ev_allocation_files.items():
+        for fname, finfo in session.ev_allocation_files.items():
             format_key = _ev_allocation_get_format_key(fname)
             if not format_key:
                 files_skipped.append(fname)
@@ -10686,243 +13106,19 @@ def process_ev_allocation():
                     fname + " (no mapping for key «" + str(format_key) + "»)"
                 )
                 continue
-
-            # SL Medicaid only: find "Office Name: <office_name>" in Pats First Name, extract office_name and put in Location/EntityCode; carry until next "Office Name: ..." row
-            current_location_entity = ""
-            office_name_re = re.compile(r"Office Name:\s*(.+)", re.IGNORECASE)
-
-            for sheet_name, df in finfo["data"].items():
-                if df.empty:
-                    continue
-                for idx in range(len(df)):
-                    row_series = df.iloc[idx]
-                    mapped = _ev_allocation_map_row(
-                        row_series, mapping, EV_ALLOCATION_OUTPUT_COLUMNS
-                    )
-                    if format_key == "sl_medicaid":
-                        pats_first = _ev_allocation_get_cell(
-                            row_series, "Pats First Name"
-                        )
-                        first_str = (
-                            ""
-                            if pats_first is None or pd.isna(pats_first)
-                            else str(pats_first).strip()
-                        )
-                        match = office_name_re.search(first_str)
-                        if match:
-                            current_location_entity = match.group(1).strip()
-                            mapped["Location/EntityCode"] = (
-                                _ev_allocation_sanitize_cell(current_location_entity)
-                            )
-                            pats_last = _ev_allocation_get_cell(
-                                row_series, "Pats Last Name"
-                            )
-                            last_str = (
-                                ""
-                                if pats_last is None or pd.isna(pats_last)
-                                else str(pats_last).strip()
-                            )
-                            mapped["Patients Name"] = _ev_allocation_sanitize_cell(
-                                last_str
-                            )
-                        else:
-                            mapped["Location/EntityCode"] = (
-                                _ev_allocation_sanitize_cell(current_location_entity)
-                            )
-                        mapped["Office/Doctor Name"] = mapped["Location/EntityCode"]
-                    if format_key == "erickson":
-                        mapped["Office/Doctor Name"] = "Dr. Erickson"
-                        mapped["Software"] = "Edge"
-                        mapped["Source"] = "Evening"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(
-                            row_series, "Insurance Company Name"
-                        )
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        ins_class = _ev_allocation_classify_insurance(ins_lower)
-                        mapped["Reference"] = ins_class if ins_class else "Commercial"
-                    if format_key == "hoang_viva_smiles":
-                        mapped["Office/Doctor Name"] = "Dr. Hoang Viva Smiles"
-                        mapped["Software"] = "Dolphin"
-                        mapped["Source"] = "Evening"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(
-                            row_series, "Insurance Company Billing Center Name"
-                        )
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        if ins_lower == "denti-cal":
-                            mapped["Reference"] = "MCD"
-                        else:
-                            mapped["Reference"] = "Commercial"
-                    if format_key == "hoang_ismiles":
-                        mapped["Office/Doctor Name"] = "Dr. Hoang Ismiles"
-                        mapped["Software"] = "Dolphin"
-                        mapped["Source"] = "Evening"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(
-                            row_series, "Insurance Company Billing Center Name"
-                        )
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        if ins_lower == "denti-cal":
-                            mapped["Reference"] = "MCD"
-                        else:
-                            mapped["Reference"] = "Commercial"
-                    if format_key == "kates":
-                        mapped["Office/Doctor Name"] = "Dr. Kates"
-                        mapped["Software"] = "Greyfinch"
-                        mapped["Source"] = "Evening"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(row_series, "Payor")
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        ins_class = _ev_allocation_classify_insurance(ins_lower)
-                        mapped["Reference"] = ins_class if ins_class else "Commercial"
-                    if format_key == "montefiore":
-                        mapped["Office/Doctor Name"] = "Montefiore"
-                        mapped["Software"] = "Dolphin"
-                        mapped["Source"] = "Evening"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        billing_center = _ev_allocation_get_cell(
-                            row_series, "Insurance Company Billing Center Name"
-                        )
-                        bc = ""
-                        if billing_center is not None and not pd.isna(billing_center):
-                            bc = str(billing_center).strip().lower()
-                        ins_class = _ev_allocation_classify_insurance(bc)
-                        if ins_class:
-                            mapped["Reference"] = ins_class
-                        elif bc in ("aetna hmo", "aetna dhmo"):
-                            mapped["Reference"] = "Commercial"
-                        else:
-                            mapped["Reference"] = "Commercial"
-                    if format_key == "sl_medicaid":
-                        mapped["Software"] = "Smilelink"
-                        mapped["Source"] = "Morning"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(row_series, "Carrier Name")
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        ins_class = _ev_allocation_classify_insurance(ins_lower)
-                        mapped["Reference"] = ins_class if ins_class else "Commercial"
-                    if format_key == "ortho":
-                        entity_code_val = _ev_allocation_get_cell(
-                            row_series, "Entity Code"
-                        )
-                        ec = (
-                            ""
-                            if entity_code_val is None or pd.isna(entity_code_val)
-                            else str(entity_code_val).strip().upper()
-                        )
-                        if ec == "FREDORMD":
-                            mapped["Office/Doctor Name"] = "Dr. Mansman"
-                        elif ec in ("SYRACUSE", "NTHSYRNY"):
-                            mapped["Office/Doctor Name"] = "Dr. Susan Park"
-                        else:
-                            mapped["Office/Doctor Name"] = ""
-                        mapped["Software"] = "OrthoTrack"
-                        mapped["Source"] = "Morning"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                        ins_val = _ev_allocation_get_cell(row_series, "Carrier")
-                        ins_lower = (
-                            ""
-                            if ins_val is None or pd.isna(ins_val)
-                            else str(ins_val).strip().lower()
-                        )
-                        ins_class = _ev_allocation_classify_insurance(ins_lower)
-                        mapped["Reference"] = ins_class if ins_class else "Commercial"
-                    if format_key == "sl_evening":
-                        mapped["Software"] = "Smilelink"
-                        mapped["Source"] = "Evening"
-                        office_name_val = _ev_allocation_get_cell(
-                            row_series, "Office Name"
-                        )
-                        mapped["Office/Doctor Name"] = _ev_allocation_sanitize_cell(
-                            office_name_val
-                        )
-                        billing_center = _ev_allocation_get_cell(
-                            row_series, "Insurance Company Billing Center Name"
-                        )
-                        billing_center_lower = (
-                            ""
-                            if billing_center is None or pd.isna(billing_center)
-                            else str(billing_center).strip().lower()
-                        )
-                        carrier_name = _ev_allocation_get_cell(
-                            row_series, "Carrier Name"
-                        )
-                        carrier_str = (
-                            ""
-                            if carrier_name is None or pd.isna(carrier_name)
-                            else str(carrier_name).strip()
-                        )
-                        carrier_lower = carrier_str.lower()
-                        bc_class = _ev_allocation_classify_insurance(
-                            billing_center_lower
-                        )
-                        carrier_class = _ev_allocation_classify_insurance(carrier_lower)
-                        if bc_class == "MCD":
-                            mapped["Reference"] = "MCD"
-                        elif carrier_class == "Commercial":
-                            mapped["Reference"] = "Commercial"
-                        elif bc_class == "Commercial":
-                            mapped["Reference"] = "Commercial"
-                        elif carrier_class == "MCD":
-                            mapped["Reference"] = "MCD"
-                        else:
-                            mapped["Reference"] = "Commercial"
-                        mapped["Received Date"] = datetime.now().strftime("%m/%d/%Y")
-                    # Department and Practice ID from (Office/Doctor Name, Reference) lookup (all formats)
-                    office_doc = (mapped.get("Office/Doctor Name") or "").strip()
-                    ref = (mapped.get("Reference") or "").strip()
-                    lookup_key = (office_doc.upper(), ref.upper())
-                    for (od, r), (
-                        dept,
-                        pid,
-                    ) in EV_ALLOCATION_DEPARTMENT_PRACTICE_LOOKUP.items():
-                        if (od.upper(), r.upper()) == lookup_key:
-                            mapped["Department"] = dept
-                            mapped["Practice ID"] = pid
-                            break
-                    mapped["Patients Name"] = _ev_allocation_patients_name_ensure_comma(
-                        mapped.get("Patients Name")
-                    )
-                    mapped["Appointment"] = _ev_allocation_format_date_mmddyyyy(
-                        mapped.get("Appointment")
-                    )
-                    mapped["DOB"] = _ev_allocation_format_date_mmddyyyy(
-                        mapped.get("DOB")
-                    )
-                    mapped["Subscriber DOB"] = _ev_allocation_format_date_mmddyyyy(
-                        mapped.get("Subscriber DOB")
-                    )
-                    # Skip rows with empty Patients Name for sl_medicaid
-                    if format_key == "sl_medicaid":
-                        patients_name_val = (mapped.get("Patients Name") or "").strip()
-                        if not patients_name_val:
-                            continue
-                    all_rows.append(mapped)
+            tasks.append((finfo["data"], format_key, mapping, format_date))
+            progress.append(f"Mapping {fname}")
             files_processed.append(fname)
 
-        if not all_rows:
-            ev_allocation_result = (
+        # Files are mapped side by side in worker processes; frames keep file order
+        all_frames = [
+            frame
+            for frames in map_files(_ev_allocation_map_file, tasks, progress)
+            for frame in frames
+        ]
+
+        if not all_frames:
+            session.ev_allocation_result = (
                 "❌ No rows produced. Either no file matched the filename rules, or mapping keys did not match. "
                 + (
                     "Skipped: " + ", ".join(files_skipped)
@@ -10930,22 +13126,22 @@ def process_ev_allocation():
                     else "All files were processed but had no data."
                 )
             )
-            ev_allocation_output = None
+            session.ev_allocation_output = None
             return redirect("/comparison?tab=evallocation")
 
-        result_full = pd.DataFrame(all_rows).fillna("")
+        result_full = pd.concat(all_frames, ignore_index=True).fillna("")
+        # Department and Practice ID from (Office/Doctor Name, Reference) lookup (all formats)
+        result_full = _ev_allocation_assign_department_practice(result_full)
         result_df = result_full.reindex(
             columns=EV_ALLOCATION_OUTPUT_COLUMNS, fill_value=""
         )
         for c in result_df.columns:
-            result_df[c] = result_df[c].astype(str).apply(_ev_allocation_sanitize_cell)
+            result_df[c] = _ev_allocation_sanitize_text(result_df[c].astype(str))
 
         # Internal Reference (MCD/Commercial) drives Department lookup and routing; not in EV_ALLOCATION_OUTPUT_COLUMNS
         if "Reference" in result_full.columns:
             ref_for_mask = (
-                result_full["Reference"]
-                .astype(str)
-                .apply(_ev_allocation_sanitize_cell)
+                _ev_allocation_sanitize_text(result_full["Reference"].astype(str))
                 .str.strip()
                 .str.upper()
             )
@@ -11010,17 +13206,13 @@ def process_ev_allocation():
             result_full.loc[kates_excluded_insurance_mask, "Reference"] = "Commercial"
         not_to_work_df = result_df[not_to_work_mask]
         ev_allocation_df = result_df[~not_to_work_mask]
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            ev_allocation_df.to_excel(writer, index=False, sheet_name="EVAllocation")
-            _apply_imagen_excel_sheet_styling(writer, "EVAllocation", ev_allocation_df)
-            not_to_work_df.to_excel(writer, index=False, sheet_name="Not to work")
-            _apply_imagen_excel_sheet_styling(writer, "Not to work", not_to_work_df)
-        buf.seek(0)
-        ev_allocation_output = buf.getvalue()
-        ev_allocation_output_filename = "ev_allocation_report.xlsx"
-        ev_allocation_result = (
-            f"✅ Generated <strong>{len(all_rows)}</strong> row(s) from "
+        session.ev_allocation_output = {
+            "EVAllocation": ev_allocation_df,
+            "Not to work": not_to_work_df,
+        }
+        session.ev_allocation_output_filename = "ev_allocation_report.xlsx"
+        session.ev_allocation_result = (
+            f"✅ Generated <strong>{len(result_full)}</strong> row(s) from "
             + ", ".join(files_processed)
             + ". "
             + (
@@ -11031,42 +13223,40 @@ def process_ev_allocation():
         )
         return redirect("/comparison?tab=evallocation")
     except Exception as e:
-        ev_allocation_result = f"❌ Error generating report: {str(e)}"
-        ev_allocation_output = None
+        session.ev_allocation_result = f"❌ Error generating report: {str(e)}"
+        session.ev_allocation_output = None
         return redirect("/comparison?tab=evallocation")
 
 
 @app.route("/download_ev_allocation", methods=["POST"])
 def download_ev_allocation():
     """Send the generated EV Allocation output file if available."""
-    if ev_allocation_output is None:
+    session = session_state()
+    if session.ev_allocation_output is None:
         return jsonify({"error": "No output file to download. Generate the report first."}), 400
 
     filename = request.form.get("filename", "").strip() or "ev_allocation_report.xlsx"
     if not filename.endswith(".xlsx"):
         filename += ".xlsx"
 
-    return send_file(
-        io.BytesIO(ev_allocation_output),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=filename,
+    return send_output_sheets(
+        "download_ev_allocation", session.ev_allocation_output, filename
     )
 
 
 @app.route("/reset_ev_allocation", methods=["POST"])
 def reset_ev_allocation():
     """Clear all EV Allocation uploaded files and output."""
-    global ev_allocation_files, ev_allocation_result, ev_allocation_output, ev_allocation_output_filename
+    session = session_state()
 
     try:
-        ev_allocation_files = {}
-        ev_allocation_result = None
-        ev_allocation_output = None
-        ev_allocation_output_filename = ""
+        session.ev_allocation_files = {}
+        session.ev_allocation_result = None
+        session.ev_allocation_output = None
+        session.ev_allocation_output_filename = ""
         return redirect("/comparison?tab=evallocation")
     except Exception as e:
-        ev_allocation_result = f"❌ Error resetting: {str(e)}"
+        session.ev_allocation_result = f"❌ Error resetting: {str(e)}"
         return redirect("/comparison?tab=evallocation")
 
 
@@ -11078,17 +13268,11 @@ def reset_ev_allocation():
 def _dental_bv_set_smilelink_when_office_sl(df):
     """When Office Name is SL (trimmed, case-insensitive), set Software to Smilelink."""
 
-    def _col_ci(want_key):
-        for c in df.columns:
-            nk = re.sub(r"[\s_]+", "", str(c).strip().lower())
-            if nk == want_key:
-                return c
-        return None
-
     if df is None or df.empty:
         return df
-    office_col = _col_ci("officename")
-    software_col = _col_ci("software")
+    column_index = get_column_index(df)
+    office_col = column_index.find("officename", form="compact")
+    software_col = column_index.find("software", form="compact")
     if office_col is None or software_col is None:
         return df
     mask = (
@@ -11103,13 +13287,17 @@ def _dental_bv_set_smilelink_when_office_sl(df):
 
 def _dental_bv_build_final_output():
     """Rebuild the final combined output from all step DataFrames."""
-    global dental_bv_final_output
+    session = session_state()
     frames = []
-    for df in (dental_bv_step1_data, dental_bv_step2_data, dental_bv_step3_data):
+    for df in (
+        session.dental_bv_step1_data,
+        session.dental_bv_step2_data,
+        session.dental_bv_step3_data,
+    ):
         if df is not None and not df.empty:
             frames.append(df)
     if not frames:
-        dental_bv_final_output = None
+        session.dental_bv_final_output = None
         return
     combined = pd.concat(frames, ignore_index=True)
     combined = combined.fillna("")
@@ -11123,14 +13311,9 @@ def _dental_bv_build_final_output():
         )
         combined = combined[~_ins_key.isin(DENTAL_BV_EXCLUDE_INSURANCE_NORMALIZED)].copy()
     if "Insurance" in combined.columns:
-        combined["Insurance"] = combined["Insurance"].apply(format_insurance_name)
+        combined["Insurance"] = format_insurance_series(combined["Insurance"])
     combined = _dental_bv_set_smilelink_when_office_sl(combined)
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        combined.to_excel(writer, index=False, sheet_name="Dental BV Report")
-        _apply_imagen_excel_sheet_styling(writer, "Dental BV Report", combined)
-    buf.seek(0)
-    dental_bv_final_output = buf.getvalue()
+    session.dental_bv_final_output = {"Dental BV Report": combined}
 
 
 def _dental_bv_format_date_mmddyyyy(val):
@@ -11147,21 +13330,97 @@ def _dental_bv_format_date_mmddyyyy(val):
         return s
 
 
+def _dental_bv_output_frame(df, col_map):
+    """DENTAL_BV_OUTPUT_COLUMNS frame for the rows of df: each mapped column as stripped text, the rest "".
+    col_map is {input column: output column}; a missing input column gives "" and later entries win.
+    """
+    out = pd.DataFrame(
+        "", index=df.index, columns=DENTAL_BV_OUTPUT_COLUMNS, dtype=object
+    )
+    for src_col, out_col in col_map.items():
+        if out_col in out.columns:
+            out[out_col] = (
+                _series_to_stripped_text(df[src_col]) if src_col in df.columns else ""
+            )
+    return out
+
+
+def _dental_bv_step1_read_file(original_name, content, matched_rule):
+    """Read one Dental BV Step 1 upload in a worker process.
+
+    Returns (DataFrame, processed note) or (None, rejection note); files whose
+    name matches no rule are rejected with just their name.
+    """
+    if matched_rule is None:
+        return None, original_name
+    sheet_name = matched_rule["sheet"]
+
+    try:
+        if original_name.lower().endswith(".csv"):
+            df = pd.read_csv(io.BytesIO(content))
+        else:
+            engine = "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
+            # Parse only the rule's sheet
+            with pd.ExcelFile(io.BytesIO(content), engine=engine) as xls:
+                sheet_found = find_sheet_name(xls.sheet_names, sheet_name)
+                if sheet_found is not None:
+                    df = xls.parse(sheet_found)
+            if sheet_found is None:
+                return None, f"{original_name} (sheet '{sheet_name}' not found)"
+
+        df.columns = df.columns.astype(str)
+        df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
+        if df.empty:
+            return None, f"{original_name} (empty sheet)"
+
+        # Orandi Step 1 file: ensure Patient Name is in "Last, First" style.
+        if matched_rule["contains"].strip().lower() == "orandi":
+            patient_name_col = None
+            for c in df.columns:
+                if c.strip().lower().replace(" ", "") == "patientname":
+                    patient_name_col = c
+                    break
+            if patient_name_col is not None:
+
+                def _orandi_name_with_comma(v):
+                    if pd.isna(v):
+                        return ""
+                    s = str(v).strip()
+                    if not s or "," in s:
+                        return s
+                    parts = [p for p in s.split() if p]
+                    if len(parts) < 2:
+                        return s
+                    return f"{parts[0]}, {' '.join(parts[1:])}"
+
+                df[patient_name_col] = df[patient_name_col].apply(
+                    _orandi_name_with_comma
+                )
+            # Dr. Orandi uploads: force Department to BV for this file's rows.
+            df["Department"] = "BV"
+
+        return df, f"{original_name} → sheet '{sheet_name}' ({len(df)} rows)"
+    except Exception as ex:
+        return None, f"{original_name} (error: {str(ex)})"
+
+
 @app.route("/upload_dental_bv_step1", methods=["POST"])
+@background_job("dental_bv_step1_data", "dental_bv_step2_data", "dental_bv_step3_data")
 def upload_dental_bv_step1():
     """Upload and process Dental BV Step 1 files (Stovall + Suri + Orandi)."""
-    global dental_bv_step1_data, dental_bv_step1_output, dental_bv_result_step1
+    session = session_state()
 
     try:
         files = request.files.getlist("files")
         if not files or all(f.filename == "" for f in files):
-            dental_bv_result_step1 = "❌ No files selected."
+            session.dental_bv_result_step1 = "❌ No files selected."
             return redirect("/comparison?tab=dentalbv")
 
         all_frames = []
         files_processed = []
         files_rejected = []
 
+        uploads = []  # (original name, content, matched rule or None)
         for f in files:
             if not f or f.filename == "":
                 continue
@@ -11174,85 +13433,33 @@ def upload_dental_bv_step1():
                     matched_rule = rule
                     break
 
-            if matched_rule is None:
-                files_rejected.append(original_name)
-                continue
-
-            sheet_name = matched_rule["sheet"]
-
-            try:
-                f.seek(0)
-                if original_name.lower().endswith(".csv"):
-                    df = pd.read_csv(f)
-                else:
-                    engine = (
-                        "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
-                    )
-                    all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
-                    sheet_found = None
-                    for sn in all_sheets:
-                        if sn.strip().lower() == sheet_name.strip().lower():
-                            sheet_found = sn
-                            break
-                    if sheet_found is None:
-                        files_rejected.append(
-                            f"{original_name} (sheet '{sheet_name}' not found)"
-                        )
-                        continue
-                    df = all_sheets[sheet_found]
-
-                df.columns = df.columns.astype(str)
-                df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
-                if df.empty:
-                    files_rejected.append(f"{original_name} (empty sheet)")
-                    continue
-
-                # Orandi Step 1 file: ensure Patient Name is in "Last, First" style.
-                if matched_rule["contains"].strip().lower() == "orandi":
-                    patient_name_col = None
-                    for c in df.columns:
-                        if c.strip().lower().replace(" ", "") == "patientname":
-                            patient_name_col = c
-                            break
-                    if patient_name_col is not None:
-                        def _orandi_name_with_comma(v):
-                            if pd.isna(v):
-                                return ""
-                            s = str(v).strip()
-                            if not s or "," in s:
-                                return s
-                            parts = [p for p in s.split() if p]
-                            if len(parts) < 2:
-                                return s
-                            return f"{parts[0]}, {' '.join(parts[1:])}"
-
-                        df[patient_name_col] = df[patient_name_col].apply(
-                            _orandi_name_with_comma
-                        )
-                    # Dr. Orandi uploads: force Department to BV for this file's rows.
-                    df["Department"] = "BV"
+            f.seek(0)
+            uploads.append(
+                (original_name, f.read() if matched_rule else b"", matched_rule)
+            )
 
+        # Files are read side by side in worker processes, then merged in upload order
+        progress = [f"Reading {original_name}" for original_name, _, _ in uploads]
+        for df, note in map_files(_dental_bv_step1_read_file, uploads, progress):
+            if df is None:
+                files_rejected.append(note)
+            else:
                 all_frames.append(df)
-                files_processed.append(
-                    f"{original_name} → sheet '{sheet_name}' ({len(df)} rows)"
-                )
-            except Exception as ex:
-                files_rejected.append(f"{original_name} (error: {str(ex)})")
-
+                files_processed.append(note)
         if files_rejected and not files_processed:
-            dental_bv_result_step1 = (
+            session.dental_bv_result_step1 = (
                 "❌ No valid files processed. Only files with <strong>Stovall</strong>, <strong>Suri</strong>, or <strong>Orandi</strong> "
                 "in the filename are allowed.<br>Rejected: " + ", ".join(files_rejected)
             )
-            dental_bv_step1_data = None
-            dental_bv_step1_output = None
+            session.dental_bv_step1_data = None
+            session.dental_bv_step1_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
         if not all_frames:
-            dental_bv_result_step1 = "❌ No data produced from uploaded files."
-            dental_bv_step1_data = None
-            dental_bv_step1_output = None
+            session.dental_bv_result_step1 = "❌ No data produced from uploaded files."
+            session.dental_bv_step1_data = None
+            session.dental_bv_step1_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
@@ -11271,8 +13478,9 @@ def upload_dental_bv_step1():
                 "pats birth date",
             )
         ]
+        format_dental_date = DistinctValueCache(_dental_bv_format_date_mmddyyyy)
         for dc in date_cols:
-            combined_df[dc] = combined_df[dc].apply(_dental_bv_format_date_mmddyyyy)
+            combined_df[dc] = format_dental_date.series(combined_df[dc])
 
         # Step 1 rule: force Received date to today's date for all rows.
         today_mmddyyyy = datetime.now().strftime("%m/%d/%Y")
@@ -11300,9 +13508,7 @@ def upload_dental_bv_step1():
             combined_df[remark_col] = "Workable"
 
         if "Insurance" in combined_df.columns:
-            combined_df["Insurance"] = combined_df["Insurance"].apply(
-                format_insurance_name
-            )
+            combined_df["Insurance"] = format_insurance_series(combined_df["Insurance"])
 
         remark_col_s1 = remark_col if remark_col is not None else "Remark"
         pre_filter_count = len(combined_df)
@@ -11313,14 +13519,9 @@ def upload_dental_bv_step1():
         updated_excluded_s1 = pre_filter_count - len(combined_df)
 
         combined_df = _dental_bv_set_smilelink_when_office_sl(combined_df)
-        dental_bv_step1_data = combined_df
+        session.dental_bv_step1_data = combined_df
 
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            combined_df.to_excel(writer, index=False, sheet_name="Step1")
-            _apply_imagen_excel_sheet_styling(writer, "Step1", combined_df)
-        buf.seek(0)
-        dental_bv_step1_output = buf.getvalue()
+        session.dental_bv_step1_output = {"Step1": combined_df}
 
         _dental_bv_build_final_output()
 
@@ -11333,24 +13534,25 @@ def upload_dental_bv_step1():
             msg += f"<br>🚫 Excluded <strong>{updated_excluded_s1}</strong> row(s) with 'updated' remark."
         if files_rejected:
             msg += "<br>⚠️ Rejected: " + ", ".join(files_rejected)
-        dental_bv_result_step1 = msg
+        session.dental_bv_result_step1 = msg
         return redirect("/comparison?tab=dentalbv")
     except Exception as e:
-        dental_bv_result_step1 = f"❌ Error processing Step 1: {str(e)}"
-        dental_bv_step1_data = None
-        dental_bv_step1_output = None
+        session.dental_bv_result_step1 = f"❌ Error processing Step 1: {str(e)}"
+        session.dental_bv_step1_data = None
+        session.dental_bv_step1_output = None
         return redirect("/comparison?tab=dentalbv")
 
 
 @app.route("/upload_dental_bv_step2", methods=["POST"])
+@background_job("dental_bv_step1_data", "dental_bv_step2_data", "dental_bv_step3_data")
 def upload_dental_bv_step2():
     """Upload and process Dental BV Step 2 files (Today vs Previous Day comparison)."""
-    global dental_bv_step2_data, dental_bv_step2_output, dental_bv_result_step2
+    session = session_state()
 
     try:
         files = request.files.getlist("files")
         if not files or all(f.filename == "" for f in files):
-            dental_bv_result_step2 = "❌ No files selected."
+            session.dental_bv_result_step2 = "❌ No files selected."
             return redirect("/comparison?tab=dentalbv")
 
         today_df = None
@@ -11382,7 +13584,9 @@ def upload_dental_bv_step2():
                     engine = (
                         "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
                     )
-                    all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
+                    all_sheets = read_excel_sheets(
+                        f, lambda names: names[:1], engine=engine
+                    )
                     first_sheet = list(all_sheets.keys())[0]
                     df = all_sheets[first_sheet]
 
@@ -11399,7 +13603,7 @@ def upload_dental_bv_step2():
                 files_rejected.append(f"{original_name} (error: {str(ex)})")
 
         if today_df is None:
-            dental_bv_result_step2 = (
+            session.dental_bv_result_step2 = (
                 "❌ Missing <strong>Today</strong> file. Upload a file with 'Today' in the filename."
                 + (
                     "<br>⚠️ Rejected: " + ", ".join(files_rejected)
@@ -11407,13 +13611,13 @@ def upload_dental_bv_step2():
                     else ""
                 )
             )
-            dental_bv_step2_data = None
-            dental_bv_step2_output = None
+            session.dental_bv_step2_data = None
+            session.dental_bv_step2_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
         if previous_df is None:
-            dental_bv_result_step2 = (
+            session.dental_bv_result_step2 = (
                 "❌ Missing <strong>Previous Day</strong> file. Upload a file with 'Previous Day' in the filename."
                 + (
                     "<br>⚠️ Rejected: " + ", ".join(files_rejected)
@@ -11421,8 +13625,8 @@ def upload_dental_bv_step2():
                     else ""
                 )
             )
-            dental_bv_step2_data = None
-            dental_bv_step2_output = None
+            session.dental_bv_step2_data = None
+            session.dental_bv_step2_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
@@ -11431,15 +13635,15 @@ def upload_dental_bv_step2():
         missing_today = [c for c in compare_cols if c not in today_df.columns]
         missing_prev = [c for c in compare_cols if c not in previous_df.columns]
         if missing_today:
-            dental_bv_result_step2 = f"❌ Today file is missing comparison columns: {', '.join(missing_today)}"
-            dental_bv_step2_data = None
-            dental_bv_step2_output = None
+            session.dental_bv_result_step2 = f"❌ Today file is missing comparison columns: {', '.join(missing_today)}"
+            session.dental_bv_step2_data = None
+            session.dental_bv_step2_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
         if missing_prev:
-            dental_bv_result_step2 = f"❌ Previous Day file is missing comparison columns: {', '.join(missing_prev)}"
-            dental_bv_step2_data = None
-            dental_bv_step2_output = None
+            session.dental_bv_result_step2 = f"❌ Previous Day file is missing comparison columns: {', '.join(missing_prev)}"
+            session.dental_bv_step2_data = None
+            session.dental_bv_step2_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
@@ -11456,42 +13660,34 @@ def upload_dental_bv_step2():
             .apply(lambda x: x.str.strip().str.lower())
         )
 
-        today_keys = today_compare.apply(tuple, axis=1)
-        previous_keys_set = set(previous_compare.apply(tuple, axis=1))
-
-        not_matched_mask = ~today_keys.isin(previous_keys_set)
-        new_rows_df = today_df[not_matched_mask].copy()
+        # Anti-join on the hashed composite key: Today rows with no Previous Day match
+        previous_keys = pd.MultiIndex.from_frame(previous_compare)
+        not_matched_mask = ~pd.MultiIndex.from_frame(today_compare).isin(previous_keys)
+        new_rows_df = today_df[not_matched_mask]
 
         total_today = len(today_df)
         matched_count = total_today - len(new_rows_df)
         today_mmddyyyy = datetime.now().strftime("%m/%d/%Y")
-
-        mapped_rows = []
-        for _, row in new_rows_df.iterrows():
-            mapped = {col: "" for col in DENTAL_BV_OUTPUT_COLUMNS}
-            for input_col, output_col in DENTAL_BV_STEP2_COLUMN_MAPPING.items():
-                val = row.get(input_col, "")
-                if pd.isna(val):
-                    val = ""
-                mapped[output_col] = str(val).strip()
-            # For Today-vs-Previous merge rows, move Entity Code-derived value to Location and set Office Name to SL.
-            mapped["Location"] = mapped.get("Office Name", "")
-            mapped["Office Name"] = "SL"
-            mapped["Department"] = "BV"
-            mapped["Source"] = "ORS"
-            # Today-vs-Previous Day merged rows always use Smilelink software source.
-            mapped["Software"] = "Smilelink"
-            mapped["DOB"] = _dental_bv_format_date_mmddyyyy(mapped.get("DOB"))
-            mapped["Appointment"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Appointment")
-            )
-            # Today-vs-Previous merged rows should use today's received date.
-            mapped["Received date"] = today_mmddyyyy
-            mapped_rows.append(mapped)
+        # DOB and appointment strings repeat across rows; parse each one once
+        format_dental_date = DistinctValueCache(_dental_bv_format_date_mmddyyyy)
+
+        new_rows = _dental_bv_output_frame(new_rows_df, DENTAL_BV_STEP2_COLUMN_MAPPING)
+        # For Today-vs-Previous merge rows, move Entity Code-derived value to Location and set Office Name to SL.
+        new_rows["Location"] = new_rows["Office Name"]
+        new_rows["Office Name"] = "SL"
+        new_rows["Department"] = "BV"
+        new_rows["Source"] = "ORS"
+        # Today-vs-Previous Day merged rows always use Smilelink software source.
+        new_rows["Software"] = "Smilelink"
+        for date_col in ("DOB", "Appointment"):
+            new_rows[date_col] = format_dental_date.series(new_rows[date_col])
+        # Today-vs-Previous merged rows should use today's received date.
+        new_rows["Received date"] = today_mmddyyyy
+        step2_frames = [new_rows]
 
         # Process Yesterday file: include rows where Remark != "updated"
         # Yesterday file may already have output column names, so map directly
-        yesterday_mapped_rows = []
+        yesterday_rows = None
         yesterday_total = 0
         yesterday_excluded = 0
         if yesterday_df is not None:
@@ -11518,31 +13714,23 @@ def upload_dental_bv_step2():
                     remark_col = c
                     break
 
-            for _, row in yesterday_df.iterrows():
-                if remark_col is not None:
-                    remark_val = str(row.get(remark_col, "")).strip().lower()
-                    if remark_val == "updated":
-                        yesterday_excluded += 1
-                        continue
-                mapped = {col: "" for col in DENTAL_BV_OUTPUT_COLUMNS}
-                for src_col, out_col in yesterday_col_map.items():
-                    val = row.get(src_col, "")
-                    if pd.isna(val):
-                        val = ""
-                    mapped[out_col] = str(val).strip()
-                mapped["DOB"] = _dental_bv_format_date_mmddyyyy(mapped.get("DOB"))
-                mapped["Appointment"] = _dental_bv_format_date_mmddyyyy(
-                    mapped.get("Appointment")
+            yesterday_kept = yesterday_df
+            if remark_col is not None:
+                updated_mask = (
+                    _series_to_stripped_text(yesterday_df[remark_col]).str.lower()
+                    == "updated"
                 )
-                mapped["Subscriber DOB"] = _dental_bv_format_date_mmddyyyy(
-                    mapped.get("Subscriber DOB")
+                yesterday_excluded = int(updated_mask.sum())
+                yesterday_kept = yesterday_df[~updated_mask]
+            yesterday_rows = _dental_bv_output_frame(yesterday_kept, yesterday_col_map)
+            for date_col in ("DOB", "Appointment", "Subscriber DOB"):
+                yesterday_rows[date_col] = format_dental_date.series(
+                    yesterday_rows[date_col]
                 )
-                yesterday_mapped_rows.append(mapped)
+            step2_frames.append(yesterday_rows)
 
-        all_step2_rows = mapped_rows + yesterday_mapped_rows
-
-        if not all_step2_rows:
-            dental_bv_result_step2 = (
+        if not sum(len(frame) for frame in step2_frames):
+            session.dental_bv_result_step2 = (
                 f"⚠️ No rows to output. Today: {total_today} rows all matched Previous Day."
                 + (
                     f" Yesterday: {yesterday_total} rows all had 'updated' remark."
@@ -11550,22 +13738,22 @@ def upload_dental_bv_step2():
                     else ""
                 )
             )
-            dental_bv_step2_data = None
-            dental_bv_step2_output = None
+            session.dental_bv_step2_data = None
+            session.dental_bv_step2_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
-        result_df = pd.DataFrame(all_step2_rows, columns=DENTAL_BV_OUTPUT_COLUMNS)
+        result_df = pd.concat(step2_frames, ignore_index=True)
         result_df = result_df.fillna("")
         if "Received date" in result_df.columns:
-            result_df["Received date"] = result_df["Received date"].apply(
-                _dental_bv_format_date_mmddyyyy
+            result_df["Received date"] = format_dental_date.series(
+                result_df["Received date"]
             )
         if "Remark" in result_df.columns:
             result_df["Remark"] = result_df["Remark"].fillna("").astype(str).str.strip()
             blank_remark_mask = result_df["Remark"] == ""
             result_df.loc[blank_remark_mask, "Remark"] = "Workable"
-        result_df["Insurance"] = result_df["Insurance"].apply(format_insurance_name)
+        result_df["Insurance"] = format_insurance_series(result_df["Insurance"])
 
         pre_filter_s2 = len(result_df)
         if "Remark" in result_df.columns:
@@ -11575,117 +13763,98 @@ def upload_dental_bv_step2():
         updated_excluded_s2 = pre_filter_s2 - len(result_df)
 
         result_df = _dental_bv_set_smilelink_when_office_sl(result_df)
-        dental_bv_step2_data = result_df
+        session.dental_bv_step2_data = result_df
 
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            result_df.to_excel(writer, index=False, sheet_name="Step2")
-            _apply_imagen_excel_sheet_styling(writer, "Step2", result_df)
-        buf.seek(0)
-        dental_bv_step2_output = buf.getvalue()
+        session.dental_bv_step2_output = {"Step2": result_df}
 
         _dental_bv_build_final_output()
 
         msg = (
             f"✅ Step 2: Today had <strong>{total_today}</strong> rows, "
             f"<strong>{matched_count}</strong> matched Previous Day (excluded), "
-            f"<strong>{len(mapped_rows)}</strong> new rows from Today."
+            f"<strong>{len(new_rows)}</strong> new rows from Today."
         )
         if yesterday_df is not None:
             msg += (
                 f"<br>Yesterday: <strong>{yesterday_total}</strong> rows, "
                 f"<strong>{yesterday_excluded}</strong> with 'updated' remark (excluded), "
-                f"<strong>{len(yesterday_mapped_rows)}</strong> rows added."
+                f"<strong>{len(yesterday_rows)}</strong> rows added."
             )
         if updated_excluded_s2 > 0:
             msg += f"<br>🚫 Excluded <strong>{updated_excluded_s2}</strong> additional row(s) with 'updated' remark."
         msg += f"<br>Total Step 2 output: <strong>{len(result_df)}</strong> rows."
         if files_rejected:
             msg += "<br>⚠️ Rejected: " + ", ".join(files_rejected)
-        dental_bv_result_step2 = msg
+        session.dental_bv_result_step2 = msg
         return redirect("/comparison?tab=dentalbv")
     except Exception as e:
-        dental_bv_result_step2 = f"❌ Error processing Step 2: {str(e)}"
-        dental_bv_step2_data = None
-        dental_bv_step2_output = None
+        session.dental_bv_result_step2 = f"❌ Error processing Step 2: {str(e)}"
+        session.dental_bv_step2_data = None
+        session.dental_bv_step2_output = None
         return redirect("/comparison?tab=dentalbv")
 
 
-def _dental_bv_step3_norm_header(name):
-    """Normalize column header for flexible matching (case, spaces, underscores, hyphens)."""
-    return re.sub(r"[\s_\-]+", "", str(name).strip().lower())
-
-
 def _dental_bv_step3_find_raw_name_columns(df):
     """Resolve PatsLastname / PatsFirstname columns despite spacing/casing variants."""
-    last_keys = {"patslastname"}
-    first_keys = {"patsfirstname"}
-    last_col = None
-    first_col = None
-    for c in df.columns:
-        nk = _dental_bv_step3_norm_header(c)
-        if nk in last_keys:
-            last_col = c
-        elif nk in first_keys:
-            first_col = c
+    column_index = get_column_index(df)
+    last_col = column_index.find("patslastname", form="key", last=True)
+    first_col = column_index.find("patsfirstname", form="key", last=True)
     return last_col, first_col
 
 
 def _dental_bv_step3_find_raw_insurance_col(df):
     """Raw Smilelink insurance column: 'Insurance' or 'Carrier Name' (normalized match)."""
-    by_nk = {_dental_bv_step3_norm_header(c): c for c in df.columns}
+    column_index = get_column_index(df)
     for nk in ("insurance", "carriername"):
-        if nk in by_nk:
-            return by_nk[nk]
+        col = column_index.find(nk, form="key", last=True)
+        if col is not None:
+            return col
     return None
 
 
 def _dental_bv_step3_find_raw_policy_id_col(df):
     """Raw Smilelink policy column: Policy ID / Insurer ID / Pol Employee SSN variants."""
-    by_nk = {_dental_bv_step3_norm_header(c): c for c in df.columns}
+    column_index = get_column_index(df)
     for nk in ("policyid", "insurerid", "polemployeessnid", "polemployeessn"):
-        if nk in by_nk:
-            return by_nk[nk]
+        col = column_index.find(nk, form="key", last=True)
+        if col is not None:
+            return col
     return None
 
 
-def _dental_bv_step3_patient_name_last_comma_first(row, last_col, first_col):
-    """Build 'Last, First' from two raw columns (handles blanks / NaN)."""
-    ln_raw = row.get(last_col, "") if last_col is not None else ""
-    fn_raw = row.get(first_col, "") if first_col is not None else ""
-    if pd.isna(ln_raw):
-        ln_raw = ""
-    if pd.isna(fn_raw):
-        fn_raw = ""
-    ln = str(ln_raw).strip()
-    fn = str(fn_raw).strip()
-    if ln and fn:
-        return f"{ln}, {fn}"
-    if ln:
-        return ln
-    return fn
-
-
-def _dental_bv_step3_norm_patient_key(s):
-    """Normalize patient name for lookup keys (comma spacing, collapse whitespace)."""
+def _dental_bv_step3_patient_names(df, last_col, first_col):
+    """Column-wise 'Last, First' from two raw columns (handles blanks / NaN)."""
+    blank = pd.Series("", index=df.index, dtype=object)
+    ln = _series_to_stripped_text(df[last_col]) if last_col is not None else blank
+    fn = _series_to_stripped_text(df[first_col]) if first_col is not None else blank
+    return (ln + ", " + fn).where((ln != "") & (fn != ""), ln.where(ln != "", fn))
+
+
+def _dental_bv_step3_norm_patient_keys(values):
+    """Normalize patient names for lookup keys (comma spacing, collapse whitespace)."""
+    x = values.astype(object).astype(str).str.strip().str.lower()
+    x = x.str.replace(r"\s*,\s*", ", ", regex=True)
+    return x.str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def _dental_bv_step3_parse_date(value):
+    """pd.to_datetime of one Consolidated Date cell; None when it does not parse (blanks give NaT)."""
     try:
-        x = str(s).strip().lower()
+        return pd.to_datetime(value)
     except Exception:
-        return ""
-    x = re.sub(r"\s*,\s*", ", ", x)
-    x = re.sub(r"\s+", " ", x).strip()
-    return x
+        return None
 
 
 @app.route("/upload_dental_bv_step3", methods=["POST"])
+@background_job("dental_bv_step1_data", "dental_bv_step2_data", "dental_bv_step3_data")
 def upload_dental_bv_step3():
     """Upload and process Dental BV Step 3 files (Raw Smilelink vs Smilelink Consolidated)."""
-    global dental_bv_step3_data, dental_bv_step3_output, dental_bv_result_step3
+    session = session_state()
 
     try:
         files = request.files.getlist("files")
         if not files or all(f.filename == "" for f in files):
-            dental_bv_result_step3 = "❌ No files selected."
+            session.dental_bv_result_step3 = "❌ No files selected."
             return redirect("/comparison?tab=dentalbv")
 
         raw_df = None
@@ -11719,24 +13888,26 @@ def upload_dental_bv_step3():
                     engine = (
                         "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
                     )
-                    all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
-                    sheet_names_info = list(all_sheets.keys())
-
-                    target_sheet = matched_rule.get("sheet") if matched_rule else None
-                    if target_sheet:
-                        sheet_found = None
-                        for sn in all_sheets:
-                            if sn.strip().lower() == target_sheet.strip().lower():
-                                sheet_found = sn
-                                break
-                        if sheet_found is None:
-                            files_rejected.append(
-                                f"{original_name} (sheet '{target_sheet}' not found, available: {sheet_names_info})"
+                    # Parse only the rule's sheet (or the first sheet)
+                    with pd.ExcelFile(f, engine=engine) as xls:
+                        sheet_names_info = list(xls.sheet_names)
+
+                        target_sheet = (
+                            matched_rule.get("sheet") if matched_rule else None
+                        )
+                        if target_sheet:
+                            sheet_found = find_sheet_name(
+                                sheet_names_info, target_sheet
                             )
-                            continue
-                        df = all_sheets[sheet_found]
-                    else:
-                        df = all_sheets[sheet_names_info[0]]
+                        else:
+                            sheet_found = sheet_names_info[0]
+                        if sheet_found is not None:
+                            df = xls.parse(sheet_found)
+                    if sheet_found is None:
+                        files_rejected.append(
+                            f"{original_name} (sheet '{target_sheet}' not found, available: {sheet_names_info})"
+                        )
+                        continue
 
                 df.columns = df.columns.astype(str)
                 df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
@@ -11750,7 +13921,7 @@ def upload_dental_bv_step3():
                 files_rejected.append(f"{original_name} (error: {str(ex)})")
 
         if raw_df is None:
-            dental_bv_result_step3 = (
+            session.dental_bv_result_step3 = (
                 "❌ Missing <strong>Raw Smilelink</strong> file."
                 + (
                     "<br>⚠️ Rejected: " + ", ".join(files_rejected)
@@ -11758,13 +13929,13 @@ def upload_dental_bv_step3():
                     else ""
                 )
             )
-            dental_bv_step3_data = None
-            dental_bv_step3_output = None
+            session.dental_bv_step3_data = None
+            session.dental_bv_step3_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
         if consolidated_df is None:
-            dental_bv_result_step3 = (
+            session.dental_bv_result_step3 = (
                 "❌ Missing <strong>Smilelink Consolidated</strong> file."
                 + (
                     "<br>⚠️ Rejected: " + ", ".join(files_rejected)
@@ -11772,8 +13943,8 @@ def upload_dental_bv_step3():
                     else ""
                 )
             )
-            dental_bv_step3_data = None
-            dental_bv_step3_output = None
+            session.dental_bv_step3_data = None
+            session.dental_bv_step3_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
@@ -11789,7 +13960,7 @@ def upload_dental_bv_step3():
             preview = ""
             if row_count > 0:
                 preview = "<br>First row preview: " + str(dict(raw_df.iloc[0]))[:500]
-            dental_bv_result_step3 = (
+            session.dental_bv_result_step3 = (
                 "❌ Raw Smilelink file is missing <strong>PatsLastname</strong> and/or "
                 "<strong>PatsFirstname</strong> columns (spacing/casing variants are accepted, e.g. "
                 "<em>Pats Last Name</em> / <em>Pats First Name</em>)."
@@ -11798,16 +13969,13 @@ def upload_dental_bv_step3():
                 f"<br>Rows: {row_count}"
                 f"{preview}"
             )
-            dental_bv_step3_data = None
-            dental_bv_step3_output = None
+            session.dental_bv_step3_data = None
+            session.dental_bv_step3_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
-        raw_df["_PatientName"] = raw_df.apply(
-            lambda r: _dental_bv_step3_patient_name_last_comma_first(
-                r, lastname_col, firstname_col
-            ),
-            axis=1,
+        raw_df["_PatientName"] = _dental_bv_step3_patient_names(
+            raw_df, lastname_col, firstname_col
         )
 
         # Insurance / Policy ID on Raw (flexible headers; optional — missing uses "" for match key).
@@ -11840,9 +14008,9 @@ def upload_dental_bv_step3():
         if cons_date_col is None:
             missing_cons.append("Date")
         if missing_cons:
-            dental_bv_result_step3 = f"❌ Smilelink Consolidated file is missing columns: {', '.join(missing_cons)}"
-            dental_bv_step3_data = None
-            dental_bv_step3_output = None
+            session.dental_bv_result_step3 = f"❌ Smilelink Consolidated file is missing columns: {', '.join(missing_cons)}"
+            session.dental_bv_step3_data = None
+            session.dental_bv_step3_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
@@ -11850,20 +14018,38 @@ def upload_dental_bv_step3():
         from datetime import datetime
 
         today_date = datetime.now()
-        # Store full consolidated row + parsed date, keyed by (patient_name, insurance, policy_id)
-        cons_lookup = {}
-        for idx, crow in consolidated_df.iterrows():
-            pn = _dental_bv_step3_norm_patient_key(crow.get(cons_patient_col, ""))
-            ins = str(crow.get(cons_insurance_col, "")).strip().lower()
-            pid = str(crow.get(cons_policyid_col, "")).strip().lower()
-            date_val = crow.get(cons_date_col)
-            key = (pn, ins, pid)
-            try:
-                dt = pd.to_datetime(date_val)
-                if key not in cons_lookup or dt > cons_lookup[key][0]:
-                    cons_lookup[key] = (dt, crow)
-            except Exception:
-                pass
+
+        def key_text(values):
+            return values.astype(object).astype(str).str.strip().str.lower()
+
+        # Consolidated rows keyed by (patient_name, insurance, policy_id) with their
+        # parsed Date; rows whose Date does not parse never match
+        parsed_dates = DistinctValueCache(_dental_bv_step3_parse_date).series(
+            consolidated_df[cons_date_col]
+        )
+        dated = parsed_dates.map(lambda v: v is not None).to_numpy()
+        cons_dated = consolidated_df[dated]
+        key_cols = ["_pn", "_ins", "_pid"]
+        cons_keys = pd.DataFrame(
+            {
+                "_pn": _dental_bv_step3_norm_patient_keys(cons_dated[cons_patient_col]),
+                "_ins": key_text(cons_dated[cons_insurance_col]),
+                "_pid": key_text(cons_dated[cons_policyid_col]),
+                "_date": pd.to_datetime(parsed_dates[dated]),
+                "_cons_row": dated.nonzero()[0],
+            }
+        ).reset_index(drop=True)
+        # Latest Date per key, the earliest row on ties. Blank dates never compare as
+        # later, so a key whose first row has a blank Date keeps that row.
+        leading_blank = (
+            cons_keys.groupby(key_cols, sort=False).cumcount().eq(0)
+            & cons_keys["_date"].isna()
+        )
+        rank_date = cons_keys["_date"].mask(leading_blank, pd.Timestamp.max)
+        latest = rank_date.groupby(
+            [cons_keys[c] for c in key_cols], sort=False
+        ).idxmax()
+        cons_lookup = cons_keys.loc[latest.to_numpy()]
 
         # Build column mapping for Consolidated file → output columns
         output_cols_lower = {c.strip().lower(): c for c in DENTAL_BV_OUTPUT_COLUMNS}
@@ -11883,97 +14069,79 @@ def upload_dental_bv_step3():
             elif sl in step3_input_map:
                 cons_col_map[src_col] = step3_input_map[sl]
 
-        # Match Raw Smilelink rows against Consolidated
-        mapped_rows = []
+        # Match Raw Smilelink rows against Consolidated in one merge
         total_raw = len(raw_df)
-        match_count = 0
-        old_enough_count = 0
-
-        for _, row in raw_df.iterrows():
-            display_patient = _dental_bv_step3_patient_name_last_comma_first(
-                row, lastname_col, firstname_col
-            )
-            pn = _dental_bv_step3_norm_patient_key(display_patient)
-            ins = (
-                str(row.get(raw_insurance_col, "")).strip().lower()
-                if raw_insurance_col is not None
-                else ""
-            )
-            pid = (
-                str(row.get(raw_policyid_col, "")).strip().lower()
-                if raw_policyid_col is not None
-                else ""
-            )
-            key = (pn, ins, pid)
-
-            if key not in cons_lookup:
-                continue
-            match_count += 1
-
-            cons_date, cons_row = cons_lookup[key]
-            diff_days = (today_date - cons_date).days
-            if diff_days <= 350:
-                continue
-            old_enough_count += 1
-
-            mapped = {col: "" for col in DENTAL_BV_OUTPUT_COLUMNS}
-
-            # Fill from Consolidated row
-            for src_col, out_col in cons_col_map.items():
-                val = cons_row.get(src_col, "")
-                if pd.isna(val):
-                    val = ""
-                mapped[out_col] = str(val).strip()
-
-            # Patient Name, Insurance, Policy ID from Raw Smilelink (the matching keys)
-            mapped["Patient Name"] = display_patient.strip()
-            if raw_insurance_col is not None:
-                raw_ins_val = row.get(raw_insurance_col, "")
-                if pd.isna(raw_ins_val):
-                    raw_ins_val = ""
-                mapped["Insurance"] = str(raw_ins_val).strip()
-            else:
-                mapped["Insurance"] = ""
-            if raw_policyid_col is not None:
-                raw_pid_val = row.get(raw_policyid_col, "")
-                if pd.isna(raw_pid_val):
-                    raw_pid_val = ""
-                mapped["Policy ID"] = str(raw_pid_val).strip()
-            else:
-                mapped["Policy ID"] = ""
+        # DOB and appointment strings repeat across rows; parse each one once
+        format_dental_date = DistinctValueCache(_dental_bv_format_date_mmddyyyy)
+        no_column = pd.Series("", index=raw_df.index, dtype=object)
+        raw_keys = pd.DataFrame(
+            {
+                "_pn": _dental_bv_step3_norm_patient_keys(raw_df["_PatientName"]),
+                "_ins": (
+                    key_text(raw_df[raw_insurance_col])
+                    if raw_insurance_col is not None
+                    else no_column
+                ),
+                "_pid": (
+                    key_text(raw_df[raw_policyid_col])
+                    if raw_policyid_col is not None
+                    else no_column
+                ),
+                "_raw_row": np.arange(total_raw),
+            }
+        )
+        matched = raw_keys.merge(cons_lookup, on=key_cols, how="inner").sort_values(
+            "_raw_row"
+        )
+        match_count = len(matched)
 
-            mapped["DOB"] = _dental_bv_format_date_mmddyyyy(mapped.get("DOB"))
-            mapped["Appointment"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Appointment")
-            )
-            mapped["Subscriber DOB"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Subscriber DOB")
-            )
-            mapped["Received date"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Received date")
-            )
-            mapped["Work Date"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Work Date")
-            )
-            mapped["Date work"] = _dental_bv_format_date_mmddyyyy(
-                mapped.get("Date work")
-            )
-            mapped_rows.append(mapped)
+        # Blank dates (NaT) have no age and count as old enough
+        age_days = (today_date - matched["_date"]).dt.days
+        qualified = matched[~(age_days <= 350)]
+        old_enough_count = len(qualified)
 
-        if not mapped_rows:
-            dental_bv_result_step3 = (
+        if qualified.empty:
+            session.dental_bv_result_step3 = (
                 f"⚠️ No rows qualified. Raw Smilelink: {total_raw} rows, "
                 f"{match_count} matched Consolidated, "
                 f"{old_enough_count} had Date > 350 days old."
             )
-            dental_bv_step3_data = None
-            dental_bv_step3_output = None
+            session.dental_bv_step3_data = None
+            session.dental_bv_step3_output = None
             _dental_bv_build_final_output()
             return redirect("/comparison?tab=dentalbv")
 
-        result_df = pd.DataFrame(mapped_rows, columns=DENTAL_BV_OUTPUT_COLUMNS)
+        # Fill from Consolidated rows; Patient Name, Insurance, Policy ID from Raw
+        # Smilelink (the matching keys)
+        raw_rows = raw_df.iloc[qualified["_raw_row"].to_numpy()]
+        result_df = _dental_bv_output_frame(
+            consolidated_df.iloc[qualified["_cons_row"].to_numpy()].reset_index(
+                drop=True
+            ),
+            cons_col_map,
+        )
+        result_df["Patient Name"] = raw_rows["_PatientName"].str.strip().to_numpy()
+        result_df["Insurance"] = (
+            _series_to_stripped_text(raw_rows[raw_insurance_col]).to_numpy()
+            if raw_insurance_col is not None
+            else ""
+        )
+        result_df["Policy ID"] = (
+            _series_to_stripped_text(raw_rows[raw_policyid_col]).to_numpy()
+            if raw_policyid_col is not None
+            else ""
+        )
+        for date_col in (
+            "DOB",
+            "Appointment",
+            "Subscriber DOB",
+            "Received date",
+            "Work Date",
+            "Date work",
+        ):
+            result_df[date_col] = format_dental_date.series(result_df[date_col])
         result_df = result_df.fillna("")
-        result_df["Insurance"] = result_df["Insurance"].apply(format_insurance_name)
+        result_df["Insurance"] = format_insurance_series(result_df["Insurance"])
 
         pre_filter_s3 = len(result_df)
         if "Remark" in result_df.columns:
@@ -11983,14 +14151,9 @@ def upload_dental_bv_step3():
         updated_excluded_s3 = pre_filter_s3 - len(result_df)
 
         result_df = _dental_bv_set_smilelink_when_office_sl(result_df)
-        dental_bv_step3_data = result_df
+        session.dental_bv_step3_data = result_df
 
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            result_df.to_excel(writer, index=False, sheet_name="Step3")
-            _apply_imagen_excel_sheet_styling(writer, "Step3", result_df)
-        buf.seek(0)
-        dental_bv_step3_output = buf.getvalue()
+        session.dental_bv_step3_output = {"Step3": result_df}
 
         _dental_bv_build_final_output()
 
@@ -12004,23 +14167,24 @@ def upload_dental_bv_step3():
         msg += f"<br>Final Step 3 output: <strong>{len(result_df)}</strong> rows."
         if files_rejected:
             msg += "<br>⚠️ Rejected: " + ", ".join(files_rejected)
-        dental_bv_result_step3 = msg
+        session.dental_bv_result_step3 = msg
         return redirect("/comparison?tab=dentalbv")
     except Exception as e:
-        dental_bv_result_step3 = f"❌ Error processing Step 3: {str(e)}"
-        dental_bv_step3_data = None
-        dental_bv_step3_output = None
+        session.dental_bv_result_step3 = f"❌ Error processing Step 3: {str(e)}"
+        session.dental_bv_step3_data = None
+        session.dental_bv_step3_output = None
         return redirect("/comparison?tab=dentalbv")
 
 
 @app.route("/download_dental_bv_step", methods=["POST"])
 def download_dental_bv_step():
     """Download a specific step's output."""
+    session = session_state()
     step = request.form.get("step", "")
     outputs = {
-        "1": dental_bv_step1_output,
-        "2": dental_bv_step2_output,
-        "3": dental_bv_step3_output,
+        "1": session.dental_bv_step1_output,
+        "2": session.dental_bv_step2_output,
+        "3": session.dental_bv_step3_output,
     }
     output = outputs.get(step)
     if output is None:
@@ -12030,54 +14194,44 @@ def download_dental_bv_step():
     if not filename.endswith(".xlsx"):
         filename += ".xlsx"
 
-    return send_file(
-        io.BytesIO(output),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=filename,
-    )
+    return send_output_sheets("download_dental_bv_step", output, filename)
 
 
 @app.route("/download_dental_bv_final", methods=["POST"])
 def download_dental_bv_final():
     """Download the final combined Dental BV report."""
-    if dental_bv_final_output is None:
+    session = session_state()
+    if session.dental_bv_final_output is None:
         return jsonify({"error": "No final report to download. Complete steps and generate output first."}), 400
 
     filename = request.form.get("filename", "").strip() or "dental_bv_report.xlsx"
     if not filename.endswith(".xlsx"):
         filename += ".xlsx"
 
-    return send_file(
-        io.BytesIO(dental_bv_final_output),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=filename,
+    return send_output_sheets(
+        "download_dental_bv_final", session.dental_bv_final_output, filename
     )
 
 
 @app.route("/reset_dental_bv", methods=["POST"])
 def reset_dental_bv():
     """Clear all Dental BV data and start fresh."""
-    global dental_bv_step1_data, dental_bv_step2_data, dental_bv_step3_data
-    global dental_bv_step1_output, dental_bv_step2_output, dental_bv_step3_output
-    global dental_bv_result_step1, dental_bv_result_step2, dental_bv_result_step3
-    global dental_bv_final_output
+    session = session_state()
 
     try:
-        dental_bv_step1_data = None
-        dental_bv_step2_data = None
-        dental_bv_step3_data = None
-        dental_bv_step1_output = None
-        dental_bv_step2_output = None
-        dental_bv_step3_output = None
-        dental_bv_result_step1 = None
-        dental_bv_result_step2 = None
-        dental_bv_result_step3 = None
-        dental_bv_final_output = None
+        session.dental_bv_step1_data = None
+        session.dental_bv_step2_data = None
+        session.dental_bv_step3_data = None
+        session.dental_bv_step1_output = None
+        session.dental_bv_step2_output = None
+        session.dental_bv_step3_output = None
+        session.dental_bv_result_step1 = None
+        session.dental_bv_result_step2 = None
+        session.dental_bv_result_step3 = None
+        session.dental_bv_final_output = None
         return redirect("/comparison?tab=dentalbv")
     except Exception as e:
-        dental_bv_result_step1 = f"❌ Error resetting: {str(e)}"
+        session.dental_bv_result_step1 = f"❌ Error resetting: {str(e)}"
         return redirect("/comparison?tab=dentalbv")
 
 
@@ -12089,75 +14243,68 @@ def reset_dental_bv():
 @app.route("/upload_apt", methods=["POST"])
 def upload_apt():
     """Upload file for Agent Productivity Tracker."""
-    global apt_data, apt_filename, apt_selected_sheet, apt_sheet_columns
-    global apt_agent_col, apt_date_col
-    global apt_remark_values, apt_result, apt_output
+    session = session_state()
 
     try:
         if "file" not in request.files:
-            apt_result = "❌ No file selected."
+            session.apt_result = "❌ No file selected."
             return redirect("/comparison?tab=agentproductivity")
 
         f = request.files["file"]
         if not f or f.filename == "":
-            apt_result = "❌ Empty file."
+            session.apt_result = "❌ Empty file."
             return redirect("/comparison?tab=agentproductivity")
 
         original_name = f.filename
         f.seek(0)
         engine = "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
-        all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
-
-        cleaned = {}
-        for sn, df in all_sheets.items():
-            df.columns = df.columns.astype(str)
-            df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
-            cleaned[sn] = df
-
-        apt_data = cleaned
-        apt_filename = original_name
-        apt_selected_sheet = None
-        apt_sheet_columns = []
-        apt_agent_col = None
-        apt_date_col = None
-        apt_remark_values = []
-        apt_result = None
-        apt_output = None
+        cleaned = LazySheets(f, engine=engine, transform=drop_unnamed_columns)
+
+        session.apt_data = cleaned
+        session.apt_filename = original_name
+        session.apt_selected_sheet = None
+        session.apt_sheet_columns = []
+        session.apt_agent_col = None
+        session.apt_date_col = None
+        session.apt_remark_values = []
+        session.apt_result = None
+        session.apt_output = None
         return redirect("/comparison?tab=agentproductivity")
     except Exception as e:
-        apt_result = f"❌ Error uploading file: {str(e)}"
+        session.apt_result = f"❌ Error uploading file: {str(e)}"
         return redirect("/comparison?tab=agentproductivity")
 
 
 @app.route("/apt_select_sheet", methods=["POST"])
 def apt_select_sheet():
     """Select a sheet, populate columns, accept column selections, extract unique Remark values."""
-    global apt_selected_sheet, apt_sheet_columns, apt_agent_col, apt_date_col
-    global apt_remark_values, apt_result, apt_output
+    session = session_state()
 
     try:
         sheet_name = request.form.get("sheet", "")
-        if not sheet_name or not apt_data or sheet_name not in apt_data:
-            apt_result = "❌ Invalid sheet selection."
+        if not sheet_name or not session.apt_data or sheet_name not in session.apt_data:
+            session.apt_result = "❌ Invalid sheet selection."
             return redirect("/comparison?tab=agentproductivity")
 
-        df = apt_data[sheet_name]
-        apt_selected_sheet = sheet_name
-        apt_sheet_columns = [c for c in df.columns if not str(c).startswith("Unnamed:")]
+        df = session.apt_data[sheet_name]
+        session.apt_selected_sheet = sheet_name
+        session.apt_sheet_columns = [
+            c for c in df.columns if not str(c).startswith("Unnamed:")
+        ]
 
         agent_col = request.form.get("agent_col", "")
         date_col = request.form.get("date_col", "")
 
         if not agent_col or not date_col:
-            apt_agent_col = None
-            apt_date_col = None
-            apt_remark_values = []
-            apt_result = None
-            apt_output = None
+            session.apt_agent_col = None
+            session.apt_date_col = None
+            session.apt_remark_values = []
+            session.apt_result = None
+            session.apt_output = None
             return redirect("/comparison?tab=agentproductivity")
 
-        apt_agent_col = agent_col
-        apt_date_col = date_col
+        session.apt_agent_col = agent_col
+        session.apt_date_col = date_col
 
         remark_col = None
         for c in df.columns:
@@ -12166,18 +14313,18 @@ def apt_select_sheet():
                 break
 
         if remark_col is None:
-            apt_result = f"❌ Sheet '{sheet_name}' does not have a 'Remark' column. Available columns: {', '.join(df.columns.tolist()[:20])}"
-            apt_remark_values = []
+            session.apt_result = f"❌ Sheet '{sheet_name}' does not have a 'Remark' column. Available columns: {', '.join(df.columns.tolist()[:20])}"
+            session.apt_remark_values = []
             return redirect("/comparison?tab=agentproductivity")
 
         unique_remarks = df[remark_col].dropna().astype(str).str.strip().unique().tolist()
         unique_remarks = sorted([r for r in unique_remarks if r and r.lower() != "nan"])
-        apt_remark_values = unique_remarks
-        apt_result = None
-        apt_output = None
+        session.apt_remark_values = unique_remarks
+        session.apt_result = None
+        session.apt_output = None
         return redirect("/comparison?tab=agentproductivity")
     except Exception as e:
-        apt_result = f"❌ Error loading sheet: {str(e)}"
+        session.apt_result = f"❌ Error loading sheet: {str(e)}"
         return redirect("/comparison?tab=agentproductivity")
 
 
@@ -12270,24 +14417,30 @@ def _apt_build_productivity(df, agent_col_name, date_col_name, remark_col, selec
 @app.route("/process_apt", methods=["POST"])
 def process_apt():
     """Process agent productivity based on selected remarks."""
-    global apt_result, apt_output, apt_selected_remarks
+    session = session_state()
 
     try:
         selected_remarks = request.form.getlist("remarks")
         if not selected_remarks:
-            apt_result = "❌ No remark values selected."
+            session.apt_result = "❌ No remark values selected."
             return redirect("/comparison?tab=agentproductivity")
 
-        if not apt_data or not apt_selected_sheet or apt_selected_sheet not in apt_data:
-            apt_result = "❌ No sheet selected. Please upload a file and select a sheet first."
+        if (
+            not session.apt_data
+            or not session.apt_selected_sheet
+            or session.apt_selected_sheet not in session.apt_data
+        ):
+            session.apt_result = (
+                "❌ No sheet selected. Please upload a file and select a sheet first."
+            )
             return redirect("/comparison?tab=agentproductivity")
 
-        if not apt_agent_col or not apt_date_col:
-            apt_result = "❌ Agent/Auditor column or Date column not selected."
+        if not session.apt_agent_col or not session.apt_date_col:
+            session.apt_result = "❌ Agent/Auditor column or Date column not selected."
             return redirect("/comparison?tab=agentproductivity")
 
-        df = apt_data[apt_selected_sheet]
-        apt_selected_remarks = selected_remarks
+        df = session.apt_data[session.apt_selected_sheet]
+        session.apt_selected_remarks = selected_remarks
 
         remark_col = None
         for c in df.columns:
@@ -12295,87 +14448,80 @@ def process_apt():
                 remark_col = c
                 break
         if remark_col is None:
-            apt_result = "❌ 'Remark' column not found in the sheet."
+            session.apt_result = "❌ 'Remark' column not found in the sheet."
             return redirect("/comparison?tab=agentproductivity")
 
-        if apt_agent_col not in df.columns:
-            apt_result = f"❌ Selected Agent/Auditor column '{apt_agent_col}' not found."
+        if session.apt_agent_col not in df.columns:
+            session.apt_result = (
+                f"❌ Selected Agent/Auditor column '{session.apt_agent_col}' not found."
+            )
             return redirect("/comparison?tab=agentproductivity")
-        if apt_date_col not in df.columns:
-            apt_result = f"❌ Selected Date column '{apt_date_col}' not found."
+        if session.apt_date_col not in df.columns:
+            session.apt_result = (
+                f"❌ Selected Date column '{session.apt_date_col}' not found."
+            )
             return redirect("/comparison?tab=agentproductivity")
 
         selected_lower = {r.strip().lower() for r in selected_remarks}
 
         agent_summary, agent_detail, agent_rows, agent_count = _apt_build_productivity(
-            df, apt_agent_col, apt_date_col, remark_col, selected_lower
+            df, session.apt_agent_col, session.apt_date_col, remark_col, selected_lower
         )
 
         if agent_summary is None:
-            apt_result = "⚠️ No valid rows after filtering (empty names or invalid dates)."
-            apt_output = None
+            session.apt_result = (
+                "⚠️ No valid rows after filtering (empty names or invalid dates)."
+            )
+            session.apt_output = None
             return redirect("/comparison?tab=agentproductivity")
 
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            agent_summary.to_excel(writer, index=False, sheet_name="Summary")
-            _apply_imagen_excel_sheet_styling(writer, "Summary", agent_summary)
-            agent_detail.to_excel(writer, index=False, sheet_name="Detail")
-            _apply_imagen_excel_sheet_styling(writer, "Detail", agent_detail)
-        buf.seek(0)
-        apt_output = buf.getvalue()
-
-        apt_result = (
+        session.apt_output = {"Summary": agent_summary, "Detail": agent_detail}
+
+        session.apt_result = (
             f"✅ Processed <strong>{agent_rows}</strong> rows for "
             f"<strong>{agent_count}</strong> agent(s) across "
             f"<strong>{len(selected_remarks)}</strong> remark value(s)."
         )
         return redirect("/comparison?tab=agentproductivity")
     except Exception as e:
-        apt_result = f"❌ Error processing: {str(e)}"
-        apt_output = None
+        session.apt_result = f"❌ Error processing: {str(e)}"
+        session.apt_output = None
         return redirect("/comparison?tab=agentproductivity")
 
 
 @app.route("/download_apt", methods=["POST"])
 def download_apt():
     """Download the agent productivity report."""
-    if apt_output is None:
+    session = session_state()
+    if session.apt_output is None:
         return jsonify({"error": "No report to download. Run Calculate Productivity first."}), 400
 
     filename = request.form.get("filename", "").strip() or "agent_productivity_report.xlsx"
     if not filename.endswith(".xlsx"):
         filename += ".xlsx"
 
-    return send_file(
-        io.BytesIO(apt_output),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=filename,
-    )
+    return send_output_sheets("download_apt", session.apt_output, filename)
 
 
 @app.route("/reset_apt", methods=["POST"])
 def reset_apt():
     """Clear all Agent Productivity Tracker data."""
-    global apt_data, apt_filename, apt_selected_sheet, apt_sheet_columns
-    global apt_agent_col, apt_date_col
-    global apt_remark_values, apt_result, apt_output, apt_selected_remarks
+    session = session_state()
 
     try:
-        apt_data = None
-        apt_filename = None
-        apt_selected_sheet = None
-        apt_sheet_columns = []
-        apt_agent_col = None
-        apt_date_col = None
-        apt_remark_values = []
-        apt_selected_remarks = []
-        apt_result = None
-        apt_output = None
+        session.apt_data = None
+        session.apt_filename = None
+        session.apt_selected_sheet = None
+        session.apt_sheet_columns = []
+        session.apt_agent_col = None
+        session.apt_date_col = None
+        session.apt_remark_values = []
+        session.apt_selected_remarks = []
+        session.apt_result = None
+        session.apt_output = None
         return redirect("/comparison?tab=agentproductivity")
     except Exception as e:
-        apt_result = f"❌ Error resetting: {str(e)}"
+        session.apt_result = f"❌ Error resetting: {str(e)}"
         return redirect("/comparison?tab=agentproductivity")
 
 
@@ -12387,63 +14533,57 @@ def reset_apt():
 @app.route("/upload_nh", methods=["POST"])
 def upload_nh():
     """Upload first file for NH Allocation Report."""
-    global nh_data, nh_filename, nh_selected_sheet, nh_remark_values
-    global nh_selected_remarks, nh_filtered_df, nh_step2_files, nh_file2_data, nh_file2_filename
-    global nh_result, nh_output
+    session = session_state()
 
     try:
         if "file" not in request.files:
-            nh_result = "❌ No file selected."
+            session.nh_result = "❌ No file selected."
             return redirect("/comparison?tab=nhallocation")
 
         f = request.files["file"]
         if not f or f.filename == "":
-            nh_result = "❌ Empty file."
+            session.nh_result = "❌ Empty file."
             return redirect("/comparison?tab=nhallocation")
 
         original_name = f.filename
         f.seek(0)
         engine = "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
-        all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
-
-        cleaned = {}
-        for sn, df in all_sheets.items():
-            df.columns = df.columns.astype(str)
-            df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
-            cleaned[sn] = df
-
-        nh_data = cleaned
-        nh_filename = original_name
-        nh_selected_sheet = None
-        nh_remark_values = []
-        nh_selected_remarks = []
-        nh_filtered_df = None
-        nh_step2_files = None
-        nh_file2_data = None
-        nh_file2_filename = None
-        nh_result = f"✅ File uploaded: {original_name} ({len(cleaned)} sheet(s))"
-        nh_output = None
+        cleaned = LazySheets(f, engine=engine, transform=drop_unnamed_columns)
+
+        session.nh_data = cleaned
+        session.nh_filename = original_name
+        session.nh_selected_sheet = None
+        session.nh_remark_values = []
+        session.nh_selected_remarks = []
+        session.nh_filtered_df = None
+        session.nh_step2_files = None
+        session.nh_file2_data = None
+        session.nh_file2_filename = None
+        session.nh_result = (
+            f"✅ File uploaded: {original_name} ({len(cleaned)} sheet(s))"
+        )
+        session.nh_output = None
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error uploading file: {str(e)}"
+        session.nh_result = f"❌ Error uploading file: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
 @app.route("/nh_select_sheet", methods=["POST"])
 def nh_select_sheet():
     """Select a sheet and extract unique Remark values."""
-    global nh_selected_sheet, nh_remark_values, nh_result, nh_filtered_df, nh_output
+    session = session_state()
 
     try:
         sheet_name = request.form.get("sheet", "")
-        if not sheet_name or not nh_data or sheet_name not in nh_data:
-            nh_result = "❌ Invalid sheet selection."
+        if not sheet_name or not session.nh_data or sheet_name not in session.nh_data:
+            session.nh_result = "❌ Invalid sheet selection."
             return redirect("/comparison?tab=nhallocation")
 
-        df = nh_data[sheet_name]
-        nh_selected_sheet = sheet_name
-        nh_filtered_df = None
-        nh_output = None
+        df = session.nh_data[sheet_name]
+        session.nh_selected_sheet = sheet_name
+        session.nh_filtered_df = None
+        session.nh_output = None
 
         remark_col = None
         for c in df.columns:
@@ -12452,37 +14592,41 @@ def nh_select_sheet():
                 break
 
         if remark_col is None:
-            nh_result = f"❌ Sheet '{sheet_name}' does not have a 'Remark' column. Available columns: {', '.join(df.columns.tolist()[:20])}"
-            nh_remark_values = []
+            session.nh_result = f"❌ Sheet '{sheet_name}' does not have a 'Remark' column. Available columns: {', '.join(df.columns.tolist()[:20])}"
+            session.nh_remark_values = []
             return redirect("/comparison?tab=nhallocation")
 
         unique_remarks = df[remark_col].dropna().astype(str).str.strip().unique().tolist()
         unique_remarks = sorted([r for r in unique_remarks if r and r.lower() != "nan"])
-        nh_remark_values = unique_remarks
-        nh_result = f"✅ Sheet '{sheet_name}' loaded. {len(unique_remarks)} unique remark value(s) found. Select values to exclude."
+        session.nh_remark_values = unique_remarks
+        session.nh_result = f"✅ Sheet '{sheet_name}' loaded. {len(unique_remarks)} unique remark value(s) found. Select values to exclude."
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error loading sheet: {str(e)}"
+        session.nh_result = f"❌ Error loading sheet: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
 @app.route("/nh_filter_remarks", methods=["POST"])
 def nh_filter_remarks():
     """Filter first file by excluding rows matching selected remark values."""
-    global nh_selected_remarks, nh_filtered_df, nh_result, nh_output
+    session = session_state()
 
     try:
         selected_remarks = request.form.getlist("remarks")
         if not selected_remarks:
-            nh_result = "❌ No remark values selected to exclude."
+            session.nh_result = "❌ No remark values selected to exclude."
             return redirect("/comparison?tab=nhallocation")
 
-        if not nh_data or not nh_selected_sheet or nh_selected_sheet not in nh_data:
-            nh_result = "❌ No sheet selected."
+        if (
+            not session.nh_data
+            or not session.nh_selected_sheet
+            or session.nh_selected_sheet not in session.nh_data
+        ):
+            session.nh_result = "❌ No sheet selected."
             return redirect("/comparison?tab=nhallocation")
 
-        df = nh_data[nh_selected_sheet].copy()
-        nh_selected_remarks = selected_remarks
+        df = session.nh_data[session.nh_selected_sheet].copy()
+        session.nh_selected_remarks = selected_remarks
 
         remark_col = None
         for c in df.columns:
@@ -12491,7 +14635,7 @@ def nh_filter_remarks():
                 break
 
         if remark_col is None:
-            nh_result = "❌ 'Remark' column not found."
+            session.nh_result = "❌ 'Remark' column not found."
             return redirect("/comparison?tab=nhallocation")
 
         original_count = len(df)
@@ -12530,17 +14674,17 @@ def nh_filter_remarks():
         mapped_df["Appointment"] = raw_appt.values
 
         mapped_df = mapped_df.fillna("")
-        nh_filtered_df = mapped_df
+        session.nh_filtered_df = mapped_df
 
-        nh_result = (
+        session.nh_result = (
             f"✅ Excluded <strong>{excluded_count}</strong> row(s) matching selected remarks. "
-            f"<strong>{len(nh_filtered_df)}</strong> row(s) remaining out of {original_count}. "
+            f"<strong>{len(session.nh_filtered_df)}</strong> row(s) remaining out of {original_count}. "
             f"Now upload the second file."
         )
-        nh_output = None
+        session.nh_output = None
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error filtering: {str(e)}"
+        session.nh_result = f"❌ Error filtering: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
@@ -12655,10 +14799,12 @@ def _nh_format_date_cell_mmddyyyy_or_keep(v):
     return s
 
 
-def _nh_series_format_date_mmddyyyy_or_keep(series):
+def _nh_series_format_date_mmddyyyy_or_keep(series, format_date=None):
     if series is None:
         return pd.Series(dtype=object)
-    return pd.Series(series).apply(_nh_format_date_cell_mmddyyyy_or_keep)
+    if format_date is None:
+        format_date = DistinctValueCache(_nh_format_date_cell_mmddyyyy_or_keep)
+    return format_date.series(series)
 
 
 def _nh_map_file2_to_output_columns(df2):
@@ -12690,16 +14836,16 @@ def _nh_map_file2_to_output_columns(df2):
 @app.route("/nh_upload_file2", methods=["POST"])
 def nh_upload_file2():
     """Upload one or more Step 2 files; read all sheets from each and store for sheet selection."""
-    global nh_step2_files, nh_file2_data, nh_file2_filename, nh_result, nh_output
+    session = session_state()
 
     try:
         files = request.files.getlist("file")
         if not files or all(not f or f.filename == "" for f in files):
-            nh_result = "❌ No file(s) selected for Step 2."
+            session.nh_result = "❌ No file(s) selected for Step 2."
             return redirect("/comparison?tab=nhallocation")
 
-        if nh_filtered_df is None:
-            nh_result = "❌ Please complete Step 1 first."
+        if session.nh_filtered_df is None:
+            session.nh_result = "❌ Please complete Step 1 first."
             return redirect("/comparison?tab=nhallocation")
 
         step2_list = []
@@ -12709,17 +14855,11 @@ def nh_upload_file2():
             original_name = f.filename
             f.seek(0)
             engine = "xlrd" if original_name.lower().endswith(".xls") else "openpyxl"
-            all_sheets = pd.read_excel(f, sheet_name=None, engine=engine)
-            cleaned = {}
-            for sn, df in all_sheets.items():
-                df = df.copy()
-                df.columns = df.columns.astype(str)
-                df = df.loc[:, ~df.columns.str.startswith("Unnamed:")]
-                cleaned[sn] = df
+            cleaned = LazySheets(f, engine=engine, transform=drop_unnamed_columns)
             sheet_names = list(cleaned.keys())
             default_sheet = "Today" if "Today" in cleaned else (sheet_names[0] if sheet_names else None)
             if not sheet_names:
-                nh_result = f"❌ No sheets found in '{original_name}'."
+                session.nh_result = f"❌ No sheets found in '{original_name}'."
                 return redirect("/comparison?tab=nhallocation")
             step2_list.append({
                 "filename": original_name,
@@ -12729,35 +14869,37 @@ def nh_upload_file2():
             })
 
         if not step2_list:
-            nh_result = "❌ No valid file(s) to process."
+            session.nh_result = "❌ No valid file(s) to process."
             return redirect("/comparison?tab=nhallocation")
 
-        nh_step2_files = step2_list
-        nh_file2_data = None
-        nh_file2_filename = None
-        nh_output = None
-        nh_result = f"✅ Uploaded {len(step2_list)} file(s). Select which sheet to merge for each file below, then click Merge."
+        session.nh_step2_files = step2_list
+        session.nh_file2_data = None
+        session.nh_file2_filename = None
+        session.nh_output = None
+        session.nh_result = f"✅ Uploaded {len(step2_list)} file(s). Select which sheet to merge for each file below, then click Merge."
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error uploading: {str(e)}"
+        session.nh_result = f"❌ Error uploading: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
 @app.route("/nh_merge_step2_sheets", methods=["POST"])
 def nh_merge_step2_sheets():
     """Merge Step 1 filtered data with selected sheet from each Step 2 file."""
-    global nh_step2_files, nh_file2_data, nh_file2_filename, nh_result, nh_output
+    session = session_state()
 
     try:
-        if not nh_step2_files or nh_filtered_df is None:
-            nh_result = "❌ No Step 2 files or Step 1 data. Upload files in Step 2 first."
+        if not session.nh_step2_files or session.nh_filtered_df is None:
+            session.nh_result = (
+                "❌ No Step 2 files or Step 1 data. Upload files in Step 2 first."
+            )
             return redirect("/comparison?tab=nhallocation")
 
         mapped_list = []
         file_names = []
         total_step2_rows = 0
 
-        for i, item in enumerate(nh_step2_files):
+        for i, item in enumerate(session.nh_step2_files):
             key = f"sheet_{i}"
             selected_sheet = request.form.get(key)
             if not selected_sheet or selected_sheet not in item["sheets"]:
@@ -12771,15 +14913,20 @@ def nh_merge_step2_sheets():
         combined_df2 = pd.concat(mapped_list, ignore_index=True)
         combined_df2 = combined_df2.fillna("")
 
-        nh_file2_data = combined_df2
-        nh_file2_filename = ", ".join(file_names) if len(file_names) <= 3 else f"{len(file_names)} files"
+        session.nh_file2_data = combined_df2
+        session.nh_file2_filename = (
+            ", ".join(file_names)
+            if len(file_names) <= 3
+            else f"{len(file_names)} files"
+        )
 
-        merged_df = pd.concat([nh_filtered_df, combined_df2], ignore_index=True)
+        merged_df = pd.concat([session.nh_filtered_df, combined_df2], ignore_index=True)
         merged_df = merged_df.fillna("")
+        _nh_format_date = DistinctValueCache(_nh_format_date_cell_mmddyyyy_or_keep)
         for _nh_col in NH_DATE_COLUMNS_MM_DD_YYYY:
             if _nh_col in merged_df.columns:
                 merged_df[_nh_col] = _nh_series_format_date_mmddyyyy_or_keep(
-                    merged_df[_nh_col]
+                    merged_df[_nh_col], _nh_format_date
                 )
 
         # Apply Remark rules from Insurance: "NO INFO" -> "No Info"; MCD list -> "Not to Work" (except Office Name "Dr. Startaloo")
@@ -12808,68 +14955,57 @@ def nh_merge_step2_sheets():
             remark_blank = merged_df["Remark"].astype(str).str.strip() == ""
             merged_df.loc[remark_blank, "Remark"] = "Workable"
 
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-            merged_df.to_excel(writer, index=False, sheet_name="NH Allocation")
-            _apply_imagen_excel_sheet_styling(writer, "NH Allocation", merged_df)
-        buf.seek(0)
-        nh_output = buf.getvalue()
+        session.nh_output = {"NH Allocation": merged_df}
 
-        nh_step2_files = None
+        session.nh_step2_files = None
 
         files_summary = ", ".join(f"'{n}'" for n in file_names) if len(file_names) <= 3 else f"{len(file_names)} files"
-        nh_result = (
+        session.nh_result = (
             f"✅ Merge complete!<br>"
-            f"File 1 (filtered): <strong>{len(nh_filtered_df)}</strong> rows<br>"
+            f"File 1 (filtered): <strong>{len(session.nh_filtered_df)}</strong> rows<br>"
             f"Step 2 ({files_summary}): <strong>{total_step2_rows}</strong> rows combined (from selected sheets)<br>"
             f"Merged output: <strong>{len(merged_df)}</strong> total rows, {len(NH_OUTPUT_COLUMNS)} columns."
         )
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error merging: {str(e)}"
+        session.nh_result = f"❌ Error merging: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
 @app.route("/download_nh", methods=["POST"])
 def download_nh():
     """Download the NH Allocation Report."""
-    if nh_output is None:
+    session = session_state()
+    if session.nh_output is None:
         return jsonify({"error": "No report to download. Complete the merge step first."}), 400
 
     filename = request.form.get("filename", "").strip() or "nh_allocation_report.xlsx"
     if not filename.endswith(".xlsx"):
         filename += ".xlsx"
 
-    return send_file(
-        io.BytesIO(nh_output),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        as_attachment=True,
-        download_name=filename,
-    )
+    return send_output_sheets("download_nh", session.nh_output, filename)
 
 
 @app.route("/reset_nh", methods=["POST"])
 def reset_nh():
     """Clear all NH Allocation Report data."""
-    global nh_data, nh_filename, nh_selected_sheet, nh_remark_values
-    global nh_selected_remarks, nh_filtered_df, nh_step2_files, nh_file2_data, nh_file2_filename
-    global nh_result, nh_output
+    session = session_state()
 
     try:
-        nh_data = None
-        nh_filename = None
-        nh_selected_sheet = None
-        nh_remark_values = []
-        nh_selected_remarks = []
-        nh_filtered_df = None
-        nh_step2_files = None
-        nh_file2_data = None
-        nh_file2_filename = None
-        nh_result = None
-        nh_output = None
+        session.nh_data = None
+        session.nh_filename = None
+        session.nh_selected_sheet = None
+        session.nh_remark_values = []
+        session.nh_selected_remarks = []
+        session.nh_filtered_df = None
+        session.nh_step2_files = None
+        session.nh_file2_data = None
+        session.nh_file2_filename = None
+        session.nh_result = None
+        session.nh_output = None
         return redirect("/comparison?tab=nhallocation")
     except Exception as e:
-        nh_result = f"❌ Error resetting: {str(e)}"
+        session.nh_result = f"❌ Error resetting: {str(e)}"
         return redirect("/comparison?tab=nhallocation")
 
 
@@ -12881,7 +15017,7 @@ def reset_nh():
 @app.route("/load_general_primary", methods=["POST"])
 def load_general_primary():
     """Load the primary file, capture sheet/column metadata for UI selection."""
-    global general_primary_data, general_primary_filename, general_comparison_updated_data, general_comparison_result, general_comparison_output
+    session = session_state()
 
     try:
         if "primary_file" not in request.files:
@@ -12895,30 +15031,26 @@ def load_general_primary():
 
         # Read Excel file directly from memory (same approach as other modules)
         primary_file.seek(0)  # Reset file pointer to beginning
-        excel_data = pd.read_excel(primary_file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets (same as other modules)
-        cleaned_data = {}
-        columns_by_sheet = {}
-        for sheet_name, df in excel_data.items():
-            # Convert column names to strings first, then remove columns that start with "Unnamed:"
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-            columns_by_sheet[sheet_name] = [str(col) for col in df_cleaned.columns]
+        # Only header rows are read here; "Unnamed:" columns are removed as each
+        # sheet loads (same as other modules)
+        cleaned_data = LazySheets(
+            primary_file, engine="openpyxl", transform=drop_unnamed_columns
+        )
+        columns_by_sheet = {
+            sheet_name: cleaned_data.sheet_columns(sheet_name)
+            for sheet_name in cleaned_data
+        }
 
-        general_primary_data = cleaned_data
-        general_primary_filename = primary_filename
-        general_comparison_updated_data = None
-        general_comparison_result = None
-        general_comparison_output = ""
+        session.general_primary_data = cleaned_data
+        session.general_primary_filename = primary_filename
+        session.general_comparison_updated_data = None
+        session.general_comparison_result = None
+        session.general_comparison_output = ""
 
         return jsonify(
             {
                 "ok": True,
-                "filename": general_primary_filename,
+                "filename": session.general_primary_filename,
                 "sheets": list(cleaned_data.keys()),
                 "columns": columns_by_sheet,
             }
@@ -12936,7 +15068,7 @@ def load_general_primary():
 @app.route("/load_general_main", methods=["POST"])
 def load_general_main():
     """Load the main dataset file, capture sheet/column metadata for UI selection."""
-    global general_main_data, general_main_filename, general_comparison_updated_data, general_comparison_result, general_comparison_output
+    session = session_state()
 
     try:
         if "main_file" not in request.files:
@@ -12953,30 +15085,26 @@ def load_general_main():
 
         # Read Excel file directly from memory (same approach as other modules)
         main_file.seek(0)  # Reset file pointer to beginning
-        excel_data = pd.read_excel(main_file, sheet_name=None, engine="openpyxl")
-
-        # Remove "Unnamed:" columns from all sheets (same as other modules)
-        cleaned_data = {}
-        columns_by_sheet = {}
-        for sheet_name, df in excel_data.items():
-            # Convert column names to strings first, then remove columns that start with "Unnamed:"
-            df.columns = df.columns.astype(str)
-            df_cleaned = df.loc[
-                :, ~df.columns.str.contains("^Unnamed:", na=False, regex=True)
-            ]
-            cleaned_data[sheet_name] = df_cleaned
-            columns_by_sheet[sheet_name] = [str(col) for col in df_cleaned.columns]
+        # Only header rows are read here; "Unnamed:" columns are removed as each
+        # sheet loads (same as other modules)
+        cleaned_data = LazySheets(
+            main_file, engine="openpyxl", transform=drop_unnamed_columns
+        )
+        columns_by_sheet = {
+            sheet_name: cleaned_data.sheet_columns(sheet_name)
+            for sheet_name in cleaned_data
+        }
 
-        general_main_data = cleaned_data
-        general_main_filename = main_filename
-        general_comparison_updated_data = None
-        general_comparison_result = None
-        general_comparison_output = ""
+        session.general_main_data = cleaned_data
+        session.general_main_filename = main_filename
+        session.general_comparison_updated_data = None
+        session.general_comparison_result = None
+        session.general_comparison_output = ""
 
         return jsonify(
             {
                 "ok": True,
-                "filename": general_main_filename,
+                "filename": session.general_main_filename,
                 "sheets": list(cleaned_data.keys()),
                 "columns": columns_by_sheet,
             }
@@ -12992,17 +15120,22 @@ def load_general_main():
 
 
 @app.route("/run_general_comparison", methods=["POST"])
+@background_job(
+    "general_primary_data",
+    "general_main_data",
+    "general_primary_filename",
+    "general_main_filename",
+)
 def run_general_comparison():
-    global general_primary_data, general_main_data, general_primary_filename, general_main_filename
-    global general_comparison_result, general_comparison_output, general_comparison_updated_data
+    session = session_state()
 
     try:
         output_lines = []
-        general_comparison_output = ""
-        general_comparison_updated_data = None
+        session.general_comparison_output = ""
+        session.general_comparison_updated_data = None
 
-        if not general_primary_data or not general_main_data:
-            general_comparison_result = (
+        if not session.general_primary_data or not session.general_main_data:
+            session.general_comparison_result = (
                 "❌ Please upload both Primary and Main Dataset files first."
             )
             return redirect("/comparison?tab=general")
@@ -13012,32 +15145,52 @@ def run_general_comparison():
         key_columns = request.form.getlist("gc_key_columns")
         update_columns = request.form.getlist("gc_update_columns")
 
-        if not primary_sheet or primary_sheet not in general_primary_data:
-            general_comparison_result = "❌ Primary sheet is missing or invalid."
+        if not primary_sheet or primary_sheet not in session.general_primary_data:
+            session.general_comparison_result = (
+                "❌ Primary sheet is missing or invalid."
+            )
             return redirect("/comparison?tab=general")
-        if not main_sheet or main_sheet not in general_main_data:
-            general_comparison_result = "❌ Main dataset sheet is missing or invalid."
+        if not main_sheet or main_sheet not in session.general_main_data:
+            session.general_comparison_result = (
+                "❌ Main dataset sheet is missing or invalid."
+            )
             return redirect("/comparison?tab=general")
         if not key_columns:
-            general_comparison_result = "❌ Please select at least one key column."
+            session.general_comparison_result = (
+                "❌ Please select at least one key column."
+            )
             return redirect("/comparison?tab=general")
         if not update_columns:
-            general_comparison_result = (
+            session.general_comparison_result = (
                 "❌ Please select at least one column to update."
             )
             return redirect("/comparison?tab=general")
 
-        primary_df = general_primary_data[primary_sheet].copy()
-        main_df = general_main_data[main_sheet].copy()
+        primary_df = session.general_primary_data[primary_sheet].copy()
+        # Only the key and update columns of the main dataset are read; when one is
+        # missing or its name repeats, take the whole sheet for the checks below
+        main_columns = sheet_column_names(session.general_main_data, main_sheet)
+        main_names = [str(col).strip() for col in main_columns]
+        wanted_main = set(key_columns) | set(update_columns)
+        if wanted_main.issubset(main_names) and sum(
+            name in wanted_main for name in main_names
+        ) == len(wanted_main):
+            main_df = select_sheet_columns(
+                session.general_main_data,
+                main_sheet,
+                [c for c, name in zip(main_columns, main_names) if name in wanted_main],
+            ).copy()
+        else:
+            main_df = session.general_main_data[main_sheet].copy()
 
         # Check if dataframes are empty
         if primary_df.empty:
-            general_comparison_result = (
+            session.general_comparison_result = (
                 "❌ Primary sheet is empty. Please check your file."
             )
             return redirect("/comparison?tab=general")
         if main_df.empty:
-            general_comparison_result = (
+            session.general_comparison_result = (
                 "❌ Main dataset sheet is empty. Please check your file."
             )
             return redirect("/comparison?tab=general")
@@ -13069,63 +15222,49 @@ def run_general_comparison():
                 available_cols = ", ".join(list(primary_df.columns)[:10])
                 if len(primary_df.columns) > 10:
                     available_cols += f", ... ({len(primary_df.columns)} total)"
-                general_comparison_result = f"❌ Key column '{col}' not found in primary sheet. Available columns: {available_cols}"
+                session.general_comparison_result = f"❌ Key column '{col}' not found in primary sheet. Available columns: {available_cols}"
                 return redirect("/comparison?tab=general")
             if col not in main_df.columns:
                 available_cols = ", ".join(list(main_df.columns)[:10])
                 if len(main_df.columns) > 10:
                     available_cols += f", ... ({len(main_df.columns)} total)"
-                general_comparison_result = f"❌ Key column '{col}' not found in main dataset sheet. Available columns: {available_cols}"
+                session.general_comparison_result = f"❌ Key column '{col}' not found in main dataset sheet. Available columns: {available_cols}"
                 return redirect("/comparison?tab=general")
         for col in update_columns:
             if col not in main_df.columns:
                 available_cols = ", ".join(list(main_df.columns)[:10])
                 if len(main_df.columns) > 10:
                     available_cols += f", ... ({len(main_df.columns)} total)"
-                general_comparison_result = f"❌ Update column '{col}' not found in main dataset sheet. Available columns: {available_cols}"
+                session.general_comparison_result = f"❌ Update column '{col}' not found in main dataset sheet. Available columns: {available_cols}"
                 return redirect("/comparison?tab=general")
 
-        def normalize_val(v, is_patient_id=False):
-            """Normalize a value for key matching. Use patient ID normalization for Patient ID columns."""
-            if isinstance(v, pd.Series):
-                v = v.iloc[0] if len(v) > 0 else ""
-            try:
-                if pd.isna(v):
-                    return ""
-            except (ValueError, TypeError):
-                pass
-
-            if is_patient_id:
-                normalized = normalize_patient_id(v)
-                if normalized is None:
-                    return ""
-                return str(normalized).strip()
-
-            s = str(v).strip()
-            s = " ".join(s.split())
-            return s.lower()
-
         def build_key(df_input):
-            is_pid_col = {}
+            key = None
             for col in key_columns:
                 col_lower = str(col).lower().strip()
-                is_pid_col[col] = (
+                is_pid_col = (
                     "patient" in col_lower and "id" in col_lower
                 ) or col_lower in ["pid", "pat id", "patientid"]
 
-            return df_input[key_columns].apply(
-                lambda row: "|".join(
-                    normalize_val(row[col], is_patient_id=is_pid_col.get(col, False))
-                    for col in key_columns
-                ),
-                axis=1,
-            )
+                # Patient ID columns are normalized as a whole column
+                if is_pid_col:
+                    part = normalize_patient_id_series(df_input[col]).fillna("")
+                else:
+                    # Trimmed, whitespace-collapsed, lowercased text; blanks become ""
+                    part = (
+                        _series_to_stripped_text(df_input[col])
+                        .str.split()
+                        .str.join(" ")
+                        .str.lower()
+                    )
+                key = part if key is None else key + "|" + part
+            return key
 
         try:
             primary_keys = build_key(primary_df)
             main_keys = build_key(main_df)
         except Exception as e:
-            general_comparison_result = f"❌ Error building keys: {str(e)}"
+            session.general_comparison_result = f"❌ Error building keys: {str(e)}"
             return redirect("/comparison?tab=general")
 
         # Debug: Show sample keys for investigation
@@ -13153,36 +15292,21 @@ def run_general_comparison():
         # Map from key to main_df row index. When main has multiple rows per key,
         # prefer the row with Remark in ["UPDATED","QCP","ASST"] (so we pick new remark
         # not old); otherwise use last occurrence so later rows in file (newer data) win.
-        main_key_to_indices = {}
-        for idx, key in main_keys.items():
-            if not key:
-                continue
-            if key not in main_key_to_indices:
-                main_key_to_indices[key] = []
-            main_key_to_indices[key].append(idx)
+        keyed_main = main_keys[main_keys != ""]
+        main_key_map = pd.Series(keyed_main.index, index=keyed_main.to_numpy())
+        main_key_map = main_key_map[~main_key_map.index.duplicated(keep="last")]
 
-        remark_col_main = None
-        if "Remark" in update_columns and "Remark" in main_df.columns:
-            remark_col_main = "Remark"
         PREFERRED_REMARKS = {"UPDATED", "QCP", "ASST"}
-
-        def choose_main_idx(indices):
-            if not indices:
-                return None
-            if remark_col_main is not None:
-                for idx in indices:
-                    rv = (
-                        str(main_df.at[idx, remark_col_main]).strip().upper()
-                        if pd.notna(main_df.at[idx, remark_col_main])
-                        else ""
-                    )
-                    if rv in PREFERRED_REMARKS:
-                        return idx
-            return indices[-1]  # last occurrence wins
-
-        main_key_map = {
-            k: choose_main_idx(idxs) for k, idxs in main_key_to_indices.items()
-        }
+        if "Remark" in update_columns and "Remark" in main_df.columns:
+            remark_text = _series_to_stripped_text(main_df["Remark"]).str.upper()
+            preferred = keyed_main[
+                remark_text.loc[keyed_main.index].isin(PREFERRED_REMARKS)
+            ]
+            first_preferred = pd.Series(preferred.index, index=preferred.to_numpy())
+            first_preferred = first_preferred[
+                ~first_preferred.index.duplicated(keep="first")
+            ]
+            main_key_map.loc[first_preferred.index] = first_preferred.to_numpy()
 
         output_lines.append(
             f"\nUnique keys in PRIMARY: {primary_keys.nunique()} (total rows: {len(primary_keys)})"
@@ -13197,77 +15321,60 @@ def run_general_comparison():
             if col not in primary_df.columns:
                 primary_df[col] = ""
 
-        matched_rows = 0
-        updated_cells = 0
-        unmatched_keys = []
-        matched_examples = []
-
         output_lines.append("\n" + "=" * 80)
         output_lines.append("DEBUG: MATCHING PROCESS")
         output_lines.append("=" * 80)
 
-        for idx, key in primary_keys.items():
-            if key and key in main_key_map:  # Only process non-empty keys
-                matched_rows += 1
-                main_idx = main_key_map[key]
-
-                # Store first few matches as examples
-                if len(matched_examples) < 3:
-                    matched_examples.append(
-                        {
-                            "primary_row": idx,
-                            "main_row": main_idx,
-                            "key": key,
-                            "updates": {},
-                        }
-                    )
+        # One hash join: the chosen main row for every primary row ("" keys never match)
+        main_rows = primary_keys.map(main_key_map)
+        matched = main_rows.notna().to_numpy()
+        matched_index = primary_keys.index[matched]
+        source_rows = main_rows[matched].astype(main_df.index.dtype)
+        matched_rows = len(matched_index)
+        updated_cells = matched_rows * len(update_columns)
 
-                for col in update_columns:
-                    try:
-                        old_value = (
-                            primary_df.at[idx, col]
-                            if col in primary_df.columns
-                            else None
-                        )
-                        value = (
-                            main_df.at[main_idx, col]
-                            if col in main_df.columns
-                            else None
-                        )
-                        # Handle NaN values
-                        if pd.isna(value):
-                            value = ""
-                        if pd.isna(old_value):
-                            old_value = ""
+        # Store first few matches as examples
+        matched_examples = []
+        for idx, main_idx in zip(matched_index[:3], source_rows.iloc[:3]):
+            updates = {}
+            for col in update_columns:
+                old_value = primary_df.at[idx, col]
+                value = main_df.at[main_idx, col]
+                updates[col] = {
+                    "old": str("" if pd.isna(old_value) else old_value)[:50],
+                    "new": str("" if pd.isna(value) else value)[:50],
+                }
+            matched_examples.append(
+                {
+                    "primary_row": idx,
+                    "main_row": main_idx,
+                    "key": primary_keys[idx],
+                    "updates": updates,
+                }
+            )
 
-                        # Store update info for examples
-                        if (
-                            len(matched_examples) > 0
-                            and matched_examples[-1]["primary_row"] == idx
-                        ):
-                            matched_examples[-1]["updates"][col] = {
-                                "old": str(old_value)[:50],
-                                "new": str(value)[:50],
-                            }
+        # Column-wise update of the matched primary rows; blanks in main are written as ""
+        if matched_rows:
+            for col in update_columns:
+                values = main_df[col].reindex(source_rows.to_numpy())
+                blank = values.isna().to_numpy()
+                if not blank.all():
+                    primary_df.loc[matched_index[~blank], col] = values[
+                        ~blank
+                    ].to_numpy()
+                if blank.any():
+                    primary_df.loc[matched_index[blank], col] = ""
 
-                        primary_df.at[idx, col] = value
-                        updated_cells += 1
-                    except Exception as e:
-                        # Log error but continue with other columns
-                        output_lines.append(
-                            f"Warning: Error updating column '{col}' at row {idx}: {str(e)}"
-                        )
-            elif key:  # Non-empty key but no match found
-                if len(unmatched_keys) < 5:  # Store first 5 unmatched keys
-                    unmatched_keys.append(
-                        {
-                            "row": idx,
-                            "key": key,
-                            "raw_values": {
-                                col: primary_df.at[idx, col] for col in key_columns
-                            },
-                        }
-                    )
+        unmatched_keys = []
+        unmatched = (primary_keys != "") & ~matched
+        for idx in primary_keys.index[unmatched.to_numpy()][:5]:
+            unmatched_keys.append(
+                {
+                    "row": idx,
+                    "key": primary_keys[idx],
+                    "raw_values": {col: primary_df.at[idx, col] for col in key_columns},
+                }
+            )
 
         # Show matching examples
         if matched_examples:
@@ -13298,20 +15405,21 @@ def run_general_comparison():
 
         # Build output workbook: replace only the selected primary sheet (all primary rows kept; no duplicate-row removal)
         updated_workbook = {
-            name: df.copy() for name, df in general_primary_data.items()
+            name: df.copy() for name, df in session.general_primary_data.items()
         }
         updated_workbook[primary_sheet] = primary_df
-        general_comparison_updated_data = updated_workbook
+        session.general_comparison_updated_data = updated_workbook
 
         output_lines.insert(0, "=" * 80)
         output_lines.insert(1, "GENERAL COMPARISON RESULTS")
         output_lines.insert(2, "=" * 80)
         output_lines.insert(
             3,
-            f"Primary file: {general_primary_filename or 'N/A'} | Sheet: {primary_sheet}",
+            f"Primary file: {session.general_primary_filename or 'N/A'} | Sheet: {primary_sheet}",
         )
         output_lines.insert(
-            4, f"Main dataset: {general_main_filename or 'N/A'} | Sheet: {main_sheet}"
+            4,
+            f"Main dataset: {session.general_main_filename or 'N/A'} | Sheet: {main_sheet}",
         )
         output_lines.insert(5, f"Key columns: {', '.join(key_columns)}")
         output_lines.insert(6, f"Update columns: {', '.join(update_columns)}")
@@ -13355,37 +15463,42 @@ def run_general_comparison():
                 "\n✅ General comparison complete. Download the updated primary file."
             )
 
-        general_comparison_output = "\n".join(output_lines)
-        general_comparison_result = "✅ General comparison completed successfully."
+        session.general_comparison_output = "\n".join(output_lines)
+        session.general_comparison_result = (
+            "✅ General comparison completed successfully."
+        )
 
         return redirect("/comparison?tab=general")
 
     except Exception as e:
-        general_comparison_result = f"❌ Error during general comparison: {str(e)}"
-        general_comparison_output = general_comparison_result
+        session.general_comparison_result = (
+            f"❌ Error during general comparison: {str(e)}"
+        )
+        session.general_comparison_output = session.general_comparison_result
         return redirect("/comparison?tab=general")
 
 
 @app.route("/reset_general", methods=["POST"])
 def reset_general():
     """Reset all General Comparison state and return to the tab."""
-    global general_primary_data, general_main_data, general_primary_filename, general_main_filename
-    global general_comparison_result, general_comparison_output, general_comparison_updated_data
+    session = session_state()
 
     try:
-        general_primary_data = None
-        general_main_data = None
-        general_primary_filename = None
-        general_main_filename = None
-        general_comparison_result = (
+        session.general_primary_data = None
+        session.general_main_data = None
+        session.general_primary_filename = None
+        session.general_main_filename = None
+        session.general_comparison_result = (
             "🔄 General Comparison reset. All uploaded files and results cleared."
         )
-        general_comparison_output = ""
-        general_comparison_updated_data = None
+        session.general_comparison_output = ""
+        session.general_comparison_updated_data = None
 
         return redirect("/comparison?tab=general")
     except Exception as e:
-        general_comparison_result = f"❌ Error resetting General Comparison: {str(e)}"
+        session.general_comparison_result = (
+            f"❌ Error resetting General Comparison: {str(e)}"
+        )
         return redirect("/comparison?tab=general")
 
 
@@ -13404,35 +15517,19 @@ def _general_comparison_df_format_date_cols_mmddyyyy(df):
         t.strip().lower(): t for t in GENERAL_COMPARISON_DATE_COLUMNS_MM_DD_YYYY
     }
 
-    def _gc_format_one_date(date_val):
-        if pd.isna(date_val) or date_val == "":
-            return ""
-        try:
-            if isinstance(date_val, pd.Timestamp):
-                date_obj = date_val
-            elif isinstance(date_val, str):
-                date_obj = pd.to_datetime(date_val, errors="coerce")
-                if pd.isna(date_obj):
-                    return str(date_val)
-            else:
-                date_obj = pd.to_datetime(date_val, errors="coerce")
-                if pd.isna(date_obj):
-                    return str(date_val)
-            return date_obj.strftime("%m/%d/%Y")
-        except (ValueError, TypeError, AttributeError):
-            return str(date_val)
-
     for c in list(out.columns):
         if str(c).strip().lower() not in targets_lower:
             continue
-        out[c] = out[c].apply(_gc_format_one_date)
-        out[c] = out[c].astype(str)
+        out[c] = format_date_series_mmddyyyy(out[c])
     return out
 
 
 @app.route("/download_general_comparison", methods=["POST"])
 def download_general_comparison():
-    data_to_write = general_comparison_updated_data or general_primary_data
+    session = session_state()
+    data_to_write = (
+        session.general_comparison_updated_data or session.general_primary_data
+    )
     if not data_to_write:
         return jsonify({"error": "No general comparison data available"}), 400
 
@@ -13441,27 +15538,19 @@ def download_general_comparison():
         filename += ".xlsx"
 
     try:
-        import tempfile
-
-        temp_fd, temp_path = tempfile.mkstemp(suffix=".xlsx")
-
-        try:
-            with pd.ExcelWriter(temp_path, engine="openpyxl") as writer:
-                for sheet_name, df in data_to_write.items():
-                    df_export = _general_comparison_df_format_date_cols_mmddyyyy(df)
-                    df_export.to_excel(
-                        writer, sheet_name=sheet_name, index=False
-                    )
-                    _apply_imagen_excel_sheet_styling(
-                        writer, sheet_name, df_export
-                    )
+        export_format = requested_export_format()
+        cache_key, cached = cached_download(
+            "download_general_comparison", data_to_write, export_format
+        )
+        if cached is not None:
+            return send_xlsx_bytes(cached, filename)
 
-            return send_file(temp_path, as_attachment=True, download_name=filename)
+        with SheetExport(export_format) as writer:
+            for sheet_name, df in data_to_write.items():
+                df_export = _general_comparison_df_format_date_cols_mmddyyyy(df)
+                writer.write_sheet(sheet_name, df_export)
 
-        finally:
-            os.close(temp_fd)
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        return writer.response(filename, cache_key)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500